@@ -5,10 +5,10 @@ Analyzes extracted emails to identify patterns, keywords, and characteristics fo
 
 import os
 import json
-import re
-from collections import defaultdict, Counter
+from collections import defaultdict
 from typing import Dict, List, Any
-import math
+
+from corpus_analytics import CorpusAnalytics
 
 class CategoryPatternAnalyzer:
     """Analyze patterns for each email category"""
@@ -22,177 +22,41 @@ class CategoryPatternAnalyzer:
         # Group emails by category
         self.emails_by_category = defaultdict(list)
         for email in self.emails:
-            category = email.get('category', 'Other')
+            category = email.get('category') or 'Other'
             self.emails_by_category[category].append(email)
+        
+        self._analytics = None
+    
+    @property
+    def analytics(self) -> CorpusAnalytics:
+        """Sparse term/sender statistics for the whole corpus, built on first use"""
+        if self._analytics is None:
+            self._analytics = CorpusAnalytics(self.emails)
+        return self._analytics
     
     def calculate_tfidf(self, category: str, top_n: int = 50) -> Dict[str, float]:
         """Calculate TF-IDF scores for category-specific terms"""
-        category_emails = self.emails_by_category[category]
-        
-        if not category_emails:
+        if not self.emails_by_category[category]:
             return {}
         
-        # Document frequency across all categories
-        df = Counter()
-        total_docs = len(self.emails)
-        
-        # Term frequency in this category
-        tf_category = Counter()
-        
-        for email in self.emails:
-            text = f"{email.get('subject', '')} {email.get('body', '')}"
-            words = set(re.findall(r'\b\w+\b', text.lower()))
-            for word in words:
-                df[word] += 1
-        
-        for email in category_emails:
-            text = f"{email.get('subject', '')} {email.get('body', '')}"
-            words = re.findall(r'\b\w+\b', text.lower())
-            for word in words:
-                if len(word) > 3:  # Skip short words
-                    tf_category[word] += 1
-        
-        # Calculate TF-IDF
-        tfidf_scores = {}
-        for term, tf in tf_category.items():
-            if df[term] > 0:
-                idf = math.log(total_docs / df[term])
-                tfidf_scores[term] = tf * idf
-        
-        # Return top N
-        return dict(sorted(tfidf_scores.items(), key=lambda x: x[1], reverse=True)[:top_n])
+        # Category term frequency x log(N / document frequency), words longer than 3
+        return self.analytics.tfidf(category, top_n)
     
     def extract_sender_patterns(self, category: str) -> Dict[str, Any]:
         """Extract sender domain and email patterns for a category"""
-        emails = self.emails_by_category[category]
-        
-        domains = Counter()
-        senders = Counter()
-        
-        for email in emails:
-            sender = email.get('from', '')
-            if not sender:
-                continue
-            
-            # Extract domain
-            domain_match = re.search(r'@([\w\.-]+)', sender)
-            if domain_match:
-                domains[domain_match.group(1)] += 1
-            
-            senders[sender] += 1
-        
-        return {
-            'top_domains': dict(domains.most_common(10)),
-            'top_senders': dict(senders.most_common(10)),
-            'unique_domains': len(domains),
-            'unique_senders': len(senders)
-        }
+        return self.analytics.sender_patterns(category)
     
     def extract_subject_patterns(self, category: str) -> Dict[str, Any]:
         """Extract subject line patterns and keywords"""
-        emails = self.emails_by_category[category]
-        
-        subjects = []
-        keywords = Counter()
-        patterns = []
-        
-        for email in emails:
-            subject = email.get('subject', '')
-            if not subject:
-                continue
-            
-            subjects.append(subject)
-            
-            # Extract keywords
-            words = re.findall(r'\b\w+\b', subject.lower())
-            for word in words:
-                if len(word) > 3:
-                    keywords[word] += 1
-            
-            # Extract patterns (e.g., "Re:", "Fwd:", dates, etc.)
-            if 're:' in subject.lower():
-                patterns.append('reply')
-            if 'fwd:' in subject.lower():
-                patterns.append('forward')
-            if re.search(r'\d{4}', subject):
-                patterns.append('contains_year')
-            if re.search(r'\d{1,2}:\d{2}', subject):
-                patterns.append('contains_time')
-        
-        pattern_counts = Counter(patterns)
-        
-        return {
-            'top_keywords': dict(keywords.most_common(20)),
-            'common_patterns': dict(pattern_counts),
-            'total_subjects': len(subjects),
-            'avg_subject_length': sum(len(s) for s in subjects) / len(subjects) if subjects else 0
-        }
+        return self.analytics.subject_patterns(category)
     
     def extract_body_patterns(self, category: str) -> Dict[str, Any]:
         """Extract body content patterns"""
-        emails = self.emails_by_category[category]
-        
-        body_lengths = []
-        keywords = Counter()
-        phrases = []
-        
-        for email in emails:
-            body = email.get('body', '')
-            if not body:
-                continue
-            
-            body_lengths.append(len(body))
-            
-            # Extract keywords
-            words = re.findall(r'\b\w+\b', body.lower())
-            for word in words:
-                if len(word) > 4:  # Longer words for body
-                    keywords[word] += 1
-            
-            # Extract common phrases (2-3 word combinations)
-            for i in range(len(words) - 1):
-                phrase = f"{words[i]} {words[i+1]}"
-                if len(phrase) > 10:
-                    phrases.append(phrase)
-        
-        phrase_counts = Counter(phrases)
-        
-        return {
-            'top_keywords': dict(keywords.most_common(30)),
-            'top_phrases': dict(phrase_counts.most_common(20)),
-            'avg_body_length': sum(body_lengths) / len(body_lengths) if body_lengths else 0,
-            'min_length': min(body_lengths) if body_lengths else 0,
-            'max_length': max(body_lengths) if body_lengths else 0
-        }
+        return self.analytics.body_patterns(category)
     
     def extract_temporal_patterns(self, category: str) -> Dict[str, Any]:
         """Extract temporal patterns"""
-        emails = self.emails_by_category[category]
-        
-        hours = Counter()
-        days = Counter()
-        
-        for email in emails:
-            date_str = email.get('date', '')
-            if not date_str:
-                continue
-            
-            try:
-                from datetime import datetime
-                date = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-                hours[date.hour] += 1
-                days[date.weekday()] += 1
-            except:
-                pass
-        
-        day_names = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        
-        return {
-            'hour_distribution': dict(hours),
-            'day_distribution': dict(days),
-            'peak_hours': [h for h, _ in hours.most_common(3)],
-            'peak_days': [day_names[d] for d, _ in days.most_common(3)]
-        }
+        return self.analytics.temporal_patterns(category)
     
     def analyze_category(self, category: str) -> Dict[str, Any]:
         """Perform comprehensive analysis for a single category"""
@@ -262,6 +126,11 @@ class CategoryPatternAnalyzer:
             # Combine and deduplicate keywords
             all_keywords = list(set(tfidf_keywords + subject_keywords))[:15]
             
+            # TF-IDF weights scaled to [0, 1] (the classifier caps each term's contribution at 1)
+            top_tfidf = dict(list(pattern.get('tfidf_keywords', {}).items())[:20])
+            max_tfidf = max(top_tfidf.values(), default=0) or 1.0
+            tfidf_scores = {term: round(score / max_tfidf, 4) for term, score in top_tfidf.items()}
+            
             # Generate description
             description = f"Auto-generated category for {category} emails"
             
@@ -277,7 +146,8 @@ class CategoryPatternAnalyzer:
                     },
                     'bodyAnalysis': {
                         'keywords': list(pattern.get('body_patterns', {}).get('top_keywords', {}).keys())[:20],
-                        'phrases': list(pattern.get('body_patterns', {}).get('top_phrases', {}).keys())[:10]
+                        'phrases': list(pattern.get('body_patterns', {}).get('top_phrases', {}).keys())[:10],
+                        'tfidfScores': tfidf_scores
                     },
                     'metadataAnalysis': {
                         'peakHours': pattern.get('temporal_patterns', {}).get('peak_hours', []),
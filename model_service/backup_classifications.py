@@ -1,157 +1,396 @@
 """
 Backup Current Email Classifications
 Creates a backup of all email classifications before reclassification
+
+Backups are compressed NDJSON streamed from a projected cursor: a header line, one line
+per email and a trailing manifest (counts, category distribution and a SHA-256 of the
+email lines), so memory stays constant however large the mailbox is. With --snapshot the
+classifications are instead copied into a snapshot collection by the server itself.
 """
 
 import os
 import sys
+import gzip
 import json
+import hashlib
+from collections import Counter
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Iterator, Optional
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 try:
     from pymongo import MongoClient
+    from bson import json_util
     from dotenv import load_dotenv
+    from tqdm import tqdm
 except ImportError:
     print("Installing required packages...")
-    os.system("pip install pymongo python-dotenv")
+    os.system("pip install pymongo python-dotenv tqdm")
     from pymongo import MongoClient
+    from bson import json_util
     from dotenv import load_dotenv
+    from tqdm import tqdm
+
+from batch_pipeline import BatchPipeline, Stage
 
 # Load environment variables
 load_dotenv()
 
 MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/sortify')
 
+BACKUP_FORMAT = 'sortify-classification-backup'
+BACKUP_FORMAT_VERSION = 2
+
+# Fields copied into the backup
+BACKUP_PROJECTION = {
+    '_id': 1,
+    'subject': 1,
+    'category': 1,
+    'classification': 1,
+    'from': 1,
+    'date': 1
+}
+
+COMPRESSION_EXTENSIONS = {'gzip': '.ndjson.gz', 'zstd': '.ndjson.zst', 'none': '.ndjson'}
+
+# Emails covered by backups and snapshots
+BACKUP_QUERY = {'isDeleted': {'$ne': True}}
+
+# Server-side snapshots: one collection per snapshot, registered in SNAPSHOTS_COLLECTION
+SNAPSHOT_PREFIX = 'classification_snapshot_'
+SNAPSHOTS_COLLECTION = 'classification_snapshots'
+
+# Snapshots also keep the email date so a restore can be limited to a date range
+SNAPSHOT_PROJECTION = {'category': 1, 'classification': 1, 'date': 1}
+
+# Same fallback as backup_category, evaluated by the server
+SNAPSHOT_CATEGORY_EXPR = {'$ifNull': ['$classification.label', {'$ifNull': ['$category', 'Unknown']}]}
+
+
+def compression_for(path: str) -> str:
+    if path.endswith('.gz'):
+        return 'gzip'
+    if path.endswith('.zst'):
+        return 'zstd'
+    return 'none'
+
+
+def open_backup(path: str, mode: str = 'rt'):
+    """Open a backup file as text, (de)compressing by extension (.gz, .zst or plain)"""
+    compression = compression_for(path)
+    if compression == 'gzip':
+        return gzip.open(path, mode, encoding='utf-8', compresslevel=6)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstd backups need the 'zstandard' package (pip install zstandard)")
+        import io
+        raw = open(path, mode.replace('t', '') + 'b')
+        if 'w' in mode:
+            stream = zstandard.ZstdCompressor(level=10).stream_writer(raw, closefd=True)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def is_legacy_backup(path: str) -> bool:
+    """Version 1 backups are a single JSON document"""
+    return path.endswith('.json')
+
+
+def iter_backup(path: str, checksum=None) -> Iterator[Dict[str, Any]]:
+    """
+    Records of a backup in order: header, emails ('type': 'email') and manifest
+
+    `checksum` (a hashlib object) is fed the raw email lines, as the manifest's sha256 was.
+    """
+    if is_legacy_backup(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        yield {'type': 'header', 'format_version': 1, 'backup_date': data.get('backup_date')}
+        for email in data.get('emails', []):
+            yield {'type': 'email', **email}
+        yield {
+            'type': 'manifest',
+            'total_emails': data.get('total_emails', 0),
+            'category_distribution': data.get('category_distribution', {})
+        }
+        return
+
+    with open_backup(path, 'rt') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json_util.loads(line)
+            if checksum is not None and record.get('type') == 'email':
+                checksum.update(line.encode('utf-8'))
+            yield record
+
+
+def read_manifest(path: str) -> Optional[Dict[str, Any]]:
+    """Manifest from the sidecar written next to the backup, if present"""
+    sidecar = f"{path}.manifest.json"
+    if not os.path.exists(sidecar):
+        return None
+    with open(sidecar, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def snapshot_collection(name: str) -> str:
+    """Collection name of a snapshot, given with or without SNAPSHOT_PREFIX"""
+    return name if name.startswith(SNAPSHOT_PREFIX) else f"{SNAPSHOT_PREFIX}{name}"
+
+
+def backup_category(email: Dict[str, Any]) -> str:
+    """Current category of an email as recorded in backups"""
+    classification = email.get('classification') or {}
+    if classification.get('label'):
+        return classification['label']
+    return email.get('category') or 'Unknown'
+
 
 class ClassificationBackup:
     """Backup email classifications"""
-    
-    def __init__(self, mongodb_uri: str = MONGODB_URI):
+
+    def __init__(self, mongodb_uri: str = MONGODB_URI, batch_size: int = 1000):
         self.client = MongoClient(mongodb_uri)
         self.db = self.client.get_database()
         self.emails_collection = self.db['emails']
-        
-    def create_backup(self, output_file: str = None) -> Dict[str, Any]:
-        """Create backup of current classifications"""
-        
+        self.batch_size = batch_size
+
+    def iter_batches(self, cursor) -> Iterator[List[Dict[str, Any]]]:
+        batch = []
+        try:
+            for email in cursor:
+                batch.append(email)
+                if len(batch) == self.batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        finally:
+            cursor.close()
+
+    def create_backup(self, output_file: str = None, compression: str = 'gzip') -> Dict[str, Any]:
+        """Create backup of current classifications; returns the manifest"""
+
         if output_file is None:
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            output_file = f'classification_backup_{timestamp}.json'
-        
+            output_file = f'classification_backup_{timestamp}{COMPRESSION_EXTENSIONS[compression]}'
+
         print("="*70)
         print("CREATING CLASSIFICATION BACKUP")
         print("="*70)
         print(f"\nOutput file: {output_file}")
-        
-        # Extract current classifications
-        print("\nExtracting email classifications from MongoDB...")
-        
-        emails = list(self.emails_collection.find(
-            {'isDeleted': {'$ne': True}},
-            {
-                '_id': 1,
-                'subject': 1,
-                'category': 1,
-                'classification': 1,
-                'from': 1,
-                'date': 1
+
+        query = BACKUP_QUERY
+        total = self.emails_collection.count_documents(query)
+        print(f"\nStreaming {total} email classifications from MongoDB...")
+
+        category_counts = Counter()
+        checksum = hashlib.sha256()
+        written = 0
+        backup_date = datetime.now().isoformat()
+
+        tmp_file = f"{output_file}.tmp{''.join(os.path.splitext(output_file)[1:])}"
+        with open_backup(tmp_file, 'wt') as f:
+            f.write(json.dumps({
+                'type': 'header',
+                'format': BACKUP_FORMAT,
+                'format_version': BACKUP_FORMAT_VERSION,
+                'backup_date': backup_date,
+                'query': query
+            }) + '\n')
+
+            def write_batch(batch: List[Dict[str, Any]]) -> int:
+                nonlocal written
+                lines = []
+                for email in batch:
+                    category_counts[backup_category(email)] += 1
+                    lines.append(json_util.dumps({
+                        'type': 'email',
+                        '_id': email['_id'],
+                        'subject': email.get('subject', ''),
+                        'category': email.get('category'),
+                        'classification': email.get('classification'),
+                        'from': email.get('from', ''),
+                        'date': email.get('date')
+                    }, ensure_ascii=False) + '\n')
+                chunk = ''.join(lines)
+                checksum.update(chunk.encode('utf-8'))
+                f.write(chunk)
+                written += len(batch)
+                return len(batch)
+
+            # Cursor reads overlap with serialisation and compression
+            cursor = self.emails_collection.find(query, BACKUP_PROJECTION).sort('_id', 1).batch_size(self.batch_size)
+            with tqdm(total=total, desc="Backing up", unit="email") as pbar:
+                BatchPipeline(self.iter_batches(cursor), [Stage('write', write_batch)], progress=pbar).run()
+
+            manifest = {
+                'type': 'manifest',
+                'format_version': BACKUP_FORMAT_VERSION,
+                'backup_date': backup_date,
+                'completed_at': datetime.now().isoformat(),
+                'total_emails': written,
+                'category_distribution': dict(category_counts),
+                'sha256': checksum.hexdigest()
             }
-        ))
-        
-        print(f"✓ Found {len(emails)} emails")
-        
-        # Prepare backup data
-        backup_data = {
-            'backup_date': datetime.now().isoformat(),
-            'total_emails': len(emails),
-            'emails': []
-        }
-        
-        # Analyze current distribution
-        category_counts = {}
-        
-        for email in emails:
-            # Get current category
-            category = None
-            if 'classification' in email and 'label' in email['classification']:
-                category = email['classification']['label']
-            elif 'category' in email:
-                category = email['category']
-            else:
-                category = 'Unknown'
-            
-            # Count
-            category_counts[category] = category_counts.get(category, 0) + 1
-            
-            # Add to backup
-            backup_data['emails'].append({
-                'email_id': str(email['_id']),
-                'subject': email.get('subject', ''),
-                'category': email.get('category'),
-                'classification': email.get('classification'),
-                'from': email.get('from', ''),
-                'date': str(email.get('date', ''))
-            })
-        
-        # Add statistics
-        backup_data['category_distribution'] = category_counts
-        
-        # Save backup
-        print(f"\nSaving backup to {output_file}...")
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(backup_data, f, indent=2, ensure_ascii=False)
-        
-        print(f"✓ Backup saved successfully")
-        
+            f.write(json.dumps(manifest) + '\n')
+
+        os.replace(tmp_file, output_file)
+        with open(f"{output_file}.manifest.json", 'w', encoding='utf-8') as mf:
+            json.dump(manifest, mf, indent=2)
+
+        print(f"✓ Backup saved successfully ({os.path.getsize(output_file) / 1e6:.1f} MB)")
+
         # Display statistics
         print("\n" + "="*70)
         print("BACKUP STATISTICS")
         print("="*70)
-        print(f"\nTotal emails backed up: {len(emails)}")
+        print(f"\nTotal emails backed up: {written}")
         print(f"\nCategory Distribution:")
-        for category, count in sorted(category_counts.items(), 
-                                     key=lambda x: x[1], 
-                                     reverse=True):
-            percentage = (count / len(emails)) * 100
+        for category, count in category_counts.most_common():
+            percentage = (count / written) * 100
             print(f"  {category:20s}: {count:5d} ({percentage:5.1f}%)")
-        
+
         print(f"\n✓ Backup complete: {output_file}")
-        
-        return backup_data
-    
+
+        return manifest
+
     def verify_backup(self, backup_file: str) -> bool:
-        """Verify backup file integrity"""
+        """Verify backup file integrity by streaming it against its manifest"""
         print(f"\nVerifying backup: {backup_file}")
-        
+
         try:
-            with open(backup_file, 'r', encoding='utf-8') as f:
-                backup_data = json.load(f)
-            
-            # Check required fields
-            required_fields = ['backup_date', 'total_emails', 'emails', 'category_distribution']
-            for field in required_fields:
-                if field not in backup_data:
-                    print(f"✗ Missing field: {field}")
-                    return False
-            
+            header = manifest = None
+            count = 0
+            category_counts = Counter()
+            checksum = hashlib.sha256()
+
+            for record in iter_backup(backup_file, checksum):
+                kind = record.get('type')
+                if kind == 'header':
+                    header = record
+                elif kind == 'email':
+                    count += 1
+                    category_counts[backup_category(record)] += 1
+                elif kind == 'manifest':
+                    manifest = record
+
+            if header is None:
+                print(f"✗ Missing header")
+                return False
+            if manifest is None:
+                print(f"✗ Missing manifest (backup is incomplete)")
+                return False
+
             # Verify counts match
-            if len(backup_data['emails']) != backup_data['total_emails']:
+            if count != manifest['total_emails']:
                 print(f"✗ Email count mismatch")
                 return False
-            
+            if dict(category_counts) != manifest.get('category_distribution', dict(category_counts)):
+                print(f"✗ Category distribution mismatch")
+                return False
+            if 'sha256' in manifest and checksum.hexdigest() != manifest['sha256']:
+                print(f"✗ Checksum mismatch")
+                return False
+
             print(f"✓ Backup verified successfully")
-            print(f"  - Total emails: {backup_data['total_emails']}")
-            print(f"  - Categories: {len(backup_data['category_distribution'])}")
-            
+            print(f"  - Total emails: {count}")
+            print(f"  - Categories: {len(category_counts)}")
+
             return True
-            
+
         except Exception as e:
             print(f"✗ Verification failed: {e}")
             return False
-    
+
+    def create_snapshot(self, name: str = None) -> Dict[str, Any]:
+        """
+        Copy {_id, category, classification, date} of every email into a snapshot collection
+
+        Runs entirely on the server with $out, so nothing crosses the network; returns the
+        snapshot's registry entry.
+        """
+        name = snapshot_collection(name or datetime.now().strftime('%Y%m%d_%H%M%S'))
+
+        print("="*70)
+        print("CREATING CLASSIFICATION SNAPSHOT")
+        print("="*70)
+        print(f"\nSnapshot collection: {name}")
+
+        created_at = datetime.now()
+        self.emails_collection.aggregate([
+            {'$match': BACKUP_QUERY},
+            {'$project': SNAPSHOT_PROJECTION},
+            {'$out': name}
+        ])
+
+        distribution = {
+            doc['_id']: doc['count']
+            for doc in self.db[name].aggregate([{'$group': {'_id': SNAPSHOT_CATEGORY_EXPR, 'count': {'$sum': 1}}}])
+        }
+        entry = {
+            '_id': name,
+            'createdAt': created_at,
+            'completedAt': datetime.now(),
+            'query': BACKUP_QUERY,
+            'totalEmails': sum(distribution.values()),
+            'categoryDistribution': distribution
+        }
+        self.db[SNAPSHOTS_COLLECTION].replace_one({'_id': name}, entry, upsert=True)
+
+        print(f"✓ Snapshot saved in {(entry['completedAt'] - created_at).total_seconds():.1f}s")
+        print(f"\nTotal emails snapshotted: {entry['totalEmails']}")
+        print(f"\nCategory Distribution:")
+        for category, count in sorted(distribution.items(), key=lambda item: -item[1]):
+            percentage = (count / entry['totalEmails']) * 100
+            print(f"  {category:20s}: {count:5d} ({percentage:5.1f}%)")
+
+        print(f"\n✓ Snapshot complete: {name}")
+
+        return entry
+
+    def list_snapshots(self) -> List[Dict[str, Any]]:
+        """Registered snapshots, newest first"""
+        return list(self.db[SNAPSHOTS_COLLECTION].find().sort('createdAt', -1))
+
+    def verify_snapshot(self, name: str) -> bool:
+        """Check a snapshot collection against its registry entry"""
+        name = snapshot_collection(name)
+        print(f"\nVerifying snapshot: {name}")
+
+        entry = self.db[SNAPSHOTS_COLLECTION].find_one({'_id': name})
+        if entry is None:
+            print(f"✗ Snapshot not registered")
+            return False
+
+        count = self.db[name].estimated_document_count()
+        if count != entry['totalEmails']:
+            print(f"✗ Email count mismatch ({count} != {entry['totalEmails']})")
+            return False
+
+        print(f"✓ Snapshot verified successfully")
+        print(f"  - Total emails: {count}")
+        print(f"  - Categories: {len(entry['categoryDistribution'])}")
+        return True
+
+    def drop_snapshot(self, name: str) -> bool:
+        """Drop a registered snapshot collection and its registry entry"""
+        name = snapshot_collection(name)
+        if self.db[SNAPSHOTS_COLLECTION].find_one({'_id': name}) is None:
+            print(f"✗ Not a registered snapshot: {name}")
+            return False
+
+        self.db[name].drop()
+        self.db[SNAPSHOTS_COLLECTION].delete_one({'_id': name})
+        print(f"✓ Dropped snapshot: {name}")
+        return True
+
     def close(self):
         """Close MongoDB connection"""
         self.client.close()
@@ -160,40 +399,68 @@ class ClassificationBackup:
 def main():
     """Main backup function"""
     import argparse
-    
+
     parser = argparse.ArgumentParser(description="Backup email classifications")
     parser.add_argument("--output", type=str, default=None,
-                       help="Output backup file path")
+                       help="Output backup file path (.ndjson.gz, .ndjson.zst or .ndjson)")
+    parser.add_argument("--compression", type=str, default="gzip", choices=["gzip", "zstd", "none"],
+                       help="Compression for the default output file name")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                       help="Emails fetched per cursor batch")
     parser.add_argument("--verify", type=str, default=None,
                        help="Verify existing backup file")
-    
+    parser.add_argument("--snapshot", action="store_true",
+                       help="Snapshot classifications into a server-side collection instead of a file")
+    parser.add_argument("--snapshot-name", type=str, default=None,
+                       help=f"Snapshot name, {SNAPSHOT_PREFIX} is prepended (default: timestamped)")
+    parser.add_argument("--verify-snapshot", type=str, default=None,
+                       help="Verify existing snapshot collection")
+    parser.add_argument("--list-snapshots", action="store_true",
+                       help="List snapshot collections")
+    parser.add_argument("--drop-snapshot", type=str, default=None,
+                       help="Drop a snapshot collection")
+
     args = parser.parse_args()
-    
-    backup = ClassificationBackup()
-    
+
+    backup = ClassificationBackup(batch_size=args.batch_size)
+
     try:
-        if args.verify:
+        if args.list_snapshots:
+            for entry in backup.list_snapshots():
+                print(f"  {entry['_id']}  {entry['createdAt']:%Y-%m-%d %H:%M:%S}  {entry['totalEmails']} emails")
+        elif args.drop_snapshot:
+            if not backup.drop_snapshot(args.drop_snapshot):
+                sys.exit(1)
+        elif args.verify_snapshot:
+            if not backup.verify_snapshot(args.verify_snapshot):
+                sys.exit(1)
+        elif args.snapshot:
+            entry = backup.create_snapshot(args.snapshot_name)
+            if not backup.verify_snapshot(entry['_id']):
+                sys.exit(1)
+        elif args.verify:
             # Verify existing backup
-            backup.verify_backup(args.verify)
+            if not backup.verify_backup(args.verify):
+                sys.exit(1)
         else:
             # Create new backup
-            backup.create_backup(args.output)
-            
+            backup.create_backup(args.output, args.compression)
+
             # Auto-verify
             if args.output:
-                backup.verify_backup(args.output)
+                latest = args.output
             else:
                 # Find the latest backup
                 import glob
-                backups = glob.glob('classification_backup_*.json')
-                if backups:
-                    latest = max(backups, key=os.path.getctime)
-                    backup.verify_backup(latest)
-    
+                backups = glob.glob('classification_backup_*.ndjson*')
+                backups = [b for b in backups if not b.endswith('.manifest.json')]
+                latest = max(backups, key=os.path.getctime) if backups else None
+            if latest and not backup.verify_backup(latest):
+                sys.exit(1)
+
     finally:
         backup.close()
 
 
 if __name__ == "__main__":
     main()
-
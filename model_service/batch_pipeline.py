@@ -0,0 +1,235 @@
+"""
+Pipelined Batch Executor for the Maintenance Scripts
+Runs a reader, concurrent processing stages and a writer in threads connected by bounded
+queues, so Mongo reads, model inference and bulk writes overlap instead of taking turns
+"""
+
+import time
+import queue
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, List, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Batches buffered between two stages
+DEFAULT_QUEUE_SIZE = 4
+
+_DONE = object()
+
+
+@dataclass
+class Stage:
+    """
+    One processing step: fn(batch) -> batch for the next stage
+
+    Returning None drops the batch. With workers > 1 batches overtake each other, so
+    downstream stages must not depend on order (use the sequence number given to
+    on_complete for that).
+    """
+    name: str
+    fn: Callable[[Any], Any]
+    workers: int = 1
+
+    # Filled while running
+    batches: int = 0
+    records: int = 0
+    busy_seconds: float = 0.0
+    inbox: Optional[queue.Queue] = field(default=None, repr=False)
+
+    def rate(self, elapsed: float) -> float:
+        return self.records / elapsed if elapsed > 0 else 0.0
+
+
+def batch_size(batch: Any) -> int:
+    try:
+        return len(batch)
+    except TypeError:
+        return 1
+
+
+class BatchPipeline:
+    """
+    Reader -> stages -> sink, each in its own thread(s)
+
+    The reader iterates `source` (an iterable of batches, e.g. chunks of a Mongo cursor).
+    Every batch carries its sequence number in source order and its record count as read,
+    which all stages report even if they reshape the batch; `on_complete(seq, output)`
+    runs after the last stage finishes a batch, in that stage's thread. Queues between
+    stages are bounded, so a slow stage back-pressures the reader instead of buffering
+    the collection, and end-to-end throughput is that of the slowest stage.
+
+    The first exception in any stage stops the pipeline and is re-raised by run().
+    """
+
+    def __init__(
+        self,
+        source: Iterable[Any],
+        stages: List[Stage],
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        on_complete: Optional[Callable[[int, Any], None]] = None,
+        progress=None
+    ):
+        if not stages:
+            raise ValueError("BatchPipeline needs at least one stage")
+        self.source = source
+        self.stages = stages
+        self.queue_size = queue_size
+        self.on_complete = on_complete
+        self.progress = progress
+
+        self.read = Stage('read', fn=lambda batch: batch)
+        self.stop_event = threading.Event()
+        self.error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self._start_time = None
+
+    # Queue helpers that give up once the pipeline is stopping
+
+    def _put(self, q: queue.Queue, item):
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self.stop_event.is_set():
+            try:
+                return q.get(timeout=0.2)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _fail(self, error: BaseException):
+        with self._lock:
+            if self.error is None:
+                self.error = error
+        self.stop_event.set()
+
+    def _reader(self):
+        outbox = self.stages[0].inbox
+        try:
+            iterator = iter(self.source)
+            seq = 0
+            while not self.stop_event.is_set():
+                start = time.perf_counter()
+                try:
+                    batch = next(iterator)
+                except StopIteration:
+                    break
+                self.read.busy_seconds += time.perf_counter() - start
+                size = batch_size(batch)
+                self.read.batches += 1
+                self.read.records += size
+                if not self._put(outbox, (seq, size, batch)):
+                    break
+                seq += 1
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            for _ in range(self.stages[0].workers):
+                self._put(outbox, _DONE)
+
+    def _worker(self, index: int, remaining: List[int]):
+        stage = self.stages[index]
+        last = index == len(self.stages) - 1
+        outbox = None if last else self.stages[index + 1].inbox
+        try:
+            while True:
+                item = self._get(stage.inbox)
+                if item is _DONE:
+                    break
+                seq, size, batch = item
+                start = time.perf_counter()
+                output = stage.fn(batch)
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    stage.busy_seconds += elapsed
+                    stage.batches += 1
+                    stage.records += size
+                if output is None:
+                    continue
+                if last:
+                    if self.on_complete is not None:
+                        self.on_complete(seq, output)
+                    self._report(size)
+                elif not self._put(outbox, (seq, size, output)):
+                    break
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            # The stage's last worker to finish closes the next stage's inbox
+            with self._lock:
+                remaining[index] -= 1
+                closing = remaining[index] == 0
+            if closing and outbox is not None:
+                for _ in range(self.stages[index + 1].workers):
+                    self._put(outbox, _DONE)
+
+    def _report(self, records: int):
+        if self.progress is None:
+            return
+        with self._lock:
+            self.progress.set_postfix_str(self.status_line(), refresh=False)
+            self.progress.update(records)
+
+    def status_line(self) -> str:
+        """Per-stage throughput and backlog, e.g. "read 900/s | classify 310/s q4 | write 305/s q0" """
+        elapsed = time.perf_counter() - self._start_time if self._start_time else 0.0
+        parts = [f"{self.read.name} {self.read.rate(elapsed):.0f}/s"]
+        for stage in self.stages:
+            parts.append(f"{stage.name} {stage.rate(elapsed):.0f}/s q{stage.inbox.qsize()}")
+        return " | ".join(parts)
+
+    def stage_stats(self) -> List[dict]:
+        """Records, batches, throughput and utilisation per stage"""
+        elapsed = time.perf_counter() - self._start_time if self._start_time else 0.0
+        stats = []
+        for stage in [self.read] + self.stages:
+            stats.append({
+                'stage': stage.name,
+                'workers': stage.workers,
+                'batches': stage.batches,
+                'records': stage.records,
+                'records_per_second': round(stage.rate(elapsed), 2),
+                'busy_seconds': round(stage.busy_seconds, 3),
+                'utilisation': round(stage.busy_seconds / (elapsed * stage.workers), 3) if elapsed > 0 else 0.0
+            })
+        return stats
+
+    def run(self) -> List[dict]:
+        """Run to completion and return stage_stats(); Ctrl-C stops all stages"""
+        for stage in self.stages:
+            stage.inbox = queue.Queue(maxsize=self.queue_size)
+        remaining = [stage.workers for stage in self.stages]
+        self._start_time = time.perf_counter()
+
+        threads = [threading.Thread(target=self._reader, name='pipeline-read', daemon=True)]
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._worker, args=(index, remaining),
+                    name=f"pipeline-{stage.name}-{n}", daemon=True
+                ))
+
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=0.5)
+        except KeyboardInterrupt:
+            self.stop_event.set()
+            for thread in threads:
+                thread.join(timeout=5)
+            raise
+
+        if self.error is not None:
+            raise self.error
+        return self.stage_stats()
@@ -0,0 +1,495 @@
+"""
+Batch Tool Benchmark
+Runs the Mongo-backed maintenance tools against a local stand-in database filled with a
+synthetic mailbox and records throughput and the peak RSS each tool adds
+
+Backends: mongomock (in-process, no server needed), a mongod spawned on a temporary
+dbpath, or an existing disposable database given by URI. Each scenario runs in its own
+forked process. A forked child starts out with the parent's resident pages (with mongomock,
+the whole mailbox), so the reported memory is the peak RSS above what the child started
+with. Scenarios that need server-only aggregation stages are skipped on mongomock. Reclassification uses a keyword scorer built from the
+category patterns in place of the model, so it measures Mongo I/O and pipeline overhead.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import resource
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from contextlib import redirect_stdout, redirect_stderr
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_mailbox import SyntheticMailbox, load_category_profiles
+from classification_versions import fingerprint, category_digests, categories_version
+
+# Tools whose module-level MongoClient is pointed at the mongomock stand-in
+TOOL_MODULES = [
+    'backup_classifications', 'rollback_reclassification', 'reclassify_all_emails',
+    'extract_training_data', 'extract_enhanced_features'
+]
+
+DATABASE_NAME = 'sortify_benchmark'
+
+# One in this many emails is made stale before the incremental reclassification scenario
+STALE_EVERY = 10
+
+# Added-RSS growth below this many MB is never reported as a regression
+RSS_NOISE_MB = 8.0
+
+
+class StandIn:
+    """A throwaway MongoDB: mongomock, a spawned mongod, or an existing URI"""
+
+    def __init__(self, backend: str, mongodb_uri: Optional[str] = None):
+        self.backend = backend
+        self.uri = mongodb_uri or f"mongodb://127.0.0.1/{DATABASE_NAME}"
+        self.process = None
+        self.dbpath = None
+        self.client = None
+
+    def start(self):
+        if self.backend == 'mongomock':
+            import mongomock
+            self.client = mongomock.MongoClient(self.uri)
+            self._patch_tools()
+        elif self.backend == 'mongod':
+            binary = shutil.which('mongod')
+            if binary is None:
+                raise RuntimeError("mongod not found on PATH")
+            with socket.socket() as s:
+                s.bind(('127.0.0.1', 0))
+                port = s.getsockname()[1]
+            self.dbpath = tempfile.mkdtemp(prefix='sortify-mongod-')
+            self.process = subprocess.Popen(
+                [binary, '--dbpath', self.dbpath, '--port', str(port), '--bind_ip', '127.0.0.1', '--quiet'],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            self.uri = f"mongodb://127.0.0.1:{port}/{DATABASE_NAME}"
+            self.client = self._connect()
+        else:
+            self.client = self._connect()
+        return self
+
+    def _connect(self, timeout: float = 30.0):
+        from pymongo import MongoClient
+        client = MongoClient(self.uri, serverSelectionTimeoutMS=int(timeout * 1000))
+        client.admin.command('ping')
+        return client
+
+    def _patch_tools(self):
+        """Every MongoClient(uri) in the tools returns the shared in-memory client"""
+        client = self.client
+        for name in TOOL_MODULES:
+            module = __import__(name)
+            module.MongoClient = lambda *args, **kwargs: client
+
+    @property
+    def supports_server_stages(self) -> bool:
+        """$merge, $regexFind, $dateToParts etc. need a real server"""
+        return self.backend != 'mongomock'
+
+    def emails(self):
+        return self.client.get_database()['emails']
+
+    def stop(self):
+        if self.backend != 'mongomock' and self.client is not None:
+            if self.backend == 'mongod':
+                self.client.drop_database(DATABASE_NAME)
+            self.client.close()
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=30)
+        if self.dbpath:
+            shutil.rmtree(self.dbpath, ignore_errors=True)
+
+
+class KeywordScorer:
+    """Stand-in for the model: scores categories by keyword hits in subject and body"""
+
+    def __init__(self, profiles: Dict[str, Dict[str, Any]]):
+        self.keywords = {name: [k.lower() for k in profile['keywords']] for name, profile in profiles.items()}
+        digests = category_digests(profiles)
+        self.versions = {
+            'model_version': fingerprint('keyword-scorer'),
+            'categories_version': categories_version(digests),
+            'category_digests': digests
+        }
+
+    def predict_batch(self, emails: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+        predictions = []
+        for email in emails:
+            text = f"{email['subject']} {email['body']}".lower()
+            hits = {name: sum(text.count(k) for k in keywords) for name, keywords in self.keywords.items()}
+            total = sum(hits.values()) or 1
+            scores = {name: count / total for name, count in hits.items()}
+            label = max(scores, key=scores.get)
+            predictions.append({'label': label, 'confidence': scores[label], 'scores': scores})
+        return predictions
+
+
+# Scenarios: fn(ctx) -> number of emails processed; run in order, in a forked process each
+
+def scenario_backup(ctx):
+    from backup_classifications import ClassificationBackup
+    backup = ClassificationBackup(ctx['uri'], batch_size=ctx['batch_size'])
+    try:
+        return backup.create_backup(ctx['backup_file'])['total_emails']
+    finally:
+        backup.close()
+
+
+def scenario_verify(ctx):
+    from backup_classifications import ClassificationBackup, read_manifest
+    backup = ClassificationBackup(ctx['uri'])
+    try:
+        if not backup.verify_backup(ctx['backup_file']):
+            raise RuntimeError("backup verification failed")
+        return read_manifest(ctx['backup_file'])['total_emails']
+    finally:
+        backup.close()
+
+
+def scenario_rollback(ctx):
+    from rollback_reclassification import ClassificationRollback
+    rollback = ClassificationRollback(ctx['uri'], chunk_size=ctx['batch_size'], workers=ctx['workers'])
+    try:
+        rollback.restore_from_backup(ctx['backup_file'])
+        return rollback.stats['total_restored']
+    finally:
+        rollback.close()
+
+
+def scenario_snapshot(ctx):
+    from backup_classifications import ClassificationBackup
+    backup = ClassificationBackup(ctx['uri'])
+    try:
+        return backup.create_snapshot('benchmark')['totalEmails']
+    finally:
+        backup.close()
+
+
+def scenario_snapshot_rollback(ctx):
+    from backup_classifications import SNAPSHOT_PREFIX
+    from rollback_reclassification import ClassificationRollback
+    rollback = ClassificationRollback(ctx['uri'])
+    try:
+        rollback.restore_from_snapshot(f"{SNAPSHOT_PREFIX}benchmark")
+        return rollback.stats['total_restored']
+    finally:
+        rollback.close()
+
+
+def scenario_training_report(ctx):
+    from extract_training_data import EmailDataExtractor
+    extractor = EmailDataExtractor(ctx['uri'])
+    try:
+        emails = extractor.extract_emails()
+        extractor.generate_analysis_report(emails, 'extraction_report.json')
+        return len(emails)
+    finally:
+        extractor.close()
+
+
+def scenario_training_analytics(ctx):
+    from extract_training_data import EmailDataExtractor
+    extractor = EmailDataExtractor(ctx['uri'])
+    try:
+        return extractor.generate_aggregation_report('extraction_report_aggregation.json')['total_emails']
+    finally:
+        extractor.close()
+
+
+def scenario_enhanced_features(ctx):
+    import extract_enhanced_features
+    os.environ['MONGO_URI'] = ctx['uri']
+    sys.argv = ['extract_enhanced_features.py', '--output-dir', 'enhanced_features',
+                '--workers', str(ctx['workers']), '--full']
+    extract_enhanced_features.main()
+    return extract_enhanced_features.load_manifest('enhanced_features')['total_samples']
+
+
+def _reclassifier(ctx, **kwargs):
+    from reclassify_all_emails import EmailReclassifier
+    scorer = KeywordScorer(ctx['profiles'])
+    reclassifier = EmailReclassifier(
+        mongodb_uri=ctx['uri'], batch_size=ctx['batch_size'], workers=ctx['workers'],
+        checkpoint_file=os.path.join(ctx['workdir'], 'reclassification_checkpoint.json'), **kwargs
+    )
+    reclassifier.classify_emails = scorer.predict_batch
+    reclassifier.load_versions = lambda: scorer.versions
+    return reclassifier
+
+
+def scenario_reclassify(ctx):
+    reclassifier = _reclassifier(ctx)
+    try:
+        reclassifier.reclassify_all()
+        return reclassifier.stats['total_processed'] + reclassifier.stats['total_unchanged']
+    finally:
+        reclassifier.close()
+
+
+def setup_reclassify_incremental(ctx):
+    # Forked scenarios on mongomock do not see each other's writes: stamp versions first,
+    # then make every STALE_EVERY-th email look classified by another model
+    reclassifier = _reclassifier(ctx, incremental=True)
+    try:
+        reclassifier.reclassify_all()
+        emails = reclassifier.emails_collection
+        ids = [doc['_id'] for doc in emails.find({'isDeleted': {'$ne': True}}, {'_id': 1}).sort('_id', 1)]
+        emails.update_many({'_id': {'$in': ids[::STALE_EVERY]}},
+                           {'$set': {'classification.modelFingerprint': fingerprint('previous-model')}})
+    finally:
+        reclassifier.close()
+
+
+def scenario_reclassify_incremental(ctx):
+    # Finds the stale emails through the version index and reclassifies only those
+    reclassifier = _reclassifier(ctx, incremental=True)
+    try:
+        reclassifier.reclassify_all()
+        return reclassifier.stats['total_processed']
+    finally:
+        reclassifier.close()
+
+
+SCENARIOS = [
+    # (name, fn, needs server-only aggregation stages, untimed setup run in the same process)
+    ('backup', scenario_backup, False, None),
+    ('verify-backup', scenario_verify, False, None),
+    ('rollback', scenario_rollback, False, None),
+    ('snapshot', scenario_snapshot, False, None),
+    ('snapshot-rollback', scenario_snapshot_rollback, True, None),
+    ('training-report', scenario_training_report, False, None),
+    ('training-analytics', scenario_training_analytics, True, None),
+    ('enhanced-features', scenario_enhanced_features, False, None),
+    ('reclassify', scenario_reclassify, False, None),
+    ('reclassify-incremental', scenario_reclassify_incremental, False, setup_reclassify_incremental),
+]
+
+
+def _status_kb(field: str) -> Optional[int]:
+    """A VmRSS/VmHWM-style field of /proc/self/status in KiB (None off Linux)"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _maxrss_kb(who) -> float:
+    """ru_maxrss in KiB (it is bytes on macOS)"""
+    maxrss = resource.getrusage(who).ru_maxrss
+    return maxrss / 1024 if sys.platform == 'darwin' else maxrss
+
+
+def start_rss_measurement() -> float:
+    """Reset this process's peak RSS to its current RSS and return that baseline in KiB"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        # No resettable high-water mark: peaks are relative to the inherited maximum
+        return _maxrss_kb(resource.RUSAGE_SELF)
+    return _status_kb('VmRSS')
+
+
+def added_rss_mb(baseline_kb: float) -> float:
+    """Peak RSS of this process and its waited-for children above `baseline_kb`, in MB"""
+    own = _status_kb('VmHWM')
+    if own is None:
+        own = _maxrss_kb(resource.RUSAGE_SELF)
+    children = _maxrss_kb(resource.RUSAGE_CHILDREN)  # forked workers inherit the same pages
+    return max(own - baseline_kb, children - baseline_kb, 0) / 1024
+
+
+def _run_child(fn: Callable, setup: Optional[Callable], ctx: Dict[str, Any], conn, verbose: bool):
+    os.chdir(ctx['workdir'])
+    result = {'status': 'ok'}
+    sink = sys.stdout if verbose else open(os.devnull, 'w')
+    try:
+        with redirect_stdout(sink), redirect_stderr(sink):
+            if setup is not None:
+                setup(ctx)
+            baseline_kb = start_rss_measurement()
+            result['start_rss_mb'] = round(baseline_kb / 1024, 1)
+            start = time.perf_counter()
+            result['emails'] = fn(ctx)
+            result['seconds'] = time.perf_counter() - start
+            result['peak_rss_added_mb'] = round(added_rss_mb(baseline_kb), 1)
+    except BaseException as e:
+        result = {'status': 'error', 'error': f"{type(e).__name__}: {e}"}
+    conn.send(result)
+    conn.close()
+
+
+def run_scenario(name: str, fn: Callable, ctx: Dict[str, Any], verbose: bool = False,
+                 setup: Optional[Callable] = None) -> Dict[str, Any]:
+    """Run one scenario in a forked process; the stand-in's data is inherited (mongomock) or shared (server)"""
+    context = multiprocessing.get_context('fork')
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    process = context.Process(target=_run_child, args=(fn, setup, ctx, child_conn, verbose), name=f"bench-{name}")
+    process.start()
+    child_conn.close()
+    try:
+        result = parent_conn.recv()
+    except EOFError:
+        result = {'status': 'error', 'error': f"scenario process exited with code {process.exitcode}"}
+    process.join()
+
+    result['scenario'] = name
+    if result['status'] == 'ok':
+        result['seconds'] = round(result['seconds'], 3)
+        result['emails_per_second'] = round(result['emails'] / result['seconds'], 1) if result['seconds'] > 0 else 0.0
+    return result
+
+
+def compare_with_baseline(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Scenarios whose throughput dropped or added peak RSS grew by more than `tolerance`"""
+    previous = {r['scenario']: r for r in baseline.get('results', []) if r.get('status') == 'ok'}
+    regressions = []
+    for result in results:
+        before = previous.get(result['scenario'])
+        if before is None or result['status'] != 'ok':
+            continue
+        if result['emails_per_second'] < before['emails_per_second'] * (1 - tolerance):
+            regressions.append(f"{result['scenario']}: {before['emails_per_second']:.0f} -> "
+                               f"{result['emails_per_second']:.0f} emails/s")
+        if 'peak_rss_added_mb' not in before:
+            continue  # baseline predates added-RSS measurement
+        allowed = max(before['peak_rss_added_mb'] * (1 + tolerance), before['peak_rss_added_mb'] + RSS_NOISE_MB)
+        if result['peak_rss_added_mb'] > allowed:
+            regressions.append(f"{result['scenario']}: added RSS {before['peak_rss_added_mb']:.0f} -> "
+                               f"{result['peak_rss_added_mb']:.0f} MB")
+    return regressions
+
+
+def run_benchmark(backend: str, emails: int, seed: int, batch_size: int, workers: int,
+                  scenarios: Optional[List[str]] = None, mongodb_uri: Optional[str] = None,
+                  verbose: bool = False) -> Dict[str, Any]:
+    """Fill a stand-in with a synthetic mailbox and run the scenarios against it"""
+    stand_in = StandIn(backend, mongodb_uri).start()
+    workdir = tempfile.mkdtemp(prefix='sortify-bench-')
+    try:
+        profiles = load_category_profiles()
+        mailbox = SyntheticMailbox(profiles, seed=seed, end_date=datetime(2025, 1, 1))
+        stand_in.emails().drop()
+        start = time.perf_counter()
+        mailbox.insert(stand_in.emails(), emails, batch_size=batch_size, progress=verbose)
+        generation_seconds = time.perf_counter() - start
+
+        ctx = {
+            'uri': stand_in.uri,
+            'workdir': workdir,
+            'backup_file': os.path.join(workdir, 'classification_backup.ndjson.gz'),
+            'batch_size': batch_size,
+            'workers': workers,
+            'emails': emails,
+            'profiles': profiles
+        }
+
+        results = []
+        for name, fn, needs_server, setup in SCENARIOS:
+            if scenarios and name not in scenarios:
+                continue
+            if needs_server and not stand_in.supports_server_stages:
+                results.append({'scenario': name, 'status': 'skipped', 'error': 'needs a MongoDB server'})
+                continue
+            results.append(run_scenario(name, fn, ctx, verbose, setup))
+
+        return {
+            'timestamp': datetime.now().isoformat(),
+            'backend': backend,
+            'emails': emails,
+            'seed': seed,
+            'batch_size': batch_size,
+            'workers': workers,
+            'cpus': os.cpu_count(),
+            'generation_emails_per_second': round(emails / generation_seconds, 1) if generation_seconds > 0 else 0.0,
+            'results': results
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        stand_in.stop()
+
+
+def main():
+    """Main benchmark function"""
+    parser = argparse.ArgumentParser(description="Benchmark the Mongo-backed batch tools on a synthetic mailbox")
+    parser.add_argument("--backend", type=str, default="mongomock", choices=["mongomock", "mongod", "uri"],
+                       help="Stand-in database")
+    parser.add_argument("--mongodb-uri", type=str, default=None,
+                       help="Disposable database for --backend uri (its emails collection is dropped)")
+    parser.add_argument("--emails", type=int, default=10000,
+                       help="Synthetic mailbox size")
+    parser.add_argument("--seed", type=int, default=42,
+                       help="Random seed of the mailbox")
+    parser.add_argument("--batch-size", type=int, default=500,
+                       help="Batch size passed to the tools")
+    parser.add_argument("--workers", type=int, default=2,
+                       help="Workers passed to the tools")
+    parser.add_argument("--scenario", action="append", default=None,
+                       choices=[scenario[0] for scenario in SCENARIOS],
+                       help="Only run this scenario (repeatable)")
+    parser.add_argument("--baseline", type=str, default=None,
+                       help="Earlier report to compare against; exits 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                       help="Allowed throughput drop / peak RSS growth versus the baseline")
+    parser.add_argument("--output", type=str, default=None,
+                       help="Optional JSON output file")
+    parser.add_argument("--verbose", action="store_true",
+                       help="Show the tools' own output")
+
+    args = parser.parse_args()
+    if args.backend == 'uri' and not args.mongodb_uri:
+        parser.error("--backend uri needs --mongodb-uri")
+
+    print("="*70)
+    print("BATCH TOOL BENCHMARK")
+    print("="*70)
+
+    report = run_benchmark(args.backend, args.emails, args.seed, args.batch_size, args.workers,
+                           args.scenario, args.mongodb_uri, args.verbose)
+
+    print(f"\nBackend: {report['backend']}  Emails: {report['emails']}  CPUs: {report['cpus']}  "
+          f"Generation: {report['generation_emails_per_second']:.0f} emails/s")
+    print(f"\n  {'Scenario':<24} {'Emails':>8} {'Seconds':>9} {'Emails/s':>10} {'Added RSS MB':>13}")
+    print(f"  {'-'*67}")
+    for row in report['results']:
+        if row['status'] == 'ok':
+            print(f"  {row['scenario']:<24} {row['emails']:>8} {row['seconds']:>9.2f} "
+                  f"{row['emails_per_second']:>10.0f} {row['peak_rss_added_mb']:>13.1f}")
+        else:
+            print(f"  {row['scenario']:<24} {row['status']}: {row.get('error', '')}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✓ Report saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(report['results'], baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ Regressions versus {args.baseline}:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            sys.exit(1)
+        print(f"\n✓ No regressions versus {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Feature Model Inference Benchmark
+Compares the sklearn-wrapper prediction path of FeatureBasedClassifier with the compiled fast path
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+from typing import Dict, List, Any
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from ensemble_classifier import FeatureBasedClassifier
+
+
+def make_synthetic_data(n_samples: int, n_features: int, n_classes: int, seed: int = 42):
+    """Create a separable synthetic feature matrix with string labels"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, 3, size=(n_classes, n_features))
+    y_idx = rng.integers(0, n_classes, size=n_samples)
+    X = centers[y_idx] + rng.normal(0, 1, size=(n_samples, n_features))
+    labels = np.array([f"Category_{i}" for i in range(n_classes)])
+    return X, labels[y_idx]
+
+
+def legacy_predict(clf: FeatureBasedClassifier, X: np.ndarray):
+    """The original path: StandardScaler.transform + predict_proba + inverse_transform per row batch"""
+    X_scaled = clf.scaler.transform(X)
+    predictions = clf.model.predict_proba(X_scaled)
+    predicted_idx = np.argmax(predictions, axis=1)
+    return clf.label_encoder.inverse_transform(predicted_idx), predictions
+
+
+def fast_predict(clf: FeatureBasedClassifier, X: np.ndarray):
+    """The compiled path: folded scaler + in-place booster prediction + precomputed labels"""
+    predictions = clf.predict_proba_batch(X)
+    return clf._classes[np.argmax(predictions, axis=1)], predictions
+
+
+def time_path(fn, clf, X: np.ndarray, repeats: int) -> float:
+    """Median seconds per call"""
+    fn(clf, X)  # warm-up
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(clf, X)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def run_benchmark(batch_sizes: List[int], repeats: int, n_classes: int, model_type: str) -> Dict[str, Any]:
+    """Benchmark both prediction paths at each batch size"""
+    n_features = len(FeatureBasedClassifier.EXPECTED_FEATURES)
+    X_train, y_train = make_synthetic_data(5000, n_features, n_classes)
+    X_test, _ = make_synthetic_data(max(batch_sizes), n_features, n_classes, seed=7)
+
+    clf = FeatureBasedClassifier(model_type)
+    clf.train(X_train, y_train)
+
+    results = []
+    for batch_size in batch_sizes:
+        X = X_test[:batch_size]
+
+        legacy_labels, legacy_probs = legacy_predict(clf, X)
+        fast_labels, fast_probs = fast_predict(clf, X)
+        agreement = float(np.mean(legacy_labels == fast_labels))
+        max_abs_diff = float(np.max(np.abs(legacy_probs - fast_probs)))
+
+        legacy_s = time_path(legacy_predict, clf, X, repeats)
+        fast_s = time_path(fast_predict, clf, X, repeats)
+
+        results.append({
+            'batch_size': batch_size,
+            'legacy_ms': legacy_s * 1000,
+            'fast_ms': fast_s * 1000,
+            'speedup': legacy_s / fast_s if fast_s > 0 else 0.0,
+            'legacy_rows_per_sec': batch_size / legacy_s if legacy_s > 0 else 0.0,
+            'fast_rows_per_sec': batch_size / fast_s if fast_s > 0 else 0.0,
+            'label_agreement': agreement,
+            'max_probability_diff': max_abs_diff
+        })
+
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'model_type': model_type,
+        'threads': clf.n_jobs,
+        'n_features': n_features,
+        'n_classes': n_classes,
+        'repeats': repeats,
+        'results': results
+    }
+
+
+def main():
+    """Main benchmark function"""
+    parser = argparse.ArgumentParser(description="Benchmark feature model inference paths")
+    parser.add_argument("--batch-sizes", type=int, nargs='+', default=[1, 32, 1024],
+                       help="Batch sizes to benchmark")
+    parser.add_argument("--repeats", type=int, default=200,
+                       help="Timed calls per batch size")
+    parser.add_argument("--classes", type=int, default=9,
+                       help="Number of synthetic categories")
+    parser.add_argument("--model-type", type=str, default='xgboost',
+                       help="Feature model type")
+    parser.add_argument("--output", type=str, default=None,
+                       help="Optional JSON output file")
+
+    args = parser.parse_args()
+
+    print("="*70)
+    print("FEATURE MODEL INFERENCE BENCHMARK")
+    print("="*70)
+
+    report = run_benchmark(args.batch_sizes, args.repeats, args.classes, args.model_type)
+
+    print(f"\nModel: {report['model_type']}  Threads: {report['threads']}  "
+          f"Features: {report['n_features']}  Classes: {report['n_classes']}")
+    print(f"\n  {'Batch':>6} {'Legacy ms':>11} {'Fast ms':>9} {'Speedup':>8} {'Fast rows/s':>12} {'Agree':>6}")
+    print(f"  {'-'*58}")
+    for row in report['results']:
+        print(f"  {row['batch_size']:>6} {row['legacy_ms']:>11.3f} {row['fast_ms']:>9.3f} "
+              f"{row['speedup']:>7.1f}x {row['fast_rows_per_sec']:>12.0f} {row['label_agreement']:>6.3f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✓ Report saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
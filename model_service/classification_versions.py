@@ -0,0 +1,175 @@
+"""
+Classification Versions for Incremental Reclassification
+Content digests, model and category-set fingerprints, and the MongoDB filters that select
+emails whose stored classification is out of date
+"""
+
+import os
+import json
+import hashlib
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+# Fields written next to every stored classification
+CONTENT_DIGEST_FIELD = 'classification.contentDigest'
+MODEL_VERSION_FIELD = 'classification.modelFingerprint'
+CATEGORIES_VERSION_FIELD = 'classification.categoriesVersion'
+
+# Support the clauses of the stale-classification filter (also declared on the Email schema)
+VERSION_INDEX = [(MODEL_VERSION_FIELD, 1), (CATEGORIES_VERSION_FIELD, 1)]
+CATEGORIES_VERSION_INDEX = [(CATEGORIES_VERSION_FIELD, 1)]
+
+# Category definitions per categories version, so a later run can tell which categories changed
+CATEGORY_VERSIONS_COLLECTION = 'classification_category_versions'
+
+# An email is affected by a category change when the category is in the top-k of its cached scores
+AFFECTED_TOP_K = int(os.getenv('RECLASSIFY_AFFECTED_TOP_K', '3'))
+
+# Category fields that change without changing classification behaviour
+VOLATILE_CATEGORY_FIELDS = {'created_at', 'updated_at', 'trained_at', 'last_trained'}
+
+
+def fingerprint(value: Any) -> str:
+    """Short, stable hash of a JSON-serialisable value"""
+    payload = json.dumps(value, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def content_digest(subject: str, body: str) -> str:
+    """Digest of the text the model classifies"""
+    return fingerprint([subject or '', body or ''])
+
+
+def category_digests(categories: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+    """Fingerprint of each category definition"""
+    return {
+        name: fingerprint({k: v for k, v in (data or {}).items() if k not in VOLATILE_CATEGORY_FIELDS})
+        for name, data in categories.items()
+    }
+
+
+def categories_version(digests: Dict[str, str]) -> str:
+    return fingerprint(digests)
+
+
+def changed_categories(old: Dict[str, str], new: Dict[str, str]) -> Tuple[Set[str], Set[str]]:
+    """(categories modified or removed, categories added) between two digest maps"""
+    changed = {name for name, digest in old.items() if new.get(name) != digest}
+    added = set(new) - set(old)
+    return changed, added
+
+
+def top_k_expr(categories: Iterable[str], top_k: int = AFFECTED_TOP_K) -> Dict[str, Any]:
+    """
+    $expr that is true when any of `categories` is the stored label or among the top_k
+    cached scores (fewer than top_k categories score higher)
+
+    Scores are matched by key through $objectToArray, so category names with spaces or
+    dots are safe.
+    """
+    categories = sorted(categories)
+    scores = {'$objectToArray': {'$ifNull': ['$classification.scores', {}]}}
+    in_top_k = []
+    for name in categories:
+        score = {'$let': {
+            'vars': {'match': {'$filter': {'input': scores, 'cond': {'$eq': ['$$this.k', name]}}}},
+            'in': {'$arrayElemAt': ['$$match.v', 0]}
+        }}
+        in_top_k.append({'$let': {
+            'vars': {'score': score},
+            'in': {'$and': [
+                {'$ne': [{'$ifNull': ['$$score', None]}, None]},
+                {'$lt': [
+                    {'$size': {'$filter': {'input': scores, 'cond': {'$gt': ['$$this.v', '$$score']}}}},
+                    top_k
+                ]}
+            ]}
+        }})
+    return {'$or': [{'$in': ['$classification.label', categories]}] + in_top_k}
+
+
+def stale_query(
+    model_version: str,
+    current_version: str,
+    current_digests: Dict[str, str],
+    previous_versions: Optional[Dict[str, Dict[str, str]]] = None,
+    top_k: int = AFFECTED_TOP_K
+) -> Dict[str, Any]:
+    """
+    Filter for emails whose classification is out of date
+
+    An email is stale when it was never versioned or was classified by another model, or
+    was classified under another category set. For a previous category set whose
+    definitions are known and that only modified or removed categories, only emails that
+    had a changed category as label or in their top_k scores are stale. A category set
+    that added categories makes all of its emails stale, since their cached scores say
+    nothing about the new category.
+    """
+    partial = {}
+    for version, digests in (previous_versions or {}).items():
+        if version == current_version:
+            continue
+        changed, added = changed_categories(digests, current_digests)
+        if not added:
+            partial[version] = changed
+
+    # Every clause can use VERSION_INDEX or CATEGORIES_VERSION_INDEX. The content digest is
+    # always stored with the model fingerprint, so "no digest" is covered by the $ne clause.
+    clauses = [
+        {MODEL_VERSION_FIELD: {'$ne': model_version}},
+        {CATEGORIES_VERSION_FIELD: {'$nin': [current_version] + sorted(partial)}}
+    ]
+    for version, changed in sorted(partial.items()):
+        if changed:
+            clauses.append({CATEGORIES_VERSION_FIELD: version, '$expr': top_k_expr(changed, top_k)})
+    return {'$or': clauses}
+
+
+def is_stale(
+    email: Dict[str, Any],
+    digest: str,
+    model_version: str,
+    current_version: str,
+    current_digests: Dict[str, str],
+    previous_versions: Optional[Dict[str, Dict[str, str]]] = None,
+    top_k: int = AFFECTED_TOP_K
+) -> bool:
+    """Client-side stale_query for a projected email, also comparing its content digest"""
+    classification = email.get('classification') or {}
+    if classification.get('contentDigest') != digest:
+        return True
+    if classification.get('modelFingerprint') != model_version:
+        return True
+
+    version = classification.get('categoriesVersion')
+    if version == current_version:
+        return False
+    previous = (previous_versions or {}).get(version)
+    if previous is None:
+        return True
+    changed, added = changed_categories(previous, current_digests)
+    if added:
+        return True
+    if classification.get('label') in changed:
+        return True
+
+    scores = classification.get('scores') or {}
+    ranked = sorted(scores, key=scores.get, reverse=True)[:top_k]
+    return any(name in changed for name in ranked)
+
+
+class CategoryVersionRegistry:
+    """Category digests of every categories version seen, stored in MongoDB"""
+
+    def __init__(self, db):
+        self.collection = db[CATEGORY_VERSIONS_COLLECTION]
+
+    def register(self, version: str, digests: Dict[str, str]):
+        self.collection.update_one(
+            {'_id': version},
+            {'$setOnInsert': {'categories': digests, 'createdAt': datetime.now()}},
+            upsert=True
+        )
+
+    def load(self) -> Dict[str, Dict[str, str]]:
+        return {doc['_id']: doc.get('categories', {}) for doc in self.collection.find({}, {'categories': 1})}
@@ -0,0 +1,264 @@
+"""
+Corpus Analytics Engine
+Tokenizes every email once into sparse term-document matrices and derives per-category
+term, phrase, sender and temporal statistics for all categories at once
+"""
+
+import re
+import time
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from domain_intelligence import get_domain_intelligence
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Word tokens, same as r'\b\w+\b' (text is lowercased first)
+TOKEN_RE = re.compile(r'\w+')
+
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def top_entries(row: sp.csr_matrix, names: np.ndarray, mask: Optional[np.ndarray], top_n: int) -> Dict[str, float]:
+    """Largest entries of a sparse row vector as {name: value}, optionally restricted by a column mask"""
+    indices, values = row.indices, row.data
+    if mask is not None:
+        keep = mask[indices]
+        indices, values = indices[keep], values[keep]
+    keep = values > 0
+    indices, values = indices[keep], values[keep]
+    if len(values) > top_n:
+        part = np.argpartition(-values, top_n - 1)[:top_n]
+        indices, values = indices[part], values[part]
+    # Ties keep corpus first-occurrence order (column order)
+    order = np.lexsort((indices, -values))
+    return {str(names[i]): values[j].item() for j, i in zip(order, indices[order])}
+
+
+class CorpusAnalytics:
+    """
+    Sparse statistics over a labelled email corpus
+
+    Subjects and bodies are tokenized once into vocabulary ids and a CSR count matrix
+    with a shared vocabulary (rows [0, N) are subjects, rows [N, 2N) bodies). Body
+    phrases are adjacent id pairs aggregated in numpy. Per-category statistics are
+    products with a sparse category-by-email indicator matrix, so every category is
+    computed at once.
+    """
+
+    def __init__(self, emails: List[Dict[str, Any]]):
+        start = time.perf_counter()
+        self.emails = emails
+        self.n_docs = len(emails)
+
+        categories = [email.get('category') or 'Other' for email in emails]
+        self.categories, category_codes = np.unique(np.array(categories, dtype=object), return_inverse=True)
+        self.category_index = {category: i for i, category in enumerate(self.categories)}
+        self.category_codes = category_codes
+        self.indicator = sp.csr_matrix(
+            (np.ones(self.n_docs), (category_codes, np.arange(self.n_docs))),
+            shape=(len(self.categories), self.n_docs)
+        )
+        self.category_sizes = np.bincount(category_codes, minlength=len(self.categories))
+
+        self.subjects = [str(email.get('subject', '') or '') for email in emails]
+        self.bodies = [str(email.get('body', '') or '') for email in emails]
+
+        self._build_term_matrices()
+        self._build_sender_matrices()
+        self._build_metadata()
+
+        self._tfidf = None
+        logger.info(f"Indexed {self.n_docs} emails ({len(self.terms)} terms) in {time.perf_counter() - start:.1f}s")
+
+    def _build_term_matrices(self):
+        # Tokenize every subject and body exactly once, then map tokens to vocabulary ids
+        tokens: List[str] = []
+        doc_lengths = np.zeros(2 * self.n_docs, dtype=np.int64)
+        for doc, text in enumerate(self.subjects + self.bodies):
+            doc_tokens = TOKEN_RE.findall(text.lower())
+            tokens.extend(doc_tokens)
+            doc_lengths[doc] = len(doc_tokens)
+
+        # Ids follow first occurrence in the corpus
+        token_ids, terms = pd.factorize(np.array(tokens, dtype=object))
+        del tokens
+        self.terms = np.asarray(terms, dtype=object)
+        self.term_lengths = np.fromiter((len(t) for t in self.terms), dtype=np.int64, count=len(self.terms))
+        n_terms = len(self.terms)
+
+        token_ids = token_ids.astype(np.int64)
+        token_docs = np.repeat(np.arange(2 * self.n_docs), doc_lengths)
+        counts = sp.csr_matrix(
+            (np.ones(len(token_ids), dtype=np.int32), (token_docs, token_ids)),
+            shape=(2 * self.n_docs, n_terms)
+        )
+        self.subject_counts = counts[:self.n_docs]
+        self.body_counts = counts[self.n_docs:]
+
+        # Document frequency of words over subject + body
+        full = (self.subject_counts + self.body_counts).tocsc()
+        self.document_frequency = np.diff(full.indptr)
+
+        # Per-category totals: categories x terms
+        self.category_subject_tf = (self.indicator @ self.subject_counts).tocsr()
+        self.category_body_tf = (self.indicator @ self.body_counts).tocsr()
+        self.category_tf = (self.category_subject_tf + self.category_body_tf).tocsr()
+
+        # Body phrases: adjacent token pairs within a body, encoded as first * n_terms + second
+        in_body = token_docs >= self.n_docs
+        same_doc = np.zeros(len(token_ids), dtype=bool)
+        same_doc[:-1] = (token_docs[:-1] == token_docs[1:]) & in_body[:-1]
+        first = token_ids[:-1][same_doc[:-1]]
+        second = token_ids[1:][same_doc[:-1]]
+        phrase_docs = token_docs[:-1][same_doc[:-1]] - self.n_docs
+
+        self.phrase_keys, phrase_codes = np.unique(first * n_terms + second, return_inverse=True)
+        phrase_categories = self.category_codes[phrase_docs]
+        self.category_phrases = sp.csr_matrix(
+            (np.ones(len(phrase_codes), dtype=np.int32), (phrase_categories, phrase_codes)),
+            shape=(len(self.categories), len(self.phrase_keys))
+        )
+        self.phrase_lengths = self.term_lengths[self.phrase_keys // max(n_terms, 1)] + 1 + \
+            self.term_lengths[self.phrase_keys % max(n_terms, 1)]
+
+    def phrase(self, code: int) -> str:
+        first, second = divmod(int(self.phrase_keys[code]), len(self.terms))
+        return f"{self.terms[first]} {self.terms[second]}"
+
+    def _build_sender_matrices(self):
+        domain_intel = get_domain_intelligence()
+        senders = np.array([str(email.get('from', '') or '') for email in self.emails], dtype=object)
+        self.sender_names, sender_codes = np.unique(senders, return_inverse=True)
+
+        # Resolve each distinct sender once
+        sender_domains = np.array([domain_intel.extract_domain(s) if s else '' for s in self.sender_names],
+                                  dtype=object)
+        self.domain_names, domain_of_sender = np.unique(sender_domains, return_inverse=True)
+
+        has_sender = senders != ''
+        rows, cols = self.category_codes[has_sender], sender_codes[has_sender]
+        self.category_senders = sp.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)), shape=(len(self.categories), len(self.sender_names))
+        )
+
+        domain_codes = domain_of_sender[cols]
+        has_domain = sender_domains[cols] != ''
+        self.category_domains = sp.csr_matrix(
+            (np.ones(int(has_domain.sum())), (rows[has_domain], domain_codes[has_domain])),
+            shape=(len(self.categories), len(self.domain_names))
+        )
+
+    def _build_metadata(self):
+        subjects_lower = np.array([s.lower() for s in self.subjects], dtype=object)
+        self.has_subject = np.array([bool(s) for s in self.subjects])
+        self.subject_lengths = np.array([len(s) for s in self.subjects])
+        self.body_lengths = np.array([len(b) for b in self.bodies])
+        self.has_body = self.body_lengths > 0
+
+        year = re.compile(r'\d{4}')
+        clock = re.compile(r'\d{1,2}:\d{2}')
+        self.subject_flags = {
+            'reply': np.array(['re:' in s for s in subjects_lower]),
+            'forward': np.array(['fwd:' in s for s in subjects_lower]),
+            'contains_year': np.array([bool(year.search(s)) for s in self.subjects]),
+            'contains_time': np.array([bool(clock.search(s)) for s in self.subjects])
+        }
+
+        hours = np.full(self.n_docs, -1)
+        days = np.full(self.n_docs, -1)
+        for i, email in enumerate(self.emails):
+            date_str = email.get('date', '')
+            if not date_str:
+                continue
+            try:
+                date = datetime.fromisoformat(str(date_str).replace('Z', '+00:00'))
+            except ValueError:
+                continue
+            hours[i] = date.hour
+            days[i] = date.weekday()
+        self.hours = hours
+        self.days = days
+
+    def _rows(self, category: str) -> np.ndarray:
+        return self.category_codes == self.category_index[category]
+
+    def tfidf_matrix(self) -> sp.csr_matrix:
+        """categories x terms TF-IDF (category term frequency x log(N / df)) for words longer than 3"""
+        if self._tfidf is None:
+            idf = np.zeros(len(self.terms))
+            words = self.document_frequency > 0
+            idf[words] = np.log(self.n_docs / self.document_frequency[words])
+            keep = words & (self.term_lengths > 3)
+            self._tfidf = (self.category_tf.multiply(idf * keep)).tocsr()
+            self._tfidf.eliminate_zeros()
+        return self._tfidf
+
+    def tfidf(self, category: str, top_n: int = 50) -> Dict[str, float]:
+        if category not in self.category_index:
+            return {}
+        return top_entries(self.tfidf_matrix()[self.category_index[category]], self.terms, None, top_n)
+
+    def sender_patterns(self, category: str) -> Dict[str, Any]:
+        if category not in self.category_index:
+            return {'top_domains': {}, 'top_senders': {}, 'unique_domains': 0, 'unique_senders': 0}
+        i = self.category_index[category]
+        domains, senders = self.category_domains[i], self.category_senders[i]
+        return {
+            'top_domains': {k: int(v) for k, v in top_entries(domains, self.domain_names, None, 10).items()},
+            'top_senders': {k: int(v) for k, v in top_entries(senders, self.sender_names, None, 10).items()},
+            'unique_domains': int(domains.nnz),
+            'unique_senders': int(senders.nnz)
+        }
+
+    def subject_patterns(self, category: str) -> Dict[str, Any]:
+        if category not in self.category_index:
+            return {'top_keywords': {}, 'common_patterns': {}, 'total_subjects': 0, 'avg_subject_length': 0}
+        i = self.category_index[category]
+        rows = self._rows(category) & self.has_subject
+        keywords = top_entries(self.category_subject_tf[i], self.terms, self.term_lengths > 3, 20)
+        patterns = {name: int(flags[rows].sum()) for name, flags in self.subject_flags.items() if flags[rows].any()}
+        return {
+            'top_keywords': {k: int(v) for k, v in keywords.items()},
+            'common_patterns': patterns,
+            'total_subjects': int(rows.sum()),
+            'avg_subject_length': float(self.subject_lengths[rows].mean()) if rows.any() else 0
+        }
+
+    def body_patterns(self, category: str) -> Dict[str, Any]:
+        if category not in self.category_index:
+            return {'top_keywords': {}, 'top_phrases': {}, 'avg_body_length': 0, 'min_length': 0, 'max_length': 0}
+        i = self.category_index[category]
+        rows = self._rows(category) & self.has_body
+        lengths = self.body_lengths[rows]
+        keywords = top_entries(self.category_body_tf[i], self.terms, self.term_lengths > 4, 30)
+        phrase_codes = top_entries(self.category_phrases[i], np.arange(len(self.phrase_keys)),
+                                   self.phrase_lengths > 10, 20)
+        phrases = {self.phrase(int(code)): count for code, count in phrase_codes.items()}
+        return {
+            'top_keywords': {k: int(v) for k, v in keywords.items()},
+            'top_phrases': {k: int(v) for k, v in phrases.items()},
+            'avg_body_length': float(lengths.mean()) if len(lengths) else 0,
+            'min_length': int(lengths.min()) if len(lengths) else 0,
+            'max_length': int(lengths.max()) if len(lengths) else 0
+        }
+
+    def temporal_patterns(self, category: str) -> Dict[str, Any]:
+        rows = self._rows(category) if category in self.category_index else np.zeros(self.n_docs, dtype=bool)
+        hours = np.bincount(self.hours[rows & (self.hours >= 0)], minlength=24)
+        days = np.bincount(self.days[rows & (self.days >= 0)], minlength=7)
+        peak_hours = [int(h) for h in np.argsort(-hours, kind='stable')[:3] if hours[h] > 0]
+        peak_days = [DAY_NAMES[d] for d in np.argsort(-days, kind='stable')[:3] if days[d] > 0]
+        return {
+            'hour_distribution': {int(h): int(c) for h, c in enumerate(hours) if c},
+            'day_distribution': {int(d): int(c) for d, c in enumerate(days) if c},
+            'peak_hours': peak_hours,
+            'peak_days': peak_days
+        }
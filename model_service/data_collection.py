@@ -10,7 +10,8 @@ from datetime import datetime, timedelta
 import pandas as pd
 from pathlib import Path
 
-from feature_extractor import EmailFeatureExtractor, normalize_features
+from feature_extractor import EmailFeatureExtractor, FEATURE_EXTRACTOR_VERSION, features_to_vector
+from feature_store import FeatureStore, get_feature_store, build_email_data, content_hash, sample_email_id
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -19,8 +20,9 @@ logger = logging.getLogger(__name__)
 class TrainingDataCollector:
     """Collect and prepare training data from existing classified emails"""
     
-    def __init__(self):
+    def __init__(self, feature_store: Optional[FeatureStore] = None):
         self.feature_extractor = EmailFeatureExtractor()
+        self.feature_store = feature_store if feature_store is not None else get_feature_store()
         self.collected_samples = []
     
     def collect_from_existing_data(
@@ -48,15 +50,9 @@ class TrainingDataCollector:
         for email in emails_data:
             try:
                 # Extract email content and metadata
-                email_data = {
-                    'subject': email.get('subject', ''),
-                    'body': email.get('body', '') or email.get('text', ''),
-                    'html': email.get('html', ''),
-                    'from': email.get('from', ''),
-                    'to': email.get('to', ''),
-                    'date': email.get('date'),
-                    'attachments': email.get('attachments', [])
-                }
+                email_data = build_email_data(email)
+                email_id = sample_email_id(email)
+                digest = content_hash(email_data)
                 
                 # Get classification info
                 classification = email.get('classification', {})
@@ -72,17 +68,26 @@ class TrainingDataCollector:
                 if category_counts[label] > max_samples_per_category:
                     continue
                 
-                # Extract features
-                features = self.feature_extractor.extract_features(email_data)
+                # Extract features (skipped for emails already in the feature store;
+                # their vectors are loaded by id and content hash at training time)
+                features = None
+                if self.feature_store is None or email_id is None or \
+                        self.feature_store.lookup(email_id, digest) is None:
+                    features = self.feature_extractor.extract_features(email_data)
+                    if self.feature_store is not None and email_id is not None:
+                        self.feature_store.add(email_id, digest, features_to_vector(features), label)
                 
                 # Create training sample
                 training_sample = {
+                    'emailId': email_id,
+                    'contentHash': digest,
                     'subject': email_data['subject'],
                     'body': email_data['body'],
                     'html': email_data['html'],
                     'from': email_data['from'],
                     'to': email_data['to'],
                     'date': email_data['date'],
+                    'attachments': email_data['attachments'],
                     'features': features,
                     'trueLabel': label,
                     'predictedLabel': label,  # For training, use true label
@@ -103,6 +108,9 @@ class TrainingDataCollector:
                 logger.warning(f"Error processing email {email.get('id', 'unknown')}: {e}")
                 continue
         
+        if self.feature_store is not None:
+            self.feature_store.flush()
+        
         logger.info(f"Collected {len(training_samples)} training samples")
         logger.info(f"Category distribution: {category_counts}")
         
@@ -126,12 +134,21 @@ class TrainingDataCollector:
         
         for i, sample in enumerate(training_samples):
             try:
-                features = sample.get('features', {})
-                normalized_features = normalize_features(features)
+                features = sample.get('features')
+                if features:
+                    # Convert to array in consistent order
+                    feature_vector = features_to_vector(features)
+                else:
+                    # Samples collected against the feature store carry only id and hash
+                    feature_vector = None
+                    if self.feature_store is not None and sample.get('emailId'):
+                        feature_vector = self.feature_store.lookup(sample['emailId'], sample.get('contentHash', ''))
+                    if feature_vector is None:
+                        feature_vector = features_to_vector(
+                            self.feature_extractor.extract_features(build_email_data(sample))
+                        )
                 
-                # Convert to array in consistent order
-                feature_vector = self._features_to_vector(normalized_features)
-                X.append(feature_vector)
+                X.append(feature_vector.tolist())
                 y.append(sample['trueLabel'])
                 sample_ids.append(i)
                 
@@ -147,32 +164,6 @@ class TrainingDataCollector:
         
         return X, y
     
-    def _features_to_vector(self, features: Dict[str, Any]) -> List[float]:
-        """Convert feature dictionary to ordered vector"""
-        # This should match the feature order in ensemble_classifier.py
-        expected_features = [
-            'subject_length', 'subject_word_count', 'subject_has_urgency', 'subject_caps_ratio',
-            'total_text_length', 'total_word_count', 'body_length', 'body_word_count',
-            'has_html', 'html_length', 'html_to_text_ratio', 'html_image_count',
-            'has_hidden_text', 'business_keyword_count', 'academic_keyword_count', 'job_keyword_count',
-            'link_count', 'has_links', 'external_link_count', 'unique_domain_count', 'short_url_count',
-            'sender_name_length', 'sender_email_length', 'domain_levels', 'is_common_domain',
-            'recipient_count', 'hour_of_day', 'day_of_week', 'is_business_hour', 'is_weekend',
-            'attachment_count', 'has_attachments', 'total_attachment_size', 'avg_attachment_size',
-            'unique_extension_count', 'suspicious_extension_count', 'has_pdf_attachment',
-            'has_image_attachment', 'has_document_attachment', 'subject_exclamation_count',
-            'subject_question_count', 'subject_number_count', 'body_paragraph_count',
-            'avg_paragraph_length', 'html_table_count', 'html_list_count', 'html_form_count',
-            'has_spf', 'has_dkim', 'has_dmarc', 'has_reply_to', 'has_priority_header',
-            'sender_domain_hash', 'sender_tld_hash'
-        ]
-        
-        feature_vector = []
-        for feature_name in expected_features:
-            feature_vector.append(features.get(feature_name, 0.0))
-        
-        return feature_vector
-    
     def export_training_data(
         self, 
         training_samples: List[Dict[str, Any]], 
@@ -194,7 +185,7 @@ class TrainingDataCollector:
                 'metadata': {
                     'exportedAt': datetime.now().isoformat(),
                     'totalSamples': len(training_samples),
-                    'featureExtractorVersion': '1.0.0'
+                    'featureExtractorVersion': FEATURE_EXTRACTOR_VERSION
                 },
                 'categories': list(set(sample['trueLabel'] for sample in training_samples)),
                 'samples': training_samples
@@ -5,20 +5,27 @@ Integrates with the existing model service architecture
 
 import torch
 import torch.nn as nn
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import DataLoader, Sampler
 from transformers import (
     DistilBertTokenizerFast, 
     DistilBertForSequenceClassification,
     TrainingArguments, 
     Trainer,
-    AutoConfig
+    AutoConfig,
+    DataCollatorWithPadding,
+    TrainerCallback
 )
-from datasets import load_dataset, Dataset as HFDataset
+from transformers.trainer_utils import get_last_checkpoint
+from datasets import load_dataset, load_from_disk, Dataset as HFDataset
 import numpy as np
 from sklearn.metrics import accuracy_score, precision_recall_fscore_support
 import logging
 import json
 import os
+import time
+import hashlib
+import inspect
+import shutil
 from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime
 import argparse
@@ -27,37 +34,450 @@ import argparse
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class EmailDataset(Dataset):
-    """PyTorch Dataset for email classification"""
+# Tokenized datasets are cached here, keyed by tokenizer + max_length + data checksum
+TOKENIZED_CACHE_DIR = os.getenv('TOKENIZED_CACHE_DIR', 'tokenized_cache')
+
+# Worker processes for tokenization (the fast tokenizer also batches internally)
+TOKENIZE_NUM_PROC = int(os.getenv('TOKENIZE_NUM_PROC', '1'))
+
+# Digest -> label of every example a saved model was trained with (drives incremental runs)
+TRAINING_MANIFEST_FILE = 'training_manifest.json'
+
+# TrainingArguments renamed evaluation_strategy to eval_strategy in newer transformers
+EVAL_STRATEGY_ARG = (
+    'eval_strategy' if 'eval_strategy' in inspect.signature(TrainingArguments.__init__).parameters
+    else 'evaluation_strategy'
+)
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """Digest of everything about a tokenizer that changes its output"""
+    digest = hashlib.sha1(type(tokenizer).__name__.encode('utf-8'))
+    backend = getattr(tokenizer, 'backend_tokenizer', None)
+    if backend is not None:
+        # Truncation/padding state is set on the backend by each call; it is not identity
+        state = json.loads(backend.to_str())
+        state.pop('truncation', None)
+        state.pop('padding', None)
+        digest.update(json.dumps(state, sort_keys=True).encode('utf-8'))
+    else:
+        digest.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode('utf-8'))
+    digest.update(str(getattr(tokenizer, 'do_lower_case', '')).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def dataset_checksum(texts: List[str], labels: Optional[List[int]] = None) -> str:
+    """Digest of texts and labels in order"""
+    digest = hashlib.sha1()
+    for i, text in enumerate(texts):
+        digest.update(str(text).encode('utf-8'))
+        digest.update(b'\x00')
+        if labels is not None:
+            digest.update(str(labels[i]).encode('utf-8'))
+        digest.update(b'\x01')
+    return digest.hexdigest()[:16]
+
+
+def build_tokenized_dataset(
+    texts: List[str],
+    labels: Optional[List[int]],
+    tokenizer,
+    max_length: int = 256,
+    cache_dir: Optional[str] = TOKENIZED_CACHE_DIR,
+    num_proc: int = TOKENIZE_NUM_PROC,
+    batch_size: int = 1000
+) -> HFDataset:
+    """
+    Tokenize once (batched, unpadded) and cache the result as an Arrow dataset
     
-    def __init__(self, texts: List[str], labels: List[int], tokenizer, max_length: int = 256):
-        self.texts = texts
-        self.labels = labels
-        self.tokenizer = tokenizer
-        self.max_length = max_length
+    Columns: input_ids, attention_mask, length and (when labels are given) labels.
+    Padding is left to DataCollatorWithPadding so each batch is padded only to its
+    own longest example.
+    
+    Args:
+        texts: Input texts
+        labels: Label ids, or None for unlabeled inference data
+        tokenizer: A (fast) tokenizer
+        max_length: Truncation length
+        cache_dir: Cache root; None disables caching
+        num_proc: Tokenization worker processes
+        batch_size: Texts per tokenizer call
+    """
+    cache_key = f"{tokenizer_fingerprint(tokenizer)}-{max_length}-{dataset_checksum(texts, labels)}"
+    cache_path = os.path.join(cache_dir, cache_key) if cache_dir else None
+    
+    if cache_path and os.path.isdir(cache_path):
+        logger.info(f"Loading tokenized dataset from cache {cache_path}")
+        return load_from_disk(cache_path)
+    
+    columns = {'text': [str(text) for text in texts]}
+    if labels is not None:
+        columns['labels'] = list(labels)
+    dataset = HFDataset.from_dict(columns)
+    
+    def tokenize(batch):
+        encoding = tokenizer(batch['text'], truncation=True, max_length=max_length)
+        encoding['length'] = [len(ids) for ids in encoding['input_ids']]
+        return encoding
+    
+    start = time.perf_counter()
+    dataset = dataset.map(
+        tokenize,
+        batched=True,
+        batch_size=batch_size,
+        num_proc=num_proc if num_proc and num_proc > 1 and len(texts) > batch_size else None,
+        remove_columns=['text'],
+        desc="Tokenizing"
+    )
+    logger.info(f"Tokenized {len(texts)} texts in {time.perf_counter() - start:.1f}s "
+                f"(mean length {np.mean(dataset['length']) if len(dataset) else 0:.1f} tokens)")
+    
+    if cache_path:
+        # Write to a temporary directory and rename, so readers never see a partial cache
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.tmp-{os.getpid()}"
+        dataset.save_to_disk(tmp_path)
+        try:
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # Another process cached the same dataset first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        dataset = load_from_disk(cache_path)
+        logger.info(f"Tokenized dataset cached at {cache_path}")
+    
+    return dataset
+
+def example_text_and_label(example: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    """Training text and label name of a dataset example (text is None when it has no text fields)"""
+    # Combine text fields
+    text_parts = []
+    if 'header_subject' in example:
+        text_parts.append(example['header_subject'])
+    if 'body_text' in example:
+        text_parts.append(example['body_text'])
+    if 'analysis_reasoning' in example:
+        text_parts.append(example['analysis_reasoning'])
+    if not text_parts and example.get('text'):
+        # prepare_distilbert_dataset.py writes the combined text directly
+        text_parts.append(example['text'])
+    
+    if not text_parts:
+        logger.warning(f"Example missing text fields: {example.keys()}")
+        return None, None
+    
+    # Get label
+    label = None
+    if 'trueLabel' in example:
+        label = example['trueLabel']
+    elif 'label' in example:
+        label = example['label']
+    
+    return " ".join(text_parts), label
+
+
+def stratified_split(labels: List[int], validation_split: float, seed: int = 42) -> Tuple[List[int], List[int]]:
+    """
+    Seeded per-label split into (train, validation) indices
+    
+    Every label keeps about `validation_split` of its examples for validation, whatever
+    the order of the input file. Training indices are shuffled.
+    """
+    rng = np.random.default_rng(seed)
+    labels = np.asarray(labels)
+    train_idx, val_idx = [], []
+    for label in np.unique(labels):
+        idx = rng.permutation(np.flatnonzero(labels == label))
+        n_val = int(round(len(idx) * validation_split))
+        if validation_split > 0 and len(idx) > 1:
+            n_val = min(max(n_val, 1), len(idx) - 1)
+        val_idx.extend(idx[:n_val].tolist())
+        train_idx.extend(idx[n_val:].tolist())
+    return rng.permutation(train_idx).tolist(), sorted(val_idx)
+
+
+def text_digest(text: str) -> str:
+    """Short digest identifying a training text across runs"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def in_fixed_validation(digest: str, validation_percent: int) -> bool:
+    """
+    Whether an example belongs to the fixed validation set
+    
+    Membership depends only on the text, so the set stays the same as the dataset grows
+    and incremental runs never train on it.
+    """
+    return int(digest[:8], 16) % 100 < validation_percent
+
+
+def load_training_manifest(model_dir: str) -> Dict[str, str]:
+    """text digest -> label name for every example a model was trained with"""
+    path = os.path.join(model_dir, TRAINING_MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f).get('examples', {})
+
+
+def save_training_manifest(model_dir: str, examples: Dict[str, str]):
+    path = os.path.join(model_dir, TRAINING_MANIFEST_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'examples': examples, 'updated_at': datetime.now().isoformat()}, f)
+    os.replace(tmp_path, path)
+
+
+def tokenized_logits(model, tokenizer, dataset: HFDataset, batch_size: int = 32) -> np.ndarray:
+    """Model logits for a tokenized dataset, in dataset order"""
+    device = next(model.parameters()).device
+    model.eval()
+    
+    collator = DataCollatorWithPadding(tokenizer)
+    features = dataset.remove_columns([c for c in dataset.column_names if c not in ('input_ids', 'attention_mask')])
+    
+    # Batch similar lengths together so each batch pads to little more than its own length
+    order = np.argsort(dataset['length'], kind='stable')
+    logits = np.zeros((len(dataset), model.config.num_labels), dtype=np.float32)
+    
+    with torch.no_grad():
+        for start in range(0, len(order), batch_size):
+            batch_idx = order[start:start + batch_size]
+            inputs = collator([features[int(i)] for i in batch_idx])
+            inputs = {k: v.to(device) for k, v in inputs.items()}
+            logits[batch_idx] = model(**inputs).logits.float().cpu().numpy()
+    
+    return logits
+
+
+def predict_tokenized(model, tokenizer, dataset: HFDataset, batch_size: int = 32) -> Tuple[np.ndarray, np.ndarray]:
+    """Predicted label ids and confidences for a tokenized dataset, in dataset order"""
+    probs = torch.softmax(torch.from_numpy(tokenized_logits(model, tokenizer, dataset, batch_size)), dim=-1)
+    confidences, predictions = probs.max(dim=-1)
+    return predictions.numpy().astype(np.int64), confidences.numpy().astype(np.float64)
+
+
+class BatchPlanner(Sampler):
+    """
+    Batch sampler that plans which examples share a batch
+    
+    - random: shuffled fixed-size batches (the Trainer default)
+    - length_grouped: shuffle, cut into megabatches of batch_size * megabatch_factor,
+      sort each megabatch by length and cut it into batches, then shuffle the batches
+    
+    With max_tokens set, a batch holds as many examples as fit in
+    max_tokens padded tokens (len(batch) * longest example) instead of batch_size. Token
+    batches are planned once, so every epoch has the same number of steps, and only
+    their order is reshuffled per epoch.
+    """
+    
+    STRATEGIES = ('random', 'length_grouped')
+    
+    def __init__(
+        self,
+        lengths: List[int],
+        batch_size: int = 16,
+        strategy: str = 'length_grouped',
+        max_tokens: Optional[int] = None,
+        megabatch_factor: int = 50,
+        seed: int = 42
+    ):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown batching strategy: {strategy}")
+        
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.batch_size = batch_size
+        self.strategy = strategy
+        self.max_tokens = max_tokens
+        self.megabatch_factor = megabatch_factor
+        self.seed = seed
+        self.epoch = 0
+        self.epoch_stats: Dict[int, Dict[str, Any]] = {}
+        
+        # Token batches are fixed for the whole run (see class docstring)
+        self._token_batches = self._plan(np.random.default_rng(seed)) if max_tokens else None
+    
+    def set_epoch(self, epoch: int):
+        self.epoch = int(epoch)
+    
+    def _order(self, rng: np.random.Generator) -> np.ndarray:
+        """Example order before batching"""
+        order = rng.permutation(len(self.lengths))
+        if self.strategy == 'length_grouped':
+            megabatch = max(self.batch_size * self.megabatch_factor, 1)
+            for start in range(0, len(order), megabatch):
+                chunk = order[start:start + megabatch]
+                order[start:start + megabatch] = chunk[np.argsort(-self.lengths[chunk], kind='stable')]
+        return order
+    
+    def _plan(self, rng: np.random.Generator) -> List[List[int]]:
+        """Cut the ordered examples into batches"""
+        order = self._order(rng)
+        
+        if not self.max_tokens:
+            return [order[i:i + self.batch_size].tolist() for i in range(0, len(order), self.batch_size)]
+        
+        batches = []
+        batch = []
+        longest = 0
+        for idx in order.tolist():
+            length = int(self.lengths[idx])
+            if batch and (len(batch) + 1) * max(longest, length) > self.max_tokens:
+                batches.append(batch)
+                batch = []
+                longest = 0
+            batch.append(idx)
+            longest = max(longest, length)
+        if batch:
+            batches.append(batch)
+        return batches
+    
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed + self.epoch)
+        if self._token_batches is not None:
+            batches = [self._token_batches[i] for i in rng.permutation(len(self._token_batches))]
+        else:
+            batches = self._plan(rng)
+            if self.strategy == 'length_grouped':
+                # Longest-first megabatches would otherwise always start with the largest batches
+                batches = [batches[i] for i in rng.permutation(len(batches))]
+        
+        # Token accounting for this epoch; DataCollatorWithPadding pads to the batch maximum
+        real_tokens = 0
+        padded_tokens = 0
+        for batch in batches:
+            batch_lengths = self.lengths[batch]
+            real_tokens += int(batch_lengths.sum())
+            padded_tokens += int(len(batch) * batch_lengths.max())
+        self.epoch_stats[self.epoch] = {
+            'batches': len(batches),
+            'real_tokens': real_tokens,
+            'padded_tokens': padded_tokens,
+            'padding_ratio': 1.0 - real_tokens / padded_tokens if padded_tokens else 0.0
+        }
+        
+        self.epoch += 1
+        return iter(batches)
     
     def __len__(self):
-        return len(self.texts)
+        if self._token_batches is not None:
+            return len(self._token_batches)
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+
+class ThroughputCallback(TrainerCallback):
+    """Log tokens per second and padding ratio for every training epoch"""
     
-    def __getitem__(self, idx):
-        text = str(self.texts[idx])
-        label = self.labels[idx]
+    def __init__(self, planner: BatchPlanner):
+        self.planner = planner
+        self.history: List[Dict[str, Any]] = []
+        self._epoch_start = None
+        self._planned_epoch = None
+    
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        self._epoch_start = time.perf_counter()
+        self._planned_epoch = self.planner.epoch
+    
+    def on_epoch_end(self, args, state, control, **kwargs):
+        if self._epoch_start is None:
+            return
         
-        # Tokenize
-        encoding = self.tokenizer(
-            text,
-            truncation=True,
-            padding='max_length',
-            max_length=self.max_length,
-            return_tensors='pt'
+        elapsed = time.perf_counter() - self._epoch_start
+        stats = self.planner.epoch_stats.get(self._planned_epoch, {})
+        record = {
+            'epoch': len(self.history) + 1,
+            'seconds': elapsed,
+            'batches': stats.get('batches', 0),
+            'real_tokens': stats.get('real_tokens', 0),
+            'padded_tokens': stats.get('padded_tokens', 0),
+            'padding_ratio': stats.get('padding_ratio', 0.0),
+            'tokens_per_sec': stats.get('real_tokens', 0) / elapsed if elapsed > 0 else 0.0,
+            'padded_tokens_per_sec': stats.get('padded_tokens', 0) / elapsed if elapsed > 0 else 0.0
+        }
+        self.history.append(record)
+        
+        logger.info(
+            f"Epoch {record['epoch']}: {record['tokens_per_sec']:.0f} tokens/s, "
+            f"padding ratio {record['padding_ratio']:.1%}, {record['batches']} batches in {elapsed:.1f}s"
         )
+
+
+class ProgressCallback(TrainerCallback):
+    """
+    Report step progress (loss, throughput, ETA) and stop cleanly on request
+    
+    On cancellation a checkpoint is saved at the current step so the run can be
+    resumed with resume_from_checkpoint.
+    """
+    
+    def __init__(self, report, should_cancel=None, interval: float = 2.0):
+        self.report = report
+        self.should_cancel = should_cancel
+        self.interval = interval
+        self.cancelled = False
+        self.last_loss = None
+        self._start = None
+        self._start_step = 0
+        self._last_report = 0.0
+    
+    def on_train_begin(self, args, state, control, **kwargs):
+        self._start = time.perf_counter()
+        self._start_step = state.global_step  # non-zero when resuming
+    
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if logs and 'loss' in logs:
+            self.last_loss = logs['loss']
+    
+    def on_step_end(self, args, state, control, **kwargs):
+        if self.should_cancel is not None and not self.cancelled and self.should_cancel():
+            self.cancelled = True
+            control.should_save = True
+            control.should_training_stop = True
         
+        now = time.perf_counter()
+        if self.cancelled or now - self._last_report >= self.interval or state.global_step >= state.max_steps:
+            self._last_report = now
+            self.report(self._progress(state, now))
+    
+    def on_epoch_end(self, args, state, control, **kwargs):
+        self.report(self._progress(state, time.perf_counter()))
+    
+    def _progress(self, state, now: float) -> Dict[str, Any]:
+        elapsed = now - self._start if self._start is not None else 0.0
+        steps_per_sec = (state.global_step - self._start_step) / elapsed if elapsed > 0 else 0.0
+        remaining = max(state.max_steps - state.global_step, 0)
         return {
-            'input_ids': encoding['input_ids'].flatten(),
-            'attention_mask': encoding['attention_mask'].flatten(),
-            'labels': torch.tensor(label, dtype=torch.long)
+            'step': state.global_step,
+            'max_steps': state.max_steps,
+            'epoch': state.epoch,
+            'loss': self.last_loss,
+            'steps_per_sec': steps_per_sec,
+            'elapsed_seconds': elapsed,
+            'eta_seconds': remaining / steps_per_sec if steps_per_sec > 0 else None
         }
 
+
+class BatchPlanTrainer(Trainer):
+    """Trainer whose training batches come from a BatchPlanner"""
+    
+    def __init__(self, *args, batch_planner: Optional[BatchPlanner] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_planner = batch_planner
+    
+    def get_train_dataloader(self) -> DataLoader:
+        if self.batch_planner is None:
+            return super().get_train_dataloader()
+        
+        train_dataset = self._remove_unused_columns(self.train_dataset, description="training")
+        dataloader = DataLoader(
+            train_dataset,
+            batch_sampler=self.batch_planner,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory
+        )
+        return self.accelerator.prepare(dataloader)
+
+
 class DistilBERTTrainer:
     """Enhanced DistilBERT trainer with integration to existing architecture"""
     
@@ -66,12 +486,16 @@ class DistilBERTTrainer:
         model_name: str = "distilbert-base-uncased",
         max_length: int = 256,
         num_labels: Optional[int] = None,
-        output_dir: str = "distilbert_models"
+        output_dir: str = "distilbert_models",
+        cache_dir: Optional[str] = TOKENIZED_CACHE_DIR,
+        num_proc: int = TOKENIZE_NUM_PROC
     ):
         self.model_name = model_name
         self.max_length = max_length
         self.num_labels = num_labels
         self.output_dir = output_dir
+        self.cache_dir = cache_dir
+        self.num_proc = num_proc
         
         # Create output directory
         os.makedirs(output_dir, exist_ok=True)
@@ -98,19 +522,18 @@ class DistilBERTTrainer:
         if not os.path.exists(data_file):
             raise FileNotFoundError(f"Dataset file {data_file} not found")
         
-        # Load dataset using datasets library
-        dataset = load_dataset("json", data_files=data_file)["train"]
-        
-        texts = []
-        labels = []
+        # Read examples in a single pass, then build the label mapping
+        examples = []
+        for example in load_dataset("json", data_files=data_file)["train"]:
+            text, label = example_text_and_label(example)
+            if text is None:
+                continue
+            if label is None:
+                logger.warning(f"Invalid label in example: {label}")
+                continue
+            examples.append((text, label))
         
-        # Extract labels first to create mapping
-        unique_labels = set()
-        for example in dataset:
-            if 'trueLabel' in example:
-                unique_labels.add(example['trueLabel'])
-            elif 'label' in example:
-                unique_labels.add(example['label'])
+        unique_labels = {label for _, label in examples}
         
         # Create label mapping
         self.label2id = {label: idx for idx, label in enumerate(sorted(unique_labels))}
@@ -118,42 +541,26 @@ class DistilBERTTrainer:
         
         logger.info(f"Found {len(unique_labels)} unique labels: {list(unique_labels)}")
         
-        # Process examples
-        for example in dataset:
-            # Combine text fields
-            text_parts = []
-            if 'header_subject' in example:
-                text_parts.append(example['header_subject'])
-            if 'body_text' in example:
-                text_parts.append(example['body_text'])
-            if 'analysis_reasoning' in example:
-                text_parts.append(example['analysis_reasoning'])
-            
-            if not text_parts:
-                logger.warning(f"Example missing text fields: {example.keys()}")
-                continue
-                
-            text = " ".join(text_parts)
-            
-            # Get label
-            label = None
-            if 'trueLabel' in example:
-                label = example['trueLabel']
-            elif 'label' in example:
-                label = example['label']
-                
-            if label is None or label not in self.label2id:
-                logger.warning(f"Invalid label in example: {label}")
-                continue
-            
-            texts.append(text)
-            labels.append(self.label2id[label])
+        texts = [text for text, _ in examples]
+        labels = [self.label2id[label] for _, label in examples]
         
         logger.info(f"Loaded {len(texts)} training examples")
         logger.info(f"Label distribution: {dict(zip(*np.unique(labels, return_counts=True)))}")
         
         return texts, labels, self.label2id
     
+    def read_labeled_examples(self, data_file: str) -> List[Tuple[str, str]]:
+        """(text, label name) pairs from a JSONL dataset, without touching the label mapping"""
+        if not os.path.exists(data_file):
+            raise FileNotFoundError(f"Dataset file {data_file} not found")
+        
+        examples = []
+        for example in load_dataset("json", data_files=data_file)["train"]:
+            text, label = example_text_and_label(example)
+            if text is not None and label is not None:
+                examples.append((text, label))
+        return examples
+    
     def initialize_model(self, num_labels: Optional[int] = None):
         """Initialize DistilBERT model and tokenizer"""
         if num_labels is None:
@@ -180,6 +587,17 @@ class DistilBERTTrainer:
         
         logger.info("Model initialized successfully")
     
+    def tokenize_dataset(self, texts: List[str], labels: Optional[List[int]] = None) -> HFDataset:
+        """Tokenized, unpadded dataset for texts (loaded from the cache when possible)"""
+        return build_tokenized_dataset(
+            texts,
+            labels,
+            self.tokenizer,
+            max_length=self.max_length,
+            cache_dir=self.cache_dir,
+            num_proc=self.num_proc
+        )
+    
     def compute_metrics(self, eval_pred):
         """Compute evaluation metrics"""
         predictions, labels = eval_pred
@@ -206,7 +624,15 @@ class DistilBERTTrainer:
         eval_batch_size: int = 32,
         num_epochs: int = 3,
         learning_rate: float = 2e-5,
-        warmup_steps: int = 500
+        warmup_steps: int = 500,
+        batching: str = 'length_grouped',
+        max_tokens_per_batch: Optional[int] = None,
+        megabatch_factor: int = 50,
+        callbacks: Optional[List[TrainerCallback]] = None,
+        resume_from_checkpoint: Optional[str] = None,
+        validation_texts: Optional[List[str]] = None,
+        validation_labels: Optional[List[int]] = None,
+        load_best_model: bool = True
     ) -> Dict[str, Any]:
         """
         Train the DistilBERT model
@@ -220,24 +646,49 @@ class DistilBERTTrainer:
             num_epochs: Number of training epochs
             learning_rate: Learning rate
             warmup_steps: Number of warmup steps
+            batching: 'random' or 'length_grouped' (see BatchPlanner)
+            max_tokens_per_batch: Size training batches by padded tokens instead of train_batch_size
+            megabatch_factor: Megabatch size in batches for length grouping
+            callbacks: Extra TrainerCallbacks; one with a true `cancelled` attribute after
+                training marks the run as cancelled (its checkpoint is kept, no model is saved)
+            resume_from_checkpoint: Checkpoint directory to resume from
+            validation_texts: Fixed validation set; when given, all of `texts` is trained on
+                and validation_split is ignored
+            validation_labels: Labels of validation_texts
+            load_best_model: Keep the checkpoint with the best validation F1 instead of the last one
             
         Returns:
             Training results and metrics
         """
         logger.info(f"Starting training with {len(texts)} examples")
         
-        # Split data
-        split_idx = int(len(texts) * (1 - validation_split))
-        train_texts = texts[:split_idx]
-        train_labels = labels[:split_idx]
-        val_texts = texts[split_idx:]
-        val_labels = labels[split_idx:]
+        # Tokenize once for all epochs (cached across runs)
+        dataset = self.tokenize_dataset(texts, labels)
+        
+        if validation_texts is not None:
+            train_idx, _ = stratified_split(labels, 0.0, seed=42)
+            train_dataset = dataset.select(train_idx)
+            val_dataset = (self.tokenize_dataset(validation_texts, validation_labels)
+                           if validation_texts else dataset.select([]))
+        else:
+            # Split per label, so validation covers every category regardless of file order
+            train_idx, val_idx = stratified_split(labels, validation_split, seed=42)
+            train_dataset = dataset.select(train_idx)
+            val_dataset = dataset.select(val_idx)
+        has_validation = len(val_dataset) > 0
         
-        logger.info(f"Training set: {len(train_texts)}, Validation set: {len(val_texts)}")
+        logger.info(f"Training set: {len(train_dataset)}, Validation set: {len(val_dataset)}")
         
-        # Create datasets
-        train_dataset = EmailDataset(train_texts, train_labels, self.tokenizer, self.max_length)
-        val_dataset = EmailDataset(val_texts, val_labels, self.tokenizer, self.max_length)
+        # Plan training batches from the token lengths
+        batch_planner = BatchPlanner(
+            train_dataset['length'],
+            batch_size=train_batch_size,
+            strategy=batching,
+            max_tokens=max_tokens_per_batch,
+            megabatch_factor=megabatch_factor,
+            seed=42
+        )
+        throughput_callback = ThroughputCallback(batch_planner)
         
         # Training arguments
         training_args = TrainingArguments(
@@ -250,31 +701,46 @@ class DistilBERTTrainer:
             learning_rate=learning_rate,
             logging_dir=f"{self.output_dir}/logs",
             logging_steps=100,
-            evaluation_strategy="epoch",
+            **{EVAL_STRATEGY_ARG: "epoch" if has_validation else "no"},
             save_strategy="epoch",
             save_total_limit=3,
-            load_best_model_at_end=True,
+            load_best_model_at_end=has_validation and load_best_model,
             metric_for_best_model="f1",
             greater_is_better=True,
-            report_to=None,  # Disable wandb/tensorboard
+            report_to="none",  # Disable wandb/tensorboard
             seed=42,
         )
         
         # Initialize trainer
-        trainer = Trainer(
+        trainer = BatchPlanTrainer(
             model=self.model,
             args=training_args,
             train_dataset=train_dataset,
-            eval_dataset=val_dataset,
+            eval_dataset=val_dataset if has_validation else None,
+            data_collator=DataCollatorWithPadding(self.tokenizer),
             compute_metrics=self.compute_metrics,
+            callbacks=[throughput_callback] + list(callbacks or []),
+            batch_planner=batch_planner
         )
         
         # Train the model
-        logger.info("Starting training...")
-        train_result = trainer.train()
+        logger.info("Starting training..." if not resume_from_checkpoint
+                    else f"Resuming training from {resume_from_checkpoint}...")
+        train_result = trainer.train(resume_from_checkpoint=resume_from_checkpoint)
+        
+        if any(getattr(callback, 'cancelled', False) for callback in callbacks or []):
+            checkpoint = get_last_checkpoint(self.output_dir)
+            logger.info(f"Training cancelled at step {trainer.state.global_step}; checkpoint: {checkpoint}")
+            return {
+                "cancelled": True,
+                "checkpoint": checkpoint,
+                "global_step": trainer.state.global_step,
+                "epoch_throughput": throughput_callback.history,
+                "timestamp": datetime.now().isoformat()
+            }
         
         # Evaluate
-        eval_result = trainer.evaluate()
+        eval_result = trainer.evaluate() if has_validation else {}
         
         # Save the model
         trainer.save_model()
@@ -287,10 +753,16 @@ class DistilBERTTrainer:
                 "id2label": self.id2label
             }, f, indent=2)
         
+        # Record what this model was trained with, for incremental runs (held-out examples excluded)
+        save_training_manifest(self.output_dir, {
+            text_digest(texts[i]): self.id2label[labels[i]] for i in train_idx
+        })
+        
         # Prepare results
         results = {
             "training_loss": train_result.training_loss,
             "eval_results": eval_result,
+            "epoch_throughput": throughput_callback.history,
             "model_path": self.output_dir,
             "label_mappings": {
                 "label2id": self.label2id,
@@ -299,10 +771,13 @@ class DistilBERTTrainer:
             "training_config": {
                 "model_name": self.model_name,
                 "max_length": self.max_length,
+                "padding": "dynamic",
                 "num_epochs": num_epochs,
                 "learning_rate": learning_rate,
                 "batch_size": train_batch_size,
-                "validation_split": validation_split,
+                "batching": batching,
+                "max_tokens_per_batch": max_tokens_per_batch,
+                "validation_split": validation_split if validation_texts is None else 0.0,
                 "num_labels": len(self.label2id)
             },
             "timestamp": datetime.now().isoformat()
@@ -313,6 +788,140 @@ class DistilBERTTrainer:
         
         return results
     
+    def train_streaming(
+        self,
+        data_files,
+        validation_percent: int = 10,
+        max_validation_per_label: Optional[int] = 2000,
+        train_batch_size: int = 16,
+        eval_batch_size: int = 32,
+        num_epochs: int = 3,
+        learning_rate: float = 2e-5,
+        warmup_steps: int = 500,
+        batching: str = 'length_grouped',
+        megabatch_factor: int = 50,
+        shuffle_buffer: int = 10000,
+        seed: int = 42,
+        callbacks: Optional[List[TrainerCallback]] = None
+    ) -> Dict[str, Any]:
+        """
+        Train on sharded JSONL/Parquet data without loading the corpus into memory
+
+        One pass over the shards collects label counts and a per-label validation
+        sample (see streaming_dataset.CorpusSplit); training then streams the remaining
+        examples each epoch, tokenizing them on the fly.
+
+        Args:
+            data_files: Shard path, glob, directory or comma-separated list
+            validation_percent: Fixed validation slice in percent
+            max_validation_per_label: Cap on validation examples per label (None: no cap)
+            shuffle_buffer: Examples held for shuffling the stream
+            seed: Seed for the split, shard order and shuffling
+            Other arguments as in train_model
+
+        Returns:
+            Training results and metrics
+        """
+        from streaming_dataset import CorpusSplit, StreamingEmailDataset, StreamEpochCallback
+
+        corpus = CorpusSplit(data_files, validation_percent, max_validation_per_label, seed)
+        if corpus.num_train == 0:
+            raise ValueError("No training examples found in the dataset shards")
+
+        self.label2id = corpus.label2id
+        self.id2label = corpus.id2label
+        self.initialize_model(len(self.label2id))
+
+        val_texts, val_labels = corpus.validation_examples()
+        val_dataset = self.tokenize_dataset(val_texts, val_labels)
+        train_dataset = StreamingEmailDataset(
+            corpus,
+            self.tokenizer,
+            max_length=self.max_length,
+            batch_size=train_batch_size,
+            shuffle_buffer=shuffle_buffer,
+            batching=batching,
+            megabatch_factor=megabatch_factor,
+            seed=seed
+        )
+        steps_per_epoch = train_dataset.steps_per_epoch()
+
+        logger.info(f"Streaming {corpus.num_train} training examples from {len(corpus.shards)} shards "
+                    f"({steps_per_epoch} steps/epoch), validation set: {len(val_dataset)}")
+
+        # A stream has no length, so the schedule is given in steps
+        training_args = TrainingArguments(
+            output_dir=self.output_dir,
+            max_steps=steps_per_epoch * num_epochs,
+            per_device_train_batch_size=train_batch_size,
+            per_device_eval_batch_size=eval_batch_size,
+            warmup_steps=warmup_steps,
+            weight_decay=0.01,
+            learning_rate=learning_rate,
+            logging_steps=100,
+            **{EVAL_STRATEGY_ARG: "steps"},
+            eval_steps=steps_per_epoch,
+            save_strategy="steps",
+            save_steps=steps_per_epoch,
+            save_total_limit=3,
+            load_best_model_at_end=len(val_dataset) > 0,
+            metric_for_best_model="f1",
+            greater_is_better=True,
+            report_to="none",
+            seed=seed,
+        )
+
+        trainer = Trainer(
+            model=self.model,
+            args=training_args,
+            train_dataset=train_dataset,
+            eval_dataset=val_dataset if len(val_dataset) else None,
+            data_collator=DataCollatorWithPadding(self.tokenizer),
+            compute_metrics=self.compute_metrics,
+            callbacks=[StreamEpochCallback(train_dataset)] + list(callbacks or [])
+        )
+
+        train_result = trainer.train()
+        eval_result = trainer.evaluate() if len(val_dataset) else {}
+
+        trainer.save_model()
+        self.tokenizer.save_pretrained(self.output_dir)
+        with open(os.path.join(self.output_dir, "label_mappings.json"), "w") as f:
+            json.dump({
+                "label2id": self.label2id,
+                "id2label": self.id2label
+            }, f, indent=2)
+
+        # No training manifest: it would hold a digest per example of the whole corpus
+        results = {
+            "training_loss": train_result.training_loss,
+            "eval_results": eval_result,
+            "model_path": self.output_dir,
+            "corpus": corpus.get_stats(),
+            "label_mappings": {
+                "label2id": self.label2id,
+                "id2label": self.id2label
+            },
+            "training_config": {
+                "model_name": self.model_name,
+                "max_length": self.max_length,
+                "padding": "dynamic",
+                "streaming": True,
+                "num_epochs": num_epochs,
+                "max_steps": steps_per_epoch * num_epochs,
+                "learning_rate": learning_rate,
+                "batch_size": train_batch_size,
+                "batching": batching,
+                "shuffle_buffer": shuffle_buffer,
+                "validation_percent": validation_percent,
+                "num_labels": len(self.label2id)
+            },
+            "timestamp": datetime.now().isoformat()
+        }
+
+        logger.info(f"Streaming training completed; final evaluation metrics: {eval_result}")
+        return results
+
     def load_trained_model(self, model_path: str):
         """Load a trained model and tokenizer"""
         logger.info(f"Loading trained model from {model_path}")
@@ -333,6 +942,228 @@ class DistilBERTTrainer:
         
         self.model.eval()
         logger.info("Model loaded successfully")
+    
+    def warm_start(self, model_path: str, labels: List[str]):
+        """
+        Initialize from a trained model directory instead of the base checkpoint
+        
+        Existing label ids are kept; labels the model has not seen are appended and get
+        freshly initialized rows in the classification layer.
+        """
+        if os.path.abspath(model_path) == os.path.abspath(self.output_dir):
+            raise ValueError("Incremental training must write to a different directory than its base model")
+        
+        self.load_trained_model(model_path)
+        
+        new_labels = sorted(set(labels) - set(self.label2id))
+        for label in new_labels:
+            self.label2id[label] = len(self.label2id)
+        self.id2label = {idx: label for label, idx in self.label2id.items()}
+        
+        if new_labels:
+            old_classifier = self.model.classifier
+            classifier = nn.Linear(old_classifier.in_features, len(self.label2id))
+            classifier.weight.data.normal_(mean=0.0, std=self.model.config.initializer_range)
+            classifier.bias.data.zero_()
+            classifier.weight.data[:old_classifier.out_features] = old_classifier.weight.data
+            classifier.bias.data[:old_classifier.out_features] = old_classifier.bias.data
+            self.model.classifier = classifier.to(old_classifier.weight.device)
+            self.model.num_labels = len(self.label2id)
+            logger.info(f"Extended label map with {new_labels}")
+        
+        self.model.config.num_labels = len(self.label2id)
+        self.model.config.id2label = dict(self.id2label)
+        self.model.config.label2id = dict(self.label2id)
+        self.model.train()
+        return new_labels
+    
+    def evaluate_labels(self, model, id2label: Dict[int, str], texts: List[str], label_names: List[str],
+                        batch_size: int = 64) -> Dict[str, float]:
+        """Accuracy and F1 of a model on texts; labels it does not know count as errors"""
+        dataset = self.tokenize_dataset(texts)
+        predictions, _ = predict_tokenized(model, self.tokenizer, dataset, batch_size)
+        predicted_names = [id2label.get(int(p), '') for p in predictions]
+        
+        precision, recall, f1, _ = precision_recall_fscore_support(
+            label_names, predicted_names, labels=sorted(set(label_names)), average='weighted', zero_division=0
+        )
+        _, _, macro_f1, _ = precision_recall_fscore_support(
+            label_names, predicted_names, labels=sorted(set(label_names)), average='macro', zero_division=0
+        )
+        return {
+            'accuracy': float(accuracy_score(label_names, predicted_names)),
+            'precision': float(precision),
+            'recall': float(recall),
+            'f1': float(f1),
+            'macro_f1': float(macro_f1)
+        }
+    
+    def train_incremental(
+        self,
+        data_file: str,
+        base_model_path: str,
+        new_data_file: Optional[str] = None,
+        replay_ratio: float = 4.0,
+        min_replay_per_class: int = 8,
+        validation_percent: int = 10,
+        promotion_tolerance: float = 0.0,
+        num_epochs: int = 2,
+        learning_rate: float = 1e-5,
+        train_batch_size: int = 16,
+        seed: int = 42,
+        **train_kwargs
+    ) -> Dict[str, Any]:
+        """
+        Warm-start from a deployed model and train only on what changed
+        
+        New or changed examples are those whose text is missing from the base model's
+        training manifest or whose label differs (or everything in new_data_file, when
+        given). They are mixed with a stratified replay sample of unchanged history, at
+        replay_ratio replay examples per new one and at least min_replay_per_class per
+        label, to limit forgetting. Both models are then scored on the fixed validation
+        set (see in_fixed_validation), which incremental runs never train on; a previous
+        full run may have, so the comparison is conservative. The new model is marked
+        promoted when its weighted F1 is within promotion_tolerance of the old one or better.
+        
+        Args:
+            data_file: Full labeled dataset (history plus any new samples)
+            base_model_path: Deployed model directory to warm-start from
+            new_data_file: Optional file holding only the new samples
+            replay_ratio: Replay examples per new example
+            min_replay_per_class: Minimum replay examples per label
+            validation_percent: Size of the fixed validation set, in percent of examples
+            promotion_tolerance: Allowed F1 drop for promotion
+            **train_kwargs: Passed through to train_model
+            
+        Returns:
+            Training results plus the incremental plan and the model comparison
+        """
+        start = time.perf_counter()
+        rng = np.random.default_rng(seed)
+        
+        history = self.read_labeled_examples(data_file)
+        new_examples = self.read_labeled_examples(new_data_file) if new_data_file else None
+        manifest = load_training_manifest(base_model_path)
+        if not manifest and new_examples is None:
+            logger.warning(f"No training manifest in {base_model_path}; every example counts as new")
+        
+        # Fixed validation set, deduplicated by text
+        validation = {}
+        for text, label in history + (new_examples or []):
+            digest = text_digest(text)
+            if in_fixed_validation(digest, validation_percent):
+                validation[digest] = (text, label)
+        
+        # New or changed samples
+        candidates = new_examples if new_examples is not None else history
+        delta = {}
+        for text, label in candidates:
+            digest = text_digest(text)
+            if digest in validation:
+                continue
+            if new_examples is not None or manifest.get(digest) != label:
+                delta[digest] = (text, label)
+        
+        if not delta:
+            logger.info("No new or changed samples; nothing to train")
+            return {"skipped": True, "reason": "no new or changed samples", "promoted": False}
+        
+        # Stratified replay of unchanged history
+        pool = {}
+        for text, label in history:
+            digest = text_digest(text)
+            if digest not in validation and digest not in delta:
+                pool.setdefault(label, {})[digest] = (text, label)
+        
+        replay_size = int(replay_ratio * len(delta))
+        pool_size = sum(len(items) for items in pool.values())
+        replay = []
+        for label, items in sorted(pool.items()):
+            items = list(items.values())
+            share = int(round(replay_size * len(items) / pool_size)) if pool_size else 0
+            take = min(len(items), max(share, min_replay_per_class))
+            replay.extend(items[i] for i in rng.choice(len(items), size=take, replace=False))
+        
+        train_examples = list(delta.values()) + replay
+        order = rng.permutation(len(train_examples))
+        train_examples = [train_examples[i] for i in order]
+        
+        logger.info(f"Incremental run: {len(delta)} new/changed, {len(replay)} replay, "
+                    f"{len(validation)} fixed validation examples")
+        
+        # Warm start and train
+        new_labels = self.warm_start(base_model_path, [label for _, label in train_examples] +
+                                     [label for _, label in validation.values()])
+        texts = [text for text, _ in train_examples]
+        labels = [self.label2id[label] for _, label in train_examples]
+        steps = int(np.ceil(len(texts) / train_batch_size)) * num_epochs
+        train_kwargs.setdefault('warmup_steps', max(steps // 10, 0))
+        # Every new or changed example is trained on (the manifest below records them all).
+        # The fixed validation set decides promotion, so the last checkpoint is kept rather
+        # than the one that scores best on it.
+        train_kwargs.pop('validation_split', None)
+        train_kwargs.pop('load_best_model', None)
+        results = self.train_model(
+            texts=texts,
+            labels=labels,
+            train_batch_size=train_batch_size,
+            num_epochs=num_epochs,
+            learning_rate=learning_rate,
+            validation_texts=[text for text, _ in validation.values()],
+            validation_labels=[self.label2id[label] for _, label in validation.values()],
+            load_best_model=False,
+            **train_kwargs
+        )
+        if results.get('cancelled'):
+            return results
+        
+        # Manifest of the new model: everything the base model knew plus this run's changes
+        merged = dict(manifest)
+        merged.update({digest: label for digest, (_, label) in delta.items()})
+        save_training_manifest(self.output_dir, merged)
+        
+        # Compare against the previous model on the fixed validation set
+        comparison = None
+        promoted = True
+        if validation:
+            val_texts = [text for text, _ in validation.values()]
+            val_labels = [label for _, label in validation.values()]
+            
+            new_metrics = self.evaluate_labels(self.model, self.id2label, val_texts, val_labels)
+            previous_model = DistilBertForSequenceClassification.from_pretrained(base_model_path)
+            previous_model.to(next(self.model.parameters()).device)
+            previous_id2label = {int(k): v for k, v in previous_model.config.id2label.items()}
+            mappings_file = os.path.join(base_model_path, "label_mappings.json")
+            if os.path.exists(mappings_file):
+                with open(mappings_file, "r") as f:
+                    previous_id2label = {int(k): v for k, v in json.load(f)["id2label"].items()}
+            previous_metrics = self.evaluate_labels(previous_model, previous_id2label, val_texts, val_labels)
+            del previous_model
+            
+            promoted = new_metrics['f1'] >= previous_metrics['f1'] - promotion_tolerance
+            comparison = {
+                'validation_size': len(val_texts),
+                'previous': previous_metrics,
+                'new': new_metrics,
+                'f1_delta': new_metrics['f1'] - previous_metrics['f1']
+            }
+            logger.info(f"Validation F1: previous {previous_metrics['f1']:.4f}, new {new_metrics['f1']:.4f} -> "
+                        f"{'promote' if promoted else 'keep previous model'}")
+        else:
+            logger.warning("Fixed validation set is empty; promoting without comparison")
+        
+        results.update({
+            "incremental": {
+                "base_model_path": base_model_path,
+                "new_or_changed": len(delta),
+                "replay": len(replay),
+                "new_labels": new_labels,
+                "seconds": time.perf_counter() - start
+            },
+            "comparison": comparison,
+            "promoted": promoted
+        })
+        return results
 
 def main():
     """Main training function"""
@@ -351,35 +1182,107 @@ def main():
                        help="Maximum token sequence length")
     parser.add_argument("--validation_split", type=float, default=0.2,
                        help="Validation split ratio")
+    parser.add_argument("--cache_dir", type=str, default=TOKENIZED_CACHE_DIR,
+                       help="Tokenized dataset cache directory")
+    parser.add_argument("--num_proc", type=int, default=TOKENIZE_NUM_PROC,
+                       help="Tokenization worker processes")
+    parser.add_argument("--batching", type=str, default="length_grouped", choices=BatchPlanner.STRATEGIES,
+                       help="Training batch composition")
+    parser.add_argument("--max_tokens_per_batch", type=int, default=None,
+                       help="Size training batches by padded tokens instead of --batch_size")
+    parser.add_argument("--megabatch_factor", type=int, default=50,
+                       help="Megabatch size (in batches) for length-grouped sampling")
+    parser.add_argument("--incremental", action="store_true",
+                       help="Warm-start from --base_model and train on new/changed samples plus replay")
+    parser.add_argument("--base_model", type=str, default=None,
+                       help="Deployed model directory to warm-start from (incremental mode)")
+    parser.add_argument("--new_data_file", type=str, default=None,
+                       help="JSONL file with only the new samples (default: diff against the base model's manifest)")
+    parser.add_argument("--replay_ratio", type=float, default=4.0,
+                       help="Replay examples per new example (incremental mode)")
+    parser.add_argument("--validation_percent", type=int, default=10,
+                       help="Fixed validation set size in percent (incremental and streaming modes)")
+    parser.add_argument("--promotion_tolerance", type=float, default=0.0,
+                       help="Allowed validation F1 drop for promotion (incremental mode)")
+    parser.add_argument("--streaming", action="store_true",
+                       help="Stream --data_file (path, glob, directory or comma list of JSONL/Parquet shards) "
+                            "instead of loading it into memory")
+    parser.add_argument("--max_validation_per_label", type=int, default=2000,
+                       help="Cap on validation examples per label (streaming mode)")
+    parser.add_argument("--shuffle_buffer", type=int, default=10000,
+                       help="Examples buffered for shuffling the stream (streaming mode)")
     
     args = parser.parse_args()
     
     # Initialize trainer
     trainer = DistilBERTTrainer(
         output_dir=args.output_dir,
-        max_length=args.max_length
+        max_length=args.max_length,
+        cache_dir=args.cache_dir,
+        num_proc=args.num_proc
     )
     
     try:
-        # Load and preprocess dataset
-        texts, labels, label_mapping = trainer.load_and_preprocess_dataset(args.data_file)
-        
-        if len(texts) == 0:
-            logger.error("No valid training examples found!")
-            return
-        
-        # Initialize model
-        trainer.initialize_model(len(label_mapping))
-        
-        # Train model
-        results = trainer.train_model(
-            texts=texts,
-            labels=labels,
-            validation_split=args.validation_split,
-            train_batch_size=args.batch_size,
-            num_epochs=args.num_epochs,
-            learning_rate=args.learning_rate
-        )
+        if args.incremental:
+            if not args.base_model:
+                parser.error("--incremental requires --base_model")
+            
+            results = trainer.train_incremental(
+                data_file=args.data_file,
+                base_model_path=args.base_model,
+                new_data_file=args.new_data_file,
+                replay_ratio=args.replay_ratio,
+                validation_percent=args.validation_percent,
+                promotion_tolerance=args.promotion_tolerance,
+                num_epochs=args.num_epochs,
+                learning_rate=args.learning_rate,
+                train_batch_size=args.batch_size,
+                validation_split=args.validation_split,
+                batching=args.batching,
+                max_tokens_per_batch=args.max_tokens_per_batch,
+                megabatch_factor=args.megabatch_factor
+            )
+            if results.get('skipped'):
+                logger.info(f"Incremental training skipped: {results['reason']}")
+                return
+            if not results['promoted']:
+                logger.warning(f"New model did not beat {args.base_model} on the fixed validation set; "
+                               f"keep serving the previous model")
+        elif args.streaming:
+            results = trainer.train_streaming(
+                data_files=args.data_file,
+                validation_percent=args.validation_percent,
+                max_validation_per_label=args.max_validation_per_label,
+                train_batch_size=args.batch_size,
+                num_epochs=args.num_epochs,
+                learning_rate=args.learning_rate,
+                batching=args.batching,
+                megabatch_factor=args.megabatch_factor,
+                shuffle_buffer=args.shuffle_buffer
+            )
+        else:
+            # Load and preprocess dataset
+            texts, labels, label_mapping = trainer.load_and_preprocess_dataset(args.data_file)
+            
+            if len(texts) == 0:
+                logger.error("No valid training examples found!")
+                return
+            
+            # Initialize model
+            trainer.initialize_model(len(label_mapping))
+            
+            # Train model
+            results = trainer.train_model(
+                texts=texts,
+                labels=labels,
+                validation_split=args.validation_split,
+                train_batch_size=args.batch_size,
+                num_epochs=args.num_epochs,
+                learning_rate=args.learning_rate,
+                batching=args.batching,
+                max_tokens_per_batch=args.max_tokens_per_batch,
+                megabatch_factor=args.megabatch_factor
+            )
         
         # Save results
         results_file = os.path.join(args.output_dir, "training_results.json")
@@ -0,0 +1,535 @@
+"""
+Knowledge Distillation for the DistilBERT Email Classifier
+Trains a compact student on a fine-tuned teacher's soft labels over the unlabeled mailbox
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from sklearn.metrics import accuracy_score, f1_score
+from transformers import (
+    DistilBertConfig,
+    DistilBertForSequenceClassification,
+    DataCollatorWithPadding,
+    TrainingArguments
+)
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from distilbert_trainer import (
+    DistilBERTTrainer, BatchPlanner, BatchPlanTrainer, ThroughputCallback, EVAL_STRATEGY_ARG,
+    TOKENIZED_CACHE_DIR, TOKENIZE_NUM_PROC, build_tokenized_dataset, dataset_checksum,
+    example_text_and_label, in_fixed_validation, text_digest, tokenized_logits
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Written next to the exported student
+DISTILLATION_REPORT_FILE = 'distillation_report.json'
+
+
+def read_mailbox_texts(mailbox_file: str) -> List[str]:
+    """
+    Email texts from an unlabeled mailbox export
+
+    Accepts JSONL or JSON (a list, or an object with an `emails` list) of training
+    examples or raw emails (subject/body/snippet), e.g. extract_training_data.py output.
+    Duplicate texts are dropped.
+    """
+    with open(mailbox_file, 'r', encoding='utf-8') as f:
+        if mailbox_file.endswith('.jsonl'):
+            records = [json.loads(line) for line in f if line.strip()]
+        else:
+            records = json.load(f)
+            if isinstance(records, dict):
+                records = records.get('emails', [])
+
+    texts = []
+    seen = set()
+    for record in records:
+        if 'text' in record:
+            text = record['text']
+        elif 'header_subject' in record or 'body_text' in record:
+            text, _ = example_text_and_label(record)
+        else:
+            body = record.get('body') or record.get('fullBody') or record.get('text') or record.get('snippet', '')
+            text = f"{record.get('subject', '')} {body}"
+        text = str(text or '').strip()
+        if text and text not in seen:
+            seen.add(text)
+            texts.append(text)
+
+    logger.info(f"Read {len(texts)} unique mailbox texts from {mailbox_file}")
+    return texts
+
+
+def build_student(
+    teacher: DistilBertForSequenceClassification,
+    n_layers: int = 2,
+    dim: Optional[int] = None,
+    hidden_dim: Optional[int] = None,
+    n_heads: Optional[int] = None,
+    max_length: int = 128
+) -> DistilBertForSequenceClassification:
+    """
+    A smaller DistilBERT with the teacher's vocabulary and labels
+
+    When the hidden size is kept, the student starts from the teacher's embeddings,
+    classifier and an evenly spaced subset of its transformer layers; otherwise it is
+    initialized from scratch.
+    """
+    teacher_config = teacher.config
+    config = DistilBertConfig(
+        vocab_size=teacher_config.vocab_size,
+        max_position_embeddings=max(max_length, 1),
+        n_layers=n_layers,
+        dim=dim or teacher_config.dim,
+        hidden_dim=hidden_dim or teacher_config.hidden_dim,
+        n_heads=n_heads or teacher_config.n_heads,
+        dropout=teacher_config.dropout,
+        attention_dropout=teacher_config.attention_dropout,
+        seq_classif_dropout=teacher_config.seq_classif_dropout,
+        pad_token_id=teacher_config.pad_token_id,
+        num_labels=teacher_config.num_labels,
+        id2label=teacher_config.id2label,
+        label2id=teacher_config.label2id
+    )
+    student = DistilBertForSequenceClassification(config)
+
+    if config.dim != teacher_config.dim or config.n_heads != teacher_config.n_heads:
+        logger.info(f"Student hidden size {config.dim} differs from the teacher's; initializing from scratch")
+        return student
+
+    teacher_state = teacher.state_dict()
+    student_state = student.state_dict()
+    layer_map = np.linspace(0, teacher_config.n_layers - 1, n_layers).round().astype(int)
+    for name, tensor in student_state.items():
+        source = name
+        if '.layer.' in name:
+            prefix, rest = name.split('.layer.', 1)
+            index, rest = rest.split('.', 1)
+            source = f"{prefix}.layer.{layer_map[int(index)]}.{rest}"
+        if source not in teacher_state or teacher_state[source].shape[1:] != tensor.shape[1:]:
+            continue
+        # Position embeddings are truncated to the student's max length
+        student_state[name] = teacher_state[source][:tensor.shape[0]].clone()
+    student.load_state_dict(student_state)
+    logger.info(f"Student initialized from teacher layers {layer_map.tolist()}")
+    return student
+
+
+def count_parameters(model) -> int:
+    return sum(p.numel() for p in model.parameters())
+
+
+class DistillationTrainer(BatchPlanTrainer):
+    """
+    Trainer with a distillation loss
+
+    loss = alpha * T^2 * KL(teacher_T || student_T) + (1 - alpha) * CE(student, label)
+    where the hard-label term only covers rows with a label (unlabeled rows use -100).
+    """
+
+    def __init__(self, *args, temperature: float = 2.0, alpha: float = 0.9, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def compute_loss(self, model, inputs, return_outputs=False, num_items_in_batch=None):
+        teacher_logits = inputs.pop('teacher_logits')
+        labels = inputs.pop('labels', None)
+        inputs.pop('length', None)
+        outputs = model(**inputs)
+
+        T = self.temperature
+        loss = F.kl_div(
+            F.log_softmax(outputs.logits / T, dim=-1),
+            F.softmax(teacher_logits.to(outputs.logits.dtype) / T, dim=-1),
+            reduction='batchmean'
+        ) * (T * T)
+
+        if labels is not None and self.alpha < 1.0 and bool((labels != -100).any()):
+            hard_loss = F.cross_entropy(outputs.logits, labels, ignore_index=-100)
+            loss = self.alpha * loss + (1 - self.alpha) * hard_loss
+
+        return (loss, outputs) if return_outputs else loss
+
+
+def measure_latency(model, tokenizer, texts: List[str], max_length: int, batch_size: int = 32,
+                    repeats: int = 3) -> Dict[str, float]:
+    """CPU latency of one email at a time and throughput of padded batches"""
+    model = model.to('cpu').eval()
+    single = []
+    with torch.no_grad():
+        for text in texts[:1] + texts:  # first call warms up
+            inputs = tokenizer(text, truncation=True, max_length=max_length, return_tensors='pt')
+            start = time.perf_counter()
+            model(**inputs)
+            single.append(time.perf_counter() - start)
+        single = single[1:]
+
+        batch_seconds = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for i in range(0, len(texts), batch_size):
+                inputs = tokenizer(texts[i:i + batch_size], truncation=True, padding=True,
+                                   max_length=max_length, return_tensors='pt')
+                model(**inputs)
+            batch_seconds.append(time.perf_counter() - start)
+
+    return {
+        'single_p50_ms': float(np.percentile(single, 50) * 1000),
+        'single_p95_ms': float(np.percentile(single, 95) * 1000),
+        'batch_emails_per_sec': float(len(texts) / np.median(batch_seconds)),
+        'batch_size': batch_size,
+        'torch_threads': torch.get_num_threads()
+    }
+
+
+class StudentDistiller:
+    """Distills a fine-tuned DistilBERT teacher into a smaller student"""
+
+    def __init__(
+        self,
+        teacher_dir: str,
+        output_dir: str,
+        student_layers: int = 2,
+        student_dim: Optional[int] = None,
+        student_hidden_dim: Optional[int] = None,
+        student_heads: Optional[int] = None,
+        student_max_length: int = 128,
+        teacher_max_length: int = 256,
+        cache_dir: Optional[str] = TOKENIZED_CACHE_DIR,
+        num_proc: int = TOKENIZE_NUM_PROC
+    ):
+        if os.path.abspath(teacher_dir) == os.path.abspath(output_dir):
+            raise ValueError("The student must be written to a different directory than its teacher")
+
+        self.teacher_dir = teacher_dir
+        self.output_dir = output_dir
+        self.student_max_length = student_max_length
+        self.teacher_max_length = teacher_max_length
+        self.cache_dir = cache_dir
+        self.num_proc = num_proc
+
+        # Loads the teacher model, tokenizer and label mapping
+        self.teacher = DistilBERTTrainer(output_dir=teacher_dir, max_length=teacher_max_length,
+                                         cache_dir=cache_dir, num_proc=num_proc)
+        self.teacher.load_trained_model(teacher_dir)
+        self.tokenizer = self.teacher.tokenizer
+
+        self.student = build_student(
+            self.teacher.model,
+            n_layers=student_layers,
+            dim=student_dim,
+            hidden_dim=student_hidden_dim,
+            n_heads=student_heads,
+            max_length=student_max_length
+        )
+        os.makedirs(output_dir, exist_ok=True)
+
+    def tokenize(self, texts: List[str], max_length: int, labels: Optional[List[int]] = None):
+        return build_tokenized_dataset(texts, labels, self.tokenizer, max_length=max_length,
+                                       cache_dir=self.cache_dir, num_proc=self.num_proc)
+
+    def teacher_logits(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        """Teacher logits for texts, computed once per teacher and text set"""
+        config_path = os.path.join(self.teacher_dir, 'config.json')
+        key = (f"{text_digest(os.path.abspath(self.teacher_dir))}-{int(os.path.getmtime(config_path))}"
+               f"-{self.teacher_max_length}-{dataset_checksum(texts)}")
+        cache_path = os.path.join(self.cache_dir, f"teacher-logits-{key}.npy") if self.cache_dir else None
+        if cache_path and os.path.exists(cache_path):
+            logger.info(f"Loading teacher logits from {cache_path}")
+            return np.load(cache_path)
+
+        start = time.perf_counter()
+        logits = tokenized_logits(self.teacher.model, self.tokenizer,
+                                  self.tokenize(texts, self.teacher_max_length), batch_size)
+        logger.info(f"Teacher labeled {len(texts)} texts in {time.perf_counter() - start:.1f}s")
+
+        if cache_path:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.tmp-{os.getpid()}.npy"
+            np.save(tmp_path, logits)
+            os.replace(tmp_path, cache_path)
+        return logits
+
+    def evaluate(self, model, max_length: int, texts: List[str], label_ids: np.ndarray,
+                 teacher_predictions: Optional[np.ndarray] = None) -> Dict[str, float]:
+        predictions = tokenized_logits(model, self.tokenizer, self.tokenize(texts, max_length)).argmax(axis=1)
+        metrics = {
+            'accuracy': float(accuracy_score(label_ids, predictions)),
+            'macro_f1': float(f1_score(label_ids, predictions, average='macro', zero_division=0)),
+            'weighted_f1': float(f1_score(label_ids, predictions, average='weighted', zero_division=0))
+        }
+        if teacher_predictions is not None:
+            metrics['teacher_agreement'] = float(np.mean(predictions == teacher_predictions))
+        return metrics
+
+    def distill(
+        self,
+        mailbox_texts: List[str],
+        labeled_examples: Optional[List[Tuple[str, str]]] = None,
+        validation_percent: int = 10,
+        temperature: float = 2.0,
+        alpha: float = 0.9,
+        num_epochs: int = 3,
+        learning_rate: float = 5e-5,
+        train_batch_size: int = 32,
+        warmup_ratio: float = 0.06,
+        batching: str = 'length_grouped',
+        latency_samples: int = 200
+    ) -> Dict[str, Any]:
+        """
+        Train the student and export it with a teacher comparison report
+
+        Args:
+            mailbox_texts: Unlabeled email texts the teacher labels softly
+            labeled_examples: (text, label name) pairs; the fixed validation slice is used to
+                compare teacher and student, the rest joins training with its hard labels
+            validation_percent: Size of the fixed validation slice (see in_fixed_validation)
+            temperature: Softmax temperature for the soft labels
+            alpha: Weight of the soft-label loss against the hard-label loss
+            latency_samples: Texts used to time teacher and student on CPU
+        """
+        label2id = self.teacher.label2id
+        labeled_examples = [(t, l) for t, l in (labeled_examples or []) if l in label2id]
+        eval_examples = [(t, l) for t, l in labeled_examples if in_fixed_validation(text_digest(t), validation_percent)]
+        eval_texts = {t for t, _ in eval_examples}
+
+        # Training rows: labeled examples outside the validation slice, then mailbox texts
+        train_labels = {t: label2id[l] for t, l in labeled_examples if t not in eval_texts}
+        train_texts = list(train_labels)
+        train_texts += [t for t in mailbox_texts if t not in train_labels and t not in eval_texts]
+        if not train_texts:
+            raise ValueError("No texts to distill on")
+
+        logger.info(f"Distilling on {len(train_texts)} texts ({len(train_labels)} labeled), "
+                    f"evaluating on {len(eval_examples)}")
+
+        soft_labels = self.teacher_logits(train_texts)
+        hard_labels = [train_labels.get(t, -100) for t in train_texts]
+        train_dataset = self.tokenize(train_texts, self.student_max_length, hard_labels)
+        train_dataset = train_dataset.add_column('teacher_logits', soft_labels.tolist())
+
+        batch_planner = BatchPlanner(train_dataset['length'], batch_size=train_batch_size,
+                                     strategy=batching, seed=42)
+        throughput_callback = ThroughputCallback(batch_planner)
+        steps = len(batch_planner) * num_epochs
+
+        training_args = TrainingArguments(
+            output_dir=self.output_dir,
+            num_train_epochs=num_epochs,
+            per_device_train_batch_size=train_batch_size,
+            warmup_steps=int(warmup_ratio * steps),
+            weight_decay=0.01,
+            learning_rate=learning_rate,
+            logging_steps=100,
+            **{EVAL_STRATEGY_ARG: "no"},
+            save_strategy="no",
+            remove_unused_columns=False,  # keep teacher_logits for the loss
+            report_to="none",
+            seed=42,
+        )
+        trainer = DistillationTrainer(
+            model=self.student,
+            args=training_args,
+            train_dataset=train_dataset,
+            data_collator=DataCollatorWithPadding(self.tokenizer),
+            callbacks=[throughput_callback],
+            batch_planner=batch_planner,
+            temperature=temperature,
+            alpha=alpha
+        )
+
+        start = time.perf_counter()
+        train_result = trainer.train()
+        training_seconds = time.perf_counter() - start
+
+        self.export(trainer)
+
+        report = self.compare(eval_examples, mailbox_texts or train_texts, latency_samples)
+        report.update({
+            'training': {
+                'training_loss': train_result.training_loss,
+                'seconds': training_seconds,
+                'train_texts': len(train_texts),
+                'labeled_texts': len(train_labels),
+                'epoch_throughput': throughput_callback.history,
+                'temperature': temperature,
+                'alpha': alpha,
+                'num_epochs': num_epochs,
+                'learning_rate': learning_rate,
+                'batch_size': train_batch_size
+            },
+            'teacher_path': self.teacher_dir,
+            'model_path': self.output_dir,
+            'timestamp': datetime.now().isoformat()
+        })
+        with open(os.path.join(self.output_dir, DISTILLATION_REPORT_FILE), 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        return report
+
+    def export(self, trainer):
+        """Save the student in the layout DynamicEmailClassifier.load_model_from_path reads"""
+        trainer.save_model(self.output_dir)
+
+        # Serving truncates to the tokenizer's model_max_length (see load_model_from_path)
+        teacher_model_max_length = self.tokenizer.model_max_length
+        self.tokenizer.model_max_length = self.student_max_length
+        self.tokenizer.save_pretrained(self.output_dir)
+        self.tokenizer.model_max_length = teacher_model_max_length
+
+        with open(os.path.join(self.output_dir, "label_mappings.json"), "w") as f:
+            json.dump({
+                "label2id": self.teacher.label2id,
+                "id2label": self.teacher.id2label
+            }, f, indent=2)
+        logger.info(f"Student exported to {self.output_dir}")
+
+    def compare(self, eval_examples: List[Tuple[str, str]], latency_texts: List[str], latency_samples: int) -> Dict[str, Any]:
+        """Accuracy and CPU latency of teacher and student side by side"""
+        rng = np.random.default_rng(42)
+        latency_texts = list(rng.permutation(latency_texts)[:latency_samples]) if latency_texts else []
+
+        models = {
+            'teacher': (self.teacher.model, self.teacher_max_length),
+            'student': (self.student, self.student_max_length)
+        }
+        report = {name: {
+            'parameters': count_parameters(model),
+            'layers': model.config.n_layers,
+            'dim': model.config.dim,
+            'hidden_dim': model.config.hidden_dim,
+            'max_length': max_length
+        } for name, (model, max_length) in models.items()}
+
+        if eval_examples:
+            texts = [t for t, _ in eval_examples]
+            label_ids = np.array([self.teacher.label2id[l] for _, l in eval_examples])
+            teacher_predictions = tokenized_logits(
+                self.teacher.model, self.tokenizer, self.tokenize(texts, self.teacher_max_length)
+            ).argmax(axis=1)
+            report['teacher']['metrics'] = self.evaluate(self.teacher.model, self.teacher_max_length,
+                                                         texts, label_ids)
+            report['student']['metrics'] = self.evaluate(self.student, self.student_max_length,
+                                                         texts, label_ids, teacher_predictions)
+
+        if latency_texts:
+            for name, (model, max_length) in models.items():
+                report[name]['latency'] = measure_latency(model, self.tokenizer, latency_texts, max_length)
+            teacher_latency, student_latency = report['teacher']['latency'], report['student']['latency']
+            report['speedup'] = {
+                'single': teacher_latency['single_p50_ms'] / student_latency['single_p50_ms'],
+                'batch': student_latency['batch_emails_per_sec'] / teacher_latency['batch_emails_per_sec']
+            }
+        report['compression'] = report['teacher']['parameters'] / report['student']['parameters']
+        return report
+
+
+def main():
+    """Main distillation function"""
+    parser = argparse.ArgumentParser(description="Distill a fine-tuned DistilBERT into a compact student")
+    parser.add_argument("--teacher_dir", type=str, default="model_service/distilbert_email_model",
+                       help="Fine-tuned teacher model directory")
+    parser.add_argument("--mailbox_file", type=str, required=True,
+                       help="Unlabeled emails (JSON/JSONL, e.g. extract_training_data.py output)")
+    parser.add_argument("--data_file", type=str, default=None,
+                       help="Optional labeled JSONL dataset for hard labels and the teacher/student comparison")
+    parser.add_argument("--output_dir", type=str, default="model_service/distilbert_email_student",
+                       help="Output directory for the student")
+    parser.add_argument("--student_layers", type=int, default=2,
+                       help="Transformer layers in the student (the teacher has 6)")
+    parser.add_argument("--student_dim", type=int, default=None,
+                       help="Student hidden size (default: the teacher's, which allows layer initialization)")
+    parser.add_argument("--student_hidden_dim", type=int, default=None,
+                       help="Student feed-forward size")
+    parser.add_argument("--student_heads", type=int, default=None,
+                       help="Student attention heads")
+    parser.add_argument("--student_max_length", type=int, default=128,
+                       help="Token length the student is trained and served at")
+    parser.add_argument("--teacher_max_length", type=int, default=256,
+                       help="Token length the teacher labels at")
+    parser.add_argument("--temperature", type=float, default=2.0,
+                       help="Soft-label temperature")
+    parser.add_argument("--alpha", type=float, default=0.9,
+                       help="Soft-label loss weight (the rest goes to hard labels)")
+    parser.add_argument("--num_epochs", type=int, default=3,
+                       help="Training epochs")
+    parser.add_argument("--batch_size", type=int, default=32,
+                       help="Training batch size")
+    parser.add_argument("--learning_rate", type=float, default=5e-5,
+                       help="Learning rate")
+    parser.add_argument("--validation_percent", type=int, default=10,
+                       help="Fixed validation slice of --data_file used for the comparison")
+    parser.add_argument("--latency_samples", type=int, default=200,
+                       help="Emails timed for the latency comparison")
+    parser.add_argument("--cache_dir", type=str, default=TOKENIZED_CACHE_DIR,
+                       help="Tokenized dataset and teacher logit cache directory")
+
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print(" " * 22 + "DISTILBERT STUDENT DISTILLATION")
+    print("=" * 70)
+
+    distiller = StudentDistiller(
+        teacher_dir=args.teacher_dir,
+        output_dir=args.output_dir,
+        student_layers=args.student_layers,
+        student_dim=args.student_dim,
+        student_hidden_dim=args.student_hidden_dim,
+        student_heads=args.student_heads,
+        student_max_length=args.student_max_length,
+        teacher_max_length=args.teacher_max_length,
+        cache_dir=args.cache_dir
+    )
+    mailbox_texts = read_mailbox_texts(args.mailbox_file)
+    labeled_examples = distiller.teacher.read_labeled_examples(args.data_file) if args.data_file else None
+
+    report = distiller.distill(
+        mailbox_texts,
+        labeled_examples,
+        validation_percent=args.validation_percent,
+        temperature=args.temperature,
+        alpha=args.alpha,
+        num_epochs=args.num_epochs,
+        learning_rate=args.learning_rate,
+        train_batch_size=args.batch_size,
+        latency_samples=args.latency_samples
+    )
+
+    print(f"\n{'':<12}{'params':>12}{'layers':>8}{'len':>6}{'p50 ms':>9}{'emails/s':>10}{'acc':>8}{'macro F1':>10}")
+    for name in ('teacher', 'student'):
+        entry = report[name]
+        latency = entry.get('latency', {})
+        metrics = entry.get('metrics', {})
+        print(f"{name:<12}{entry['parameters']:>12,}{entry['layers']:>8}{entry['max_length']:>6}"
+              f"{latency.get('single_p50_ms', float('nan')):>9.1f}{latency.get('batch_emails_per_sec', float('nan')):>10.1f}"
+              f"{metrics.get('accuracy', float('nan')):>8.4f}{metrics.get('macro_f1', float('nan')):>10.4f}")
+
+    if 'speedup' in report:
+        print(f"\nSpeedup: {report['speedup']['single']:.1f}x single email, "
+              f"{report['speedup']['batch']:.1f}x batched; {report['compression']:.1f}x fewer parameters")
+    if 'teacher_agreement' in report['student'].get('metrics', {}):
+        print(f"Student agrees with the teacher on {report['student']['metrics']['teacher_agreement']:.1%} of validation emails")
+
+    print(f"\n✓ Student saved to {args.output_dir}")
+    print(f"✓ Report: {os.path.join(args.output_dir, DISTILLATION_REPORT_FILE)}")
+    print(f"  Load it with POST /model/load {{'model_path': '{args.output_dir}'}}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Domain Intelligence for Sender Analysis
+Offline, memoized domain parsing shared by the feature extractor and sender-pattern scripts
+"""
+
+import os
+import hashlib
+import logging
+import threading
+from functools import lru_cache
+from email.utils import parseaddr
+from pathlib import Path
+from typing import Any, Dict, NamedTuple, Optional
+
+import tldextract
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Optional local copy of the public suffix list (e.g. public_suffix_list.dat).
+# When unset, the snapshot bundled with the installed tldextract release is used.
+PUBLIC_SUFFIX_LIST_FILE = os.getenv('PUBLIC_SUFFIX_LIST_FILE')
+
+COMMON_EMAIL_DOMAINS = frozenset([
+    'gmail.com', 'yahoo.com', 'outlook.com', 'hotmail.com', 'icloud.com',
+    'aol.com', 'protonmail.com', 'fastmail.com'
+])
+
+
+class DomainInfo(NamedTuple):
+    """Parsed sender domain"""
+    domain: str
+    registered_domain: str
+    suffix: str
+    levels: int
+    is_common: int
+
+
+UNKNOWN_DOMAIN = DomainInfo('unknown', 'unknown', 'unknown', 0, 0)
+
+
+class DomainIntelligence:
+    """Parse sender domains against a fixed suffix-list snapshot with LRU memoization"""
+
+    def __init__(self, suffix_list_file: Optional[str] = PUBLIC_SUFFIX_LIST_FILE, cache_size: int = 8192):
+        self.suffix_list_file = suffix_list_file
+        self.cache_size = cache_size
+        self.snapshot_version = None
+        self._extractor = None
+        self._lock = threading.Lock()
+
+        # Memoized lookups; lru_cache turns repeat senders into a dict hit
+        self._lookup_domain = lru_cache(maxsize=cache_size)(self._parse_domain)
+        self._lookup_address = lru_cache(maxsize=cache_size)(self._parse_address)
+
+    def _get_extractor(self) -> tldextract.TLDExtract:
+        """Load the suffix-list snapshot once, without any network access"""
+        if self._extractor is not None:
+            return self._extractor
+
+        with self._lock:
+            if self._extractor is None:
+                if self.suffix_list_file and os.path.exists(self.suffix_list_file):
+                    with open(self.suffix_list_file, 'rb') as f:
+                        digest = hashlib.sha1(f.read()).hexdigest()[:12]
+                    self._extractor = tldextract.TLDExtract(
+                        suffix_list_urls=(Path(self.suffix_list_file).resolve().as_uri(),),
+                        cache_dir=None,
+                        fallback_to_snapshot=True
+                    )
+                    self.snapshot_version = f"psl-file-{digest}"
+                else:
+                    if self.suffix_list_file:
+                        logger.warning(f"Suffix list {self.suffix_list_file} not found, using bundled snapshot")
+                    # Empty URL list: never fetch, use the snapshot shipped with tldextract
+                    self._extractor = tldextract.TLDExtract(
+                        suffix_list_urls=(),
+                        cache_dir=None,
+                        fallback_to_snapshot=True
+                    )
+                    self.snapshot_version = f"tldextract-{getattr(tldextract, '__version__', 'unknown')}-bundled"
+
+                logger.info(f"Domain suffix list loaded ({self.snapshot_version})")
+
+        return self._extractor
+
+    def _parse_domain(self, domain: str) -> DomainInfo:
+        """Parse a lowercased domain (cache miss path)"""
+        if not domain:
+            return UNKNOWN_DOMAIN
+
+        extracted = self._get_extractor()(domain)
+        suffix = extracted.suffix.lower() if extracted.suffix else 'unknown'
+        if extracted.domain and extracted.suffix:
+            registered_domain = f"{extracted.domain}.{extracted.suffix}".lower()
+        else:
+            registered_domain = domain
+
+        return DomainInfo(
+            domain=domain,
+            registered_domain=registered_domain,
+            suffix=suffix,
+            levels=len(domain.split('.')),
+            is_common=1 if domain in COMMON_EMAIL_DOMAINS else 0
+        )
+
+    def _parse_address(self, address: str) -> DomainInfo:
+        """Parse a raw From/To value such as 'Name <user@domain>' (cache miss path)"""
+        _, email_addr = parseaddr(address)
+        if not email_addr or '@' not in email_addr:
+            return UNKNOWN_DOMAIN
+        return self._lookup_domain(email_addr.split('@')[1].strip().lower())
+
+    def lookup(self, domain: str) -> DomainInfo:
+        """Look up a bare domain"""
+        if not domain:
+            return UNKNOWN_DOMAIN
+        return self._lookup_domain(domain.strip().lower())
+
+    def lookup_address(self, address: str) -> DomainInfo:
+        """Look up the domain of an email address or From header"""
+        if not address:
+            return UNKNOWN_DOMAIN
+        return self._lookup_address(address)
+
+    def extract_domain(self, address: str) -> str:
+        """Return the sender domain of an address, or '' if it has none"""
+        info = self.lookup_address(address)
+        return '' if info is UNKNOWN_DOMAIN else info.domain
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache hit-rate statistics"""
+        stats = {'snapshot_version': self.snapshot_version, 'max_size': self.cache_size}
+
+        for name, cached in (('domain', self._lookup_domain), ('address', self._lookup_address)):
+            info = cached.cache_info()
+            total = info.hits + info.misses
+            stats[name] = {
+                'hits': info.hits,
+                'misses': info.misses,
+                'size': info.currsize,
+                'hit_rate': info.hits / total if total else 0.0
+            }
+
+        return stats
+
+    def clear_cache(self):
+        """Clear memoized lookups (the loaded snapshot is kept)"""
+        self._lookup_domain.cache_clear()
+        self._lookup_address.cache_clear()
+
+
+_shared_instance = None
+_shared_lock = threading.Lock()
+
+
+def get_domain_intelligence() -> DomainIntelligence:
+    """Get the process-wide DomainIntelligence instance"""
+    global _shared_instance
+    if _shared_instance is None:
+        with _shared_lock:
+            if _shared_instance is None:
+                _shared_instance = DomainIntelligence()
+    return _shared_instance
@@ -21,6 +21,8 @@ from collections import defaultdict
 import pickle
 import os
 
+from classification_versions import category_digests, categories_version, fingerprint
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -186,6 +188,15 @@ class DynamicCategoryManager:
                 return self.categories[category_name]['id']
             return None
     
+    def get_version_info(self) -> Dict[str, Any]:
+        """Fingerprint of the category set and of each category definition"""
+        with self.lock:
+            digests = category_digests(self.categories)
+        return {
+            "categories_version": categories_version(digests),
+            "category_digests": digests
+        }
+    
     def _save_categories(self):
         """Save categories to file"""
         try:
@@ -206,6 +217,7 @@ class DynamicEmailClassifier:
     def __init__(self, model_name: str = "distilbert-base-uncased", max_length: int = 512):
         self.model_name = model_name
         self.max_length = max_length
+        self.default_max_length = max_length
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         
         # Initialize components
@@ -214,6 +226,13 @@ class DynamicEmailClassifier:
         self.model = None
         self.classification_head = None
         
+        # Optional head fitted over frozen encoder embeddings (see fast_head.py)
+        self.encoder_id = model_name
+        self.fast_head = None
+        
+        # Directory of the fine-tuned model being served, if any
+        self.model_path = None
+        
         # Performance optimization
         self.batch_size = 32
         self.max_batch_size = 1000
@@ -272,6 +291,9 @@ class DynamicEmailClassifier:
             # Load tokenizer and model
             self.tokenizer = AutoTokenizer.from_pretrained(model_path)
 
+            # Distilled students are saved with the shorter length they were trained at
+            self.max_length = min(self.default_max_length, self.tokenizer.model_max_length)
+
             config = AutoConfig.from_pretrained(model_path)
             # Ensure the number of labels aligns to current categories count
             num_categories = len(self.category_manager.get_categories())
@@ -284,6 +306,15 @@ class DynamicEmailClassifier:
             self.model.to(self.device)
             self.model.eval()
 
+            # A fast head is only valid for the encoder it was fitted on
+            config_path = os.path.join(model_path, 'config.json')
+            config_mtime = int(os.path.getmtime(config_path)) if os.path.exists(config_path) else 0
+            self.encoder_id = f"{os.path.abspath(model_path)}@{config_mtime}"
+            self.model_path = model_path
+            if self.fast_head is not None and self.fast_head.encoder_id != self.encoder_id:
+                logger.info("Dropping fast head fitted on a different encoder")
+                self.fast_head = None
+
             # Capture label mappings if present on config
             self.id2label = getattr(config, 'id2label', None)
             self.label2id = getattr(config, 'label2id', None)
@@ -392,6 +423,61 @@ class DynamicEmailClassifier:
             logger.error(f"Error tokenizing batch: {e}")
             raise RuntimeError(f"Tokenization failed: {e}")
     
+    def encode_texts(self, texts: List[str], batch_size: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Run the frozen model once over texts
+        
+        Batches are formed from length-sorted texts to keep padding low.
+        Returns ([CLS] embeddings, model class probabilities) in input order.
+        """
+        batch_size = batch_size or self.batch_size
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        embeddings = np.zeros((len(texts), self.model.config.hidden_size), dtype=np.float32)
+        probabilities = np.zeros((len(texts), self.model.config.num_labels), dtype=np.float32)
+        
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            encodings = self.tokenize_batch([texts[i] for i in idx])
+            with torch.no_grad():
+                outputs = self.model(**encodings, output_hidden_states=True)
+            embeddings[idx] = outputs.hidden_states[-1][:, 0, :].float().cpu().numpy()
+            probabilities[idx] = torch.softmax(outputs.logits, dim=1).float().cpu().numpy()
+        
+        return embeddings, probabilities
+    
+    def map_model_scores(self, probabilities) -> Dict[str, float]:
+        """Map one row of model label probabilities onto current category names"""
+        category_names = self.category_manager.get_category_names()
+        mapped_scores = {name: 0.0 for name in category_names}
+        id_map = getattr(self, 'model_label_to_category_id', None)
+        for i in range(len(probabilities)):
+            mapped_cat_id = id_map.get(i, i) if id_map else i
+            mapped_name = self.category_manager.get_category_by_id(mapped_cat_id) or 'Other'
+            score_val = float(probabilities[i])
+            # If multiple model labels map to same category, take max
+            mapped_scores[mapped_name] = max(mapped_scores.get(mapped_name, 0.0), score_val)
+        return mapped_scores
+    
+    def score_outputs(self, embeddings: np.ndarray, probabilities: np.ndarray, fast_head=None) -> List[Dict[str, float]]:
+        """Category scores for encoded texts from the fast head if given, else from the model"""
+        if fast_head is None:
+            return [self.map_model_scores(row) for row in probabilities]
+        
+        category_names = self.category_manager.get_category_names()
+        results = []
+        for head_scores in fast_head.scores(embeddings):
+            # Categories removed since the head was fitted are dropped
+            scores = {name: 0.0 for name in category_names}
+            scores.update({name: score for name, score in head_scores.items() if name in scores})
+            results.append(scores)
+        return results
+    
+    def install_fast_head(self, fast_head) -> None:
+        """Swap in a fitted fast head; in-flight predictions keep the head they started with"""
+        self.fast_head = fast_head
+        self.prediction_cache.clear()
+        logger.info(f"Installed fast head over {len(fast_head.classes)} categories")
+    
     def _apply_comprehensive_analysis(self, subject: str, body: str, scores: Dict[str, float], 
                                     ml_category: str, ml_confidence: float, ml_category_id: int) -> tuple:
         """
@@ -675,25 +761,19 @@ class DynamicEmailClassifier:
             if cache_key in self.prediction_cache:
                 return self.prediction_cache[cache_key]
             
-            # Tokenize
-            encodings = self.tokenize_batch([text])
-            
-            # Get predictions
-            with torch.no_grad():
-                outputs = self.model(**encodings)
-                logits = outputs.logits
-                probabilities = torch.softmax(logits, dim=1)
-            
-            # Map model label indices -> current category IDs/names
-            category_names = self.category_manager.get_category_names()
-            mapped_scores = {name: 0.0 for name in category_names}
-            id_map = getattr(self, 'model_label_to_category_id', None)
-            for i in range(probabilities.shape[1]):
-                mapped_cat_id = id_map.get(i, i) if id_map else i
-                mapped_name = self.category_manager.get_category_by_id(mapped_cat_id) or 'Other'
-                score_val = probabilities[0][i].item()
-                # If multiple model labels map to same category, take max
-                mapped_scores[mapped_name] = max(mapped_scores.get(mapped_name, 0.0), score_val)
+            # Get predictions (fast head scores when one is installed)
+            fast_head = self.fast_head
+            if fast_head is not None:
+                embeddings, probabilities = self.encode_texts([text])
+                mapped_scores = self.score_outputs(embeddings, probabilities, fast_head)[0]
+            else:
+                encodings = self.tokenize_batch([text])
+                with torch.no_grad():
+                    outputs = self.model(**encodings)
+                    probabilities = torch.softmax(outputs.logits, dim=1)
+                
+                # Map model label indices -> current category IDs/names
+                mapped_scores = self.map_model_scores(probabilities[0].cpu().numpy())
 
             # Choose best category by mapped score
             category_name, confidence = max(mapped_scores.items(), key=lambda x: x[1])
@@ -749,6 +829,21 @@ class DynamicEmailClassifier:
                 text = self.preprocess_text(subject, body)
                 texts.append(text)
             
+            # With a fast head installed, score all texts through it in one encoding pass
+            fast_head = self.fast_head
+            if fast_head is not None:
+                embeddings, probabilities = self.encode_texts(texts)
+                results = []
+                for scores in self.score_outputs(embeddings, probabilities, fast_head):
+                    category_name, confidence = max(scores.items(), key=lambda x: x[1])
+                    results.append({
+                        "label": category_name,
+                        "confidence": round(confidence, 4),
+                        "scores": scores,
+                        "category_id": self.category_manager.get_category_id_by_name(category_name) or 0
+                    })
+                return results
+            
             # Process in chunks for memory efficiency
             results = []
             for i in range(0, len(texts), self.batch_size):
@@ -842,6 +937,21 @@ class DynamicEmailClassifier:
         """Get all categories"""
         return self.category_manager.get_categories()
     
+    def get_model_version(self) -> str:
+        """Fingerprint of the model producing predictions (encoder and fast head)"""
+        fast_head = self.fast_head
+        return fingerprint({
+            "encoder": self.encoder_id,
+            "max_length": self.max_length,
+            "fast_head": [fast_head.encoder_id, fast_head.trained_at] if fast_head is not None else None
+        })
+    
+    def get_version_info(self) -> Dict[str, Any]:
+        """Model and category-set versions stored with every classification"""
+        info = self.category_manager.get_version_info()
+        info["model_version"] = self.get_model_version()
+        return info
+    
     def get_model_info(self) -> Dict[str, Any]:
         """Get model information"""
         return {
@@ -852,6 +962,9 @@ class DynamicEmailClassifier:
             "categories": self.category_manager.get_categories(),
             "num_categories": len(self.category_manager.get_categories()),
             "cache_size": len(self.prediction_cache),
+            "fast_head": self.fast_head.get_info() if self.fast_head is not None else None,
+            "model_version": self.get_model_version(),
+            "categories_version": self.category_manager.get_version_info()["categories_version"],
             "status": "ready" if self.model is not None else "not_loaded"
         }
     
@@ -18,7 +18,10 @@ from dynamic_classifier import DynamicEmailClassifier
 from ensemble_classifier import EnsembleEmailClassifier
 from training_pipeline import ModelTrainingPipeline
 from data_collection import TrainingDataCollector
-from distilbert_trainer import DistilBERTTrainer
+from training_jobs import TrainingJobManager, TrainingJobStore
+from reclassification_jobs import ReclassificationJobManager, ReclassificationJobStore
+from feature_store import get_feature_store
+from fast_head import FastHeadTrainer, HEAD_TYPES
 import threading
 import time
 
@@ -50,7 +53,9 @@ classifier = None
 ensemble_classifier = None
 training_pipeline = None
 data_collector = None
-distilbert_trainer = None
+training_job_manager = None
+reclassification_job_manager = None
+fast_head_trainer = None
 websocket_connections = set()
 performance_stats = {
     "total_predictions": 0,
@@ -76,6 +81,7 @@ class EnsembleEmailInput(BaseModel):
     attachments: Optional[List[Dict[str, Any]]] = Field(default_factory=list, description="Email attachments")
     headers: Optional[Dict[str, str]] = Field(default_factory=dict, description="Email headers")
     user_id: Optional[str] = Field(None, description="User ID for dynamic categories")
+    email_id: Optional[str] = Field(None, description="Email id (Mongo _id or Gmail id) for feature store reuse")
 
 class BatchEmailInput(BaseModel):
     emails: List[EmailInput] = Field(..., description="List of emails to classify")
@@ -131,6 +137,8 @@ class PerformanceStats(BaseModel):
 class TrainingInput(BaseModel):
     classification_strategy: Optional[Dict[str, Any]] = Field(None, description="Classification strategy")
     sample_emails: List[EmailInput] = Field(default_factory=list, description="Sample emails for training")
+    mode: str = Field("fast_head", description="'fast_head' fits a head over frozen embeddings; 'strategy_only' stores the strategy")
+    head_type: str = Field("logistic", description="Fast head type: 'logistic' or 'mlp'")
 
 class TrainingResponse(BaseModel):
     status: str
@@ -159,6 +167,25 @@ class DistilBERTTrainingInput(BaseModel):
     learning_rate: Optional[float] = Field(2e-5, description="Learning rate")
     max_length: Optional[int] = Field(256, description="Maximum token sequence length")
     validation_split: Optional[float] = Field(0.2, description="Validation split ratio")
+    batching: Optional[str] = Field("length_grouped", description="Training batch composition: 'random' or 'length_grouped'")
+    max_tokens_per_batch: Optional[int] = Field(None, description="Size training batches by padded tokens")
+    incremental: bool = Field(False, description="Warm-start from the deployed model and train on new/changed samples plus replay")
+    base_model_path: Optional[str] = Field(None, description="Model to warm-start from (default: the model being served)")
+    new_data_file: Optional[str] = Field(None, description="JSONL file with only the new samples")
+    replay_ratio: Optional[float] = Field(4.0, description="Replay examples per new example")
+    promotion_tolerance: Optional[float] = Field(0.0, description="Allowed validation F1 drop for promotion")
+
+class ReclassificationJobInput(BaseModel):
+    user_id: Optional[str] = Field(None, description="Only this user's emails")
+    categories: List[str] = Field(default_factory=list, description="Only emails currently in these categories")
+    since: Optional[datetime] = Field(None, description="Only emails dated on or after this time")
+    until: Optional[datetime] = Field(None, description="Only emails dated before this time")
+    incremental: bool = Field(False, description="Only emails whose classification is stale for the current model and categories")
+    check_content: bool = Field(False, description="Also compare content digests (scans every matching email)")
+    dry_run: bool = Field(False, description="Classify and report without writing")
+    confidence_threshold: float = Field(0.0, description="Minimum confidence to change an email's category")
+    batch_size: int = Field(100, ge=1, le=1000, description="Emails read, classified and written per batch")
+    limit: Optional[int] = Field(None, ge=1, description="Stop after this many emails")
 
 # WebSocket connection manager
 class ConnectionManager:
@@ -194,22 +221,46 @@ manager = ConnectionManager()
 # Initialize classifier
 @app.on_event("startup")
 async def startup_event():
-    global classifier, ensemble_classifier
+    global classifier, ensemble_classifier, fast_head_trainer, training_job_manager, reclassification_job_manager
     try:
         logger.info("Initializing enhanced ML classifier...")
         classifier = DynamicEmailClassifier()
         logger.info("✅ Enhanced ML classifier initialized successfully")
         
+        # Reinstall the fast category head from the last /categories/{name}/train
+        fast_head_trainer = FastHeadTrainer(classifier)
+        if fast_head_trainer.restore():
+            logger.info("✅ Fast category head restored")
+        
         # Initialize ensemble classifier
         logger.info("Initializing ensemble email classifier...")
         ensemble_classifier = EnsembleEmailClassifier(
             distilbert_model=classifier,
             feature_model_type='xgboost',
             distilbert_weight=float(os.getenv('ENSEMBLE_DISTILBERT_WEIGHT', '0.6')),
-            feature_weight=float(os.getenv('ENSEMBLE_FEATURE_WEIGHT', '0.4'))
+            feature_weight=float(os.getenv('ENSEMBLE_FEATURE_WEIGHT', '0.4')),
+            feature_store=get_feature_store()
         )
         logger.info("✅ Ensemble classifier initialized successfully")
         
+        # Training jobs run in a separate worker process; this task relays their events
+        training_job_manager = TrainingJobManager(
+            TrainingJobStore(),
+            broadcast=manager.broadcast,
+            on_completed=handoff_trained_model
+        )
+        training_job_manager.recover()
+        asyncio.create_task(training_job_manager.run())
+        
+        # Bulk reclassification jobs read and write MongoDB directly with the live classifier
+        reclassification_job_manager = ReclassificationJobManager(
+            ReclassificationJobStore(),
+            get_classifier=lambda: classifier,
+            broadcast=manager.broadcast
+        )
+        reclassification_job_manager.recover()
+        asyncio.create_task(reclassification_job_manager.run())
+        
         # Start performance monitoring
         asyncio.create_task(performance_monitor())
         
@@ -234,6 +285,12 @@ def initialize_classifier():
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutting down enhanced ML service...")
+    if ensemble_classifier is not None and ensemble_classifier.feature_store is not None:
+        ensemble_classifier.feature_store.flush()
+    if training_job_manager is not None:
+        training_job_manager.shutdown()
+    if reclassification_job_manager is not None:
+        reclassification_job_manager.shutdown()
 
 # Performance monitoring task
 async def performance_monitor():
@@ -377,7 +434,9 @@ async def predict_email_ensemble(email: EnsembleEmailInput):
         }
         
         # Get ensemble prediction
-        result = ensemble_classifier.predict_single(email.subject, email.body, email_data)
+        result = ensemble_classifier.predict_single(
+            email.subject, email.body, email_data, email_id=email.email_id
+        )
         
         # Update performance stats
         performance_stats["total_predictions"] += 1
@@ -531,6 +590,9 @@ async def remove_category(category_name: str):
         if not success:
             raise HTTPException(status_code=400, detail="Failed to remove category")
         
+        if fast_head_trainer is not None and fast_head_trainer.sample_bank.remove_category(category_name):
+            fast_head_trainer.sample_bank.save()
+        
         # Broadcast category update
         await manager.broadcast({
             "type": "category_removed",
@@ -645,6 +707,12 @@ async def train_category(category_name: str, training_data: TrainingInput):
         if category_name not in categories:
             raise HTTPException(status_code=404, detail="Category not found")
         
+        # Validate before anything is changed, so a rejected request stores no strategy
+        if training_data.mode not in ("fast_head", "strategy_only"):
+            raise HTTPException(status_code=400, detail=f"Unknown training mode: {training_data.mode}")
+        if training_data.head_type not in HEAD_TYPES:
+            raise HTTPException(status_code=400, detail=f"Unknown head type: {training_data.head_type}")
+        
         logger.info(f"Training category '{category_name}' with {len(training_data.sample_emails)} samples")
         
         # Perform few-shot training
@@ -661,31 +729,24 @@ async def train_category(category_name: str, training_data: TrainingInput):
                 training_metrics["strategy_applied"] = True
                 logger.info(f"Applied classification strategy for '{category_name}'")
         
-        if training_data.sample_emails:
-            # Convert sample emails to the format expected by the classifier
-            sample_texts = []
-            for email in training_data.sample_emails:
-                if email.subject and email.body:
-                    text = f"{email.subject} [SEP] {email.body}"
-                    sample_texts.append(text)
+        if training_data.sample_emails and training_data.mode == "fast_head" and fast_head_trainer is not None:
+            # Encode samples with the frozen encoder and fit a head over all categories,
+            # off the event loop; the head is installed atomically when done
+            sample_emails = [{"subject": e.subject, "body": e.body} for e in training_data.sample_emails]
+            loop = asyncio.get_running_loop()
+            try:
+                head_metrics = await loop.run_in_executor(
+                    None, fast_head_trainer.train, category_name, sample_emails, training_data.head_type
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            training_metrics.update(head_metrics)
             
-            if sample_texts:
-                # Perform few-shot learning (simplified version)
-                # In a real implementation, you would:
-                # 1. Fine-tune the model or classification head
-                # 2. Update embeddings or weights based on samples
-                # 3. Calculate actual confidence improvement
-                
-                # For now, we'll simulate training success
-                training_metrics.update({
-                    "samples_processed": len(sample_texts),
-                    "training_method": "few_shot_patterns",
-                    "confidence_threshold": 0.7
-                })
-                
-                # Simulate confidence improvement
-                confidence_improvement = min(0.2, len(sample_texts) * 0.05)
-                logger.info(f"Processed {len(sample_texts)} training samples for '{category_name}'")
+            # Real change in held-out confidence for this category, when it had held-out samples
+            heldout = head_metrics["heldout_metrics"]
+            if heldout.get("category_confidence") is not None:
+                confidence_improvement = heldout["category_confidence"] - heldout["baseline_category_confidence"]
+            logger.info(f"Fast head trained with {head_metrics['samples_added']} new samples for '{category_name}'")
         
         # Clear prediction cache to force new predictions with updated model
         classifier.clear_cache()
@@ -884,6 +945,13 @@ async def load_finetuned_model(payload: Dict[str, Any]):
         logger.error(f"Failed to load model: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to load model: {str(e)}")
 
+@app.get("/model/version")
+async def get_model_version():
+    """Model and category-set versions, stored with classifications for incremental reclassification"""
+    if classifier is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    return classifier.get_version_info()
+
 @app.get("/model/performance")
 async def get_model_performance():
     """Get detailed model performance metrics"""
@@ -914,109 +982,232 @@ async def get_model_performance():
         raise HTTPException(status_code=500, detail=f"Failed to get model performance: {str(e)}")
 
 @app.post("/training/distilbert", response_model=TrainingResponse)
-async def train_distilbert_model(training_config: DistilBERTTrainingInput, background_tasks: BackgroundTasks):
-    """Train DistilBERT model with provided dataset"""
-    global distilbert_trainer
+async def train_distilbert_model(training_config: DistilBERTTrainingInput):
+    """Queue a DistilBERT training job; it runs in the training worker process"""
+    if training_job_manager is None:
+        raise HTTPException(status_code=503, detail="Training jobs not initialized")
     
     try:
-        logger.info(f"Starting DistilBERT training with dataset: {training_config.data_file}")
+        logger.info(f"Queueing DistilBERT training with dataset: {training_config.data_file}")
         
         # Validate data file exists
         if not os.path.exists(training_config.data_file):
             raise HTTPException(status_code=404, detail=f"Dataset file not found: {training_config.data_file}")
         
-        # Initialize trainer if not already done
-        if distilbert_trainer is None:
-            distilbert_trainer = DistilBERTTrainer(
-                output_dir=training_config.output_dir,
-                max_length=training_config.max_length
-            )
+        config = training_config.dict()
+        if training_config.incremental:
+            config["base_model_path"] = training_config.base_model_path or (classifier.model_path if classifier else None)
+            if not config["base_model_path"]:
+                raise HTTPException(status_code=400, detail="Incremental training needs a fine-tuned base model")
+            if "num_epochs" not in training_config.model_fields_set:
+                config["num_epochs"] = 2
+            if "learning_rate" not in training_config.model_fields_set:
+                config["learning_rate"] = 1e-5
         
-        # Add training task to background
-        background_tasks.add_task(
-            run_distilbert_training,
-            training_config,
-            distilbert_trainer
-        )
+        job = training_job_manager.submit("distilbert", config)
         
         return TrainingResponse(
-            status="success",
-            message=f"DistilBERT training started for dataset: {training_config.data_file}",
-            training_metrics=None,
+            status="queued",
+            message=f"DistilBERT training job {job['id']} queued for dataset: {training_config.data_file}",
+            training_metrics={
+                "job_id": job["id"],
+                "queue_position": training_job_manager.queue_position(job["id"]),
+                "output_dir": job["output_dir"]
+            },
             confidence_improvement=None
         )
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Failed to start DistilBERT training: {e}")
+        logger.error(f"Failed to queue DistilBERT training: {e}")
         raise HTTPException(status_code=500, detail=f"Training initialization failed: {str(e)}")
 
-async def run_distilbert_training(training_config: DistilBERTTrainingInput, trainer: DistilBERTTrainer):
-    """Background task to run DistilBERT training"""
+@app.get("/training/jobs")
+async def list_training_jobs():
+    """List training jobs, oldest first"""
+    if training_job_manager is None:
+        raise HTTPException(status_code=503, detail="Training jobs not initialized")
+    
+    jobs = training_job_manager.store.list()
+    return {
+        "jobs": [{k: v for k, v in job.items() if k not in ("result", "traceback")} for job in jobs],
+        "count": len(jobs),
+        "worker": training_job_manager.get_stats()
+    }
+
+@app.get("/training/jobs/{job_id}")
+async def get_training_job(job_id: str):
+    """Get one training job with its progress and results"""
+    if training_job_manager is None:
+        raise HTTPException(status_code=503, detail="Training jobs not initialized")
+    
+    job = training_job_manager.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Training job not found")
+    job["queue_position"] = training_job_manager.queue_position(job_id)
+    return job
+
+@app.post("/training/jobs/{job_id}/cancel")
+async def cancel_training_job(job_id: str, force: bool = False):
+    """Cancel a queued job, or checkpoint and stop a running one (force kills it instead)"""
+    if training_job_manager is None:
+        raise HTTPException(status_code=503, detail="Training jobs not initialized")
+    
     try:
-        logger.info("Starting DistilBERT training in background...")
-        
-        # Load and preprocess dataset
-        texts, labels, label_mapping = trainer.load_and_preprocess_dataset(training_config.data_file)
-        
-        if len(texts) == 0:
-            logger.error("No valid training examples found!")
-            return
-        
-        # Initialize model
-        trainer.initialize_model(len(label_mapping))
-        
-        # Train model
-        results = trainer.train_model(
-            texts=texts,
-            labels=labels,
-            validation_split=training_config.validation_split,
-            train_batch_size=training_config.batch_size,
-            num_epochs=training_config.num_epochs,
-            learning_rate=training_config.learning_rate
-        )
-        
-        logger.info(f"DistilBERT training completed successfully! Results: {results.get('eval_results', {})}")
-        
-        # Auto-load fine-tuned model into live classifier so all endpoints use it
-        global classifier
+        job = training_job_manager.cancel(job_id, force=force)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Training job not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    await manager.broadcast({
+        "type": "training_job_status",
+        "data": {"job_id": job_id, "status": job["status"]}
+    })
+    return {"status": "success", "job_id": job_id, "job_status": job["status"]}
+
+@app.post("/training/jobs/{job_id}/resume")
+async def resume_training_job(job_id: str):
+    """Queue a cancelled, interrupted or failed job again from its newest checkpoint"""
+    if training_job_manager is None:
+        raise HTTPException(status_code=503, detail="Training jobs not initialized")
+    
+    try:
+        job = training_job_manager.resume(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Training job not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    return {
+        "status": "success",
+        "job_id": job_id,
+        "resume_from_checkpoint": job["resume_from_checkpoint"],
+        "queue_position": training_job_manager.queue_position(job_id)
+    }
+
+@app.post("/reclassification/jobs")
+async def create_reclassification_job(spec: ReclassificationJobInput):
+    """Queue a bulk reclassification of the emails matching the spec; progress is broadcast over /ws"""
+    if reclassification_job_manager is None:
+        raise HTTPException(status_code=503, detail="Reclassification jobs not initialized")
+    if classifier is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    if spec.since and spec.until and spec.since >= spec.until:
+        raise HTTPException(status_code=400, detail="since must be before until")
+    
+    config = spec.dict()
+    config["since"] = spec.since.isoformat() if spec.since else None
+    config["until"] = spec.until.isoformat() if spec.until else None
+    job = reclassification_job_manager.submit(config)
+    
+    return {
+        "status": "queued",
+        "job_id": job["id"],
+        "queue_position": reclassification_job_manager.queue_position(job["id"])
+    }
+
+@app.get("/reclassification/jobs")
+async def list_reclassification_jobs():
+    """List reclassification jobs, oldest first"""
+    if reclassification_job_manager is None:
+        raise HTTPException(status_code=503, detail="Reclassification jobs not initialized")
+    
+    jobs = reclassification_job_manager.store.list()
+    return {
+        "jobs": [{k: v for k, v in job.items() if k not in ("result", "traceback")} for job in jobs],
+        "count": len(jobs),
+        "worker": reclassification_job_manager.get_stats()
+    }
+
+@app.get("/reclassification/jobs/{job_id}")
+async def get_reclassification_job(job_id: str):
+    """Get one reclassification job with its progress and results"""
+    if reclassification_job_manager is None:
+        raise HTTPException(status_code=503, detail="Reclassification jobs not initialized")
+    
+    job = reclassification_job_manager.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Reclassification job not found")
+    job["queue_position"] = reclassification_job_manager.queue_position(job_id)
+    return job
+
+@app.post("/reclassification/jobs/{job_id}/cancel")
+async def cancel_reclassification_job(job_id: str):
+    """Cancel a queued job, or stop a running one once its in-flight batches are written"""
+    if reclassification_job_manager is None:
+        raise HTTPException(status_code=503, detail="Reclassification jobs not initialized")
+    
+    try:
+        job = reclassification_job_manager.cancel(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Reclassification job not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    await manager.broadcast({
+        "type": "reclassification_job_status",
+        "data": {"job_id": job_id, "status": job["status"]}
+    })
+    return {"status": "success", "job_id": job_id, "job_status": job["status"]}
+
+@app.post("/reclassification/jobs/{job_id}/resume")
+async def resume_reclassification_job(job_id: str):
+    """Queue a cancelled, interrupted or failed job again after its last committed batch"""
+    if reclassification_job_manager is None:
+        raise HTTPException(status_code=503, detail="Reclassification jobs not initialized")
+    
+    try:
+        reclassification_job_manager.resume(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Reclassification job not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    return {
+        "status": "success",
+        "job_id": job_id,
+        "queue_position": reclassification_job_manager.queue_position(job_id)
+    }
+
+async def handoff_trained_model(job: Dict[str, Any]):
+    """Load a finished job's model into the live classifier so all endpoints use it"""
+    global classifier
+    results = job.get("result") or {}
+    model_dir = results.get("model_path")
+    
+    # Incremental runs that lost to the previous model on the fixed validation set are not promoted
+    promoted = results.get("promoted", True)
+    if not promoted:
+        logger.info(f"Training job {job['id']} was not promoted: {results.get('comparison')}")
+    
+    loaded = False
+    if model_dir and promoted:
         if classifier is None:
             classifier = DynamicEmailClassifier()
-        model_dir = results.get("model_path")
-        if model_dir:
-            try:
-                loaded = classifier.load_model_from_path(model_dir)
-                if loaded:
-                    logger.info("Fine-tuned DistilBERT loaded into live classifier")
-                else:
-                    logger.warning("Fine-tuned model could not be loaded; continuing with existing model")
-            except Exception as e:
-                logger.warning(f"Failed to load fine-tuned model into classifier: {e}")
-
-        # Broadcast training completion
-        await manager.broadcast({
-            "type": "distilbert_training_completed",
-            "data": {
-                "status": "success",
-                "model_path": results.get("model_path"),
-                "metrics": results.get("eval_results", {}),
-                "timestamp": results.get("timestamp")
-            }
-        })
-        
-    except Exception as e:
-        logger.error(f"DistilBERT training failed: {e}")
-        
-        # Broadcast training failure
-        await manager.broadcast({
-            "type": "distilbert_training_failed",
-            "data": {
-                "status": "error",
-                "error": str(e),
-                "timestamp": datetime.now().isoformat()
-            }
-        })
+        # Loading weights takes seconds; keep it off the event loop
+        loop = asyncio.get_running_loop()
+        loaded = await loop.run_in_executor(None, classifier.load_model_from_path, model_dir)
+        if loaded:
+            logger.info(f"Fine-tuned DistilBERT from job {job['id']} loaded into live classifier")
+        else:
+            logger.warning("Fine-tuned model could not be loaded; continuing with existing model")
+    
+    # Broadcast training completion
+    await manager.broadcast({
+        "type": "distilbert_training_completed",
+        "data": {
+            "status": "success",
+            "job_id": job["id"],
+            "model_path": model_dir,
+            "model_loaded": loaded,
+            "promoted": promoted,
+            "comparison": results.get("comparison"),
+            "metrics": results.get("eval_results", {}),
+            "timestamp": results.get("timestamp")
+        }
+    })
 
 # WebSocket endpoint for real-time updates
 @app.websocket("/ws")
@@ -19,85 +19,76 @@ import json
 from datetime import datetime
 
 from dynamic_classifier import DynamicEmailClassifier
-from feature_extractor import EmailFeatureExtractor, normalize_features
+from feature_extractor import EmailFeatureExtractor, FEATURE_VECTOR_NAMES, features_to_vector
+from feature_store import FeatureStore, build_email_data, content_hash, sample_email_id
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Fixed thread budget for the feature model so it does not oversubscribe
+# the CPU next to torch (n_jobs=-1 spawns one thread per core per call)
+FEATURE_MODEL_THREADS = int(os.getenv('FEATURE_MODEL_THREADS', '2'))
+
 class FeatureBasedClassifier:
     """Traditional ML classifier for metadata and structural features"""
     
-    def __init__(self, model_type: str = 'xgboost'):
+    # Feature order expected by the model (must match training features)
+    EXPECTED_FEATURES = FEATURE_VECTOR_NAMES
+    
+    # Default hyperparameters per model type; model_params overrides them
+    DEFAULT_MODEL_PARAMS = {
+        'xgboost': {'n_estimators': 100, 'max_depth': 6, 'learning_rate': 0.1},
+        'random_forest': {'n_estimators': 100, 'max_depth': 10},
+        'logistic_regression': {'max_iter': 1000}
+    }
+    
+    def __init__(self, model_type: str = 'xgboost', n_jobs: int = FEATURE_MODEL_THREADS,
+                 model_params: Optional[Dict[str, Any]] = None):
         self.model_type = model_type
+        self.n_jobs = n_jobs
+        self.model_params = {**self.DEFAULT_MODEL_PARAMS.get(model_type, {}), **(model_params or {})}
         self.model = None
         self.scaler = StandardScaler()
         self.label_encoder = LabelEncoder()
         self.feature_names = None
         self.is_trained = False
         
+        # Fast-path inference state (see compile_fast_path)
+        self._booster = None
+        self._scale_mean = None
+        self._scale_inv = None
+        self._classes = None
+        self._class_names = []
+        
         self._initialize_model()
     
     def _initialize_model(self):
         """Initialize the ML model"""
         if self.model_type == 'xgboost':
             self.model = xgb.XGBClassifier(
-                n_estimators=100,
-                max_depth=6,
-                learning_rate=0.1,
                 random_state=42,
-                n_jobs=-1
+                n_jobs=self.n_jobs,
+                **self.model_params
             )
         elif self.model_type == 'random_forest':
             self.model = RandomForestClassifier(
-                n_estimators=100,
-                max_depth=10,
                 random_state=42,
-                n_jobs=-1
+                n_jobs=self.n_jobs,
+                **self.model_params
             )
         elif self.model_type == 'logistic_regression':
             self.model = LogisticRegression(
                 random_state=42,
-                max_iter=1000,
-                n_jobs=-1
+                n_jobs=self.n_jobs,
+                **self.model_params
             )
         else:
             raise ValueError(f"Unsupported model type: {self.model_type}")
     
     def prepare_features(self, features: Dict[str, Any]) -> np.ndarray:
         """Prepare and normalize features for ML model"""
-        normalized_features = normalize_features(features)
-        
-        # Define expected feature order (these should match training features)
-        expected_features = [
-            'subject_length', 'subject_word_count', 'subject_has_urgency', 'subject_caps_ratio',
-            'total_text_length', 'total_word_count', 'body_length', 'body_word_count',
-            'has_html', 'html_length', 'html_to_text_ratio', 'html_image_count',
-            'has_hidden_text', 'business_keyword_count', 'academic_keyword_count', 'job_keyword_count',
-            'link_count', 'has_links', 'external_link_count', 'unique_domain_count', 'short_url_count',
-            'sender_name_length', 'sender_email_length', 'domain_levels', 'is_common_domain',
-            'recipient_count', 'hour_of_day', 'day_of_week', 'is_business_hour', 'is_weekend',
-            'attachment_count', 'has_attachments', 'total_attachment_size', 'avg_attachment_size',
-            'unique_extension_count', 'suspicious_extension_count', 'has_pdf_attachment',
-            'has_image_attachment', 'has_document_attachment', 'subject_exclamation_count',
-            'subject_question_count', 'subject_number_count', 'body_paragraph_count',
-            'avg_paragraph_length', 'html_table_count', 'html_list_count', 'html_form_count',
-            'has_spf', 'has_dkim', 'has_dmarc', 'has_reply_to', 'has_priority_header'
-        ]
-        
-        # Add categorical feature hashes
-        categorical_features = ['sender_domain_hash', 'sender_tld_hash']
-        expected_features.extend(categorical_features)
-        
-        # Create feature vector
-        feature_vector = []
-        for feature_name in expected_features:
-            if feature_name in normalized_features:
-                feature_vector.append(normalized_features[feature_name])
-            else:
-                feature_vector.append(0.0)  # Default value for missing features
-        
-        return np.array(feature_vector).reshape(1, -1)
+        return features_to_vector(features).reshape(1, -1)
     
     def train(self, X: np.ndarray, y: np.ndarray):
         """Train the feature-based classifier"""
@@ -114,6 +105,7 @@ class FeatureBasedClassifier:
             self.model.fit(X_scaled, y_encoded)
             self.feature_names = [f"feature_{i}" for i in range(X.shape[1])]
             self.is_trained = True
+            self.compile_fast_path()
             
             logger.info(f"Feature-based classifier training completed")
             
@@ -121,34 +113,113 @@ class FeatureBasedClassifier:
             logger.error(f"Error training feature-based classifier: {e}")
             raise
     
+    def compile_fast_path(self):
+        """
+        Precompute everything single-row inference needs so that predict()
+        skips the sklearn wrapper layers:
+        - the StandardScaler folded into float32 mean / inverse-scale arrays
+        - the raw XGBoost booster pinned to a fixed thread count, used with
+          in-place prediction (no DMatrix construction)
+        - the decoded label array (no LabelEncoder.inverse_transform per call)
+        """
+        if not self.is_trained:
+            return
+        
+        try:
+            mean = getattr(self.scaler, 'mean_', None)
+            scale = getattr(self.scaler, 'scale_', None)
+            if mean is not None and scale is not None:
+                self._scale_mean = np.asarray(mean, dtype=np.float32)
+                self._scale_inv = (1.0 / np.asarray(scale, dtype=np.float64)).astype(np.float32)
+            else:
+                self._scale_mean = None
+                self._scale_inv = None
+            
+            self._classes = np.asarray(self.label_encoder.classes_)
+            self._class_names = [str(label) for label in self._classes]
+            
+            self._booster = None
+            if self.model_type == 'xgboost':
+                booster = self.model.get_booster()
+                booster.set_param({'nthread': self.n_jobs})
+                self._booster = booster
+            elif hasattr(self.model, 'n_jobs'):
+                # Models pickled with n_jobs=-1 get the fixed budget too
+                self.model.n_jobs = self.n_jobs
+            
+        except Exception as e:
+            logger.warning(f"Could not compile fast inference path, using sklearn path: {e}")
+            self._booster = None
+            self._scale_mean = None
+            self._scale_inv = None
+    
+    def predict_proba_batch(self, X: np.ndarray) -> np.ndarray:
+        """Class probabilities for a raw (unscaled) feature matrix"""
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        
+        if self._scale_mean is not None:
+            X = (X - self._scale_mean) * self._scale_inv
+        else:
+            X = self.scaler.transform(X).astype(np.float32)
+        
+        if self._booster is not None:
+            probabilities = self._booster.inplace_predict(X)
+            if probabilities.ndim == 1:
+                # binary:logistic returns P(class 1) only
+                probabilities = np.stack([1.0 - probabilities, probabilities], axis=1)
+            return probabilities
+        
+        return self.model.predict_proba(X)
+    
     def predict(self, features: Dict[str, Any]) -> Tuple[str, float, Dict[str, float]]:
         """Predict using feature-based model"""
+        if not self.is_trained:
+            return "Other", 0.0, {}
+        
+        return self.predict_vector(self.prepare_features(features))
+    
+    def predict_vector(self, X: np.ndarray) -> Tuple[str, float, Dict[str, float]]:
+        """Predict from an already prepared feature vector (e.g. a feature store row)"""
         try:
             if not self.is_trained:
                 return "Other", 0.0, {}
             
-            # Prepare features
-            X = self.prepare_features(features)
-            X_scaled = self.scaler.transform(X)
+            if self._classes is None:
+                self.compile_fast_path()
             
-            # Get predictions
-            predictions = self.model.predict_proba(X_scaled)[0]
-            predicted_class_idx = np.argmax(predictions)
+            predictions = self.predict_proba_batch(X)[0]
+            predicted_class_idx = int(np.argmax(predictions))
             confidence = predictions[predicted_class_idx]
             
-            # Decode label
-            predicted_label = self.label_encoder.inverse_transform([predicted_class_idx])[0]
+            # Decode label from the precomputed class array
+            predicted_label = self._classes[predicted_class_idx]
             
             # Create scores dictionary
-            scores = {}
-            for i, label in enumerate(self.label_encoder.classes_):
-                scores[label] = float(predictions[i])
+            scores = dict(zip(self._class_names, predictions.tolist()))
             
             return predicted_label, float(confidence), scores
             
         except Exception as e:
             logger.error(f"Error in feature-based prediction: {e}")
             return "Other", 0.0, {}
+    
+    def predict_matrix(self, X: np.ndarray) -> List[Tuple[str, float, Dict[str, float]]]:
+        """Predict every row of a prepared feature matrix in one call"""
+        if not self.is_trained:
+            return [("Other", 0.0, {}) for _ in range(len(X))]
+        
+        if self._classes is None:
+            self.compile_fast_path()
+        
+        predictions = self.predict_proba_batch(X)
+        predicted_idx = np.argmax(predictions, axis=1)
+        
+        return [
+            (self._class_names[idx], float(row[idx]), dict(zip(self._class_names, row.tolist())))
+            for idx, row in zip(predicted_idx, predictions)
+        ]
 
 class ModelFusion:
     """Combine predictions from different models with weighted confidence"""
@@ -259,16 +330,19 @@ class EnsembleEmailClassifier:
         distilbert_model: Optional[DynamicEmailClassifier] = None,
         feature_model_type: str = 'xgboost',
         distilbert_weight: float = 0.6,
-        feature_weight: float = 0.4
+        feature_weight: float = 0.4,
+        feature_store: Optional[FeatureStore] = None,
+        feature_model_params: Optional[Dict[str, Any]] = None
     ):
         self.distilbert_weight = distilbert_weight
         self.feature_weight = feature_weight
         
         # Initialize components
         self.distilbert_classifier = distilbert_model or DynamicEmailClassifier()
-        self.feature_classifier = FeatureBasedClassifier(feature_model_type)
+        self.feature_classifier = FeatureBasedClassifier(feature_model_type, model_params=feature_model_params)
         self.feature_extractor = EmailFeatureExtractor()
         self.model_fusion = ModelFusion(distilbert_weight, feature_weight)
+        self.feature_store = feature_store
         
         # Performance tracking
         self.prediction_count = 0
@@ -280,35 +354,24 @@ class EnsembleEmailClassifier:
         try:
             logger.info(f"Training feature model with {len(training_data)} samples")
             
-            X = []
-            y = []
-            
-            for sample in training_data:
-                # Extract features
-                features = sample.get('features', {})
-                if not features:
-                    # Extract features from email data
-                    email_data = {
-                        'subject': sample.get('subject', ''),
-                        'body': sample.get('body', ''),
-                        'html': sample.get('html', ''),
-                        'from': sample.get('from', ''),
-                        'to': sample.get('to', ''),
-                        'date': sample.get('date'),
-                        'attachments': sample.get('attachments', [])
-                    }
-                    features = self.feature_extractor.extract_features(email_data)
-                
-                # Prepare feature vector
-                feature_vector = self.feature_classifier.prepare_features(features)
-                X.append(feature_vector.flatten())
-                
-                # Get label
-                label = sample.get('trueLabel') or sample.get('label', 'Other')
-                y.append(label)
-            
-            X = np.array(X)
-            y = np.array(y)
+            if self.feature_store is not None:
+                # Only new or changed emails are extracted; the rest come from the store
+                X = self.feature_store.extract_or_load(training_data, self.feature_extractor)
+            else:
+                X = []
+                for sample in training_data:
+                    # Extract features
+                    features = sample.get('features', {})
+                    if not features:
+                        features = self.feature_extractor.extract_features(build_email_data(sample))
+                    
+                    # Prepare feature vector
+                    feature_vector = self.feature_classifier.prepare_features(features)
+                    X.append(feature_vector.flatten())
+                X = np.array(X)
+            
+            # Get labels
+            y = np.array([sample.get('trueLabel') or sample.get('label', 'Other') for sample in training_data])
             
             # Train the model
             self.feature_classifier.train(X, y)
@@ -319,7 +382,13 @@ class EnsembleEmailClassifier:
             logger.error(f"Error training feature-based classifier: {e}")
             raise
     
-    def predict_single(self, subject: str, body: str, email_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    def predict_single(
+        self,
+        subject: str,
+        body: str,
+        email_data: Optional[Dict[str, Any]] = None,
+        email_id: Optional[str] = None
+    ) -> Dict[str, Any]:
         """Predict category for single email using ensemble approach"""
         try:
             start_time = datetime.now()
@@ -336,19 +405,33 @@ class EnsembleEmailClassifier:
                     'attachments': []
                 }
             
-            # Extract comprehensive features
-            features = self.feature_extractor.extract_features(email_data)
+            # Reuse stored features for known, unchanged emails
+            features = None
+            feature_vector = None
+            if self.feature_store is not None and email_id:
+                digest = content_hash(email_data)
+                feature_vector = self.feature_store.lookup(email_id, digest)
+                if feature_vector is None:
+                    features = self.feature_extractor.extract_features(email_data)
+                    feature_vector = features_to_vector(features)
+                    self.feature_store.add(email_id, digest, feature_vector)
+            else:
+                # Extract comprehensive features
+                features = self.feature_extractor.extract_features(email_data)
             
             # Get DistilBERT prediction
             distilbert_result = self.distilbert_classifier.predict_single(subject, body)
             
             # Get feature-based prediction
-            feature_result = self.feature_classifier.predict(features)
+            if feature_vector is not None:
+                feature_result = self.feature_classifier.predict_vector(feature_vector.reshape(1, -1))
+            else:
+                feature_result = self.feature_classifier.predict(features)
             
             # Fuse predictions
             ensemble_result = self.model_fusion.fuse_predictions(distilbert_result, feature_result)
             
-            # Add feature extraction metadata
+            # Add feature extraction metadata (None when served from the feature store)
             ensemble_result['features'] = features
             ensemble_result['extractionTime'] = (datetime.now() - start_time).total_seconds()
             
@@ -373,18 +456,9 @@ class EnsembleEmailClassifier:
                 body = email.get('body', '')
                 
                 # Extract additional email data for feature extraction
-                email_data = {
-                    'subject': subject,
-                    'body': body,
-                    'html': email.get('html', ''),
-                    'from': email.get('from', ''),
-                    'to': email.get('to', ''),
-                    'date': email.get('date'),
-                    'attachments': email.get('attachments', []),
-                    'headers': email.get('headers', {})
-                }
+                email_data = build_email_data(email)
                 
-                result = self.predict_single(subject, body, email_data)
+                result = self.predict_single(subject, body, email_data, sample_email_id(email))
                 results.append(result)
             
             return results
@@ -394,6 +468,24 @@ class EnsembleEmailClassifier:
             # Fallback to DistilBERT batch prediction
             return self.distilbert_classifier.predict_batch(emails)
     
+    def predict_batch_with_features(self, emails: List[Dict[str, Any]], X: np.ndarray) -> List[Dict[str, Any]]:
+        """
+        Ensemble predictions for emails whose feature matrix is already known
+        
+        Args:
+            emails: Emails with subject and body (row i of X belongs to emails[i])
+            X: Prepared feature matrix, e.g. from the feature store or a training run
+        """
+        distilbert_results = self.distilbert_classifier.predict_batch(emails)
+        feature_results = self.feature_classifier.predict_matrix(X)
+        
+        results = []
+        for distilbert_result, feature_result in zip(distilbert_results, feature_results):
+            results.append(self.model_fusion.fuse_predictions(distilbert_result, feature_result))
+        
+        self.prediction_count += len(results)
+        return results
+    
     def get_categories(self) -> Dict[str, Any]:
         """Get all available categories"""
         return self.distilbert_classifier.get_categories()
@@ -413,7 +505,9 @@ class EnsembleEmailClassifier:
             'prediction_count': self.prediction_count,
             'avg_prediction_time': (
                 self.prediction_time / max(self.prediction_count, 1)
-            )
+            ),
+            'domain_lookup_stats': self.feature_extractor.domain_intel.get_stats(),
+            'feature_store': self.feature_store.get_stats() if self.feature_store is not None else None
         }
         
         return ensemble_info
@@ -441,6 +535,7 @@ class EnsembleEmailClassifier:
                 'distilbert_weight': self.distilbert_weight,
                 'feature_weight': self.feature_weight,
                 'feature_model_type': self.feature_classifier.model_type,
+                'feature_model_params': self.feature_classifier.model_params,
                 'save_timestamp': datetime.now().isoformat()
             }
             
@@ -465,6 +560,7 @@ class EnsembleEmailClassifier:
                 self.feature_classifier.label_encoder = model_data['label_encoder']
                 self.feature_classifier.feature_names = model_data['feature_names']
                 self.feature_classifier.is_trained = model_data['is_trained']
+                self.feature_classifier.compile_fast_path()
                 
                 logger.info("Feature-based model loaded successfully")
             
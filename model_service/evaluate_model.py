@@ -14,56 +14,35 @@ import numpy as np
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from distilbert_trainer import DistilBERTTrainer
+from distilbert_trainer import DistilBERTTrainer, TOKENIZED_CACHE_DIR, predict_tokenized
 import torch
 
 
 class ModelEvaluator:
     """Evaluate trained DistilBERT model"""
     
-    def __init__(self, model_path: str):
+    def __init__(self, model_path: str, cache_dir: str = TOKENIZED_CACHE_DIR, batch_size: int = 32):
         self.model_path = model_path
-        self.trainer = DistilBERTTrainer(output_dir=model_path)
+        self.batch_size = batch_size
+        self.trainer = DistilBERTTrainer(output_dir=model_path, cache_dir=cache_dir)
         self.trainer.load_trained_model(model_path)
         
         print(f"✓ Model loaded from {model_path}")
     
-    def predict_batch(self, texts: List[str]) -> tuple:
+    def predict_batch(self, texts: List[str], labels: List[int] = None) -> tuple:
         """Predict labels for a batch of texts"""
-        predictions = []
-        confidences = []
-        
+        # Tokenized once and cached with the same key scheme as training
+        dataset = self.trainer.tokenize_dataset(texts, labels)
+        return self.predict_dataset(dataset)
+    
+    def predict_dataset(self, dataset) -> tuple:
+        """Predict labels for a tokenized dataset, in dataset order"""
         device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.trainer.model.to(device)
-        self.trainer.model.eval()
-        
-        with torch.no_grad():
-            for text in texts:
-                # Tokenize
-                inputs = self.trainer.tokenizer(
-                    text,
-                    truncation=True,
-                    padding='max_length',
-                    max_length=self.trainer.max_length,
-                    return_tensors='pt'
-                )
-                
-                # Move to device
-                inputs = {k: v.to(device) for k, v in inputs.items()}
-                
-                # Predict
-                outputs = self.trainer.model(**inputs)
-                logits = outputs.logits
-                
-                # Get prediction and confidence
-                probs = torch.softmax(logits, dim=-1)
-                pred_id = torch.argmax(probs, dim=-1).item()
-                confidence = probs[0][pred_id].item()
-                
-                predictions.append(pred_id)
-                confidences.append(confidence)
-        
-        return predictions, confidences
+        predictions, confidences = predict_tokenized(
+            self.trainer.model, self.trainer.tokenizer, dataset, self.batch_size
+        )
+        return predictions.tolist(), confidences.tolist()
     
     def calculate_metrics(self, y_true: List[int], y_pred: List[int]) -> Dict[str, float]:
         """Calculate evaluation metrics"""
@@ -134,7 +113,7 @@ class ModelEvaluator:
         
         # Predict
         print(f"  Running predictions...")
-        predictions, confidences = self.predict_batch(texts)
+        predictions, confidences = self.predict_batch(texts, true_labels)
         
         # Calculate metrics
         print(f"  Calculating metrics...")
@@ -262,6 +241,10 @@ def main():
     parser.add_argument("--output", type=str,
                        default="model_service/evaluation_report.json",
                        help="Output file for evaluation report")
+    parser.add_argument("--cache_dir", type=str, default=TOKENIZED_CACHE_DIR,
+                       help="Tokenized dataset cache directory (shared with training)")
+    parser.add_argument("--batch_size", type=int, default=32,
+                       help="Inference batch size")
     
     args = parser.parse_args()
     
@@ -291,7 +274,7 @@ def main():
         print("LOADING MODEL")
         print("-"*70)
         
-        evaluator = ModelEvaluator(args.model_path)
+        evaluator = ModelEvaluator(args.model_path, cache_dir=args.cache_dir, batch_size=args.batch_size)
         
         # Evaluate
         print("\n" + "-"*70)
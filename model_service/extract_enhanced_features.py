@@ -2,18 +2,73 @@
 """
 Enhanced Feature Extraction for Email Classification
 Extracts comprehensive features including sender, subject, body, and metadata
+
+The emails collection is range-partitioned by _id across worker processes; each worker
+streams its range through its own cursor and writes a typed Parquet (or Arrow) part file.
+A manifest next to the parts records per-part stats and the highest _id extracted, so a
+rerun only extracts emails added since (use --full to rebuild).
 """
 
 import os
 import sys
 import json
 import re
+import time
+import uuid
+import argparse
 from datetime import datetime
+from multiprocessing import Pool
 from pymongo import MongoClient
-from bson import ObjectId
-import pandas as pd
+from bson import ObjectId, json_util
+import pyarrow as pa
+import pyarrow.parquet as pq
 from collections import Counter
 
+from domain_intelligence import get_domain_intelligence
+
+# Rows buffered per worker before a row group is written
+CHUNK_ROWS = 5000
+
+MANIFEST_FILE = '_manifest.json'
+PART_EXTENSIONS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+# Only the fields extract_email_features reads
+FEATURE_PROJECTION = {
+    'userId': 1, 'subject': 1, 'snippet': 1, 'from': 1, 'category': 1,
+    'fullBody': 1, 'text': 1, 'attachments': 1, 'date': 1
+}
+
+# Compiled once per process
+SENDER_NAME_RE = re.compile(r'^([^<]+)<')
+PROFESSOR_PATTERNS = [
+    re.compile(r'\(([^)]*(?:Assistant Professor|Associate Professor|Professor|Faculty|Dr\.).*?)\)', re.IGNORECASE),
+    re.compile(r'(Assistant Professor|Associate Professor|Professor|Dr\.)\s+', re.IGNORECASE),
+    re.compile(r'\b(Dr\.)\s+([A-Z][a-z]+\s+[A-Z][a-z]+)', re.IGNORECASE)
+]
+
+INDICATOR_KEYWORDS = {
+    'has_placement': ['placement', 'recruitment', 'interview', 'shortlisted', 'pre-placement'],
+    'has_nptel': ['nptel', 'star badges', 'iit madras', 'scmpro'],
+    'has_hod': ['hod', 'head of department', 'hod office', 'respected hod'],
+    'has_ezone': ['e-zone', 'ezone', 'one time password', 'sharda e-zone'],
+    'has_promotions': ["'promotions' via", 'shardacare', 'healthcity', 'free screening'],
+    'has_whats_happening': ["'what's happening' via", 'nss cell', 'my bharat portal'],
+    'has_professor': ['assistant professor', 'associate professor', 'evaluation', 'project eval']
+}
+
+# Column types of the part files
+FEATURE_SCHEMA = pa.schema(
+    [(name, pa.string()) for name in [
+        'email_id', 'user_id', 'subject', 'snippet', 'from_raw', 'category', 'body',
+        'sender_domain', 'sender_name', 'professor_title'
+    ]]
+    + [(name, pa.bool_()) for name in INDICATOR_KEYWORDS]
+    + [('has_attachment', pa.bool_())]
+    + [(name, pa.int32()) for name in [
+        'attachment_count', 'hour_of_day', 'day_of_week', 'subject_length', 'body_length', 'total_length'
+    ]]
+)
+
 # Load configuration
 def load_config():
     """Load MongoDB configuration"""
@@ -36,13 +91,8 @@ def extract_sender_domain(from_email):
     if not from_email:
         return ''
     
-    # Extract email from "Name <email@domain.com>" format
-    email_match = re.search(r'<(.+?)>', from_email)
-    email = email_match.group(1) if email_match else from_email
-    
-    # Extract domain
-    domain_match = re.search(r'@(.+)$', email)
-    return domain_match.group(1).strip() if domain_match else ''
+    # Handles "Name <email@domain.com>" format; memoized per sender
+    return get_domain_intelligence().extract_domain(from_email)
 
 def extract_sender_name(from_email):
     """Extract sender name from email"""
@@ -50,7 +100,7 @@ def extract_sender_name(from_email):
         return ''
     
     # Extract name from "Name <email@domain.com>" format
-    name_match = re.search(r'^([^<]+)<', from_email)
+    name_match = SENDER_NAME_RE.search(from_email)
     if name_match:
         return name_match.group(1).strip()
     
@@ -63,14 +113,8 @@ def extract_professor_title(from_email):
     if not from_email:
         return ''
     
-    professor_patterns = [
-        r'\(([^)]*(?:Assistant Professor|Associate Professor|Professor|Faculty|Dr\.).*?)\)',
-        r'(Assistant Professor|Associate Professor|Professor|Dr\.)\s+',
-        r'\b(Dr\.)\s+([A-Z][a-z]+\s+[A-Z][a-z]+)'
-    ]
-    
-    for pattern in professor_patterns:
-        match = re.search(pattern, from_email, re.IGNORECASE)
+    for pattern in PROFESSOR_PATTERNS:
+        match = pattern.search(from_email)
         if match:
             return match.group(1).strip()
     
@@ -78,50 +122,14 @@ def extract_professor_title(from_email):
 
 def extract_category_indicators(text):
     """Extract category-specific indicators from text"""
-    indicators = {
-        'has_placement': False,
-        'has_nptel': False,
-        'has_hod': False,
-        'has_ezone': False,
-        'has_promotions': False,
-        'has_whats_happening': False,
-        'has_professor': False
-    }
-    
     if not text:
-        return indicators
+        return {key: False for key in INDICATOR_KEYWORDS}
     
     text_lower = text.lower()
-    
-    # Placement indicators
-    if any(word in text_lower for word in ['placement', 'recruitment', 'interview', 'shortlisted', 'pre-placement']):
-        indicators['has_placement'] = True
-    
-    # NPTEL indicators
-    if any(word in text_lower for word in ['nptel', 'star badges', 'iit madras', 'scmpro']):
-        indicators['has_nptel'] = True
-    
-    # HOD indicators
-    if any(word in text_lower for word in ['hod', 'head of department', 'hod office', 'respected hod']):
-        indicators['has_hod'] = True
-    
-    # E-Zone indicators
-    if any(word in text_lower for word in ['e-zone', 'ezone', 'one time password', 'sharda e-zone']):
-        indicators['has_ezone'] = True
-    
-    # Promotions indicators
-    if any(word in text_lower for word in ["'promotions' via", 'shardacare', 'healthcity', 'free screening']):
-        indicators['has_promotions'] = True
-    
-    # Whats happening indicators
-    if any(word in text_lower for word in ["'what's happening' via", 'nss cell', 'my bharat portal']):
-        indicators['has_whats_happening'] = True
-    
-    # Professor indicators
-    if any(word in text_lower for word in ['assistant professor', 'associate professor', 'evaluation', 'project eval']):
-        indicators['has_professor'] = True
-    
-    return indicators
+    return {
+        key: any(word in text_lower for word in keywords)
+        for key, keywords in INDICATOR_KEYWORDS.items()
+    }
 
 def extract_email_features(email_doc):
     """Extract comprehensive features from an email document"""
@@ -133,7 +141,7 @@ def extract_email_features(email_doc):
     features['subject'] = email_doc.get('subject', '')
     features['snippet'] = email_doc.get('snippet', '')
     features['from_raw'] = email_doc.get('from', '')
-    features['category'] = email_doc.get('category', 'Other')
+    features['category'] = email_doc.get('category') or 'Other'
     
     # Body content (use fullBody if available, otherwise snippet)
     features['body'] = email_doc.get('fullBody') or email_doc.get('text') or email_doc.get('snippet', '')
@@ -178,86 +186,253 @@ def extract_email_features(email_doc):
     
     return features
 
+def features_table(rows):
+    """Typed Arrow table of extracted feature rows"""
+    return pa.Table.from_pylist(rows, schema=FEATURE_SCHEMA)
+
+def partition_bounds(collection, query, workers):
+    """
+    Split the _id range matching `query` into up to `workers` contiguous ranges
+
+    Boundaries are picked by skipping along the _id index, so each range holds about
+    the same number of emails. Returns [(lower, upper)] with lower inclusive, upper
+    exclusive and None for open ends.
+    """
+    total = collection.count_documents(query)
+    if total == 0:
+        return []
+    workers = max(1, min(workers, total))
+
+    bounds = [None]
+    for i in range(1, workers):
+        doc = next(collection.find(query, {'_id': 1}).sort('_id', 1).skip(i * total // workers).limit(1), None)
+        if doc is not None and doc['_id'] != bounds[-1]:
+            bounds.append(doc['_id'])
+    bounds.append(None)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def range_query(query, lower, upper):
+    id_range = dict(query.get('_id', {}))
+    if lower is not None:
+        id_range['$gte'] = lower
+    if upper is not None:
+        id_range['$lt'] = upper
+    ranged = dict(query)
+    if id_range:
+        ranged['_id'] = id_range
+    return ranged
+
+def write_part(rows_iter, part_path, output_format):
+    """Write feature rows to a part file in CHUNK_ROWS slices; returns the row count"""
+    tmp_path = f"{part_path}.tmp"
+    rows = 0
+    writer = None
+    try:
+        if output_format == 'parquet':
+            writer = pq.ParquetWriter(tmp_path, FEATURE_SCHEMA, compression='zstd')
+        else:
+            writer = pa.ipc.new_file(tmp_path, FEATURE_SCHEMA, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+        for chunk in rows_iter:
+            table = features_table(chunk)
+            if output_format == 'parquet':
+                writer.write_table(table)
+            else:
+                writer.write(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    os.replace(tmp_path, part_path)
+    return rows
+
+def extract_partition(task):
+    """
+    Worker process: extract one _id range into one part file
+
+    Opens its own MongoDB connection; returns the part's stats for the manifest.
+    """
+    start = time.perf_counter()
+    client = MongoClient(task['mongo_uri'])
+    try:
+        collection = client.get_database()['emails']
+        query = range_query(json_util.loads(task['query']), *json_util.loads(task['bounds']))
+        cursor = collection.find(query, FEATURE_PROJECTION, batch_size=1000).sort('_id', 1)
+
+        categories = Counter()
+        ids = {'min': None, 'max': None}
+
+        def chunks():
+            chunk = []
+            for email_doc in cursor:
+                features = extract_email_features(email_doc)
+                categories[features['category']] += 1
+                if ids['min'] is None:
+                    ids['min'] = email_doc['_id']
+                ids['max'] = email_doc['_id']
+                chunk.append(features)
+                if len(chunk) == CHUNK_ROWS:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+        rows = write_part(chunks(), task['part_path'], task['format'])
+    finally:
+        client.close()
+
+    if rows == 0:
+        os.remove(task['part_path'])
+    return {
+        'file': os.path.basename(task['part_path']),
+        'rows': rows,
+        'min_id': json_util.dumps(ids['min']),
+        'max_id': json_util.dumps(ids['max']),
+        'categories': dict(categories),
+        'seconds': round(time.perf_counter() - start, 2)
+    }
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+def remove_unlisted_parts(output_dir, manifest):
+    """Drop part files of runs that never reached the manifest"""
+    listed = {part['file'] for part in (manifest or {}).get('parts', [])}
+    for name in os.listdir(output_dir):
+        if name.startswith('part-') and name not in listed:
+            os.remove(os.path.join(output_dir, name))
+
 def main():
     """Main function"""
+    parser = argparse.ArgumentParser(description="Extract enhanced features from MongoDB emails")
+    parser.add_argument("--output-dir", type=str, default="enhanced_features",
+                       help="Directory for part files and the manifest")
+    parser.add_argument("--format", type=str, default="parquet", choices=["parquet", "arrow"],
+                       help="Part file format")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                       help="Extraction processes (one _id range each)")
+    parser.add_argument("--full", action="store_true",
+                       help="Re-extract every email instead of only new ones")
+    args = parser.parse_args()
+
     print("═" * 50)
     print("  ENHANCED FEATURE EXTRACTION")
     print("═" * 50)
     print()
-    
+
     # Load config
     config = load_config()
-    
+
     # Connect to MongoDB
     client, db = connect_to_mongodb(config['mongo_uri'])
-    
+
     try:
         # Get emails collection
         emails_collection = db['emails']
-        
+
+        os.makedirs(args.output_dir, exist_ok=True)
+        existing = load_manifest(args.output_dir)
+        remove_unlisted_parts(args.output_dir, existing)
+        manifest = None if args.full else existing
+        if manifest is not None and manifest.get('format') != args.format:
+            print(f"⚠️  Existing parts are {manifest.get('format')}, re-extracting everything as {args.format}")
+            manifest = None
+
+        # Incremental runs only look past the highest _id already extracted
+        query = {'isDeleted': False}
+        if manifest is not None and manifest.get('watermark'):
+            query['_id'] = {'$gt': json_util.loads(manifest['watermark'])}
+            print(f"📂 Incremental run: {manifest['total_samples']} emails already extracted")
+
         # Count total emails
-        total_emails = emails_collection.count_documents({'isDeleted': False})
-        print(f"📊 Total emails found: {total_emails}")
-        
+        total_emails = emails_collection.count_documents(query)
+        print(f"📊 {'New' if manifest else 'Total'} emails found: {total_emails}")
+
         if total_emails == 0:
-            print("⚠️  No emails found in database")
+            print("⚠️  No emails to extract")
             return
-        
-        # Extract features from all emails
-        print(f"\n📥 Extracting features from {total_emails} emails...")
-        
-        features_list = []
-        batch_size = 100
-        processed = 0
-        
-        cursor = emails_collection.find(
-            {'isDeleted': False},
-            batch_size=batch_size
-        )
-        
-        for email_doc in cursor:
-            features = extract_email_features(email_doc)
-            features_list.append(features)
-            
-            processed += 1
-            if processed % 100 == 0:
-                progress = (processed / total_emails) * 100
-                print(f"   Progress: {processed}/{total_emails} ({progress:.1f}%)")
-        
-        print(f"✅ Extracted features from {processed} emails\n")
-        
-        # Convert to DataFrame
-        df = pd.DataFrame(features_list)
-        
-        # Save to CSV
-        output_file = 'enhanced_features.csv'
-        df.to_csv(output_file, index=False)
-        print(f"✅ Saved features to {output_file}")
-        
+
+        # Partition the _id range
+        bounds = partition_bounds(emails_collection, query, args.workers)
+        # Unique per run: two runs in the same second must not overwrite each other's parts
+        run = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        extension = PART_EXTENSIONS[args.format]
+        tasks = [{
+            'mongo_uri': config['mongo_uri'],
+            'query': json_util.dumps(query),
+            'bounds': json_util.dumps(list(b)),
+            'part_path': os.path.join(args.output_dir, f"part-{run}-{i:04d}{extension}"),
+            'format': args.format
+        } for i, b in enumerate(bounds)]
+
+        print(f"\n📥 Extracting features from {total_emails} emails with {len(tasks)} workers...")
+        start = time.perf_counter()
+
+        parts = []
+        with Pool(processes=len(tasks)) as pool:
+            for part in pool.imap_unordered(extract_partition, tasks):
+                parts.append(part)
+                print(f"   {part['file']}: {part['rows']} emails in {part['seconds']}s")
+
+        elapsed = time.perf_counter() - start
+        parts = sorted((p for p in parts if p['rows']), key=lambda p: p['file'])
+        extracted = sum(p['rows'] for p in parts)
+        print(f"✅ Extracted features from {extracted} emails ({extracted / max(elapsed, 1e-9):.0f}/s)\n")
+
+        # Merge into the manifest; it is the list of valid parts
+        if manifest is None:
+            manifest = {'format': args.format, 'parts': [], 'runs': [], 'categories': {}, 'total_samples': 0}
+
+        manifest['parts'].extend(parts)
+        categories = Counter()
+        for category, count in manifest['categories'].items():
+            # Manifests written before null categories became 'Other' have them under "null"
+            categories['Other' if category == 'null' else category] += count
+        for part in parts:
+            categories.update(part['categories'])
+        manifest['categories'] = dict(categories)
+        manifest['total_samples'] += extracted
+        manifest['features'] = FEATURE_SCHEMA.names
+        manifest['schema'] = {field.name: str(field.type) for field in FEATURE_SCHEMA}
+        if parts:
+            manifest['watermark'] = max(parts, key=lambda p: json_util.loads(p['max_id']))['max_id']
+        manifest['runs'].append({
+            'run': run,
+            'extracted_at': datetime.now().isoformat(),
+            'workers': len(tasks),
+            'rows': extracted,
+            'seconds': round(elapsed, 2)
+        })
+        save_manifest(args.output_dir, manifest)
+
+        # A full rebuild replaces the previous parts only once the new manifest is in place
+        if manifest is not existing:
+            remove_unlisted_parts(args.output_dir, manifest)
+
         # Print statistics
-        print(f"\n📊 Feature Statistics:")
-        print(f"   Total samples: {len(df)}")
-        print(f"   Total features: {len(df.columns)}")
+        total = manifest['total_samples']
+        print(f"📊 Feature Statistics:")
+        print(f"   Total samples: {total}")
+        print(f"   Total features: {len(manifest['features'])}")
         print(f"\n   Category distribution:")
-        category_counts = df['category'].value_counts()
-        for category, count in category_counts.items():
-            percentage = (count / len(df)) * 100
+        for category, count in categories.most_common():
+            percentage = (count / total) * 100
             print(f"     {category}: {count} ({percentage:.1f}%)")
-        
-        # Save category distribution
-        category_stats = {
-            'total_samples': len(df),
-            'categories': category_counts.to_dict(),
-            'features': list(df.columns)
-        }
-        
-        with open('enhanced_features_stats.json', 'w') as f:
-            json.dump(category_stats, f, indent=2)
-        
+
         print(f"\n✅ Feature extraction complete!")
-        print(f"   Output: {output_file}")
-        print(f"   Stats: enhanced_features_stats.json\n")
-        
+        print(f"   Output: {args.output_dir}/ ({len(manifest['parts'])} parts)")
+        print(f"   Stats: {os.path.join(args.output_dir, MANIFEST_FILE)}\n")
+
     except Exception as e:
         print(f"\n❌ Error during feature extraction: {e}")
         import traceback
@@ -268,4 +443,3 @@ def main():
 
 if __name__ == '__main__':
     main()
-
@@ -23,12 +23,21 @@ except ImportError:
     from pymongo import MongoClient
     from dotenv import load_dotenv
 
+from domain_intelligence import get_domain_intelligence
+
 # Load environment variables
 load_dotenv()
 
 # MongoDB connection
 MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/sortify')
 
+# Analytics mode: category and sender domain as computed by the server
+CATEGORY_EXPR = {'$ifNull': ['$classification.label', {'$ifNull': ['$category', 'Other']}]}
+DOMAIN_REGEX = r'@([A-Za-z0-9.-]+)'
+
+# Subject keywords are counted client-side from a cursor of this many emails per batch
+KEYWORD_BATCH_SIZE = 1000
+
 class EmailDataExtractor:
     """Extract and analyze emails from MongoDB"""
     
@@ -91,6 +100,7 @@ class EmailDataExtractor:
         sender_domains = defaultdict(int)
         sender_emails = defaultdict(int)
         category_senders = defaultdict(lambda: defaultdict(int))
+        domain_intel = get_domain_intelligence()
         
         for email in emails:
             # Get category
@@ -102,9 +112,8 @@ class EmailDataExtractor:
                 continue
             
             # Extract domain
-            domain_match = re.search(r'@([\w\.-]+)', sender)
-            if domain_match:
-                domain = domain_match.group(1)
+            domain = domain_intel.extract_domain(sender)
+            if domain:
                 sender_domains[domain] += 1
                 category_senders[category][domain] += 1
             
@@ -118,6 +127,8 @@ class EmailDataExtractor:
                 sorted(senders.items(), key=lambda x: x[1], reverse=True)[:10]
             )
         
+        print(f"  Domain lookup cache: {domain_intel.get_stats()['address']}")
+        
         return {
             'top_domains': dict(sorted(sender_domains.items(), 
                                      key=lambda x: x[1], 
@@ -257,6 +268,168 @@ class EmailDataExtractor:
         
         return report
     
+    def aggregate_analytics(self, query: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Category distribution, sender domains, temporal histograms and statistics in one
+        aggregation ($facet), computed inside the database
+        
+        Only per-group counts come back over the network, never the emails themselves.
+        """
+        text = {'$cond': [{'$eq': [{'$type': '$text'}, 'string']}, '$text',
+                          {'$cond': [{'$eq': [{'$type': '$body'}, 'string']}, '$body', '']}]}
+        date = {'$convert': {'input': '$date', 'to': 'date', 'onError': None, 'onNull': None}}
+        domain = {'$regexFind': {'input': {'$ifNull': ['$from', '']}, 'regex': DOMAIN_REGEX}}
+        
+        pipeline = [
+            {'$match': query},
+            {'$project': {
+                '_id': 0,
+                'category': CATEGORY_EXPR,
+                'from': {'$ifNull': ['$from', '']},
+                'domain': {'$let': {
+                    'vars': {'found': domain},
+                    'in': {'$toLower': {'$ifNull': [{'$arrayElemAt': ['$$found.captures', 0]}, '']}}
+                }},
+                'has_subject': {'$gt': [{'$strLenCP': {'$cond': [{'$eq': [{'$type': '$subject'}, 'string']}, '$subject', '']}}, 0]},
+                'body_length': {'$strLenCP': text},
+                'has_attachments': {'$gt': [{'$size': {'$cond': [{'$isArray': '$attachments'}, '$attachments', []]}}, 0]},
+                'parts': {'$dateToParts': {'date': date, 'iso8601': True}}
+            }},
+            {'$facet': {
+                'categories': [
+                    {'$group': {'_id': '$category', 'count': {'$sum': 1},
+                                'with_subject': {'$sum': {'$cond': ['$has_subject', 1, 0]}}}},
+                    {'$sort': {'count': -1}}
+                ],
+                'domains': [
+                    {'$match': {'domain': {'$ne': ''}}},
+                    {'$group': {'_id': '$domain', 'count': {'$sum': 1}}},
+                    {'$sort': {'count': -1}},
+                    {'$limit': 20}
+                ],
+                'senders': [
+                    {'$match': {'from': {'$ne': ''}}},
+                    {'$group': {'_id': '$from', 'count': {'$sum': 1}}},
+                    {'$sort': {'count': -1}},
+                    {'$limit': 20}
+                ],
+                'category_domains': [
+                    {'$match': {'domain': {'$ne': ''}}},
+                    {'$group': {'_id': {'category': '$category', 'domain': '$domain'}, 'count': {'$sum': 1}}},
+                    {'$sort': {'count': -1}},
+                    {'$group': {'_id': '$_id.category', 'domains': {'$push': {'domain': '$_id.domain', 'count': '$count'}}}},
+                    {'$project': {'domains': {'$slice': ['$domains', 10]}}}
+                ],
+                'hours': [
+                    {'$match': {'parts': {'$ne': None}}},
+                    {'$group': {'_id': {'category': '$category', 'hour': '$parts.hour'}, 'count': {'$sum': 1}}}
+                ],
+                'days': [
+                    {'$match': {'parts': {'$ne': None}}},
+                    {'$group': {'_id': {'category': '$category', 'day': '$parts.isoDayOfWeek'}, 'count': {'$sum': 1}}}
+                ],
+                'statistics': [
+                    {'$group': {
+                        '_id': None,
+                        'total': {'$sum': 1},
+                        'emails_with_body': {'$sum': {'$cond': [{'$gt': ['$body_length', 0]}, 1, 0]}},
+                        'emails_with_subject': {'$sum': {'$cond': ['$has_subject', 1, 0]}},
+                        'emails_with_attachments': {'$sum': {'$cond': ['$has_attachments', 1, 0]}},
+                        'body_length': {'$sum': '$body_length'}
+                    }}
+                ]
+            }}
+        ]
+        return next(self.emails_collection.aggregate(pipeline, allowDiskUse=True))
+    
+    def stream_subject_keywords(self, query: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+        """Top subject keywords per category from a projected cursor; memory grows with the vocabulary only"""
+        category_keywords = defaultdict(Counter)
+        word_re = re.compile(r'\b\w+\b')
+        
+        cursor = self.emails_collection.find(
+            query, {'_id': 0, 'subject': 1, 'category': 1, 'classification.label': 1}
+        ).batch_size(KEYWORD_BATCH_SIZE)
+        try:
+            for email in cursor:
+                subject = email.get('subject', '')
+                if not subject:
+                    continue
+                category = email.get('classification', {}).get('label') or email.get('category', 'Other')
+                category_keywords[category].update(
+                    word for word in word_re.findall(subject.lower()) if len(word) > 3
+                )
+        finally:
+            cursor.close()
+        
+        return {category: dict(keywords.most_common(20)) for category, keywords in category_keywords.items()}
+    
+    def generate_aggregation_report(self, output_file: str = 'extraction_report.json') -> Dict[str, Any]:
+        """Analysis report of generate_analysis_report, computed with aggregation pipelines"""
+        print("\n" + "="*60)
+        print("GENERATING ANALYSIS REPORT (AGGREGATION)")
+        print("="*60)
+        
+        query = {'isDeleted': {'$ne': True}}
+        
+        print("\nAggregating distribution, senders and temporal patterns...")
+        facets = self.aggregate_analytics(query)
+        
+        category_distribution = {doc['_id']: doc['count'] for doc in facets['categories']}
+        print("\nCategory Distribution:")
+        total = sum(category_distribution.values())
+        for category, count in category_distribution.items():
+            percentage = (count / total) * 100
+            print(f"  {category:20s}: {count:5d} ({percentage:5.1f}%)")
+        
+        hour_distribution = defaultdict(dict)
+        for doc in facets['hours']:
+            hour_distribution[doc['_id']['category']][doc['_id']['hour']] = doc['count']
+        day_distribution = defaultdict(dict)
+        for doc in facets['days']:
+            # isoDayOfWeek is 1=Monday..7=Sunday; the report uses weekday() numbering
+            day_distribution[doc['_id']['category']][doc['_id']['day'] - 1] = doc['count']
+        
+        print("\nStreaming subject keywords...")
+        top_keywords_per_category = self.stream_subject_keywords(query)
+        
+        stats = facets['statistics'][0] if facets['statistics'] else {}
+        report = {
+            'extraction_date': datetime.now().isoformat(),
+            'total_emails': total,
+            'category_distribution': category_distribution,
+            'sender_patterns': {
+                'top_domains': {doc['_id']: doc['count'] for doc in facets['domains']},
+                'top_senders': {doc['_id']: doc['count'] for doc in facets['senders']},
+                'category_senders': {
+                    doc['_id']: {entry['domain']: entry['count'] for entry in doc['domains']}
+                    for doc in facets['category_domains']
+                }
+            },
+            'subject_patterns': {
+                'category_subject_counts': {doc['_id']: doc['with_subject'] for doc in facets['categories'] if doc['with_subject']},
+                'top_keywords_per_category': top_keywords_per_category
+            },
+            'temporal_patterns': {
+                'hour_distribution': {cat: dict(sorted(hours.items())) for cat, hours in hour_distribution.items()},
+                'day_distribution': {cat: dict(sorted(days.items())) for cat, days in day_distribution.items()}
+            },
+            'statistics': {
+                'emails_with_body': stats.get('emails_with_body', 0),
+                'emails_with_subject': stats.get('emails_with_subject', 0),
+                'emails_with_attachments': stats.get('emails_with_attachments', 0),
+                'average_body_length': stats['body_length'] / stats['total'] if stats.get('total') else 0
+            }
+        }
+        
+        # Save report
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        
+        print(f"\n✓ Analysis report saved to {output_file}")
+        
+        return report
+    
     def close(self):
         """Close MongoDB connection"""
         self.client.close()
@@ -264,6 +437,13 @@ class EmailDataExtractor:
 
 def main():
     """Main extraction function"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Extract emails for DistilBERT training")
+    parser.add_argument("--analytics", action="store_true",
+                       help="Only build the analysis report, with aggregation pipelines inside MongoDB")
+    args = parser.parse_args()
+    
     print("="*60)
     print("EMAIL DATA EXTRACTION FOR DISTILBERT TRAINING")
     print("="*60)
@@ -272,6 +452,12 @@ def main():
     extractor = EmailDataExtractor()
     
     try:
+        if args.analytics:
+            report = extractor.generate_aggregation_report('model_service/extraction_report.json')
+            print(f"\n✓ Total emails analysed: {report['total_emails']}")
+            print(f"✓ Categories found: {len(report['category_distribution'])}")
+            return
+        
         # Extract emails
         emails = extractor.extract_emails()
         
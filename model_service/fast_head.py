@@ -0,0 +1,335 @@
+"""
+Fast Head Training for Dynamic Categories
+Fits a lightweight classifier over frozen DistilBERT embeddings of per-category sample emails
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import joblib
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, f1_score, precision_recall_fscore_support
+from sklearn.neural_network import MLPClassifier
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Where the sample bank and the installed head are persisted
+FAST_HEAD_DIR = os.getenv('FAST_HEAD_DIR', 'fast_head')
+
+# Newest samples kept per category
+MAX_SAMPLES_PER_CATEGORY = int(os.getenv('FAST_HEAD_MAX_SAMPLES', '500'))
+
+HEAD_TYPES = ('logistic', 'mlp')
+
+
+def sample_digest(subject: str, body: str) -> str:
+    """Digest of a sample email's text, used for dedup and the embedding cache"""
+    return hashlib.sha1(f"{subject}\x00{body}".encode('utf-8')).hexdigest()
+
+
+class CategorySampleBank:
+    """Labeled sample emails per category, accumulated across training calls"""
+
+    def __init__(self, path: str, max_per_category: int = MAX_SAMPLES_PER_CATEGORY):
+        self.path = Path(path)
+        self.max_per_category = max_per_category
+        self.samples: Dict[str, List[Dict[str, str]]] = {}
+        self.lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        if self.path.exists():
+            try:
+                with open(self.path, 'r') as f:
+                    self.samples = json.load(f)
+            except Exception as e:
+                logger.error(f"Error loading sample bank: {e}")
+                self.samples = {}
+
+    def save(self):
+        with self.lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix('.json.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(self.samples, f)
+            os.replace(tmp_path, self.path)
+
+    def add(self, category: str, emails: List[Dict[str, str]]) -> int:
+        """Add samples to a category; an email already filed under any category moves to this one"""
+        with self.lock:
+            incoming = {}
+            for email in emails:
+                subject = email.get('subject', '') or ''
+                body = email.get('body', '') or ''
+                if not (subject or body):
+                    continue
+                digest = sample_digest(subject, body)
+                incoming[digest] = {'subject': subject, 'body': body, 'digest': digest}
+
+            for name in list(self.samples):
+                self.samples[name] = [s for s in self.samples[name] if s['digest'] not in incoming]
+
+            kept = self.samples.get(category, []) + list(incoming.values())
+            self.samples[category] = kept[-self.max_per_category:]
+            return len(incoming)
+
+    def remove_category(self, category: str) -> bool:
+        with self.lock:
+            return self.samples.pop(category, None) is not None
+
+    def get_samples(self, categories: List[str]) -> List[Tuple[str, Dict[str, str]]]:
+        """(category, sample) pairs for the given categories"""
+        with self.lock:
+            return [(name, sample) for name in categories for sample in self.samples.get(name, [])]
+
+    def counts(self) -> Dict[str, int]:
+        with self.lock:
+            return {name: len(samples) for name, samples in self.samples.items()}
+
+
+class FastHead:
+    """Fitted head mapping encoder [CLS] embeddings to category scores"""
+
+    def __init__(self, classes: List[str], estimator, encoder_id: str, head_type: str,
+                 metrics: Optional[Dict[str, Any]] = None):
+        self.classes = list(classes)
+        self.estimator = estimator
+        self.encoder_id = encoder_id
+        self.head_type = head_type
+        self.metrics = metrics or {}
+        self.trained_at = datetime.now().isoformat()
+
+    def predict_proba(self, embeddings: np.ndarray) -> np.ndarray:
+        return self.estimator.predict_proba(embeddings)
+
+    def scores(self, embeddings: np.ndarray) -> List[Dict[str, float]]:
+        probabilities = self.predict_proba(embeddings)
+        return [dict(zip(self.classes, map(float, row))) for row in probabilities]
+
+    def get_info(self) -> Dict[str, Any]:
+        return {
+            'head_type': self.head_type,
+            'classes': self.classes,
+            'encoder_id': self.encoder_id,
+            'trained_at': self.trained_at,
+            'metrics': self.metrics
+        }
+
+    def save(self, path: str):
+        """Write atomically so a crash never leaves a partial head behind"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        joblib.dump(self, tmp_path)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path: str) -> Optional['FastHead']:
+        if not os.path.exists(path):
+            return None
+        return joblib.load(path)
+
+
+class FastHeadTrainer:
+    """
+    Fast training mode for category owners
+
+    Every sample email is encoded once by the frozen encoder (embeddings are cached by
+    text digest), then only a small head is fitted over all categories' samples.
+    Metrics come from a per-category held-out split; the installed head is refit on
+    all samples.
+    """
+
+    def __init__(self, classifier, head_dir: str = FAST_HEAD_DIR, holdout: float = 0.2,
+                 random_state: int = 42):
+        self.classifier = classifier
+        self.head_dir = Path(head_dir)
+        self.head_path = self.head_dir / 'head.joblib'
+        self.holdout = holdout
+        self.random_state = random_state
+        self.sample_bank = CategorySampleBank(str(self.head_dir / 'samples.json'))
+        self.embedding_cache: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._cache_encoder_id = None
+        self._train_lock = threading.Lock()
+
+    def restore(self) -> bool:
+        """Reinstall the persisted head if it was fitted on the current encoder"""
+        try:
+            head = FastHead.load(str(self.head_path))
+        except Exception as e:
+            logger.error(f"Error loading fast head: {e}")
+            return False
+
+        if head is None:
+            return False
+        if head.encoder_id != self.classifier.encoder_id:
+            logger.info("Persisted fast head was fitted on a different encoder; not restoring")
+            return False
+
+        self.classifier.install_fast_head(head)
+        return True
+
+    def _category_prototype(self, name: str, data: Dict[str, Any]) -> Optional[Dict[str, str]]:
+        """Description and keywords as a pseudo-sample, so categories without samples stay in the head"""
+        text = f"{data.get('description', '')} {' '.join(data.get('keywords', []))}".strip()
+        if not text:
+            return None
+        return {'subject': name, 'body': text, 'digest': sample_digest(name, text)}
+
+    def encode(self, samples: List[Dict[str, str]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Embeddings and current-model probabilities, encoding only texts not seen before"""
+        encoder_id = self.classifier.encoder_id
+        if encoder_id != self._cache_encoder_id:
+            self.embedding_cache.clear()
+            self._cache_encoder_id = encoder_id
+
+        missing = [s for s in samples if s['digest'] not in self.embedding_cache]
+        if missing:
+            texts = [self.classifier.preprocess_text(s['subject'], s['body']) for s in missing]
+            embeddings, probabilities = self.classifier.encode_texts(texts)
+            for sample, embedding, probs in zip(missing, embeddings, probabilities):
+                self.embedding_cache[sample['digest']] = (embedding, probs)
+
+        cached = [self.embedding_cache[s['digest']] for s in samples]
+        return np.stack([c[0] for c in cached]), np.stack([c[1] for c in cached])
+
+    def _holdout_split(self, labels: np.ndarray, is_prototype: np.ndarray) -> np.ndarray:
+        """Boolean held-out mask: a share of each category's real samples, when it has at least two"""
+        rng = np.random.default_rng(self.random_state)
+        mask = np.zeros(len(labels), dtype=bool)
+        for label in np.unique(labels):
+            idx = np.flatnonzero((labels == label) & ~is_prototype)
+            if len(idx) < 2:
+                continue
+            n_holdout = max(1, int(round(len(idx) * self.holdout)))
+            mask[rng.choice(idx, size=n_holdout, replace=False)] = True
+        return mask
+
+    def _build_estimator(self, head_type: str):
+        if head_type == 'mlp':
+            classifier = MLPClassifier(hidden_layer_sizes=(256,), alpha=1e-3, max_iter=300,
+                                       random_state=self.random_state)
+        else:
+            classifier = LogisticRegression(C=1.0, max_iter=1000, class_weight='balanced')
+        return make_pipeline(StandardScaler(), classifier)
+
+    def _evaluate(self, category_name: str, estimator, X: np.ndarray, y: np.ndarray,
+                  baseline_scores: List[Dict[str, float]]) -> Dict[str, Any]:
+        """Held-out metrics of the new head against what is serving now"""
+        head_probabilities = estimator.predict_proba(X)
+        head_classes = list(estimator.classes_)
+        y_pred = np.array([head_classes[i] for i in np.argmax(head_probabilities, axis=1)])
+        y_base = np.array([max(scores.items(), key=lambda x: x[1])[0] for scores in baseline_scores])
+
+        precision, recall, f1, _ = precision_recall_fscore_support(
+            y, y_pred, labels=[category_name], average=None, zero_division=0
+        )
+
+        # Mean probability given to the true category, on this category's held-out samples
+        target = y == category_name
+        head_confidence = baseline_confidence = None
+        if target.any() and category_name in head_classes:
+            head_confidence = float(head_probabilities[target, head_classes.index(category_name)].mean())
+            baseline_confidence = float(np.mean([
+                baseline_scores[i].get(category_name, 0.0) for i in np.flatnonzero(target)
+            ]))
+
+        return {
+            'holdout_samples': int(len(y)),
+            'accuracy': float(accuracy_score(y, y_pred)),
+            'macro_f1': float(f1_score(y, y_pred, labels=np.unique(y), average='macro', zero_division=0)),
+            'baseline_accuracy': float(accuracy_score(y, y_base)),
+            'category_holdout_samples': int(target.sum()),
+            'category_precision': float(precision[0]),
+            'category_recall': float(recall[0]),
+            'category_f1': float(f1[0]),
+            'category_confidence': head_confidence,
+            'baseline_category_confidence': baseline_confidence
+        }
+
+    def train(self, category_name: str, sample_emails: List[Dict[str, str]],
+              head_type: str = 'logistic') -> Dict[str, Any]:
+        """Add samples for a category, fit a head over all categories and install it"""
+        if head_type not in HEAD_TYPES:
+            raise ValueError(f"Unknown head type: {head_type}")
+
+        with self._train_lock:
+            start = time.perf_counter()
+            added = self.sample_bank.add(category_name, sample_emails)
+            self.sample_bank.save()
+
+            categories = self.classifier.get_categories()
+            pairs = self.sample_bank.get_samples(list(categories))
+            labels = [name for name, _ in pairs]
+            samples = [sample for _, sample in pairs]
+            is_prototype = [False] * len(samples)
+            for name, data in categories.items():
+                prototype = self._category_prototype(name, data)
+                if prototype is not None:
+                    labels.append(name)
+                    samples.append(prototype)
+                    is_prototype.append(True)
+
+            y = np.array(labels)
+            classes = sorted(set(labels))
+            if len(classes) < 2:
+                raise ValueError("Fast head training needs samples for at least two categories")
+
+            encode_start = time.perf_counter()
+            X, model_probabilities = self.encode(samples)
+            encode_seconds = time.perf_counter() - encode_start
+
+            # Held-out evaluation
+            holdout_mask = self._holdout_split(y, np.array(is_prototype))
+            fit_start = time.perf_counter()
+            metrics = {}
+            if holdout_mask.any() and len(np.unique(y[~holdout_mask])) >= 2:
+                estimator = self._build_estimator(head_type)
+                estimator.fit(X[~holdout_mask], y[~holdout_mask])
+                baseline_scores = self.classifier.score_outputs(
+                    X[holdout_mask], model_probabilities[holdout_mask], self.classifier.fast_head
+                )
+                metrics = self._evaluate(category_name, estimator, X[holdout_mask], y[holdout_mask],
+                                         baseline_scores)
+            else:
+                logger.warning("Not enough samples for a held-out split; reporting no metrics")
+
+            # Installed head is refit on every sample
+            estimator = self._build_estimator(head_type)
+            estimator.fit(X, y)
+            fit_seconds = time.perf_counter() - fit_start
+
+            head = FastHead(list(estimator.classes_), estimator, self.classifier.encoder_id,
+                            head_type, metrics)
+            head.save(str(self.head_path))
+            self.classifier.install_fast_head(head)
+
+            result = {
+                'training_method': f'fast_head_{head_type}',
+                'samples_added': added,
+                'samples_total': int(len(samples) - sum(is_prototype)),
+                'samples_per_category': {name: int((y == name).sum()) for name in classes},
+                'categories_in_head': len(classes),
+                'encoded_texts': len(self.embedding_cache),
+                'encode_seconds': encode_seconds,
+                'fit_seconds': fit_seconds,
+                'total_seconds': time.perf_counter() - start,
+                'heldout_metrics': metrics
+            }
+            logger.info(
+                f"Fast head for '{category_name}' fitted over {len(classes)} categories in "
+                f"{result['total_seconds']:.2f}s (held-out accuracy: {metrics.get('accuracy', 'n/a')})"
+            )
+            return result
@@ -3,8 +3,11 @@ Enhanced Feature Extractor for Email Classification
 Extracts comprehensive features from email content, metadata, and structure
 """
 
+import os
 import re
 import json
+import zlib
+import numpy as np
 from typing import Dict, List, Any, Optional, Tuple
 from urllib.parse import urlparse
 from email.utils import parseaddr, parsedate
@@ -12,44 +15,245 @@ from datetime import datetime
 import html
 import logging
 from bs4 import BeautifulSoup
-import tldextract
+
+from domain_intelligence import get_domain_intelligence
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Plain-text URLs (used when there is no HTML part)
+URL_PATTERN = re.compile(r'https?://[^\s<>"{}|\\^`\[\]]+', re.IGNORECASE)
+
+# Bump when extraction or normalization changes feature values
+FEATURE_EXTRACTOR_VERSION = '1.1.0'
+
+# Ordered feature vector consumed by the feature-based models
+FEATURE_VECTOR_NAMES = (
+    'subject_length', 'subject_word_count', 'subject_has_urgency', 'subject_caps_ratio',
+    'total_text_length', 'total_word_count', 'body_length', 'body_word_count',
+    'has_html', 'html_length', 'html_to_text_ratio', 'html_image_count',
+    'has_hidden_text', 'business_keyword_count', 'academic_keyword_count', 'job_keyword_count',
+    'link_count', 'has_links', 'external_link_count', 'unique_domain_count', 'short_url_count',
+    'sender_name_length', 'sender_email_length', 'domain_levels', 'is_common_domain',
+    'recipient_count', 'hour_of_day', 'day_of_week', 'is_business_hour', 'is_weekend',
+    'attachment_count', 'has_attachments', 'total_attachment_size', 'avg_attachment_size',
+    'unique_extension_count', 'suspicious_extension_count', 'has_pdf_attachment',
+    'has_image_attachment', 'has_document_attachment', 'subject_exclamation_count',
+    'subject_question_count', 'subject_number_count', 'body_paragraph_count',
+    'avg_paragraph_length', 'html_table_count', 'html_list_count', 'html_form_count',
+    'has_spf', 'has_dkim', 'has_dmarc', 'has_reply_to', 'has_priority_header',
+    # Categorical feature hashes
+    'sender_domain_hash', 'sender_tld_hash'
+)
+
+# Keyword families counted as <family>_keyword_count (substring matches on the lowercased text)
+DEFAULT_KEYWORD_FAMILIES = {
+    # Business/promotional keywords
+    'business': [
+        'invoice', 'payment', 'receipt', 'order', 'purchase', 'billing',
+        'subscription', 'unsubscribe', 'promo', 'sale', 'discount', 'offer'
+    ],
+    # Academic keywords
+    'academic': [
+        'assignment', 'homework', 'course', 'lecture', 'university', 'college',
+        'research', 'paper', 'thesis', 'exam', 'grade', 'professor'
+    ],
+    # Job-related keywords
+    'job': [
+        'job', 'career', 'hiring', 'position', 'interview', 'resume',
+        'application', 'candidate', 'employment', 'salary'
+    ]
+}
+
+# Urgency indicators
+URGENCY_PATTERNS = [
+    r'\b(urgent|asap|immediate|emergency|critical)\b',
+    r'\b(deadline|expires?|limited time)\b',
+    r'!{2,}',  # Multiple exclamation marks
+    r'\bact now\b'
+]
+
+# Optional category_templates.json whose keywords become extra families
+# (category_<name>_keyword_count); the built-in families are never replaced
+KEYWORD_TEMPLATES_FILE = os.getenv('FEATURE_KEYWORD_TEMPLATES')
+
+
+def load_template_keyword_families(templates_file: str) -> Dict[str, List[str]]:
+    """Build keyword families from the keywords and body phrases of each category template"""
+    with open(templates_file, 'r') as f:
+        templates = json.load(f).get('templates', {})
+    
+    families = {}
+    for name, template in templates.items():
+        body_analysis = template.get('classification_strategy', {}).get('bodyAnalysis', {})
+        keywords = list(template.get('keywords', []))
+        keywords += body_analysis.get('keywords', [])
+        keywords += body_analysis.get('phrases', [])
+        family = 'category_' + re.sub(r'\W+', '_', name.lower()).strip('_')
+        families[family] = keywords
+    
+    return families
+
+
+def _trie_pattern(keywords: List[str]) -> str:
+    """Regex alternation with shared prefixes factored out; matches the longest keyword at a position"""
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for ch in keyword:
+            node = node.setdefault(ch, {})
+        node[''] = True
+    
+    def build(node: Dict) -> str:
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        if len(branches) == 1 and '' not in node:
+            return branches[0]
+        group = '(?:' + '|'.join(branches) + ')'
+        return group + '?' if '' in node else group
+    
+    return build(trie)
+
+
+# Keyword sets at least this large are matched with one trie regex; below it,
+# one C-level substring search per distinct keyword is faster than the regex walk
+TRIE_MIN_KEYWORDS = 64
+
+
+class LexicalScanner:
+    """
+    Compiled lexical stage: keyword families are merged into one deduplicated keyword
+    index (a single trie regex for large sets) and the urgency patterns into one alternation
+    """
+    
+    def __init__(self, keyword_families: Dict[str, List[str]], urgency_patterns: List[str] = URGENCY_PATTERNS):
+        self.families = {
+            family: sorted({keyword.lower() for keyword in keywords if keyword})
+            for family, keywords in keyword_families.items()
+        }
+        
+        # keyword -> families it belongs to
+        self.keyword_families: Dict[str, List[str]] = {}
+        for family, keywords in self.families.items():
+            for keyword in keywords:
+                self.keyword_families.setdefault(keyword, []).append(family)
+        
+        keywords = sorted(self.keyword_families)
+        self.keywords = keywords
+        self.keyword_regex = re.compile(_trie_pattern(keywords)) if len(keywords) >= TRIE_MIN_KEYWORDS else None
+        
+        # The scan is non-overlapping and longest-first. A keyword hidden inside or across
+        # the end of a match is implied by (contained) or re-checked for (overlapping) that match.
+        self.contained: Dict[str, List[str]] = {}
+        self.overlapping: Dict[str, List[str]] = {}
+        for keyword in keywords:
+            for other in keywords:
+                if other == keyword:
+                    continue
+                if other in keyword:
+                    self.contained.setdefault(keyword, []).append(other)
+                elif any(keyword.endswith(other[:i]) for i in range(1, len(other))):
+                    self.overlapping.setdefault(keyword, []).append(other)
+        
+        self.urgency_regex = re.compile('|'.join(f'(?:{p})' for p in urgency_patterns), re.IGNORECASE)
+        self.number_regex = re.compile(r'\d+')
+    
+    def find_keywords(self, text_lower: str) -> set:
+        """Distinct keywords occurring in text (same result as `keyword in text` for each keyword)"""
+        if self.keyword_regex is None:
+            return {keyword for keyword in self.keywords if keyword in text_lower}
+        
+        matched = set(self.keyword_regex.findall(text_lower))
+        found = set(matched)
+        for keyword in matched:
+            found.update(self.contained.get(keyword, ()))
+        for keyword in matched:
+            for other in self.overlapping.get(keyword, ()):
+                if other not in found and other in text_lower:
+                    found.add(other)
+        return found
+    
+    def keyword_counts(self, text_lower: str) -> Dict[str, int]:
+        """<family>_keyword_count for every family"""
+        counts = dict.fromkeys(self.families, 0)
+        for keyword in self.find_keywords(text_lower):
+            for family in self.keyword_families[keyword]:
+                counts[family] += 1
+        return {f'{family}_keyword_count': count for family, count in counts.items()}
+    
+    def has_urgency(self, text: str) -> int:
+        """Check for urgency patterns in text"""
+        return 1 if self.urgency_regex.search(text) else 0
+    
+    def scan(self, subject: str, body: str, snippet: str = '') -> Dict[str, Any]:
+        """All text-count features of subject, body and snippet in one go"""
+        features = {}
+        
+        subject_words = len(subject.split())
+        body_words = len(body.split())
+        snippet_words = len(snippet.split()) if snippet else 0
+        full_text = f"{subject} {body} {snippet}".strip()
+        
+        # Subject
+        features['subject_length'] = len(subject)
+        features['subject_word_count'] = subject_words
+        features['subject_has_urgency'] = self.has_urgency(subject)
+        features['subject_caps_ratio'] = sum(map(str.isupper, subject)) / len(subject) if subject else 0.0
+        features['subject_exclamation_count'] = subject.count('!')
+        features['subject_question_count'] = subject.count('?')
+        features['subject_number_count'] = len(self.number_regex.findall(subject))
+        
+        # Whole text; split() never joins tokens across the separating spaces
+        features['total_text_length'] = len(full_text)
+        features['total_word_count'] = subject_words + body_words + snippet_words
+        features['body_length'] = len(body)
+        features['body_word_count'] = body_words
+        
+        # Body structure
+        features['body_paragraph_count'] = len([p for p in body.split('\n\n') if p.strip()])
+        features['avg_paragraph_length'] = len(body) / max(features['body_paragraph_count'], 1)
+        features['body_bold_count'] = body.count('**') + body.count('__')
+        features['body_italic_count'] = body.count('*') + body.count('_')
+        
+        # Keyword families
+        features.update(self.keyword_counts(full_text.lower()))
+        
+        return features
+
+
 class EmailFeatureExtractor:
     """Extract comprehensive features from email content and metadata"""
     
-    def __init__(self):
+    def __init__(
+        self,
+        keyword_families: Optional[Dict[str, List[str]]] = None,
+        templates_file: Optional[str] = KEYWORD_TEMPLATES_FILE
+    ):
+        # Shared, memoized sender-domain parser
+        self.domain_intel = get_domain_intelligence()
+        
         # Common spam/malicious file extensions
         self.suspicious_extensions = ['.exe', '.scr', '.bat', '.cmd', '.com', '.pif', '.zip', '.rar']
         
-        # Business/promotional keywords
-        self.business_keywords = [
-            'invoice', 'payment', 'receipt', 'order', 'purchase', 'billing',
-            'subscription', 'unsubscribe', 'promo', 'sale', 'discount', 'offer'
-        ]
-        
-        # Academic keywords
-        self.academic_keywords = [
-            'assignment', 'homework', 'course', 'lecture', 'university', 'college',
-            'research', 'paper', 'thesis', 'exam', 'grade', 'professor'
-        ]
-        
-        # Job-related keywords
-        self.job_keywords = [
-            'job', 'career', 'hiring', 'position', 'interview', 'resume',
-            'application', 'candidate', 'employment', 'salary'
-        ]
-        
-        # Urgency indicators
-        self.urgency_patterns = [
-            r'\b(urgent|asap|immediate|emergency|critical)\b',
-            r'\b(deadline|expires?|limited time)\b',
-            r'!{2,}',  # Multiple exclamation marks
-            r'\bact now\b'
-        ]
+        # Keyword families: built-in ones, then caller and template extras
+        families = {family: list(keywords) for family, keywords in DEFAULT_KEYWORD_FAMILIES.items()}
+        if templates_file:
+            try:
+                families.update(load_template_keyword_families(templates_file))
+            except Exception as e:
+                logger.warning(f"Could not load keyword families from {templates_file}: {e}")
+        if keyword_families:
+            families.update(keyword_families)
+        
+        self.business_keywords = families['business']
+        self.academic_keywords = families['academic']
+        self.job_keywords = families['job']
+        self.urgency_patterns = list(URGENCY_PATTERNS)
+        
+        # One compiled scanner for all keyword families and urgency patterns
+        self.lexical_scanner = LexicalScanner(families, self.urgency_patterns)
     
     def extract_features(self, email_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -65,12 +269,20 @@ class EmailFeatureExtractor:
         features = {}
         
         try:
+            # Lexical pass over subject, body and snippet shared by content and structural features
+            lexical = self.lexical_scanner.scan(
+                email_data.get('subject', '') or '',
+                email_data.get('body', '') or '',
+                email_data.get('snippet', '') or ''
+            )
+            
             # Extract content features
             features.update(self._extract_content_features(
                 email_data.get('subject', ''),
                 email_data.get('body', ''),
                 email_data.get('html', ''),
-                email_data.get('snippet', '')
+                email_data.get('snippet', ''),
+                lexical
             ))
             
             # Extract metadata features
@@ -90,7 +302,8 @@ class EmailFeatureExtractor:
             features.update(self._extract_structural_features(
                 email_data.get('subject', ''),
                 email_data.get('body', ''),
-                email_data.get('html', '')
+                email_data.get('html', ''),
+                lexical
             ))
             
             return features
@@ -99,23 +312,24 @@ class EmailFeatureExtractor:
             logger.error(f"Error extracting features: {e}")
             return self._get_default_features()
     
-    def _extract_content_features(self, subject: str, body: str, html: str, snippet: str) -> Dict[str, Any]:
+    def _extract_content_features(
+        self,
+        subject: str,
+        body: str,
+        html: str,
+        snippet: str,
+        lexical: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
         """Extract content-based features"""
         features = {}
         
-        # Subject analysis
-        subject_lower = subject.lower().strip()
-        features['subject_length'] = len(subject)
-        features['subject_word_count'] = len(subject.split())
-        features['subject_has_urgency'] = self._has_urgency_patterns(subject)
-        features['subject_caps_ratio'] = self._calculate_caps_ratio(subject)
+        if lexical is None:
+            lexical = self.lexical_scanner.scan(subject, body, snippet)
         
-        # Body content analysis
-        full_text = f"{subject} {body} {snippet}".strip()
-        features['total_text_length'] = len(full_text)
-        features['total_word_count'] = len(full_text.split())
-        features['body_length'] = len(body)
-        features['body_word_count'] = len(body.split())
+        # Subject and body content analysis
+        for key in ('subject_length', 'subject_word_count', 'subject_has_urgency', 'subject_caps_ratio',
+                    'total_text_length', 'total_word_count', 'body_length', 'body_word_count'):
+            features[key] = lexical[key]
         
         # HTML analysis
         if html:
@@ -145,19 +359,16 @@ class EmailFeatureExtractor:
             features['html_image_count'] = 0
             features['has_hidden_text'] = 0
         
-        # Keyword analysis
-        full_text_lower = full_text.lower()
-        features['business_keyword_count'] = sum(1 for keyword in self.business_keywords if keyword in full_text_lower)
-        features['academic_keyword_count'] = sum(1 for keyword in self.academic_keywords if keyword in full_text_lower)
-        features['job_keyword_count'] = sum(1 for keyword in self.job_keywords if keyword in full_text_lower)
+        # Keyword analysis (all families from the lexical scan)
+        features.update({key: value for key, value in lexical.items() if key.endswith('_keyword_count')})
         
         # Link extraction from HTML
         if html:
             features.update(self._extract_link_features(html))
         else:
             # Extract URLs from plain text
-            url_pattern = r'https?://[^\s<>"{}|\\^`\[\]]+'
-            urls = re.findall(url_pattern, full_text, re.IGNORECASE)
+            full_text = f"{subject} {body} {snippet}".strip()
+            urls = URL_PATTERN.findall(full_text)
             features.update(self._analyze_extracted_urls(urls))
         
         return features
@@ -173,17 +384,12 @@ class EmailFeatureExtractor:
             features['sender_email_length'] = len(sender_email)
             
             if sender_email and '@' in sender_email:
-                domain = sender_email.split('@')[1].lower()
-                features['sender_domain'] = domain
-                
-                # Domain analysis
-                domain_parts = domain.split('.')
-                features['domain_levels'] = len(domain_parts)
-                features['is_common_domain'] = self._is_common_domain(domain)
-                
-                # Extract top-level domain
-                extracted = tldextract.extract(sender_email)
-                features['sender_tld'] = extracted.suffix.lower() if extracted.suffix else 'unknown'
+                # Domain analysis (memoized lookup against the bundled suffix list)
+                domain_info = self.domain_intel.lookup(sender_email.split('@')[1])
+                features['sender_domain'] = domain_info.domain
+                features['domain_levels'] = domain_info.levels
+                features['is_common_domain'] = domain_info.is_common
+                features['sender_tld'] = domain_info.suffix
             else:
                 features['sender_domain'] = 'unknown'
                 features['domain_levels'] = 0
@@ -276,23 +482,24 @@ class EmailFeatureExtractor:
         
         return features
     
-    def _extract_structural_features(self, subject: str, body: str, html: str) -> Dict[str, Any]:
+    def _extract_structural_features(
+        self,
+        subject: str,
+        body: str,
+        html: str,
+        lexical: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
         """Extract structural and formatting features"""
         features = {}
         
         try:
-            # Text structure analysis
-            features['subject_exclamation_count'] = subject.count('!')
-            features['subject_question_count'] = subject.count('?')
-            features['subject_number_count'] = len(re.findall(r'\d+', subject))
-            
-            # Body structure
-            features['body_paragraph_count'] = len([p for p in body.split('\n\n') if p.strip()])
-            features['avg_paragraph_length'] = len(body) / max(features['body_paragraph_count'], 1)
+            if lexical is None:
+                lexical = self.lexical_scanner.scan(subject, body)
             
-            # Formatting indicators
-            features['body_bold_count'] = body.count('**') + body.count('__')
-            features['body_italic_count'] = body.count('*') + body.count('_')
+            # Text structure, body structure and formatting indicators
+            for key in ('subject_exclamation_count', 'subject_question_count', 'subject_number_count',
+                        'body_paragraph_count', 'avg_paragraph_length', 'body_bold_count', 'body_italic_count'):
+                features[key] = lexical[key]
             
             if html:
                 try:
@@ -403,26 +610,17 @@ class EmailFeatureExtractor:
     
     def _has_urgency_patterns(self, text: str) -> int:
         """Check for urgency patterns in text"""
-        text_lower = text.lower()
-        for pattern in self.urgency_patterns:
-            if re.search(pattern, text_lower, re.IGNORECASE):
-                return 1
-        return 0
+        return self.lexical_scanner.has_urgency(text)
     
     def _calculate_caps_ratio(self, text: str) -> float:
         """Calculate ratio of capital letters"""
         if not text:
             return 0.0
-        caps_count = sum(1 for c in text if c.isupper())
-        return caps_count / len(text)
+        return sum(map(str.isupper, text)) / len(text)
     
     def _is_common_domain(self, domain: str) -> int:
         """Check if domain is a common email provider"""
-        common_domains = [
-            'gmail.com', 'yahoo.com', 'outlook.com', 'hotmail.com', 'icloud.com',
-            'aol.com', 'protonmail.com', 'fastmail.com'
-        ]
-        return 1 if domain.lower() in common_domains else 0
+        return self.domain_intel.lookup(domain).is_common
     
     def _get_default_features(self) -> Dict[str, Any]:
         """Return default feature values"""
@@ -578,8 +776,8 @@ def normalize_features(features: Dict[str, Any]) -> Dict[str, float]:
         elif key in ['sender_domain', 'sender_tld']:
             # Handle categorical features with simple encoding
             if isinstance(value, str):
-                # Simple hash-based encoding for domains
-                normalized[f"{key}_hash"] = float(hash(value) % 1000) / 1000.0
+                # Stable hash-based encoding for domains (hash() is salted per process)
+                normalized[f"{key}_hash"] = float(zlib.crc32(value.encode('utf-8')) % 1000) / 1000.0
             else:
                 normalized[f"{key}_hash"] = 0.0
                 
@@ -591,3 +789,21 @@ def normalize_features(features: Dict[str, Any]) -> Dict[str, float]:
                 continue
     
     return normalized
+
+def features_to_vector(features: Dict[str, Any], normalized: bool = False) -> np.ndarray:
+    """
+    Convert a feature dictionary to the ordered FEATURE_VECTOR_NAMES vector
+    
+    Args:
+        features: Raw features from EmailFeatureExtractor, or already normalized ones
+        normalized: Whether `features` has already been through normalize_features
+    """
+    if not normalized:
+        features = normalize_features(features)
+    
+    # Missing features default to 0.0
+    return np.fromiter(
+        (features.get(name, 0.0) for name in FEATURE_VECTOR_NAMES),
+        dtype=np.float64,
+        count=len(FEATURE_VECTOR_NAMES)
+    )
@@ -0,0 +1,360 @@
+"""
+Persistent Feature Store for Email Classification
+Stores schema-versioned feature vectors in columnar .npy shards keyed by email id and content hash
+"""
+
+import os
+import json
+import zlib
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from feature_extractor import FEATURE_EXTRACTOR_VERSION, FEATURE_VECTOR_NAMES, features_to_vector
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Shared store location for the service; unset disables the store
+FEATURE_STORE_DIR = os.getenv('FEATURE_STORE_DIR')
+
+# Schema version: extractor version plus a checksum of the vector layout.
+# Rows written under another schema are never read back.
+FEATURE_SCHEMA_VERSION = "v{}-{:08x}".format(
+    FEATURE_EXTRACTOR_VERSION,
+    zlib.crc32(",".join(FEATURE_VECTOR_NAMES).encode('utf-8'))
+)
+
+# Fields that feed feature extraction; the content hash covers exactly these
+CONTENT_FIELDS = ('subject', 'body', 'html', 'snippet', 'from', 'to', 'date', 'attachments', 'headers')
+
+# Candidate id fields, in order of preference (Mongo _id, then Gmail ids)
+ID_FIELDS = ('_id', 'email_id', 'emailId', 'id', 'gmailId', 'messageId')
+
+
+def sample_email_id(sample: Dict[str, Any]) -> Optional[str]:
+    """Get the store key of a sample or email document"""
+    for field in ID_FIELDS:
+        value = sample.get(field)
+        if value:
+            return str(value)
+    return None
+
+
+def build_email_data(sample: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the email_data dict EmailFeatureExtractor expects from a sample or email document"""
+    return {
+        'subject': sample.get('subject', '') or '',
+        'body': sample.get('body', '') or sample.get('text', '') or '',
+        'html': sample.get('html', '') or '',
+        'from': sample.get('from', '') or '',
+        'to': sample.get('to', '') or '',
+        'date': sample.get('date'),
+        'attachments': sample.get('attachments', []) or [],
+        'headers': sample.get('headers', {}) or {}
+    }
+
+
+def content_hash(email_data: Dict[str, Any]) -> str:
+    """Stable digest of the fields that feature extraction reads"""
+    payload = {}
+    for field in CONTENT_FIELDS:
+        value = email_data.get(field)
+        if field == 'attachments' and value:
+            value = [(att.get('filename', ''), att.get('size', 0)) for att in value]
+        payload[field] = value
+    encoded = json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()
+
+
+class FeatureStore:
+    """Append-only, schema-versioned store of feature vectors"""
+
+    def __init__(self, store_dir: str = "feature_store", shard_size: int = 50000,
+                 schema_version: str = FEATURE_SCHEMA_VERSION):
+        self.root_dir = Path(store_dir)
+        self.schema_version = schema_version
+        self.store_dir = self.root_dir / schema_version
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.shard_size = shard_size
+        self.feature_names = list(FEATURE_VECTOR_NAMES)
+        self.lock = threading.RLock()
+
+        # email_id -> (shard index, row, content hash, label)
+        self.index: Dict[str, Tuple[int, int, str, str]] = {}
+        self.shards: List[Dict[str, Any]] = []
+        self._feature_arrays: Dict[int, np.ndarray] = {}
+
+        # Rows waiting for the next flush
+        self.pending: Dict[str, Tuple[str, np.ndarray, str]] = {}
+
+        self.stats = {'hits': 0, 'misses': 0, 'rows_written': 0}
+
+        self._load_manifest()
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.store_dir / "manifest.json"
+
+    def _shard_path(self, name: str, column: str) -> Path:
+        return self.store_dir / f"{name}.{column}.npy"
+
+    def _load_manifest(self):
+        """Load the shard list and rebuild the id index (later shards win)"""
+        if not self.manifest_path.exists():
+            return
+
+        with open(self.manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+        if manifest.get('feature_names') != self.feature_names:
+            logger.warning("Feature store manifest does not match the current feature layout; ignoring it")
+            return
+
+        self.shards = manifest.get('shards', [])
+        for shard_idx, shard in enumerate(self.shards):
+            ids = np.load(self._shard_path(shard['name'], 'ids'))
+            hashes = np.load(self._shard_path(shard['name'], 'hashes'))
+            labels = np.load(self._shard_path(shard['name'], 'labels'))
+            for row, (email_id, digest, label) in enumerate(zip(ids.tolist(), hashes.tolist(), labels.tolist())):
+                self.index[email_id] = (shard_idx, row, digest, label)
+
+        logger.info(f"Feature store loaded: {len(self.index)} emails in {len(self.shards)} shards ({self.schema_version})")
+
+    def _write_manifest(self):
+        manifest = {
+            'schema_version': self.schema_version,
+            'extractor_version': FEATURE_EXTRACTOR_VERSION,
+            'feature_names': self.feature_names,
+            'shards': self.shards,
+            'total_rows': sum(shard['rows'] for shard in self.shards),
+            'live_rows': len(self.index),
+            'updated_at': datetime.now().isoformat()
+        }
+        tmp_path = self.manifest_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _features(self, shard_idx: int) -> np.ndarray:
+        """Memory-mapped feature matrix of a shard"""
+        if shard_idx not in self._feature_arrays:
+            name = self.shards[shard_idx]['name']
+            self._feature_arrays[shard_idx] = np.load(self._shard_path(name, 'features'), mmap_mode='r')
+        return self._feature_arrays[shard_idx]
+
+    def flush(self) -> int:
+        """Write pending rows as a new shard; returns the number of rows written"""
+        with self.lock:
+            if not self.pending:
+                return 0
+
+            email_ids = list(self.pending.keys())
+            digests = [self.pending[email_id][0] for email_id in email_ids]
+            matrix = np.vstack([self.pending[email_id][1] for email_id in email_ids]).astype(np.float32)
+            labels = [self.pending[email_id][2] for email_id in email_ids]
+
+            name = f"part-{len(self.shards):05d}-{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+            columns = {
+                'features': matrix,
+                'ids': np.array(email_ids, dtype=str),
+                'hashes': np.array(digests, dtype=str),
+                'labels': np.array(labels, dtype=str)
+            }
+            for column, array in columns.items():
+                # np.save appends .npy when missing, so keep it on the temp name
+                tmp_path = self.store_dir / f"{name}.{column}.tmp.npy"
+                np.save(tmp_path, array)
+                os.replace(tmp_path, self._shard_path(name, column))
+
+            shard_idx = len(self.shards)
+            self.shards.append({
+                'name': name,
+                'rows': len(email_ids),
+                'created_at': datetime.now().isoformat()
+            })
+            self._write_manifest()
+
+            for row, email_id in enumerate(email_ids):
+                self.index[email_id] = (shard_idx, row, digests[row], labels[row])
+
+            self.pending.clear()
+            self.stats['rows_written'] += len(email_ids)
+            logger.info(f"Feature store: wrote {len(email_ids)} rows to {name}")
+            return len(email_ids)
+
+    def compact(self):
+        """Rewrite all live rows into a single shard and drop superseded ones"""
+        with self.lock:
+            self.flush()
+            if len(self.shards) <= 1 and len(self.index) == sum(s['rows'] for s in self.shards):
+                return
+
+            X, email_ids, labels = self.load_matrix()
+            digests = [self.index[email_id][2] for email_id in email_ids]
+            old_shards = self.shards
+
+            self.shards = []
+            self.index = {}
+            self._feature_arrays = {}
+            for email_id, digest, vector, label in zip(email_ids, digests, X, labels):
+                self.pending[email_id] = (digest, np.array(vector), label)
+            self.flush()
+
+            for shard in old_shards:
+                for column in ('features', 'ids', 'hashes', 'labels'):
+                    path = self._shard_path(shard['name'], column)
+                    if path.exists():
+                        path.unlink()
+
+            logger.info(f"Feature store compacted to {len(self.index)} rows")
+
+    # ------------------------------------------------------------------
+    # Reads and writes
+    # ------------------------------------------------------------------
+
+    def lookup(self, email_id: str, digest: str) -> Optional[np.ndarray]:
+        """Stored vector for an email, or None if missing or its content changed"""
+        with self.lock:
+            pending = self.pending.get(email_id)
+            if pending is not None and pending[0] == digest:
+                self.stats['hits'] += 1
+                return pending[1]
+
+            entry = self.index.get(email_id)
+            if entry is None or entry[2] != digest:
+                self.stats['misses'] += 1
+                return None
+
+            self.stats['hits'] += 1
+            shard_idx, row, _, _ = entry
+            return np.asarray(self._features(shard_idx)[row])
+
+    def add(self, email_id: str, digest: str, vector: np.ndarray, label: Optional[str] = None):
+        """Queue a row; unchanged rows (same content hash and label) are skipped"""
+        label = label or ''
+        with self.lock:
+            entry = self.index.get(email_id)
+            if entry is not None and entry[2] == digest and entry[3] == label and email_id not in self.pending:
+                return
+
+            self.pending[email_id] = (digest, np.asarray(vector, dtype=np.float32).reshape(-1), label)
+            if len(self.pending) >= self.shard_size:
+                self.flush()
+
+    def load_matrix(self, email_ids: Optional[Iterable[str]] = None) -> Tuple[np.ndarray, List[str], List[str]]:
+        """
+        Load live rows as a float32 matrix
+
+        Args:
+            email_ids: Optional subset (in the requested order); defaults to every stored email
+
+        Returns:
+            Tuple of (X, email_ids, labels). A single fully-live shard is returned as a
+            read-only memory map without copying.
+        """
+        with self.lock:
+            self.flush()
+
+            if email_ids is None:
+                if len(self.shards) == 1 and len(self.index) == self.shards[0]['rows']:
+                    ids = np.load(self._shard_path(self.shards[0]['name'], 'ids')).tolist()
+                    labels = np.load(self._shard_path(self.shards[0]['name'], 'labels')).tolist()
+                    return self._features(0), ids, labels
+                email_ids = list(self.index.keys())
+            else:
+                email_ids = [email_id for email_id in email_ids if email_id in self.index]
+
+            if not email_ids:
+                return np.empty((0, len(self.feature_names)), dtype=np.float32), [], []
+
+            # Gather per shard with one fancy-index read each
+            X = np.empty((len(email_ids), len(self.feature_names)), dtype=np.float32)
+            by_shard: Dict[int, Tuple[List[int], List[int]]] = {}
+            labels = []
+            for position, email_id in enumerate(email_ids):
+                shard_idx, row, _, label = self.index[email_id]
+                positions, rows = by_shard.setdefault(shard_idx, ([], []))
+                positions.append(position)
+                rows.append(row)
+                labels.append(label)
+
+            for shard_idx, (positions, rows) in by_shard.items():
+                X[positions] = self._features(shard_idx)[rows]
+
+            return X, list(email_ids), labels
+
+    def extract_or_load(self, samples: List[Dict[str, Any]], feature_extractor) -> np.ndarray:
+        """
+        Feature matrix for samples in order, extracting only new or changed emails
+
+        Samples without an id are always extracted and never stored.
+        """
+        X = np.empty((len(samples), len(self.feature_names)), dtype=np.float32)
+        extracted = 0
+
+        for i, sample in enumerate(samples):
+            email_id = sample_email_id(sample)
+            email_data = build_email_data(sample)
+            digest = content_hash(email_data)
+            label = sample.get('trueLabel') or sample.get('label')
+
+            vector = self.lookup(email_id, digest) if email_id else None
+            if vector is None:
+                features = sample.get('features') or feature_extractor.extract_features(email_data)
+                vector = features_to_vector(features)
+                extracted += 1
+                if email_id:
+                    self.add(email_id, digest, vector, label)
+            elif label and self.index.get(email_id, (None, None, None, label))[3] != label:
+                # Label corrected since the row was written
+                self.add(email_id, digest, vector, label)
+
+            X[i] = vector
+
+        self.flush()
+        logger.info(f"Feature store: {len(samples) - extracted} loaded, {extracted} extracted")
+        return X
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get store statistics"""
+        with self.lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                'schema_version': self.schema_version,
+                'store_dir': str(self.store_dir),
+                'emails': len(self.index),
+                'pending': len(self.pending),
+                'shards': len(self.shards),
+                'total_rows': sum(shard['rows'] for shard in self.shards),
+                'hits': self.stats['hits'],
+                'misses': self.stats['misses'],
+                'hit_rate': self.stats['hits'] / lookups if lookups else 0.0,
+                'rows_written': self.stats['rows_written']
+            }
+
+
+_shared_store = None
+_shared_lock = threading.Lock()
+
+
+def get_feature_store() -> Optional[FeatureStore]:
+    """Get the process-wide store configured by FEATURE_STORE_DIR (None when disabled)"""
+    global _shared_store
+    if FEATURE_STORE_DIR is None:
+        return None
+    if _shared_store is None:
+        with _shared_lock:
+            if _shared_store is None:
+                _shared_store = FeatureStore(FEATURE_STORE_DIR)
+    return _shared_store
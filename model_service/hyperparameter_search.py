@@ -0,0 +1,460 @@
+"""
+Hyperparameter Search for the Feature Model and DistilBERT
+Successive halving over random trials, run in parallel worker processes pinned to CPU partitions
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import hashlib
+import logging
+import argparse
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import joblib
+import numpy as np
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from training_jobs import apply_cpu_budget, latest_checkpoint
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Trial histories, cached search data and trial checkpoints live here
+HPARAM_SEARCH_DIR = os.getenv('HPARAM_SEARCH_DIR', 'hparam_search')
+
+# Search spaces: name -> ('int' | 'float' | 'log', low, high) or ('choice', [options])
+FEATURE_SEARCH_SPACES = {
+    'xgboost': {
+        'max_depth': ('int', 3, 10),
+        'learning_rate': ('log', 0.01, 0.3),
+        'subsample': ('float', 0.6, 1.0),
+        'colsample_bytree': ('float', 0.5, 1.0),
+        'min_child_weight': ('log', 0.5, 10.0),
+        'reg_lambda': ('log', 0.1, 10.0)
+    },
+    'random_forest': {
+        'max_depth': ('int', 4, 30),
+        'min_samples_leaf': ('int', 1, 10),
+        'max_features': ('choice', ['sqrt', 'log2', None])
+    },
+    'logistic_regression': {
+        'C': ('log', 0.01, 100.0)
+    }
+}
+
+# Parameter that successive halving grows from rung to rung (the trial's budget)
+FEATURE_RESOURCE_PARAMS = {
+    'xgboost': 'n_estimators',
+    'random_forest': 'n_estimators',
+    'logistic_regression': 'max_iter'
+}
+
+DISTILBERT_SEARCH_SPACE = {
+    'learning_rate': ('log', 1e-5, 1e-4),
+    'max_length': ('choice', [128, 256, 384]),
+    'batch_size': ('choice', [16, 32]),
+    'warmup_ratio': ('float', 0.0, 0.2)
+}
+
+
+def sample_params(space: Dict[str, tuple], rng: np.random.Generator) -> Dict[str, Any]:
+    """Draw one configuration from a search space"""
+    params = {}
+    for name, spec in space.items():
+        kind = spec[0]
+        if kind == 'int':
+            params[name] = int(rng.integers(spec[1], spec[2] + 1))
+        elif kind == 'float':
+            params[name] = float(rng.uniform(spec[1], spec[2]))
+        elif kind == 'log':
+            params[name] = float(np.exp(rng.uniform(np.log(spec[1]), np.log(spec[2]))))
+        elif kind == 'choice':
+            params[name] = spec[1][int(rng.integers(len(spec[1])))]
+        else:
+            raise ValueError(f"Unknown parameter kind for {name}: {kind}")
+    return params
+
+
+def rung_resources(min_resource: int, max_resource: int, eta: int) -> List[int]:
+    """Budgets of successive rungs: min_resource * eta^r, capped at max_resource"""
+    resources = []
+    resource = min_resource
+    while resource < max_resource:
+        resources.append(int(resource))
+        resource *= eta
+    resources.append(int(max_resource))
+    return resources
+
+
+def cpu_partitions(workers: int, cpus: Optional[List[int]] = None) -> List[List[int]]:
+    """Split the usable cores into one disjoint partition per worker"""
+    if cpus is None:
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    workers = max(1, min(workers, len(cpus)))
+    per_worker = len(cpus) // workers
+    return [cpus[i * per_worker:(i + 1) * per_worker] for i in range(workers)]
+
+
+def _init_worker(partitions, threads: int):
+    """Pool initializer: claim a core partition and size thread pools to it"""
+    cpus = partitions.get()
+    apply_cpu_budget(threads, cpus)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def run_feature_trial(task: Dict[str, Any]) -> Dict[str, Any]:
+    """Fit the feature model with one configuration at one budget and score it on the held-out split"""
+    from sklearn.metrics import accuracy_score, f1_score
+    from ensemble_classifier import FeatureBasedClassifier
+
+    # Arrays are memory-mapped, so concurrent trials share one copy of the features
+    data = joblib.load(task['data_path'], mmap_mode='r')
+    X, y = data['X'], data['y']
+    train_idx, test_idx = data['train_idx'], data['test_idx']
+
+    params = dict(task['params'])
+    params[FEATURE_RESOURCE_PARAMS[task['model_type']]] = task['resource']
+    clf = FeatureBasedClassifier(task['model_type'], n_jobs=task['threads'], model_params=params)
+    clf.train(np.asarray(X[train_idx]), np.asarray(y[train_idx]))
+
+    probabilities = clf.predict_proba_batch(np.asarray(X[test_idx]))
+    y_pred = clf.label_encoder.inverse_transform(np.argmax(probabilities, axis=1))
+    y_true = np.asarray(y[test_idx])
+    metrics = {
+        'accuracy': float(accuracy_score(y_true, y_pred)),
+        'macro_f1': float(f1_score(y_true, y_pred, average='macro', zero_division=0)),
+        'weighted_f1': float(f1_score(y_true, y_pred, average='weighted', zero_division=0))
+    }
+    return {'score': metrics['macro_f1'], 'metrics': metrics}
+
+
+def run_distilbert_trial(task: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Train DistilBERT with one configuration for `resource` epochs
+
+    A trial promoted to the next rung resumes from its own last checkpoint, so it only
+    pays for the additional epochs.
+    """
+    from distilbert_trainer import DistilBERTTrainer
+
+    params = task['params']
+    trainer = DistilBERTTrainer(
+        output_dir=task['trial_dir'],
+        max_length=params['max_length'],
+        cache_dir=task['cache_dir']
+    )
+    texts, labels, label_mapping = trainer.load_and_preprocess_dataset(task['data_file'])
+    trainer.initialize_model(len(label_mapping))
+
+    n_train = int(len(texts) * (1 - task['validation_split']))
+    steps = math.ceil(n_train / params['batch_size']) * task['resource']
+    results = trainer.train_model(
+        texts=texts,
+        labels=labels,
+        validation_split=task['validation_split'],
+        train_batch_size=params['batch_size'],
+        num_epochs=task['resource'],
+        learning_rate=params['learning_rate'],
+        warmup_steps=int(params['warmup_ratio'] * steps),
+        resume_from_checkpoint=latest_checkpoint(task['trial_dir'])
+    )
+    eval_results = results['eval_results']
+    metrics = {k.replace('eval_', ''): v for k, v in eval_results.items() if isinstance(v, (int, float))}
+    return {'score': float(eval_results['eval_f1']), 'metrics': metrics}
+
+
+class TrialHistory:
+    """Append-only JSONL log of trial results; a rerun skips work already recorded"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.records: List[Dict[str, Any]] = []
+        if path.exists():
+            with open(path, 'r') as f:
+                self.records = [json.loads(line) for line in f if line.strip()]
+
+    def append(self, record: Dict[str, Any]):
+        record = {**record, 'timestamp': datetime.now().isoformat()}
+        self.records.append(record)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+
+    def result(self, trial_id: str, rung: int, params: Dict[str, Any],
+               status: str = 'completed') -> Optional[Dict[str, Any]]:
+        for record in reversed(self.records):
+            if (record['trial_id'] == trial_id and record['rung'] == rung and record['status'] == status
+                    and record['params'] == params):
+                return record
+        return None
+
+
+class SuccessiveHalvingSearch:
+    """
+    Random search with successive halving
+
+    All trials run at the smallest budget; after each rung only the best 1/eta move on
+    to the next (eta times larger) budget, so weak configurations are dropped early.
+    Trials of a rung run in parallel, one per worker process, and each worker is pinned
+    to its own partition of cores with thread pools sized to it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        space: Dict[str, tuple],
+        trial_fn: Callable[[Dict[str, Any]], Dict[str, Any]],
+        make_task: Callable[[Dict[str, Any], int, int], Dict[str, Any]],
+        search_dir: Path,
+        n_trials: int = 27,
+        eta: int = 3,
+        min_resource: int = 1,
+        max_resource: int = 9,
+        workers: int = 2,
+        seed: int = 42
+    ):
+        self.name = name
+        self.space = space
+        self.trial_fn = trial_fn
+        self.make_task = make_task
+        self.search_dir = search_dir
+        self.n_trials = n_trials
+        self.eta = eta
+        self.resources = rung_resources(min_resource, max_resource, eta)
+        self.partitions = cpu_partitions(workers)
+        self.threads = max(1, len(self.partitions[0]))
+        self.seed = seed
+        self.history = TrialHistory(search_dir / 'trials.jsonl')
+
+    def _run_rung(self, rung: int, trials: List[Dict[str, Any]]) -> Dict[str, float]:
+        resource = self.resources[rung]
+        scores = {}
+        pending = []
+        for trial in trials:
+            done = self.history.result(trial['trial_id'], rung, trial['params'])
+            if done is not None:
+                scores[trial['trial_id']] = done['score']
+            else:
+                pending.append(trial)
+
+        logger.info(f"Rung {rung} (budget {resource}): {len(pending)} trials to run, "
+                    f"{len(trials) - len(pending)} from history")
+        if not pending:
+            return scores
+
+        context = mp.get_context('spawn')
+        partition_queue = context.Queue()
+        for partition in self.partitions:
+            partition_queue.put(partition)
+
+        with ProcessPoolExecutor(max_workers=len(self.partitions), mp_context=context,
+                                 initializer=_init_worker, initargs=(partition_queue, self.threads)) as pool:
+            futures = {}
+            for trial in pending:
+                task = self.make_task(trial, resource, self.threads)
+                futures[pool.submit(self.trial_fn, task)] = (trial, time.perf_counter())
+
+            for future in as_completed(futures):
+                trial, started = futures[future]
+                record = {'trial_id': trial['trial_id'], 'params': trial['params'], 'rung': rung,
+                          'resource': resource, 'seconds': time.perf_counter() - started}
+                try:
+                    outcome = future.result()
+                    record.update(status='completed', score=outcome['score'], metrics=outcome['metrics'])
+                    scores[trial['trial_id']] = outcome['score']
+                    logger.info(f"Trial {trial['trial_id']} rung {rung}: score {outcome['score']:.4f}")
+                except Exception as e:
+                    record.update(status='failed', score=None, error=str(e))
+                    scores[trial['trial_id']] = float('-inf')
+                    logger.warning(f"Trial {trial['trial_id']} rung {rung} failed: {e}")
+                self.history.append(record)
+
+        return scores
+
+    def run(self) -> Dict[str, Any]:
+        start = time.perf_counter()
+        rng = np.random.default_rng(self.seed)
+        trials = [{'trial_id': f"t{i:03d}", 'params': sample_params(self.space, rng)}
+                  for i in range(self.n_trials)]
+
+        survivors = trials
+        scores = {}
+        for rung in range(len(self.resources)):
+            scores = self._run_rung(rung, survivors)
+            if rung == len(self.resources) - 1:
+                break
+
+            ranked = sorted(survivors, key=lambda t: scores.get(t['trial_id'], float('-inf')), reverse=True)
+            keep = max(1, len(ranked) // self.eta)
+            for trial in ranked[keep:]:
+                if self.history.result(trial['trial_id'], rung, trial['params'], status='pruned'):
+                    continue
+                self.history.append({'trial_id': trial['trial_id'], 'params': trial['params'], 'rung': rung,
+                                     'resource': self.resources[rung], 'status': 'pruned',
+                                     'score': scores.get(trial['trial_id'])})
+            survivors = ranked[:keep]
+
+        best = max(survivors, key=lambda t: scores.get(t['trial_id'], float('-inf')))
+        summary = {
+            'search': self.name,
+            'best_trial': best['trial_id'],
+            'best_score': scores.get(best['trial_id']),
+            'best_params': best['params'],
+            'best_resource': self.resources[-1],
+            'rung_resources': self.resources,
+            'n_trials': self.n_trials,
+            'eta': self.eta,
+            'workers': len(self.partitions),
+            'threads_per_worker': self.threads,
+            'seconds': time.perf_counter() - start,
+            'timestamp': datetime.now().isoformat()
+        }
+        with open(self.search_dir / 'summary.json', 'w') as f:
+            json.dump(summary, f, indent=2, default=str)
+        return summary
+
+
+def prepare_feature_data(data_file: str, search_dir: Path, validation_split: float) -> str:
+    """Extract features once (through the pipeline's stage memo) and save them for memory-mapped trials"""
+    from data_collection import TrainingDataCollector
+    from training_pipeline import ModelTrainingPipeline
+
+    samples = TrainingDataCollector().import_training_data(data_file)
+    pipeline = ModelTrainingPipeline(model_save_dir=str(search_dir / 'models'))
+    fingerprint = pipeline.dataset_fingerprint(samples)
+    data_path = search_dir / f"features-{fingerprint}-{validation_split}.joblib"
+
+    if not data_path.exists():
+        X, y, _, _, train_idx, test_idx = pipeline.prepare_split_data(samples, validation_split)
+        if len(test_idx) == 0:
+            raise ValueError("Not enough samples for a held-out split")
+        joblib.dump({'X': np.ascontiguousarray(X), 'y': y, 'train_idx': train_idx, 'test_idx': test_idx},
+                    data_path)
+    return str(data_path)
+
+
+def prewarm_tokenized_cache(data_file: str, max_lengths: List[int], cache_dir: str):
+    """Tokenize the dataset once per max_length so parallel trials only read the cache"""
+    from distilbert_trainer import DistilBERTTrainer, DistilBertTokenizerFast
+
+    for max_length in max_lengths:
+        trainer = DistilBERTTrainer(max_length=max_length, cache_dir=cache_dir,
+                                    output_dir=os.path.join(cache_dir, 'prewarm'))
+        trainer.tokenizer = DistilBertTokenizerFast.from_pretrained(trainer.model_name)
+        texts, labels, _ = trainer.load_and_preprocess_dataset(data_file)
+        trainer.tokenize_dataset(texts, labels)
+
+
+def main():
+    """Main search function"""
+    parser = argparse.ArgumentParser(description="Parallel hyperparameter search with successive halving")
+    parser.add_argument("target", choices=["feature", "distilbert"],
+                       help="Model to tune")
+    parser.add_argument("--data_file", type=str, required=True,
+                       help="Training data: exported training JSON (feature) or JSONL dataset (distilbert)")
+    parser.add_argument("--search_dir", type=str, default=HPARAM_SEARCH_DIR,
+                       help="Directory for trial history, cached data and trial checkpoints")
+    parser.add_argument("--model_type", type=str, default="xgboost", choices=list(FEATURE_SEARCH_SPACES),
+                       help="Feature model type")
+    parser.add_argument("--n_trials", type=int, default=None,
+                       help="Configurations sampled for the first rung (default: 27 feature, 9 distilbert)")
+    parser.add_argument("--eta", type=int, default=3,
+                       help="Keep the best 1/eta trials per rung and grow the budget eta times")
+    parser.add_argument("--min_resource", type=int, default=None,
+                       help="First-rung budget (estimators/iterations, or epochs for distilbert)")
+    parser.add_argument("--max_resource", type=int, default=None,
+                       help="Final-rung budget")
+    parser.add_argument("--workers", type=int, default=2,
+                       help="Parallel trial processes, each pinned to its own core partition")
+    parser.add_argument("--validation_split", type=float, default=0.2,
+                       help="Held-out fraction used to score trials")
+    parser.add_argument("--seed", type=int, default=42,
+                       help="Seed for configuration sampling (reruns reuse the same trials)")
+
+    args = parser.parse_args()
+
+    if args.target == "feature":
+        space = FEATURE_SEARCH_SPACES[args.model_type]
+        name = f"feature-{args.model_type}"
+        resource_defaults = {'xgboost': (30, 810), 'random_forest': (30, 810), 'logistic_regression': (50, 1350)}
+        min_resource, max_resource = resource_defaults[args.model_type]
+        n_trials = args.n_trials or 27
+        trial_fn = run_feature_trial
+    else:
+        space = DISTILBERT_SEARCH_SPACE
+        name = "distilbert"
+        min_resource, max_resource = 1, 4
+        n_trials = args.n_trials or 9
+        trial_fn = run_distilbert_trial
+
+    # Searches with different data or spaces get their own history
+    data_digest = hashlib.sha1(f"{os.path.abspath(args.data_file)}:{os.path.getmtime(args.data_file)}".encode()).hexdigest()[:8]
+    search_dir = Path(args.search_dir) / f"{name}-{data_digest}"
+    search_dir.mkdir(parents=True, exist_ok=True)
+
+    print("=" * 70)
+    print(f"HYPERPARAMETER SEARCH: {name}")
+    print("=" * 70)
+
+    if args.target == "feature":
+        data_path = prepare_feature_data(args.data_file, search_dir, args.validation_split)
+
+        def make_task(trial, resource, threads):
+            return {'params': trial['params'], 'resource': resource, 'threads': threads,
+                    'model_type': args.model_type, 'data_path': data_path}
+    else:
+        cache_dir = str(search_dir / 'tokenized_cache')
+        prewarm_tokenized_cache(args.data_file, DISTILBERT_SEARCH_SPACE['max_length'][1], cache_dir)
+
+        def make_task(trial, resource, threads):
+            return {'params': trial['params'], 'resource': resource, 'threads': threads,
+                    'data_file': args.data_file, 'cache_dir': cache_dir,
+                    'trial_dir': str(search_dir / 'trials' / trial['trial_id']),
+                    'validation_split': args.validation_split}
+
+    search = SuccessiveHalvingSearch(
+        name=name,
+        space=space,
+        trial_fn=trial_fn,
+        make_task=make_task,
+        search_dir=search_dir,
+        n_trials=n_trials,
+        eta=args.eta,
+        min_resource=args.min_resource or min_resource,
+        max_resource=args.max_resource or max_resource,
+        workers=args.workers,
+        seed=args.seed
+    )
+    summary = search.run()
+
+    best_params = dict(summary['best_params'])
+    if args.target == "feature":
+        best_params[FEATURE_RESOURCE_PARAMS[args.model_type]] = summary['best_resource']
+    else:
+        best_params['num_epochs'] = summary['best_resource']
+    with open(search_dir / 'best_params.json', 'w') as f:
+        json.dump(best_params, f, indent=2, default=str)
+
+    print(f"\nBest trial {summary['best_trial']}: score {summary['best_score']:.4f} "
+          f"in {summary['seconds'] / 60:.1f} minutes")
+    for key, value in best_params.items():
+        print(f"  {key}: {value}")
+    print(f"\n✓ Trial history: {search_dir / 'trials.jsonl'}")
+    print(f"✓ Best parameters: {search_dir / 'best_params.json'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,7 @@ from sklearn.preprocessing import LabelBinarizer
 
 from ensemble_classifier import EnsembleEmailClassifier
 from data_collection import TrainingDataCollector
+from feature_store import sample_email_id
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -79,7 +80,8 @@ class ModelEvaluator:
                     result = model.predict_single(
                         email_data['subject'], 
                         email_data['body'], 
-                        email_data
+                        email_data,
+                        email_id=sample_email_id(sample)
                     )
                     
                     predictions.append(result['label'])
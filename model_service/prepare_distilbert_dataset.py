@@ -5,43 +5,142 @@ Creates balanced JSONL training dataset with enhanced features:
 - Sender domain and name
 - Category indicators
 - Metadata features
+
+Input is read in chunks and formatted column-wise, and each category keeps a seeded
+bottom-k reservoir of at most max_samples emails, so memory stays bounded by the
+balanced dataset rather than the mailbox.
 """
 
 import os
 import json
 import random
-from collections import defaultdict, Counter
-from typing import Dict, List, Any
-import re
+import argparse
+from collections import Counter
+from typing import Dict, Iterator, List, Any, Optional
+
+import numpy as np
 import pandas as pd
 
+# Emails read per chunk
+CHUNK_ROWS = 10000
+
+# Label normalisation applied before grouping
+LABEL_RENAMES = {'Assistant': 'Professor'}
+EXCLUDED_LABELS = {'', 'All'}  # 'All' is a meta-category
+
+# Text columns of an extracted email and the enhanced-feature indicator columns
+EMAIL_COLUMNS = ['subject', 'body', 'category', 'sender_domain', 'sender_name', 'professor_title']
+INDICATOR_COLUMNS = ['has_placement', 'has_nptel', 'has_hod', 'has_ezone',
+                     'has_promotions', 'has_whats_happening', 'has_professor']
+
+MAX_TEXT_CHARS = 2000
+
+
+def iter_json_array(path: str, read_chars: int = 1 << 20) -> Iterator[Dict[str, Any]]:
+    """Objects of a top-level JSON array, decoded incrementally"""
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = f.read(read_chars)
+        while buffer.isspace():
+            buffer = f.read(read_chars)
+        buffer = buffer.lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(f"{path} is not a JSON array")
+        # Decode at an offset into the buffer; it is only compacted when more text is read
+        pos = 1
+        eof = False
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buffer):
+                if buffer[pos] == ']':
+                    return
+                try:
+                    obj, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    pos = end
+                    yield obj
+                    continue
+            elif eof:
+                raise ValueError(f"{path} ends inside the JSON array")
+            more = f.read(read_chars)
+            eof = not more
+            buffer = buffer[pos:] + more
+            pos = 0
+
+
+def part_files(path: str) -> List[str]:
+    """Part files of a dataset directory: those listed in its manifest, else all of them"""
+    manifest_path = os.path.join(path, '_manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            return [os.path.join(path, part['file']) for part in json.load(f).get('parts', [])]
+    return sorted(
+        os.path.join(path, name) for name in os.listdir(path)
+        if name.endswith(('.parquet', '.arrow', '.feather'))
+    )
+
+
+def iter_chunks(path: str, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """DataFrame chunks of a CSV, Parquet/Arrow, NDJSON or JSON-array file, or a directory of parts"""
+    if os.path.isdir(path):
+        for part in part_files(path):
+            yield from iter_chunks(part, chunk_rows)
+    elif path.endswith('.csv'):
+        yield from pd.read_csv(path, chunksize=chunk_rows)
+    elif path.endswith(('.parquet', '.arrow', '.feather')):
+        import pyarrow.parquet as pq
+        import pyarrow.feather as feather
+        if path.endswith('.parquet'):
+            batches = pq.ParquetFile(path).iter_batches(batch_size=chunk_rows)
+        else:
+            batches = feather.read_table(path, memory_map=True).to_batches(max_chunksize=chunk_rows)
+        for batch in batches:
+            yield batch.to_pandas()
+    elif path.endswith(('.jsonl', '.ndjson')):
+        yield from pd.read_json(path, lines=True, chunksize=chunk_rows, dtype=False)
+    else:
+        rows = []
+        for email in iter_json_array(path):
+            rows.append(email)
+            if len(rows) == chunk_rows:
+                yield pd.DataFrame.from_records(rows)
+                rows = []
+        if rows:
+            yield pd.DataFrame.from_records(rows)
+
+
+def string_column(df: pd.DataFrame, column: str) -> pd.Series:
+    if column not in df:
+        return pd.Series('', index=df.index, dtype=object)
+    return df[column].fillna('').astype(str)
+
+
 class DatasetPreparator:
     """Prepare balanced training dataset for DistilBERT with enhanced features"""
-    
-    def __init__(self, 
-                 enhanced_features_file: str = 'enhanced_features.csv',
+
+    def __init__(self,
+                 enhanced_features_file: str = 'enhanced_features',
                  extracted_emails_file: str = 'extracted_emails.json',
-                 patterns_file: str = 'category_patterns_report.json'):
-        
-        # Try to load enhanced features first
-        self.use_enhanced_features = False
-        if os.path.exists(enhanced_features_file):
-            try:
-                self.features_df = pd.read_csv(enhanced_features_file)
-                self.emails = self.features_df.to_dict('records')
-                self.use_enhanced_features = True
-                print(f"✅ Loaded enhanced features from {enhanced_features_file}")
-                print(f"   Total samples: {len(self.emails)}")
-            except Exception as e:
-                print(f"⚠️  Could not load enhanced features: {e}")
-                print("   Falling back to extracted_emails.json")
-        
-        # Fallback to extracted emails
-        if not self.use_enhanced_features:
-        with open(extracted_emails_file, 'r', encoding='utf-8') as f:
-            self.emails = json.load(f)
-            print(f"Loaded {len(self.emails)} emails from {extracted_emails_file}")
-        
+                 patterns_file: str = 'category_patterns_report.json',
+                 seed: int = 42,
+                 chunk_rows: int = CHUNK_ROWS):
+
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.chunk_rows = chunk_rows
+
+        # Prefer enhanced features; fall back to extracted emails
+        self.use_enhanced_features = os.path.exists(enhanced_features_file)
+        self.source_file = enhanced_features_file if self.use_enhanced_features else extracted_emails_file
+        if self.use_enhanced_features:
+            print(f"✅ Using enhanced features from {enhanced_features_file}")
+        else:
+            print(f"Using emails from {extracted_emails_file}")
+
         # Load patterns if available
         self.patterns = {}
         if os.path.exists(patterns_file):
@@ -49,347 +148,365 @@ class DatasetPreparator:
                 pattern_data = json.load(f)
                 self.patterns = pattern_data.get('detailed_patterns', {})
             print(f"Loaded patterns for {len(self.patterns)} categories")
-        
-        # Group emails by category
-        self.emails_by_category = defaultdict(list)
-        for email in self.emails:
-            category = email.get('category', 'Other')
-            # Rename Assistant to Professor if found
-            if category == 'Assistant':
-                category = 'Professor'
-                email['category'] = 'Professor'
-            if category and category != 'All':  # Exclude 'All' meta-category
-                self.emails_by_category[category].append(email)
-    
-    def format_email_text(self, email: Dict[str, Any]) -> Dict[str, Any]:
-        """Format email for training with enhanced features"""
-        subject = str(email.get('subject', '')).strip()
-        body = str(email.get('body', '')).strip()
-        
+
+        # Filled by collect(): real email count and sampled examples per category
+        self.category_counts: Counter = Counter()
+        self.reservoirs: Dict[str, pd.DataFrame] = {}
+        self.total_emails = 0
+
+    def normalize_labels(self, df: pd.DataFrame) -> pd.Series:
+        """Category per row with renames applied ('' for rows to drop)"""
+        labels = df['category'] if 'category' in df else pd.Series('Other', index=df.index)
+        labels = labels.where(labels.notna() & (labels.astype(str) != 'nan'), 'Other').astype(str)
+        labels = labels.replace(LABEL_RENAMES)
+        return labels.where(~labels.isin(EXCLUDED_LABELS), '')
+
+    def format_chunk(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Vectorized text formatting of a chunk of emails (rows without text are dropped)"""
+        subject = string_column(df, 'subject').str.strip()
+        body = string_column(df, 'body').str.strip()
+
+        has_subject = subject.str.len() > 0
+        has_body = body.str.len() > 0
+
         # Combine subject and body for primary text
-        if subject and body:
-            text = f"Subject: {subject}\n\n{body}"
-        elif subject:
-            text = f"Subject: {subject}"
-        elif body:
-            text = body
-        else:
-            text = ""
-        
-        # Limit length to avoid extremely long texts
-        if len(text) > 2000:
-            text = text[:2000]
-        
-        # Enhanced features
-        formatted = {
-            'text': text,
-            'subject': subject[:500] if subject else "",  # Separate subject field
-            'sender_domain': str(email.get('sender_domain', '')),
-            'sender_name': str(email.get('sender_name', '')),
-            'professor_title': str(email.get('professor_title', ''))
-        }
-        
+        text = pd.Series('', index=df.index, dtype=object)
+        text[has_body] = body[has_body]
+        text[has_subject] = "Subject: " + subject[has_subject]
+        both = has_subject & has_body
+        text[both] = "Subject: " + subject[both] + "\n\n" + body[both]
+
+        formatted = pd.DataFrame({
+            # Limit length to avoid extremely long texts
+            'text': text.str.slice(0, MAX_TEXT_CHARS),
+            'subject': subject.str.slice(0, 500),
+            'sender_domain': string_column(df, 'sender_domain'),
+            'sender_name': string_column(df, 'sender_name'),
+            'professor_title': string_column(df, 'professor_title'),
+            'label': self.normalize_labels(df),
+            'source': 'real'
+        })
+
         # Add category indicators if available (from enhanced features)
         if self.use_enhanced_features:
-            for key in ['has_placement', 'has_nptel', 'has_hod', 'has_ezone', 
-                       'has_promotions', 'has_whats_happening', 'has_professor']:
-                formatted[key] = bool(email.get(key, False))
-        
-        return formatted
-    
+            for key in INDICATOR_COLUMNS:
+                formatted[key] = df[key].fillna(False).astype(bool) if key in df else False
+
+        return formatted[(formatted['text'] != '') & (formatted['label'] != '')]
+
+    def collect(self, max_samples_per_category: int = 200):
+        """
+        Stream the source once, keeping a uniform sample of max_samples emails per category
+
+        Every email gets a seeded random key and each category keeps the rows with the
+        smallest keys (bottom-k sampling), so the sample is uniform, independent of chunk
+        size and reproducible for a given seed.
+        """
+        key_rng = np.random.default_rng(self.seed)
+        reservoir = None
+
+        for chunk in iter_chunks(self.source_file, self.chunk_rows):
+            self.total_emails += len(chunk)
+            formatted = self.format_chunk(chunk)
+            if formatted.empty:
+                continue
+
+            self.category_counts.update(formatted['label'].value_counts().to_dict())
+            formatted = formatted.assign(_key=key_rng.random(len(formatted)))
+
+            combined = formatted if reservoir is None else pd.concat([reservoir, formatted], ignore_index=True)
+            reservoir = (combined.sort_values('_key', kind='stable')
+                                 .groupby('label', sort=False, group_keys=False)
+                                 .head(max_samples_per_category)
+                                 .reset_index(drop=True))
+
+        if reservoir is not None:
+            for label, rows in reservoir.groupby('label', sort=True):
+                self.reservoirs[label] = rows.sort_values('_key').drop(columns='_key').reset_index(drop=True)
+
+        print(f"Read {self.total_emails} emails from {self.source_file}")
+
     def create_synthetic_example(self, category: str, patterns: Dict[str, Any]) -> str:
         """Create synthetic training example based on patterns"""
-        
+
         # Get patterns for this category
-        sender_patterns = patterns.get('sender_patterns', {})
         subject_patterns = patterns.get('subject_patterns', {})
         body_patterns = patterns.get('body_patterns', {})
-        
+
         # Generate subject
         subject_keywords = list(subject_patterns.get('top_keywords', {}).keys())
-        if subject_keywords:
+        if len(subject_keywords) >= 2:
             # Pick 2-4 keywords
-            num_keywords = random.randint(2, min(4, len(subject_keywords)))
-            selected_keywords = random.sample(subject_keywords, num_keywords)
+            num_keywords = self.rng.randint(2, min(4, len(subject_keywords)))
+            selected_keywords = self.rng.sample(subject_keywords, num_keywords)
             subject = " ".join(selected_keywords).title()
         else:
             subject = f"{category} related email"
-        
+
         # Generate body
         body_keywords = list(body_patterns.get('top_keywords', {}).keys())
         body_phrases = list(body_patterns.get('top_phrases', {}).keys())
-        
+
         body_parts = []
-        if body_phrases:
+        if len(body_phrases) >= 3:
             # Pick 3-5 phrases
-            num_phrases = random.randint(3, min(5, len(body_phrases)))
-            selected_phrases = random.sample(body_phrases, num_phrases)
-            body_parts.extend(selected_phrases)
-        
-        if body_keywords and len(body_parts) < 5:
+            num_phrases = self.rng.randint(3, min(5, len(body_phrases)))
+            body_parts.extend(self.rng.sample(body_phrases, num_phrases))
+
+        if len(body_keywords) >= 5 and len(body_parts) < 5:
             # Add some keywords
-            num_keywords = random.randint(5, min(10, len(body_keywords)))
-            selected_keywords = random.sample(body_keywords, num_keywords)
-            body_parts.extend(selected_keywords)
-        
+            num_keywords = self.rng.randint(5, min(10, len(body_keywords)))
+            body_parts.extend(self.rng.sample(body_keywords, num_keywords))
+
         body = ". ".join(body_parts) if body_parts else f"This is a {category} email."
-        
+
         return f"Subject: {subject}\n\n{body}"
-    
-    def augment_category(self, category: str, target_count: int = 150) -> List[Dict[str, Any]]:
+
+    def augment_category(self, category: str, examples: pd.DataFrame, target_count: int = 150) -> pd.DataFrame:
         """Augment category with synthetic examples if needed"""
-        emails = self.emails_by_category[category]
-        examples = []
-        
-        # Add all real emails
-        for email in emails:
-            formatted = self.format_email_text(email)
-            if formatted and formatted['text']:
-                example = {
-                    **formatted,
-                    'label': category,
-                    'source': 'real'
-                }
-                examples.append(example)
-        
-        # Check if augmentation is needed
-        if len(examples) < target_count and category in self.patterns:
-            print(f"  Augmenting {category}: {len(examples)} → {target_count} samples")
-            
-            # Calculate how many synthetic examples to create
-            num_synthetic = target_count - len(examples)
-            
-            # Create synthetic examples
-            for _ in range(num_synthetic):
-                synthetic_text = self.create_synthetic_example(
-                    category, 
-                    self.patterns[category]
-                )
-                # Create minimal enhanced features for synthetic data
-                examples.append({
-                    'text': synthetic_text,
-                    'subject': "",
-                    'sender_domain': "",
-                    'sender_name': "",
-                    'professor_title': "",
-                    'label': category,
-                    'source': 'synthetic'
-                })
-        
-        return examples
-    
-    def balance_dataset(self, min_samples_per_category: int = 100, 
-                       max_samples_per_category: int = 200) -> List[Dict[str, str]]:
+        if len(examples) >= target_count or category not in self.patterns:
+            return examples
+
+        print(f"  Augmenting {category}: {len(examples)} → {target_count} samples")
+
+        # Create minimal enhanced features for synthetic data
+        num_synthetic = target_count - len(examples)
+        synthetic = pd.DataFrame({
+            'text': [self.create_synthetic_example(category, self.patterns[category]) for _ in range(num_synthetic)],
+            'subject': "",
+            'sender_domain': "",
+            'sender_name': "",
+            'professor_title': "",
+            'label': category,
+            'source': 'synthetic'
+        })
+        return pd.concat([examples, synthetic], ignore_index=True)
+
+    def balance_dataset(self, min_samples_per_category: int = 100,
+                       max_samples_per_category: int = 200) -> pd.DataFrame:
         """Create balanced dataset across all categories"""
         print("\n" + "="*60)
         print("BALANCING DATASET")
         print("="*60)
-        
-        balanced_dataset = []
-        
+
+        if not self.reservoirs:
+            self.collect(max_samples_per_category)
+
         # Analyze current distribution
         print("\nCurrent distribution:")
-        for category, emails in self.emails_by_category.items():
-            print(f"  {category:20s}: {len(emails):4d} samples")
-        
+        for category, count in sorted(self.category_counts.items()):
+            print(f"  {category:20s}: {count:4d} samples")
+
         # Process each category
         print(f"\nBalancing to {min_samples_per_category}-{max_samples_per_category} samples per category...")
-        
-        for category in self.emails_by_category.keys():
-            current_count = len(self.emails_by_category[category])
-            
-            if current_count < min_samples_per_category:
-                # Augment
-                target = min_samples_per_category
-                examples = self.augment_category(category, target)
-            elif current_count > max_samples_per_category:
-                # Sample down
-                print(f"  Sampling down {category}: {current_count} → {max_samples_per_category}")
-                sampled_emails = random.sample(
-                    self.emails_by_category[category], 
-                    max_samples_per_category
-                )
-                examples = []
-                for email in sampled_emails:
-                    formatted = self.format_email_text(email)
-                    if formatted and formatted['text']:
-                        example = {
-                            **formatted,
-                        'label': category,
-                        'source': 'real'
-                    }
-                        examples.append(example)
-            else:
-                # Use all
-                examples = []
-                for email in self.emails_by_category[category]:
-                    formatted = self.format_email_text(email)
-                    if formatted and formatted['text']:
-                        example = {
-                            **formatted,
-                        'label': category,
-                        'source': 'real'
-                    }
-                        examples.append(example)
-            
-            balanced_dataset.extend(examples)
-        
+
+        parts = []
+        for category, examples in self.reservoirs.items():
+            if self.category_counts[category] > max_samples_per_category:
+                print(f"  Sampling down {category}: {self.category_counts[category]} → {len(examples)}")
+            parts.append(self.augment_category(category, examples, min_samples_per_category))
+
+        if not parts:
+            return pd.DataFrame(columns=['text', 'label', 'source'])
+
         # Shuffle dataset
-        random.shuffle(balanced_dataset)
-        
+        balanced_dataset = pd.concat(parts, ignore_index=True)
+        balanced_dataset = balanced_dataset.sample(frac=1.0, random_state=self.seed).reset_index(drop=True)
+
         print(f"\n✓ Balanced dataset created: {len(balanced_dataset)} samples")
-        
+
         # Print final distribution
-        category_counts = Counter(ex['label'] for ex in balanced_dataset)
         print("\nFinal distribution:")
-        for category, count in sorted(category_counts.items()):
-            real_count = sum(1 for ex in balanced_dataset 
-                           if ex['label'] == category and ex['source'] == 'real')
-            synthetic_count = count - real_count
-            print(f"  {category:20s}: {count:4d} (real: {real_count}, synthetic: {synthetic_count})")
-        
+        distribution = pd.crosstab(balanced_dataset['label'], balanced_dataset['source'])
+        for category, row in distribution.iterrows():
+            real_count = int(row.get('real', 0))
+            synthetic_count = int(row.get('synthetic', 0))
+            print(f"  {category:20s}: {real_count + synthetic_count:4d} (real: {real_count}, synthetic: {synthetic_count})")
+
         return balanced_dataset
-    
-    def split_dataset(self, dataset: List[Dict[str, str]], 
+
+    def split_dataset(self, dataset: pd.DataFrame,
                      train_ratio: float = 0.8) -> tuple:
         """Split dataset into train and validation sets"""
         print(f"\nSplitting dataset ({train_ratio:.0%} train, {1-train_ratio:.0%} validation)...")
-        
-        # Stratified split by category
-        train_data = []
-        val_data = []
-        
-        # Group by category
-        by_category = defaultdict(list)
-        for example in dataset:
-            by_category[example['label']].append(example)
-        
-        # Split each category
-        for category, examples in by_category.items():
-            split_idx = int(len(examples) * train_ratio)
-            train_data.extend(examples[:split_idx])
-            val_data.extend(examples[split_idx:])
-        
-        # Shuffle
-        random.shuffle(train_data)
-        random.shuffle(val_data)
-        
+
+        # Stratified split by category (the dataset is already shuffled)
+        position = dataset.groupby('label').cumcount()
+        size = dataset.groupby('label')['label'].transform('size')
+        is_train = position < (size * train_ratio).astype(int)
+
+        train_data = dataset[is_train].sample(frac=1.0, random_state=self.seed).reset_index(drop=True)
+        val_data = dataset[~is_train].sample(frac=1.0, random_state=self.seed).reset_index(drop=True)
+
         print(f"  Training set: {len(train_data)} samples")
         print(f"  Validation set: {len(val_data)} samples")
-        
+
         return train_data, val_data
-    
-    def export_jsonl(self, data: List[Dict[str, str]], output_file: str):
-        """Export data to JSONL format"""
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for example in data:
-                # Only export text and label for training
-                training_example = {
-                    'text': example['text'],
-                    'label': example['label']
-                }
-                f.write(json.dumps(training_example, ensure_ascii=False) + '\n')
-        
-        print(f"✓ Exported to {output_file}")
-    
-    def export_dataset(self, 
+
+    def export_jsonl(self, data: pd.DataFrame, output_file: str, shard_rows: Optional[int] = None,
+                     output_format: str = 'jsonl') -> List[str]:
+        """
+        Export text and label to JSONL (or Parquet), optionally in shards of shard_rows
+
+        Shards are named <stem>-00000.<ext>; the streaming trainer reads them with a glob.
+        """
+        columns = ['text', 'label'] if output_format == 'jsonl' else ['text', 'label', 'source']
+        data = data[columns]
+        stem, _ = os.path.splitext(output_file)
+        ext = '.jsonl' if output_format == 'jsonl' else '.parquet'
+
+        if shard_rows:
+            ranges = [(i, min(i + shard_rows, len(data))) for i in range(0, max(len(data), 1), shard_rows)]
+            paths = [f"{stem}-{n:05d}{ext}" for n in range(len(ranges))]
+        else:
+            ranges = [(0, len(data))]
+            paths = [stem + ext]
+
+        for (start, end), path in zip(ranges, paths):
+            shard = data.iloc[start:end]
+            tmp_path = f"{path}.tmp"
+            if output_format == 'jsonl':
+                shard.to_json(tmp_path, orient='records', lines=True, force_ascii=False)
+            else:
+                shard.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, path)
+
+        print(f"✓ Exported to {paths[0]}" + (f" (+{len(paths) - 1} shards)" if len(paths) > 1 else ""))
+        return paths
+
+    def export_dataset(self,
                       output_file: str = 'email_training_dataset.jsonl',
                       min_samples: int = 100,
                       max_samples: int = 200,
-                      train_ratio: float = 0.8):
+                      train_ratio: float = 0.8,
+                      shard_rows: Optional[int] = None,
+                      output_format: str = 'jsonl'):
         """Create and export complete training dataset"""
-        
+
         # Balance dataset
         balanced_dataset = self.balance_dataset(min_samples, max_samples)
-        
+
         # Split into train and validation
         train_data, val_data = self.split_dataset(balanced_dataset, train_ratio)
-        
+
         # Export
         print("\nExporting datasets...")
-        
-        # Export combined dataset
-        self.export_jsonl(balanced_dataset, output_file)
-        
-        # Export train and val separately
-        train_file = output_file.replace('.jsonl', '_train.jsonl')
-        val_file = output_file.replace('.jsonl', '_val.jsonl')
-        
-        self.export_jsonl(train_data, train_file)
-        self.export_jsonl(val_data, val_file)
-        
+        stem, _ = os.path.splitext(output_file)
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+
+        # Export combined dataset, then train and val separately
+        files = {
+            'full': self.export_jsonl(balanced_dataset, output_file, shard_rows, output_format),
+            'train': self.export_jsonl(train_data, f"{stem}_train.jsonl", shard_rows, output_format),
+            'val': self.export_jsonl(val_data, f"{stem}_val.jsonl", shard_rows, output_format)
+        }
+
         # Create metadata
+        source_counts = balanced_dataset['source'].value_counts()
         metadata = {
             'total_samples': len(balanced_dataset),
             'train_samples': len(train_data),
             'val_samples': len(val_data),
             'train_ratio': train_ratio,
-            'categories': list(set(ex['label'] for ex in balanced_dataset)),
-            'category_distribution': dict(Counter(ex['label'] for ex in balanced_dataset)),
+            'categories': sorted(balanced_dataset['label'].unique().tolist()),
+            'category_distribution': {k: int(v) for k, v in balanced_dataset['label'].value_counts().items()},
+            'source_emails': self.total_emails,
+            'source_category_counts': dict(self.category_counts),
             'augmentation_stats': {
-                'real_samples': sum(1 for ex in balanced_dataset if ex.get('source') == 'real'),
-                'synthetic_samples': sum(1 for ex in balanced_dataset if ex.get('source') == 'synthetic')
-            }
+                'real_samples': int(source_counts.get('real', 0)),
+                'synthetic_samples': int(source_counts.get('synthetic', 0))
+            },
+            'seed': self.seed,
+            'format': output_format,
+            'files': files
         }
-        
-        metadata_file = output_file.replace('.jsonl', '_metadata.json')
+
+        metadata_file = f"{stem}_metadata.json"
         with open(metadata_file, 'w', encoding='utf-8') as f:
             json.dump(metadata, f, indent=2)
-        
+
         print(f"✓ Metadata saved to {metadata_file}")
-        
+
         return metadata
 
 
 def main():
     """Main dataset preparation function"""
+    parser = argparse.ArgumentParser(description="Prepare a balanced DistilBERT training dataset")
+    parser.add_argument("--enhanced_features_file", type=str, default="model_service/enhanced_features",
+                       help="Enhanced features (part directory from extract_enhanced_features.py, CSV or Parquet); used when present")
+    parser.add_argument("--emails_file", type=str, default="model_service/extracted_emails.json",
+                       help="Extracted emails (JSON array, NDJSON or Parquet)")
+    parser.add_argument("--patterns_file", type=str, default="model_service/category_patterns_report.json",
+                       help="Category patterns report used for augmentation")
+    parser.add_argument("--output_file", type=str, default="model_service/email_training_dataset.jsonl",
+                       help="Output dataset path (train/val/metadata files are derived from it)")
+    parser.add_argument("--min_samples", type=int, default=100,
+                       help="Minimum samples per category (synthetic augmentation below this)")
+    parser.add_argument("--max_samples", type=int, default=200,
+                       help="Maximum samples per category (uniform sample above this)")
+    parser.add_argument("--train_ratio", type=float, default=0.8,
+                       help="Train fraction of each category")
+    parser.add_argument("--format", type=str, default="jsonl", choices=["jsonl", "parquet"],
+                       help="Output format")
+    parser.add_argument("--shard_rows", type=int, default=None,
+                       help="Write shards of this many rows instead of single files")
+    parser.add_argument("--chunk_rows", type=int, default=CHUNK_ROWS,
+                       help="Emails read per chunk")
+    parser.add_argument("--seed", type=int, default=42,
+                       help="Seed for sampling, augmentation and splitting")
+
+    args = parser.parse_args()
+
     print("="*60)
     print("DISTILBERT DATASET PREPARATION")
     print("="*60)
-    
-    # Set random seed for reproducibility
-    random.seed(42)
-    
+
     try:
         # Check if required files exist
-        if not os.path.exists('model_service/extracted_emails.json'):
-            print("\n❌ Error: extracted_emails.json not found!")
+        if not os.path.exists(args.enhanced_features_file) and not os.path.exists(args.emails_file):
+            print(f"\n❌ Error: {args.emails_file} not found!")
             print("   Please run extract_training_data.py first.")
             return
-        
+
         # Initialize preparator
         preparator = DatasetPreparator(
-            'model_service/extracted_emails.json',
-            'model_service/category_patterns_report.json'
+            enhanced_features_file=args.enhanced_features_file,
+            extracted_emails_file=args.emails_file,
+            patterns_file=args.patterns_file,
+            seed=args.seed,
+            chunk_rows=args.chunk_rows
         )
-        
+
         # Create and export dataset
         metadata = preparator.export_dataset(
-            output_file='model_service/email_training_dataset.jsonl',
-            min_samples=100,
-            max_samples=200,
-            train_ratio=0.8
+            output_file=args.output_file,
+            min_samples=args.min_samples,
+            max_samples=args.max_samples,
+            train_ratio=args.train_ratio,
+            shard_rows=args.shard_rows,
+            output_format=args.format
         )
-        
+
         print("\n" + "="*60)
         print("DATASET PREPARATION COMPLETE!")
         print("="*60)
+        print(f"✓ Source emails: {metadata['source_emails']}")
         print(f"✓ Total samples: {metadata['total_samples']}")
         print(f"✓ Training samples: {metadata['train_samples']}")
         print(f"✓ Validation samples: {metadata['val_samples']}")
         print(f"✓ Categories: {len(metadata['categories'])}")
         print(f"✓ Real samples: {metadata['augmentation_stats']['real_samples']}")
         print(f"✓ Synthetic samples: {metadata['augmentation_stats']['synthetic_samples']}")
-        
+
         print("\nFiles created:")
-        print("  - model_service/email_training_dataset.jsonl (full dataset)")
-        print("  - model_service/email_training_dataset_train.jsonl (training set)")
-        print("  - model_service/email_training_dataset_val.jsonl (validation set)")
-        print("  - model_service/email_training_dataset_metadata.json")
-        
+        for split, paths in metadata['files'].items():
+            print(f"  - {paths[0]}" + (f" (+{len(paths) - 1} shards)" if len(paths) > 1 else "") + f" ({split})")
+        print(f"  - {os.path.splitext(args.output_file)[0]}_metadata.json")
+
         print("\nNext step:")
         print("  Run train_email_classifier.py to train the model")
-        
+
     except Exception as e:
         print(f"\n❌ Error during dataset preparation: {e}")
         import traceback
@@ -398,4 +515,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,401 @@
+"""
+Bulk Reclassification Jobs for the Model Service
+Reads projected emails straight from MongoDB, classifies them with the live classifier in
+batches and writes the results back with unordered bulk writes, with persisted job state,
+progress events, cancellation and resume
+"""
+
+import os
+import time
+import queue
+import asyncio
+import logging
+import traceback
+import threading
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from training_jobs import TrainingJobStore
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/sortify')
+
+# Job records and per-job checkpoints live here
+RECLASSIFICATION_JOBS_DIR = os.getenv('RECLASSIFICATION_JOBS_DIR', 'reclassification_jobs')
+
+# Seconds between progress events of a running job
+PROGRESS_INTERVAL = float(os.getenv('RECLASSIFICATION_PROGRESS_INTERVAL', '2'))
+
+ACTIVE_STATUSES = ('running', 'cancelling')
+RESUMABLE_STATUSES = ('cancelled', 'interrupted', 'failed')
+
+
+class ReclassificationJobStore(TrainingJobStore):
+    """Reclassification job records, one JSON file per job next to its checkpoint"""
+
+    def __init__(self, jobs_dir: str = RECLASSIFICATION_JOBS_DIR):
+        super().__init__(jobs_dir)
+
+    def checkpoint_path(self, job_id: str) -> str:
+        return str(self.jobs_dir / job_id / 'checkpoint.json')
+
+    def create(self, job_type: str, config: Dict[str, Any]) -> Dict[str, Any]:
+        job = super().create(job_type, config)
+        job.pop('output_dir', None)
+        job.pop('resume_from_checkpoint', None)
+        job['checkpoint'] = self.checkpoint_path(job['id'])
+        with self.lock:
+            self._write(job)
+        return job
+
+
+class JobProgress:
+    """Progress sink for BatchPipeline: forwards emails done and stage rates at most every `interval` seconds"""
+
+    def __init__(self, total: int, done: int, report: Callable[[Dict[str, Any]], None],
+                 interval: float = PROGRESS_INTERVAL):
+        self.total = total
+        self.done = done
+        self.report = report
+        self.interval = interval
+        self.status_line = ''
+        self._start = time.monotonic()
+        self._last = 0.0
+
+    def set_postfix_str(self, status_line: str, refresh: bool = False):
+        self.status_line = status_line
+
+    def update(self, records: int):
+        self.done += records
+        now = time.monotonic()
+        if now - self._last >= self.interval or self.done >= self.total:
+            self._last = now
+            self.report(self.snapshot())
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self._start
+        return {
+            'emails_done': self.done,
+            'emails_total': self.total,
+            'percent': round(100.0 * self.done / self.total, 1) if self.total else 100.0,
+            'elapsed_seconds': round(elapsed, 1),
+            'pipeline': self.status_line
+        }
+
+
+def create_reclassifier(classifier, config: Dict[str, Any], checkpoint_file: str,
+                        cancel_event: threading.Event, mongodb_uri: str = MONGODB_URI):
+    """
+    EmailReclassifier that classifies with the in-process classifier and reads only the
+    emails matching the job's query spec
+
+    The cursor stops yielding once `cancel_event` is set, so batches already read are
+    still classified, written and checkpointed before the job stops; `stopped_early` tells
+    whether any matching emails were left unread.
+    """
+    from bson import ObjectId
+    from reclassify_all_emails import EmailReclassifier
+
+    class ServiceReclassifier(EmailReclassifier):
+        stopped_early = False
+
+        def classify_emails(self, emails: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+            if not emails:
+                return []
+            try:
+                return classifier.predict_batch(emails)
+            except Exception as e:
+                return [{'error': str(e)} for _ in emails]
+
+        def load_versions(self) -> Optional[Dict[str, Any]]:
+            return classifier.get_version_info()
+
+        def build_query(self, category_filter: Optional[str] = None) -> Dict[str, Any]:
+            clauses = [super().build_query(category_filter)]
+            user_id = config.get('user_id')
+            if user_id:
+                clauses.append({'userId': ObjectId(user_id) if ObjectId.is_valid(user_id) else user_id})
+            if config.get('categories'):
+                clauses.append({'$or': [
+                    {'category': {'$in': config['categories']}},
+                    {'classification.label': {'$in': config['categories']}}
+                ]})
+            date_range = {}
+            if config.get('since'):
+                date_range['$gte'] = datetime.fromisoformat(config['since'])
+            if config.get('until'):
+                date_range['$lt'] = datetime.fromisoformat(config['until'])
+            if date_range:
+                clauses.append({'date': date_range})
+            return {'$and': clauses}
+
+        def iter_batches(self, cursor):
+            for batch in super().iter_batches(cursor):
+                if cancel_event.is_set():
+                    self.stopped_early = True
+                    break
+                yield batch
+
+    return ServiceReclassifier(
+        mongodb_uri=mongodb_uri,
+        batch_size=config.get('batch_size', 100),
+        confidence_threshold=config.get('confidence_threshold', 0.0),
+        dry_run=config.get('dry_run', False),
+        workers=1,
+        checkpoint_file=checkpoint_file,
+        incremental=config.get('incremental', False),
+        check_content=config.get('check_content', False)
+    )
+
+
+def run_reclassification_job(job: Dict[str, Any], classifier, events: queue.Queue,
+                             cancel_event: threading.Event, mongodb_uri: str = MONGODB_URI):
+    """Job thread entry point: reclassify the matching emails, then report the outcome as an event"""
+    job_id = job['id']
+
+    def emit(event_type: str, **data):
+        events.put({'job_id': job_id, 'type': event_type, **data})
+
+    reclassifier = None
+    try:
+        config = job['config']
+        reclassifier = create_reclassifier(classifier, config, job['checkpoint'], cancel_event, mongodb_uri)
+        emit('status', status='running')
+
+        reclassifier.prepare_versions()
+        reclassifier._run_start = time.time()
+        watermark = reclassifier.start_job(None, config.get('limit'), resume=job.get('attempts', 1) > 1)
+        done = reclassifier.job['emails_done']
+        limit = max(config['limit'] - done, 0) if config.get('limit') else None
+        remaining = reclassifier.count_emails(None, limit, after=watermark) if limit != 0 else 0
+
+        progress = JobProgress(done + remaining, done, lambda data: emit('progress', progress=data))
+        emit('progress', progress=progress.snapshot())
+        try:
+            if remaining:
+                batches = reclassifier.iter_batches(reclassifier.get_emails(None, limit, after=watermark))
+                reclassifier.pipeline_stats = reclassifier.run_pipeline(batches, progress)
+        except Exception:
+            with reclassifier._commit_lock:
+                reclassifier.save_checkpoint('failed')
+            raise
+
+        stats = reclassifier.stats
+        result = {
+            'emails_done': reclassifier.job['emails_done'],
+            'total_processed': stats['total_processed'],
+            'total_updated': stats['total_updated'],
+            'total_skipped': stats['total_skipped'],
+            'total_unchanged': stats['total_unchanged'],
+            'total_errors': stats['total_errors'],
+            'total_modified': stats['total_modified'],
+            'average_confidence': stats['confidence_sum'] / stats['total_processed'] if stats['total_processed'] else 0.0,
+            'category_changes': {old: dict(new) for old, new in stats['category_changes'].items()},
+            'errors': stats['errors'][:20],
+            'versions': {k: v for k, v in (reclassifier.versions or {}).items() if k != 'category_digests'},
+            'pipeline': reclassifier.pipeline_stats
+        }
+
+        # A cancel that arrives after the last batch was read leaves nothing undone
+        if reclassifier.stopped_early:
+            reclassifier.save_checkpoint('cancelled')
+            emit('status', status='cancelled', result=result)
+        else:
+            reclassifier.save_checkpoint('completed')
+            result['elapsed_seconds'] = reclassifier.job['elapsed_seconds']
+            emit('status', status='completed', result=result)
+
+    except Exception as e:
+        emit('status', status='failed', error=str(e), traceback=traceback.format_exc())
+    finally:
+        if reclassifier is not None:
+            reclassifier.close()
+
+
+class ReclassificationJobManager:
+    """
+    Queue of bulk reclassification jobs run one at a time in a thread of the serving process
+
+    Jobs use the live classifier, so no second copy of the model is loaded; inference
+    releases the GIL, so serving stays responsive. As with training jobs, the event loop
+    only polls job events, persists them and passes them to `broadcast`.
+    """
+
+    def __init__(
+        self,
+        store: ReclassificationJobStore,
+        get_classifier: Callable[[], Any],
+        broadcast: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+        mongodb_uri: str = MONGODB_URI,
+        poll_interval: float = 0.5
+    ):
+        self.store = store
+        self.get_classifier = get_classifier
+        self.broadcast = broadcast
+        self.mongodb_uri = mongodb_uri
+        self.poll_interval = poll_interval
+
+        self.events = queue.Queue()
+        self.pending: List[str] = []
+        self.active_job_id: Optional[str] = None
+        self.thread = None
+        self.cancel_event = None
+        self._stopped = False
+
+    def recover(self):
+        """After a restart: running jobs lost their thread, queued jobs are queued again"""
+        for job in self.store.list():
+            if job['status'] in ACTIVE_STATUSES:
+                self.store.update(job['id'], status='interrupted', finished_at=datetime.now().isoformat())
+                logger.info(f"Reclassification job {job['id']} was interrupted by a restart")
+            elif job['status'] == 'queued':
+                self.pending.append(job['id'])
+
+    def submit(self, config: Dict[str, Any]) -> Dict[str, Any]:
+        job = self.store.create('reclassification', config)
+        self.pending.append(job['id'])
+        logger.info(f"Queued reclassification job {job['id']}")
+        return job
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        return self.pending.index(job_id) + 1 if job_id in self.pending else None
+
+    def cancel(self, job_id: str) -> Dict[str, Any]:
+        """Cancel a queued job, or stop the running one after its in-flight batches are written"""
+        job = self.store.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+
+        if job_id in self.pending:
+            self.pending.remove(job_id)
+            return self.store.update(job_id, status='cancelled', finished_at=datetime.now().isoformat())
+
+        if job_id != self.active_job_id:
+            raise ValueError(f"Job {job_id} is {job['status']} and cannot be cancelled")
+
+        self.cancel_event.set()
+        return self.store.update(job_id, status='cancelling')
+
+    def resume(self, job_id: str) -> Dict[str, Any]:
+        """Queue a stopped job again; it continues after its last committed batch"""
+        job = self.store.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        if job['status'] not in RESUMABLE_STATUSES:
+            raise ValueError(f"Job {job_id} is {job['status']} and cannot be resumed")
+
+        job = self.store.update(job_id, status='queued', error=None, finished_at=None)
+        self.pending.append(job_id)
+        logger.info(f"Resuming reclassification job {job_id}")
+        return job
+
+    def _start_next(self):
+        job_id = self.pending.pop(0)
+        job = self.store.get(job_id)
+        if job is None or job['status'] != 'queued':
+            return
+
+        classifier = self.get_classifier()
+        if classifier is None:
+            self.store.update(job_id, status='failed', error="Model not loaded",
+                              finished_at=datetime.now().isoformat())
+            return
+
+        job = self.store.update(job_id, status='running', started_at=datetime.now().isoformat(),
+                                attempts=job.get('attempts', 0) + 1)
+        self.cancel_event = threading.Event()
+        self.thread = threading.Thread(
+            target=run_reclassification_job,
+            args=(job, classifier, self.events, self.cancel_event, self.mongodb_uri),
+            name=f"reclassification-{job_id}",
+            daemon=True
+        )
+        self.thread.start()
+        self.active_job_id = job_id
+        logger.info(f"Started reclassification job {job_id}")
+
+    async def _notify(self, message: Dict[str, Any]):
+        if self.broadcast is not None:
+            try:
+                await self.broadcast(message)
+            except Exception as e:
+                logger.warning(f"Failed to broadcast reclassification event: {e}")
+
+    async def _handle_event(self, event: Dict[str, Any]):
+        job_id = event['job_id']
+
+        if event['type'] == 'progress':
+            self.store.update(job_id, progress=event['progress'])
+            await self._notify({'type': 'reclassification_job_progress',
+                                'data': {'job_id': job_id, **event['progress']}})
+            return
+
+        status = event['status']
+        fields = {'status': status}
+        if status == 'running':
+            if self.cancel_event is not None and self.cancel_event.is_set():
+                fields['status'] = 'cancelling'
+        else:
+            fields['finished_at'] = datetime.now().isoformat()
+            for key in ('result', 'error', 'traceback'):
+                if key in event:
+                    fields[key] = event[key]
+        job = self.store.update(job_id, **fields)
+
+        await self._notify({'type': 'reclassification_job_status',
+                            'data': {'job_id': job_id, 'status': job['status'], 'error': job.get('error'),
+                                     'result': {k: v for k, v in (job.get('result') or {}).items()
+                                                if k not in ('errors', 'pipeline')}}})
+
+    async def _reap(self):
+        """Clean up after the job thread exits"""
+        job_id = self.active_job_id
+        self.thread = None
+        self.active_job_id = None
+
+        job = self.store.get(job_id)
+        if job is not None and job['status'] in ACTIVE_STATUSES:
+            job = self.store.update(job_id, status='failed', error="Reclassification thread exited unexpectedly",
+                                    finished_at=datetime.now().isoformat())
+            await self._notify({'type': 'reclassification_job_status',
+                                'data': {'job_id': job_id, 'status': job['status'], 'error': job['error']}})
+
+    async def run(self):
+        """Poll loop, run as an asyncio task in the serving process"""
+        while not self._stopped:
+            try:
+                while True:
+                    try:
+                        event = self.events.get_nowait()
+                    except queue.Empty:
+                        break
+                    await self._handle_event(event)
+
+                if self.thread is not None and not self.thread.is_alive() and self.events.empty():
+                    await self._reap()
+
+                if self.thread is None and self.pending:
+                    self._start_next()
+
+            except Exception as e:
+                logger.error(f"Error in reclassification job loop: {e}")
+
+            await asyncio.sleep(self.poll_interval)
+
+    def shutdown(self, timeout: float = 30.0):
+        """Stop a running job after its in-flight batches; it is marked interrupted and can be resumed"""
+        self._stopped = True
+        if self.thread is None or not self.thread.is_alive():
+            return
+        self.cancel_event.set()
+        self.thread.join(timeout)
+        self.store.update(self.active_job_id, status='interrupted', finished_at=datetime.now().isoformat())
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'active_job_id': self.active_job_id,
+            'pending': list(self.pending)
+        }
@@ -7,6 +7,8 @@ import os
 import sys
 import json
 import argparse
+import threading
+import uuid
 from datetime import datetime
 from typing import Dict, List, Any, Optional
 from collections import defaultdict, Counter
@@ -14,17 +16,30 @@ import time
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from batch_pipeline import BatchPipeline, Stage
+from classification_versions import (
+    AFFECTED_TOP_K, VERSION_INDEX, CATEGORIES_VERSION_INDEX, CategoryVersionRegistry, content_digest, is_stale, stale_query
+)
+
 try:
-    from pymongo import MongoClient
+    from pymongo import MongoClient, UpdateOne
+    from pymongo.errors import BulkWriteError
+    from bson import json_util
     from dotenv import load_dotenv
     import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
     from tqdm import tqdm
 except ImportError:
     print("Installing required packages...")
     os.system("pip install pymongo python-dotenv requests tqdm")
-    from pymongo import MongoClient
+    from pymongo import MongoClient, UpdateOne
+    from pymongo.errors import BulkWriteError
+    from bson import json_util
     from dotenv import load_dotenv
     import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
     from tqdm import tqdm
 
 # Load environment variables
@@ -34,6 +49,129 @@ load_dotenv()
 MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/sortify')
 MODEL_SERVICE_URL = os.getenv('MODEL_SERVICE_URL', 'http://localhost:8000')
 
+# Only the fields classification needs are read from MongoDB
+EMAIL_PROJECTION = {
+    '_id': 1,
+    'subject': 1,
+    'text': 1,
+    'body': 1,
+    'category': 1,
+    'classification.label': 1,
+    'classification.contentDigest': 1,
+    'classification.modelFingerprint': 1,
+    'classification.categoriesVersion': 1
+}
+
+# The model sees at most a few hundred tokens, so longer bodies are cut before they go over the wire
+MAX_BODY_CHARS = int(os.getenv('RECLASSIFY_MAX_BODY_CHARS', '10000'))
+
+# Samples of low-confidence emails and errors kept for the report
+MAX_REPORTED_ITEMS = 1000
+
+# Job state written after every committed batch, read by --resume
+CHECKPOINT_FILE = os.getenv('RECLASSIFY_CHECKPOINT_FILE', 'reclassification_checkpoint.json')
+
+
+def new_stats() -> Dict[str, Any]:
+    """Empty statistics (running aggregates, so memory stays flat however many emails are processed)"""
+    return {
+        'total_processed': 0,
+        'total_updated': 0,
+        'total_skipped': 0,
+        'total_unchanged': 0,
+        'total_errors': 0,
+        'total_modified': 0,
+        'category_changes': defaultdict(lambda: defaultdict(int)),
+        'confidence_sum': 0.0,
+        'confidence_min': None,
+        'confidence_max': None,
+        'confidence_distribution': Counter(),
+        'low_confidence_count': 0,
+        'low_confidence_emails': [],
+        'errors': []
+    }
+
+
+def merge_stats(stats: Dict[str, Any], delta: Dict[str, Any]):
+    """Add the statistics of one batch into running statistics"""
+    for key in ('total_processed', 'total_updated', 'total_skipped', 'total_unchanged', 'total_errors',
+                'total_modified', 'confidence_sum', 'low_confidence_count'):
+        stats[key] += delta[key]
+    for old, new_cats in delta['category_changes'].items():
+        for new, count in new_cats.items():
+            stats['category_changes'][old][new] += count
+    if delta['confidence_min'] is not None:
+        if stats['confidence_min'] is None or delta['confidence_min'] < stats['confidence_min']:
+            stats['confidence_min'] = delta['confidence_min']
+        if stats['confidence_max'] is None or delta['confidence_max'] > stats['confidence_max']:
+            stats['confidence_max'] = delta['confidence_max']
+    stats['confidence_distribution'].update(delta['confidence_distribution'])
+    for key in ('low_confidence_emails', 'errors'):
+        room = MAX_REPORTED_ITEMS - len(stats[key])
+        stats[key].extend(delta[key][:max(room, 0)])
+
+
+def stats_to_json(stats: Dict[str, Any]) -> Dict[str, Any]:
+    data = dict(stats)
+    data['category_changes'] = {old: dict(new) for old, new in stats['category_changes'].items()}
+    data['confidence_distribution'] = {str(k): v for k, v in stats['confidence_distribution'].items()}
+    return data
+
+
+def stats_from_json(data: Dict[str, Any]) -> Dict[str, Any]:
+    stats = new_stats()
+    stats.update({k: v for k, v in data.items() if k not in ('category_changes', 'confidence_distribution')})
+    for old, new_cats in data.get('category_changes', {}).items():
+        for new, count in new_cats.items():
+            stats['category_changes'][old][new] = count
+    stats['confidence_distribution'] = Counter({float(k): v for k, v in data.get('confidence_distribution', {}).items()})
+    return stats
+
+
+class ReclassificationCheckpoint:
+    """
+    Durable state of a reclassification run
+
+    Emails are processed in _id order and a batch is committed only once it and every
+    batch before it are written, so the watermark (last committed _id) and the statistics
+    always describe the same prefix of the collection. Resuming from the watermark may
+    redo batches that were written but not yet committed; updates are idempotent and
+    their statistics were never counted.
+    """
+    
+    def __init__(self, path: str = CHECKPOINT_FILE):
+        self.path = path
+    
+    def load(self) -> Optional[Dict[str, Any]]:
+        if not self.path or not os.path.exists(self.path):
+            return None
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def save(self, state: Dict[str, Any]):
+        if not self.path:
+            return
+        state['updated_at'] = datetime.now().isoformat()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def create_http_session(pool_size: int = 4, retries: int = 3) -> requests.Session:
+    """HTTP session with a keep-alive connection pool and retries on transient failures"""
+    session = requests.Session()
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=['POST']
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
 
 class EmailReclassifier:
     """Reclassify all emails using DistilBERT model"""
@@ -45,7 +183,13 @@ class EmailReclassifier:
                  confidence_threshold: float = 0.0,
                  dry_run: bool = False,
                  use_direct_model: bool = False,
-                 model_path: str = None):
+                 model_path: str = None,
+                 workers: int = 4,
+                 queue_size: int = 4,
+                 checkpoint_file: Optional[str] = CHECKPOINT_FILE,
+                 incremental: bool = False,
+                 check_content: bool = False,
+                 top_k: int = AFFECTED_TOP_K):
         
         self.mongodb_uri = mongodb_uri
         self.model_service_url = model_service_url
@@ -54,23 +198,35 @@ class EmailReclassifier:
         self.dry_run = dry_run
         self.use_direct_model = use_direct_model
         self.model_path = model_path
-        
-        # Statistics
-        self.stats = {
-            'total_processed': 0,
-            'total_updated': 0,
-            'total_skipped': 0,
-            'total_errors': 0,
-            'category_changes': defaultdict(lambda: defaultdict(int)),
-            'confidence_scores': [],
-            'low_confidence_emails': [],
-            'errors': []
-        }
+        self.workers = workers
+        self.queue_size = queue_size
+        self.pipeline_stats = []
+        
+        # Incremental mode: only emails whose content digest, model or category set changed
+        self.incremental = incremental or check_content
+        self.check_content = check_content
+        self.top_k = top_k
+        self.versions = None
+        self.previous_category_versions = {}
+        
+        # Statistics of committed batches
+        self.stats = new_stats()
+        
+        # Job state: committed prefix of the _id-ordered run
+        self.checkpoint = ReclassificationCheckpoint(checkpoint_file)
+        self.job = None
+        self._pending = {}
+        self._next_seq = 0
+        self._commit_lock = threading.Lock()
+        
+        # Pooled HTTP connections to the model service (one per inference worker)
+        self.session = create_http_session(pool_size=max(workers, 1))
         
         # Connect to MongoDB
         self.client = MongoClient(mongodb_uri)
         self.db = self.client.get_database()
         self.emails_collection = self.db['emails']
+        self.category_versions = CategoryVersionRegistry(self.db)
         
         # Load model if using direct mode
         if use_direct_model:
@@ -103,7 +259,7 @@ class EmailReclassifier:
     def classify_via_api(self, subject: str, body: str) -> Dict[str, Any]:
         """Classify email using model service API"""
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.model_service_url}/predict",
                 json={'subject': subject, 'body': body},
                 timeout=30
@@ -124,6 +280,32 @@ class EmailReclassifier:
         except Exception as e:
             return {'error': str(e)}
     
+    def classify_batch_via_api(self, emails: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+        """Classify a chunk of emails with one /predict/batch request"""
+        try:
+            response = self.session.post(
+                f"{self.model_service_url}/predict/batch",
+                json={'emails': emails},
+                timeout=60 + len(emails)
+            )
+            
+            if response.status_code == 200:
+                return response.json()
+            error = f"API returned status {response.status_code}"
+        except Exception as e:
+            error = str(e)
+        
+        # Isolate the failing emails: fall back to one request per email
+        print(f"  ⚠ Batch request failed ({error}), classifying {len(emails)} emails individually")
+        return [self.classify_via_api(email['subject'], email['body']) for email in emails]
+    
+    def classify_batch_direct(self, emails: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+        """Classify a chunk of emails with the loaded model in one batched pass"""
+        try:
+            return self.classifier.predict_batch(emails)
+        except Exception as e:
+            return [{'error': str(e)} for _ in emails]
+    
     def classify_email(self, subject: str, body: str) -> Dict[str, Any]:
         """Classify email (auto-select method)"""
         if self.use_direct_model:
@@ -131,8 +313,47 @@ class EmailReclassifier:
         else:
             return self.classify_via_api(subject, body)
     
-    def get_emails(self, category_filter: Optional[str] = None, limit: Optional[int] = None):
-        """Get emails to reclassify"""
+    def classify_emails(self, emails: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+        """Classify a chunk of {'subject', 'body'} dicts (auto-select method)"""
+        if not emails:
+            return []
+        if self.use_direct_model:
+            return self.classify_batch_direct(emails)
+        else:
+            return self.classify_batch_via_api(emails)
+    
+    def load_versions(self) -> Optional[Dict[str, Any]]:
+        """Model and category-set versions of the classifier (GET /model/version in API mode)"""
+        try:
+            if self.use_direct_model:
+                return self.classifier.get_version_info()
+            response = self.session.get(f"{self.model_service_url}/model/version", timeout=30)
+            if response.status_code == 200:
+                return response.json()
+            print(f"⚠ Could not read model version: API returned status {response.status_code}")
+        except Exception as e:
+            print(f"⚠ Could not read model version: {e}")
+        return None
+    
+    def prepare_versions(self):
+        """Load versions, register the current category set and index the version fields"""
+        self.versions = self.load_versions()
+        if self.versions is None:
+            if self.incremental:
+                raise RuntimeError("Incremental mode needs the model service's /model/version endpoint")
+            return
+        
+        print(f"  Model Version: {self.versions['model_version']}")
+        print(f"  Categories Version: {self.versions['categories_version']}")
+        if not self.dry_run:
+            self.category_versions.register(self.versions['categories_version'], self.versions['category_digests'])
+            self.emails_collection.create_index(VERSION_INDEX)
+            self.emails_collection.create_index(CATEGORIES_VERSION_INDEX)
+        if self.incremental:
+            self.previous_category_versions = self.category_versions.load()
+    
+    def build_query(self, category_filter: Optional[str] = None) -> Dict[str, Any]:
+        """MongoDB filter for the emails to reclassify"""
         query = {'isDeleted': {'$ne': True}}
         
         if category_filter:
@@ -141,38 +362,136 @@ class EmailReclassifier:
                 {'classification.label': category_filter}
             ]
         
-        cursor = self.emails_collection.find(query)
+        # Only stale classifications; --check-content also compares digests client-side and scans everything
+        if self.incremental and not self.check_content:
+            query = {'$and': [query, stale_query(
+                self.versions['model_version'],
+                self.versions['categories_version'],
+                self.versions['category_digests'],
+                self.previous_category_versions,
+                self.top_k
+            )]}
+        
+        return query
+    
+    def count_emails(self, category_filter: Optional[str] = None, limit: Optional[int] = None,
+                     after: Any = None) -> int:
+        """Number of emails get_emails will yield"""
+        query = self.build_query(category_filter)
+        if after is not None:
+            query['_id'] = {'$gt': after}
+        count = self.emails_collection.count_documents(query)
+        return min(count, limit) if limit else count
+    
+    def get_emails(self, category_filter: Optional[str] = None, limit: Optional[int] = None,
+                   after: Any = None):
+        """Stream emails to reclassify in _id order (projected cursor, fetched batch_size documents at a time)"""
+        query = self.build_query(category_filter)
+        if after is not None:
+            query['_id'] = {'$gt': after}
+        
+        projection = dict(EMAIL_PROJECTION)
+        if self.check_content:
+            projection['classification.scores'] = 1
+        
+        cursor = self.emails_collection.find(
+            query,
+            projection,
+            no_cursor_timeout=True
+        ).sort('_id', 1).batch_size(self.batch_size)
         
         if limit:
             cursor = cursor.limit(limit)
         
-        return list(cursor)
+        return cursor
+    
+    def iter_batches(self, cursor):
+        """Group a cursor into lists of batch_size documents"""
+        batch = []
+        try:
+            for email in cursor:
+                batch.append(email)
+                if len(batch) == self.batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        finally:
+            cursor.close()
+    
+    @staticmethod
+    def email_content(email: Dict[str, Any]) -> Dict[str, str]:
+        """Subject and (truncated) body of an email document"""
+        subject = email.get('subject') or ''
+        body = email.get('text') or email.get('body') or ''
+        return {'subject': str(subject), 'body': str(body)[:MAX_BODY_CHARS]}
+    
+    @staticmethod
+    def record_confidence(stats: Dict[str, Any], confidence: float):
+        stats['confidence_sum'] += confidence
+        if stats['confidence_min'] is None or confidence < stats['confidence_min']:
+            stats['confidence_min'] = confidence
+        if stats['confidence_max'] is None or confidence > stats['confidence_max']:
+            stats['confidence_max'] = confidence
+        stats['confidence_distribution'][round(confidence, 1)] += 1
+    
+    def is_stale(self, email: Dict[str, Any], content: Dict[str, str]) -> bool:
+        """Whether the stored classification of a projected email is out of date"""
+        return is_stale(
+            email,
+            content_digest(content['subject'], content['body']),
+            self.versions['model_version'],
+            self.versions['categories_version'],
+            self.versions['category_digests'],
+            self.previous_category_versions,
+            self.top_k
+        )
+    
+    def classify_batch(self, emails: List[Dict]) -> tuple:
+        """Inference stage: (emails, predictions) for a batch; safe to run concurrently"""
+        contents = [self.email_content(email) for email in emails]
+        if not self.check_content:
+            return emails, self.classify_emails(contents)
+        
+        # Up-to-date emails get no prediction (None) and are counted as unchanged
+        stale = [i for i, (email, content) in enumerate(zip(emails, contents)) if self.is_stale(email, content)]
+        predictions = [None] * len(emails)
+        for i, prediction in zip(stale, self.classify_emails([contents[i] for i in stale])):
+            predictions[i] = prediction
+        return emails, predictions
     
     def process_batch(self, emails: List[Dict]) -> List[Dict]:
         """Process a batch of emails"""
+        return self.tally_results(*self.classify_batch(emails))
+    
+    def tally_results(self, emails: List[Dict], predictions: List[Dict],
+                      stats: Optional[Dict[str, Any]] = None) -> List[Dict]:
+        """Compare predictions with current categories and update statistics (self.stats by default)"""
+        stats = self.stats if stats is None else stats
         results = []
         
-        for email in emails:
-            # Extract email content
-            subject = email.get('subject', '')
-            body = email.get('text') or email.get('body', '')
+        for email, prediction in zip(emails, predictions):
+            if prediction is None:
+                stats['total_unchanged'] += 1
+                continue
+            
+            content = self.email_content(email)
+            subject = content['subject']
             
             # Get current category
             current_category = (
-                email.get('classification', {}).get('label') or 
-                email.get('category', 'Other')
+                (email.get('classification') or {}).get('label') or 
+                email.get('category') or 'Other'
             )
             
-            # Classify
-            prediction = self.classify_email(subject, body)
-            
             # Check for errors
-            if 'error' in prediction:
-                self.stats['total_errors'] += 1
-                self.stats['errors'].append({
-                    'email_id': str(email['_id']),
-                    'error': prediction['error']
-                })
+            if prediction.get('error'):
+                stats['total_errors'] += 1
+                if len(stats['errors']) < MAX_REPORTED_ITEMS:
+                    stats['errors'].append({
+                        'email_id': str(email['_id']),
+                        'error': prediction['error']
+                    })
                 results.append({
                     'email_id': email['_id'],
                     'status': 'error',
@@ -185,9 +504,9 @@ class EmailReclassifier:
             confidence = prediction.get('confidence', 0.0)
             
             # Track statistics
-            self.stats['total_processed'] += 1
-            self.stats['confidence_scores'].append(confidence)
-            self.stats['category_changes'][current_category][new_category] += 1
+            stats['total_processed'] += 1
+            self.record_confidence(stats, confidence)
+            stats['category_changes'][current_category][new_category] += 1
             
             # Check if update is needed
             should_update = (
@@ -196,13 +515,15 @@ class EmailReclassifier:
             )
             
             if should_update:
-                self.stats['total_updated'] += 1
+                stats['total_updated'] += 1
             else:
-                self.stats['total_skipped'] += 1
+                stats['total_skipped'] += 1
             
             # Flag low confidence
             if confidence < 0.7:
-                self.stats['low_confidence_emails'].append({
+                stats['low_confidence_count'] += 1
+            if confidence < 0.7 and len(stats['low_confidence_emails']) < MAX_REPORTED_ITEMS:
+                stats['low_confidence_emails'].append({
                     'email_id': str(email['_id']),
                     'subject': subject[:50],
                     'current': current_category,
@@ -216,19 +537,40 @@ class EmailReclassifier:
                 'new_category': new_category,
                 'confidence': confidence,
                 'should_update': should_update,
-                'prediction': prediction
+                'prediction': prediction,
+                'content_digest': content_digest(content['subject'], content['body'])
             })
         
         return results
     
-    def update_database(self, results: List[Dict]):
+    def update_database(self, results: List[Dict], stats: Optional[Dict[str, Any]] = None):
         """Update database with new classifications"""
+        stats = self.stats if stats is None else stats
         if self.dry_run:
             return
         
         bulk_operations = []
         
+        # Versions stored with each classification, for incremental runs
+        versions = {}
+        if self.versions is not None:
+            versions = {
+                'modelFingerprint': self.versions['model_version'],
+                'categoriesVersion': self.versions['categories_version']
+            }
+        
         for result in results:
+            if versions and 'content_digest' in result and not result.get('should_update'):
+                # Same label (or below the threshold): keep it, record that this model has seen this content
+                stamp = {f'classification.{k}': v for k, v in versions.items()}
+                stamp['classification.contentDigest'] = result['content_digest']
+                if result['new_category'] == result['current_category']:
+                    stamp['classification.scores'] = result['prediction'].get('scores', {})
+                bulk_operations.append({
+                    'filter': {'_id': result['email_id']},
+                    'update': {'$set': stamp}
+                })
+            
             if result.get('should_update'):
                 email_id = result['email_id']
                 new_category = result['new_category']
@@ -247,7 +589,8 @@ class EmailReclassifier:
                             'modelVersion': '4.0.0-distilbert',
                             'model': 'distilbert-reclassification',
                             'reason': 'Deep reclassification with DistilBERT',
-                            'scores': prediction.get('scores', {})
+                            'scores': prediction.get('scores', {}),
+                            **({'contentDigest': result['content_digest'], **versions} if versions else {})
                         },
                         'previousCategory': result['current_category'],
                         'refinementStatus': 'refined',
@@ -262,22 +605,123 @@ class EmailReclassifier:
                     'update': update
                 })
         
-        # Execute bulk update
+        # Execute bulk update; anything but per-email write errors propagates and stops the run,
+        # so the checkpoint watermark stays before this batch
         if bulk_operations:
+            operations = [
+                UpdateOne(op['filter'], op['update'])
+                for op in bulk_operations
+            ]
             try:
-                from pymongo import UpdateOne
-                operations = [
-                    UpdateOne(op['filter'], op['update'])
-                    for op in bulk_operations
-                ]
                 result = self.emails_collection.bulk_write(operations, ordered=False)
-                print(f"  ✓ Updated {result.modified_count} emails")
-            except Exception as e:
-                print(f"  ✗ Bulk update error: {e}")
-                self.stats['total_errors'] += 1
+                stats['total_modified'] += result.modified_count
+            except BulkWriteError as e:
+                details = e.details or {}
+                write_errors = details.get('writeErrors', [])
+                stats['total_modified'] += details.get('nModified', 0)
+                stats['total_errors'] += len(write_errors)
+                tqdm.write(f"  ✗ Bulk update: {len(write_errors)} email(s) failed")
+                for error in write_errors:
+                    if len(stats['errors']) < MAX_REPORTED_ITEMS:
+                        op = error.get('op') or {}
+                        stats['errors'].append({
+                            'email_id': str(op.get('q', {}).get('_id', 'unknown')),
+                            'error': error.get('errmsg', '')
+                        })
+    
+    def write_batch(self, item: tuple) -> tuple:
+        """Writer stage: tally a classified batch into its own statistics and write its updates"""
+        emails, predictions = item
+        delta = new_stats()
+        results = self.tally_results(emails, predictions, delta)
+        self.update_database(results, delta)
+        return emails[-1]['_id'], len(emails), delta
+    
+    def commit_batch(self, seq: int, output: tuple):
+        """Fold written batches into the statistics in source order and checkpoint the new watermark"""
+        with self._commit_lock:
+            self._pending[seq] = output
+            committed = False
+            while self._next_seq in self._pending:
+                last_id, count, delta = self._pending.pop(self._next_seq)
+                merge_stats(self.stats, delta)
+                self.job['watermark'] = json_util.dumps(last_id)
+                self.job['emails_done'] += count
+                self.job['batches_committed'] += 1
+                self._next_seq += 1
+                committed = True
+            if committed:
+                self.save_checkpoint('running')
+    
+    def save_checkpoint(self, status: str):
+        self.job['status'] = status
+        self.job['elapsed_seconds'] = self._elapsed_before + (time.time() - self._run_start)
+        self.job['stats'] = stats_to_json(self.stats)
+        self.checkpoint.save(self.job)
+    
+    def start_job(self, category_filter: Optional[str], sample_size: Optional[int], resume: bool) -> Any:
+        """Start a new job or restore the checkpointed one; returns the _id to continue after"""
+        config = {
+            'category_filter': category_filter,
+            'sample_size': sample_size,
+            'dry_run': self.dry_run,
+            'confidence_threshold': self.confidence_threshold,
+            'incremental': self.incremental,
+            'check_content': self.check_content
+        }
+        if self.incremental:
+            # The stale filter depends on the versions, so a resumed run must see the same ones
+            config['model_version'] = self.versions['model_version']
+            config['categories_version'] = self.versions['categories_version']
+        previous = self.checkpoint.load()
+        self._elapsed_before = 0.0
+        
+        if resume and previous and previous.get('status') != 'completed':
+            if previous.get('config') != config:
+                raise ValueError(f"Checkpoint {self.checkpoint.path} was written with different options "
+                                 f"{previous.get('config')}; rerun with the same options or without --resume")
+            self.job = previous
+            self.stats = stats_from_json(previous.get('stats', {}))
+            self._elapsed_before = previous.get('elapsed_seconds', 0.0)
+            print(f"\n↻ Resuming job {previous['job_id']}: {previous['emails_done']} emails already committed")
+            return json_util.loads(previous['watermark']) if previous.get('watermark') else None
+        
+        if resume:
+            print(f"\nNo resumable checkpoint at {self.checkpoint.path}; starting from the beginning")
+        elif previous and previous.get('status') != 'completed':
+            print(f"\n⚠ Overwriting unfinished job {previous.get('job_id')} in {self.checkpoint.path} (use --resume to continue it)")
+        
+        self.job = {
+            'job_id': uuid.uuid4().hex[:12],
+            'status': 'running',
+            'started_at': datetime.now().isoformat(),
+            'config': config,
+            'watermark': None,
+            'emails_done': 0,
+            'batches_committed': 0,
+            'elapsed_seconds': 0.0
+        }
+        return None
+    
+    def run_pipeline(self, batches, pbar) -> List[Dict]:
+        """Read, classify and write batches concurrently; returns per-stage statistics"""
+        # The in-process model already uses every core, so direct mode runs one inference worker
+        inference_workers = 1 if self.use_direct_model else max(self.workers, 1)
+        pipeline = BatchPipeline(
+            batches,
+            [
+                Stage('classify', self.classify_batch, workers=inference_workers),
+                Stage('write', self.write_batch, workers=1)
+            ],
+            queue_size=self.queue_size,
+            on_complete=self.commit_batch,
+            progress=pbar
+        )
+        return pipeline.run()
     
-    def reclassify_all(self, category_filter: Optional[str] = None, sample_size: Optional[int] = None):
-        """Reclassify all emails"""
+    def reclassify_all(self, category_filter: Optional[str] = None, sample_size: Optional[int] = None,
+                       resume: bool = False):
+        """Reclassify all emails (continuing the checkpointed job with resume=True)"""
         
         print("\n" + "="*70)
         print("EMAIL RECLASSIFICATION")
@@ -289,17 +733,27 @@ class EmailReclassifier:
         print(f"  Batch Size: {self.batch_size}")
         print(f"  Confidence Threshold: {self.confidence_threshold}")
         print(f"  Classification Method: {'Direct Model' if self.use_direct_model else 'API'}")
+        print(f"  Inference Workers: {1 if self.use_direct_model else self.workers}")
         if category_filter:
             print(f"  Category Filter: {category_filter}")
         if sample_size:
             print(f"  Sample Size: {sample_size}")
+        if self.incremental:
+            print(f"  Incremental: {'content check (full scan)' if self.check_content else 'stale versions only'}"
+                  f", top-{self.top_k} affected categories")
         
-        # Get emails
-        print(f"\nFetching emails from MongoDB...")
-        emails = self.get_emails(category_filter, sample_size)
-        total_emails = len(emails)
+        self.prepare_versions()
         
-        if total_emails == 0:
+        self._run_start = time.time()
+        watermark = self.start_job(category_filter, sample_size, resume)
+        done = self.job['emails_done']
+        limit = max(sample_size - done, 0) if sample_size else None
+        
+        # Count emails; they are streamed from a cursor below
+        print(f"\nCounting emails in MongoDB...")
+        total_emails = self.count_emails(category_filter, limit, after=watermark) if limit != 0 else 0
+        
+        if total_emails == 0 and done == 0:
             print("✗ No emails found to reclassify")
             return
         
@@ -307,23 +761,25 @@ class EmailReclassifier:
         
         # Process in batches
         print(f"\nProcessing emails in batches of {self.batch_size}...")
+        print(f"  Checkpoint: {self.checkpoint.path}")
         
-        start_time = time.time()
-        
-        with tqdm(total=total_emails, desc="Reclassifying", unit="email") as pbar:
-            for i in range(0, total_emails, self.batch_size):
-                batch = emails[i:i + self.batch_size]
-                
-                # Process batch
-                results = self.process_batch(batch)
-                
-                # Update database
-                self.update_database(results)
-                
-                # Update progress
-                pbar.update(len(batch))
-        
-        elapsed_time = time.time() - start_time
+        # Reader, inference workers and writer overlap, connected by bounded queues
+        try:
+            with tqdm(total=done + total_emails, initial=done, desc="Reclassifying", unit="email") as pbar:
+                if total_emails:
+                    batches = self.iter_batches(self.get_emails(category_filter, limit, after=watermark))
+                    self.pipeline_stats = self.run_pipeline(batches, pbar)
+        except KeyboardInterrupt:
+            with self._commit_lock:
+                self.save_checkpoint('interrupted')
+            raise
+        except Exception:
+            with self._commit_lock:
+                self.save_checkpoint('failed')
+            raise
+        
+        self.save_checkpoint('completed')
+        elapsed_time = self.job['elapsed_seconds']
         
         # Generate report
         self.generate_report(elapsed_time)
@@ -340,21 +796,32 @@ class EmailReclassifier:
         print(f"  Total Processed: {self.stats['total_processed']}")
         print(f"  Total Updated: {self.stats['total_updated']}")
         print(f"  Total Skipped: {self.stats['total_skipped']}")
+        if self.check_content:
+            print(f"  Total Unchanged (up to date): {self.stats['total_unchanged']}")
         print(f"  Total Errors: {self.stats['total_errors']}")
+        if not self.dry_run:
+            print(f"  Modified in Database: {self.stats['total_modified']}")
         print(f"  Processing Time: {elapsed_time/60:.1f} minutes")
         print(f"  Speed: {self.stats['total_processed']/elapsed_time:.1f} emails/second")
         
+        # Pipeline stages
+        if self.pipeline_stats:
+            print(f"\n⚙ Pipeline Stages:")
+            for stage in self.pipeline_stats:
+                print(f"  {stage['stage']:10s} {stage['records_per_second']:8.1f} emails/s  "
+                      f"busy {stage['utilisation']:.0%} ({stage['workers']} worker(s))")
+        
         # Confidence statistics
-        if self.stats['confidence_scores']:
-            avg_confidence = sum(self.stats['confidence_scores']) / len(self.stats['confidence_scores'])
-            min_confidence = min(self.stats['confidence_scores'])
-            max_confidence = max(self.stats['confidence_scores'])
-            
+        scored = self.stats['total_processed']
+        avg_confidence = self.stats['confidence_sum'] / scored if scored else 0
+        min_confidence = self.stats['confidence_min'] or 0
+        max_confidence = self.stats['confidence_max'] or 0
+        if scored:
             print(f"\n🎯 Confidence Statistics:")
             print(f"  Average: {avg_confidence:.4f}")
             print(f"  Min: {min_confidence:.4f}")
             print(f"  Max: {max_confidence:.4f}")
-            print(f"  Low Confidence (<0.7): {len(self.stats['low_confidence_emails'])}")
+            print(f"  Low Confidence (<0.7): {self.stats['low_confidence_count']}")
         
         # Category changes
         print(f"\n🔄 Category Changes:")
@@ -375,7 +842,7 @@ class EmailReclassifier:
         
         # Errors
         if self.stats['errors']:
-            print(f"\n❌ Errors ({len(self.stats['errors'])}):")
+            print(f"\n❌ Errors ({self.stats['total_errors']}):")
             for error in self.stats['errors'][:5]:
                 print(f"  - Email ID: {error['email_id']}")
                 print(f"    Error: {error['error']}")
@@ -389,21 +856,30 @@ class EmailReclassifier:
                 'dry_run': self.dry_run,
                 'batch_size': self.batch_size,
                 'confidence_threshold': self.confidence_threshold,
-                'use_direct_model': self.use_direct_model
+                'use_direct_model': self.use_direct_model,
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'incremental': self.incremental,
+                'check_content': self.check_content,
+                'versions': {k: v for k, v in (self.versions or {}).items() if k != 'category_digests'}
             },
+            'pipeline': self.pipeline_stats,
             'statistics': {
                 'total_processed': self.stats['total_processed'],
                 'total_updated': self.stats['total_updated'],
                 'total_skipped': self.stats['total_skipped'],
+                'total_unchanged': self.stats['total_unchanged'],
                 'total_errors': self.stats['total_errors'],
+                'total_modified': self.stats['total_modified'],
                 'elapsed_time_seconds': elapsed_time,
                 'processing_speed': self.stats['total_processed']/elapsed_time if elapsed_time > 0 else 0
             },
             'confidence': {
-                'average': sum(self.stats['confidence_scores']) / len(self.stats['confidence_scores']) if self.stats['confidence_scores'] else 0,
-                'min': min(self.stats['confidence_scores']) if self.stats['confidence_scores'] else 0,
-                'max': max(self.stats['confidence_scores']) if self.stats['confidence_scores'] else 0,
-                'distribution': dict(Counter([round(c, 1) for c in self.stats['confidence_scores']]))
+                'average': avg_confidence,
+                'min': min_confidence,
+                'max': max_confidence,
+                'distribution': dict(self.stats['confidence_distribution']),
+                'low_confidence_count': self.stats['low_confidence_count']
             },
             'category_changes': {
                 old: dict(new) for old, new in self.stats['category_changes'].items()
@@ -418,7 +894,8 @@ class EmailReclassifier:
         print(f"\n✓ Detailed report saved: {report_file}")
     
     def close(self):
-        """Close MongoDB connection"""
+        """Close MongoDB connection and HTTP session"""
+        self.session.close()
         self.client.close()
 
 
@@ -441,6 +918,20 @@ def main():
                        help="Path to trained model (for direct mode)")
     parser.add_argument("--api-url", type=str, default=MODEL_SERVICE_URL,
                        help="Model service API URL")
+    parser.add_argument("--workers", type=int, default=4,
+                       help="Concurrent /predict/batch requests (API mode)")
+    parser.add_argument("--queue-size", type=int, default=4,
+                       help="Batches buffered between pipeline stages")
+    parser.add_argument("--checkpoint", type=str, default=CHECKPOINT_FILE,
+                       help="Job state file, updated after every committed batch")
+    parser.add_argument("--resume", action="store_true",
+                       help="Continue the interrupted job in --checkpoint from its watermark")
+    parser.add_argument("--incremental", action="store_true",
+                       help="Only reclassify emails whose model or category-set version is out of date")
+    parser.add_argument("--check-content", action="store_true",
+                       help="Incremental, also comparing content digests (scans all emails, classifies only stale ones)")
+    parser.add_argument("--top-k", type=int, default=AFFECTED_TOP_K,
+                       help="After a category change, reclassify emails with a changed category in their top-k scores")
     
     args = parser.parse_args()
     
@@ -451,18 +942,26 @@ def main():
         dry_run=args.dry_run,
         use_direct_model=args.use_direct_model,
         model_path=args.model_path,
-        model_service_url=args.api_url
+        model_service_url=args.api_url,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        checkpoint_file=args.checkpoint,
+        incremental=args.incremental,
+        check_content=args.check_content,
+        top_k=args.top_k
     )
     
     try:
         # Run reclassification
         reclassifier.reclassify_all(
             category_filter=args.category,
-            sample_size=args.sample
+            sample_size=args.sample,
+            resume=args.resume
         )
         
     except KeyboardInterrupt:
         print("\n\n⚠ Interrupted by user")
+        print(f"  Progress is checkpointed in {args.checkpoint}; rerun with --resume to continue")
     except Exception as e:
         print(f"\n\n❌ Error: {e}")
         import traceback
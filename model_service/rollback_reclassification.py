@@ -1,171 +1,382 @@
 """
 Rollback Reclassification
-Restores email classifications from a backup file
+Restores email classifications from a backup file or a server-side snapshot
+
+The backup is read line by line and restored with unordered bulk writes in bounded
+chunks; the number of emails restored is checkpointed after every chunk so an
+interrupted rollback can continue with --resume. Snapshots are merged back into the
+emails collection by the server, optionally limited to some categories or a date range.
 """
 
 import os
 import sys
 import json
+import hashlib
 import argparse
+import threading
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Iterator, Optional
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 try:
-    from pymongo import MongoClient
+    from pymongo import MongoClient, UpdateOne
+    from pymongo.errors import BulkWriteError
+    from bson import ObjectId
     from dotenv import load_dotenv
     from tqdm import tqdm
 except ImportError:
     print("Installing required packages...")
     os.system("pip install pymongo python-dotenv tqdm")
-    from pymongo import MongoClient
+    from pymongo import MongoClient, UpdateOne
+    from pymongo.errors import BulkWriteError
+    from bson import ObjectId
     from dotenv import load_dotenv
     from tqdm import tqdm
 
+from backup_classifications import (
+    iter_backup, read_manifest, snapshot_collection, SNAPSHOTS_COLLECTION, SNAPSHOT_CATEGORY_EXPR
+)
+from batch_pipeline import BatchPipeline, Stage
+
 # Load environment variables
 load_dotenv()
 
 MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/sortify')
 
+# Errors kept for the summary
+MAX_REPORTED_ERRORS = 1000
+
+
+class RollbackCheckpoint:
+    """Emails of a backup already restored, stored next to the backup file"""
+
+    def __init__(self, backup_file: str):
+        self.path = f"{backup_file}.rollback.json"
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save(self, state: Dict[str, Any]):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2, default=str)
+        os.replace(tmp_path, self.path)
+
+
+def record_id(email_backup: Dict[str, Any]):
+    """_id of a backed-up email (version 1 backups store it as the string email_id)"""
+    if '_id' in email_backup:
+        return email_backup['_id']
+    return ObjectId(email_backup['email_id'])
+
 
 class ClassificationRollback:
     """Rollback email classifications to previous state"""
-    
-    def __init__(self, mongodb_uri: str = MONGODB_URI):
+
+    def __init__(self, mongodb_uri: str = MONGODB_URI, chunk_size: int = 1000, workers: int = 2):
         self.client = MongoClient(mongodb_uri)
         self.db = self.client.get_database()
         self.emails_collection = self.db['emails']
-        
+        self.chunk_size = chunk_size
+        self.workers = workers
+
         self.stats = {
             'total_restored': 0,
+            'total_modified': 0,
             'total_skipped': 0,
             'total_errors': 0,
             'errors': []
         }
-    
-    def load_backup(self, backup_file: str) -> Dict[str, Any]:
-        """Load backup file"""
+        self.manifest = None
+        self._commit_lock = threading.Lock()
+
+    def build_update(self, email_backup: Dict[str, Any], backup_file: str, backup_date: str) -> Optional[UpdateOne]:
+        """Restoration update for one backed-up email, or None if there is nothing to restore"""
+        update = {'$set': {}}
+
+        # Restore category if exists
+        if email_backup.get('category'):
+            update['$set']['category'] = email_backup['category']
+
+        # Restore classification if exists
+        if email_backup.get('classification'):
+            update['$set']['classification'] = email_backup['classification']
+
+        if not update['$set']:
+            return None
+
+        # Add rollback metadata
+        update['$set']['rollbackMetadata'] = {
+            'rolledBackAt': datetime.now(),
+            'backupFile': os.path.basename(backup_file),
+            'backupDate': backup_date
+        }
+        return UpdateOne({'_id': record_id(email_backup)}, update)
+
+    def iter_chunks(self, records: Iterator[Dict[str, Any]], skip: int) -> Iterator[List[Dict[str, Any]]]:
+        """Backed-up emails in chunks of chunk_size, after the first `skip` emails; keeps the trailing manifest"""
+        chunk = []
+        seen = 0
+        for record in records:
+            if record.get('type') == 'manifest':
+                self.manifest = record
+            if record.get('type') != 'email':
+                continue
+            seen += 1
+            if seen <= skip:
+                continue
+            chunk.append(record)
+            if len(chunk) == self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def restore_chunk(self, chunk: List[Dict[str, Any]], backup_file: str, backup_date: str, dry_run: bool) -> Dict[str, Any]:
+        """Restore one chunk with a single unordered bulk write; returns its stats"""
+        result = {'count': len(chunk), 'restored': 0, 'modified': 0, 'skipped': 0, 'errors': []}
+        operations = []
+        for email_backup in chunk:
+            try:
+                operation = self.build_update(email_backup, backup_file, backup_date)
+            except Exception as e:
+                result['errors'].append({'email_id': str(email_backup.get('_id', email_backup.get('email_id', 'unknown'))), 'error': str(e)})
+                continue
+            if operation is None:
+                result['skipped'] += 1
+            else:
+                operations.append(operation)
+
+        if dry_run or not operations:
+            result['restored'] = len(operations)
+            return result
+
+        try:
+            write = self.emails_collection.bulk_write(operations, ordered=False)
+            result['restored'] = len(operations)
+            result['modified'] = write.modified_count
+        except BulkWriteError as e:
+            details = e.details or {}
+            write_errors = details.get('writeErrors', [])
+            result['restored'] = len(operations) - len(write_errors)
+            result['modified'] = details.get('nModified', 0)
+            for error in write_errors:
+                op = error.get('op') or {}
+                result['errors'].append({'email_id': str(op.get('q', {}).get('_id', 'unknown')), 'error': error.get('errmsg', '')})
+        return result
+
+    def restore_from_backup(self, backup_file: str, dry_run: bool = False, resume: bool = False):
+        """Restore classifications from backup"""
+
+        print("\n" + "="*70)
+        print("CLASSIFICATION ROLLBACK")
+        print("="*70)
+        print(f"\nMode: {'DRY RUN (preview only)' if dry_run else 'LIVE RESTORE'}")
         print(f"Loading backup from: {backup_file}")
-        
+
         if not os.path.exists(backup_file):
             raise FileNotFoundError(f"Backup file not found: {backup_file}")
-        
-        with open(backup_file, 'r', encoding='utf-8') as f:
-            backup_data = json.load(f)
-        
-        print(f"✓ Loaded backup with {backup_data['total_emails']} emails")
-        print(f"  Backup date: {backup_data['backup_date']}")
-        
-        return backup_data
-    
-    def restore_from_backup(self, backup_file: str, dry_run: bool = False):
-        """Restore classifications from backup"""
-        
+
+        checksum = hashlib.sha256()
+        records = iter_backup(backup_file, checksum)
+        header = next(records, None)
+        if header is None or header.get('type') != 'header':
+            raise ValueError(f"Not a classification backup: {backup_file}")
+        backup_date = header.get('backup_date')
+        print(f"  Backup date: {backup_date}")
+
+        manifest = read_manifest(backup_file)
+        total = manifest['total_emails'] if manifest else None
+        if total is not None:
+            print(f"✓ Backup contains {total} emails")
+
+        # Resume after the emails already restored
+        checkpoint = RollbackCheckpoint(backup_file)
+        skip = 0
+        if resume and not dry_run:
+            state = checkpoint.load()
+            if state is None:
+                print("⚠ No rollback checkpoint found, starting from the beginning")
+            elif state.get('backup_date') != backup_date:
+                raise ValueError(f"Checkpoint {checkpoint.path} belongs to another backup ({state.get('backup_date')})")
+            else:
+                skip = state['emails_done']
+                for key in ('total_restored', 'total_modified', 'total_skipped', 'total_errors', 'errors'):
+                    self.stats[key] = state['stats'][key]
+                print(f"✓ Resuming after {skip} emails ({state.get('status')})")
+
+        if dry_run:
+            print("\n⚠ DRY RUN MODE - No changes will be made\n")
+
+        # Chunks finish out of order; the checkpoint only advances over a contiguous prefix
+        emails_done = skip
+        next_seq = 0
+        pending = {}
+
+        def save_checkpoint(status: str):
+            if dry_run:
+                return
+            checkpoint.save({
+                'backup_file': os.path.basename(backup_file),
+                'backup_date': backup_date,
+                'status': status,
+                'emails_done': emails_done,
+                'updated_at': datetime.now().isoformat(),
+                'stats': self.stats
+            })
+
+        def commit_chunk(seq: int, result: Dict[str, Any]):
+            nonlocal emails_done, next_seq
+            with self._commit_lock:
+                pending[seq] = result
+                while next_seq in pending:
+                    done = pending.pop(next_seq)
+                    next_seq += 1
+                    emails_done += done['count']
+                    self.stats['total_restored'] += done['restored']
+                    self.stats['total_modified'] += done['modified']
+                    self.stats['total_skipped'] += done['skipped']
+                    self.stats['total_errors'] += len(done['errors'])
+                    room = MAX_REPORTED_ERRORS - len(self.stats['errors'])
+                    self.stats['errors'].extend(done['errors'][:max(room, 0)])
+                save_checkpoint('running')
+
+        restore = Stage('restore', lambda chunk: self.restore_chunk(chunk, backup_file, backup_date, dry_run), workers=self.workers)
+        status = 'failed'
+        try:
+            with tqdm(total=total, initial=skip, desc="Restoring", unit="email") as pbar:
+                BatchPipeline(self.iter_chunks(records, skip), [restore], on_complete=commit_chunk, progress=pbar).run()
+            status = 'completed'
+        except KeyboardInterrupt:
+            status = 'interrupted'
+            print(f"\n⚠ Rollback interrupted after {emails_done} emails; rerun with --resume to continue")
+            raise
+        finally:
+            with self._commit_lock:
+                save_checkpoint(status)
+
+        # The trailing manifest vouches for the whole file
+        footer = self.manifest
+        if footer is None:
+            print("\n⚠ Backup has no manifest - it may be truncated")
+        elif footer.get('total_emails') != emails_done:
+            print(f"\n⚠ Backup manifest lists {footer.get('total_emails')} emails, {emails_done} were read")
+        elif 'sha256' in footer and checksum.hexdigest() != footer['sha256']:
+            print("\n⚠ Backup checksum mismatch")
+
+        # Print results
+        self.print_results(dry_run)
+
+    def snapshot_filter(self, categories: Optional[List[str]] = None, since: datetime = None, until: datetime = None) -> Dict[str, Any]:
+        """Snapshot entries to restore: by category as of the snapshot and by email date"""
+        clauses = []
+        if categories:
+            clauses.append({'$expr': {'$in': [SNAPSHOT_CATEGORY_EXPR, categories]}})
+        if since or until:
+            date_range = {}
+            if since:
+                date_range['$gte'] = since
+            if until:
+                date_range['$lt'] = until
+            clauses.append({'date': date_range})
+        return {'$and': clauses} if clauses else {}
+
+    def restore_from_snapshot(
+        self,
+        name: str,
+        dry_run: bool = False,
+        categories: Optional[List[str]] = None,
+        since: datetime = None,
+        until: datetime = None
+    ):
+        """Merge classifications from a snapshot collection back into emails, server-side"""
+        name = snapshot_collection(name)
+
         print("\n" + "="*70)
-        print("CLASSIFICATION ROLLBACK")
+        print("CLASSIFICATION ROLLBACK (SNAPSHOT)")
         print("="*70)
         print(f"\nMode: {'DRY RUN (preview only)' if dry_run else 'LIVE RESTORE'}")
-        
-        # Load backup
-        backup_data = self.load_backup(backup_file)
-        emails_to_restore = backup_data['emails']
-        
-        print(f"\nRestoring {len(emails_to_restore)} email classifications...")
-        
+
+        entry = self.db[SNAPSHOTS_COLLECTION].find_one({'_id': name})
+        if entry is None:
+            raise ValueError(f"Snapshot not found: {name}")
+        snapshot = self.db[name]
+        backup_date = entry['createdAt'].isoformat()
+        print(f"Snapshot: {name}")
+        print(f"  Snapshot date: {backup_date}")
+        print(f"✓ Snapshot contains {entry['totalEmails']} emails")
+        if categories:
+            print(f"  Categories: {', '.join(categories)}")
+        if since or until:
+            print(f"  Email dates: {since.date() if since else '...'} to {until.date() if until else '...'}")
+
+        # Same rule as build_update: entries with neither category nor classification are skipped
+        selected = self.snapshot_filter(categories, since, until)
+        restorable = {'$and': [selected, {'$or': [
+            {'category': {'$nin': [None, '']}},
+            {'classification': {'$nin': [None, {}]}}
+        ]}]}
+        total = snapshot.count_documents(selected)
+        count = snapshot.count_documents(restorable)
+
         if dry_run:
             print("\n⚠ DRY RUN MODE - No changes will be made\n")
-        
-        # Process emails
-        from pymongo import UpdateOne
-        bulk_operations = []
-        
-        with tqdm(total=len(emails_to_restore), desc="Restoring", unit="email") as pbar:
-            for email_backup in emails_to_restore:
-                try:
-                    email_id = email_backup['email_id']
-                    
-                    # Prepare restoration update
-                    update = {
-                        '$set': {}
+        else:
+            start = datetime.now()
+            snapshot.aggregate([
+                {'$match': restorable},
+                {'$project': {
+                    'category': {'$cond': [{'$eq': [{'$ifNull': ['$category', '']}, '']}, '$$REMOVE', '$category']},
+                    'classification': {'$cond': [
+                        {'$eq': [{'$ifNull': ['$classification', {'$literal': {}}]}, {'$literal': {}}]},
+                        '$$REMOVE',
+                        '$classification'
+                    ]},
+                    'rollbackMetadata': {
+                        'rolledBackAt': '$$NOW',
+                        'snapshot': name,
+                        'backupDate': backup_date
                     }
-                    
-                    # Restore category if exists
-                    if email_backup.get('category'):
-                        update['$set']['category'] = email_backup['category']
-                    
-                    # Restore classification if exists
-                    if email_backup.get('classification'):
-                        update['$set']['classification'] = email_backup['classification']
-                    
-                    # Add rollback metadata
-                    update['$set']['rollbackMetadata'] = {
-                        'rolledBackAt': datetime.now(),
-                        'backupFile': os.path.basename(backup_file),
-                        'backupDate': backup_data['backup_date']
-                    }
-                    
-                    if update['$set']:
-                        # Convert string ID to ObjectId
-                        from bson import ObjectId
-                        obj_id = ObjectId(email_id)
-                        
-                        if not dry_run:
-                            bulk_operations.append(
-                                UpdateOne(
-                                    {'_id': obj_id},
-                                    update
-                                )
-                            )
-                        
-                        self.stats['total_restored'] += 1
-                    else:
-                        self.stats['total_skipped'] += 1
-                    
-                except Exception as e:
-                    self.stats['total_errors'] += 1
-                    self.stats['errors'].append({
-                        'email_id': email_backup.get('email_id', 'unknown'),
-                        'error': str(e)
-                    })
-                
-                pbar.update(1)
-        
-        # Execute bulk restore
-        if not dry_run and bulk_operations:
-            print(f"\nExecuting bulk restore...")
-            try:
-                result = self.emails_collection.bulk_write(bulk_operations, ordered=False)
-                print(f"✓ Restored {result.modified_count} emails")
-            except Exception as e:
-                print(f"✗ Bulk restore error: {e}")
-                self.stats['total_errors'] += 1
-        
+                }},
+                # Emails deleted since the snapshot are not recreated
+                {'$merge': {'into': self.emails_collection.name, 'on': '_id', 'whenMatched': 'merge', 'whenNotMatched': 'discard'}}
+            ])
+            print(f"✓ Merged snapshot in {(datetime.now() - start).total_seconds():.1f}s")
+
+        self.stats['total_restored'] += count
+        self.stats['total_skipped'] += total - count
+
         # Print results
         self.print_results(dry_run)
-    
+
     def print_results(self, dry_run: bool):
         """Print rollback results"""
-        
+
         print("\n" + "="*70)
         print("ROLLBACK COMPLETE" if not dry_run else "DRY RUN COMPLETE")
         print("="*70)
-        
+
         print(f"\n📊 Summary:")
         print(f"  Total Restored: {self.stats['total_restored']}")
+        if not dry_run:
+            print(f"  Total Modified: {self.stats['total_modified']}")
         print(f"  Total Skipped: {self.stats['total_skipped']}")
         print(f"  Total Errors: {self.stats['total_errors']}")
-        
+
         if self.stats['errors']:
-            print(f"\n❌ Errors ({len(self.stats['errors'])}):")
+            print(f"\n❌ Errors ({self.stats['total_errors']}):")
             for error in self.stats['errors'][:10]:
                 print(f"  - Email ID: {error['email_id']}")
                 print(f"    Error: {error['error']}")
-        
+
         if dry_run:
             print(f"\n⚠ This was a DRY RUN - no changes were made")
             print(f"  Run without --dry-run to perform actual rollback")
-    
+
     def close(self):
         """Close MongoDB connection"""
         self.client.close()
@@ -174,28 +385,53 @@ class ClassificationRollback:
 def main():
     """Main rollback function"""
     parser = argparse.ArgumentParser(description="Rollback email classifications from backup")
-    parser.add_argument("backup_file", type=str,
+    parser.add_argument("backup_file", type=str, nargs="?",
                        help="Path to backup file")
+    parser.add_argument("--snapshot", type=str, default=None,
+                       help="Restore from a server-side snapshot collection instead of a file")
+    parser.add_argument("--category", action="append", default=None,
+                       help="Snapshot restore: only emails in this category as of the snapshot (repeatable)")
+    parser.add_argument("--since", type=datetime.fromisoformat, default=None,
+                       help="Snapshot restore: only emails dated on or after this date (YYYY-MM-DD)")
+    parser.add_argument("--until", type=datetime.fromisoformat, default=None,
+                       help="Snapshot restore: only emails dated before this date (YYYY-MM-DD)")
     parser.add_argument("--dry-run", action="store_true",
                        help="Preview restore without making changes")
-    
+    parser.add_argument("--resume", action="store_true",
+                       help="Continue an interrupted rollback from its checkpoint")
+    parser.add_argument("--chunk-size", type=int, default=1000,
+                       help="Emails per bulk write")
+    parser.add_argument("--workers", type=int, default=2,
+                       help="Concurrent bulk writes")
+
     args = parser.parse_args()
-    
+
+    if bool(args.backup_file) == bool(args.snapshot):
+        parser.error("give either a backup file or --snapshot")
+    if not args.snapshot and (args.category or args.since or args.until):
+        parser.error("--category, --since and --until apply to --snapshot restores")
+
     # Confirm action
     if not args.dry_run:
         print("\n⚠ WARNING: This will restore email classifications from backup")
-        print(f"   Backup file: {args.backup_file}")
+        if args.snapshot:
+            print(f"   Snapshot: {args.snapshot}")
+        else:
+            print(f"   Backup file: {args.backup_file}")
         response = input("\nAre you sure you want to proceed? (yes/no): ")
-        
+
         if response.lower() != 'yes':
             print("Rollback cancelled")
             return
-    
+
     # Initialize rollback
-    rollback = ClassificationRollback()
-    
+    rollback = ClassificationRollback(chunk_size=args.chunk_size, workers=args.workers)
+
     try:
-        rollback.restore_from_backup(args.backup_file, args.dry_run)
+        if args.snapshot:
+            rollback.restore_from_snapshot(args.snapshot, args.dry_run, args.category, args.since, args.until)
+        else:
+            rollback.restore_from_backup(args.backup_file, args.dry_run, args.resume)
     except Exception as e:
         print(f"\n❌ Rollback failed: {e}")
         import traceback
@@ -206,4 +442,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
@@ -153,7 +153,7 @@ if [ "$SKIP_BACKUP" = false ] && [ "$DRY_RUN" = false ]; then
     echo -e "${YELLOW}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━${NC}"
     echo ""
     
-    BACKUP_FILE="classification_backup_$(date +%Y%m%d_%H%M%S).json"
+    BACKUP_FILE="classification_backup_$(date +%Y%m%d_%H%M%S).ndjson.gz"
     
     $PYTHON_CMD backup_classifications.py --output "$BACKUP_FILE"
     
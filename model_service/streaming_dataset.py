@@ -0,0 +1,268 @@
+"""
+Streaming Dataset Loader for Large Email Corpora
+Reads sharded JSONL/Parquet in bounded memory, splits it by label in one pass and feeds the Trainer
+"""
+
+import os
+import glob
+import json
+import math
+import logging
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from torch.utils.data import IterableDataset, get_worker_info
+from transformers import TrainerCallback
+
+from distilbert_trainer import example_text_and_label, in_fixed_validation, text_digest
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Rows read per Parquet batch
+PARQUET_BATCH_ROWS = 10000
+
+
+def expand_shards(data_files) -> List[str]:
+    """Sorted shard paths from a path, glob, comma-separated list or list of those"""
+    if isinstance(data_files, str):
+        data_files = [part for part in data_files.split(',') if part]
+
+    shards = []
+    for pattern in data_files:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for path in matches:
+            if os.path.isdir(path):
+                matches_in_dir = sorted(glob.glob(os.path.join(path, '*.jsonl')) + glob.glob(os.path.join(path, '*.parquet')))
+                shards.extend(matches_in_dir)
+            else:
+                shards.append(path)
+
+    missing = [path for path in shards if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"Dataset shards not found: {missing}")
+    if not shards:
+        raise FileNotFoundError(f"No dataset shards match {data_files}")
+    return shards
+
+
+def iter_shard_records(path: str) -> Iterator[Dict[str, Any]]:
+    """Records of one JSONL or Parquet shard, read incrementally"""
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=PARQUET_BATCH_ROWS):
+            yield from batch.to_pylist()
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def iter_examples(shards: List[str]) -> Iterator[Tuple[str, str]]:
+    """(text, label name) pairs of the shards in order, skipping unusable records"""
+    for path in shards:
+        for record in iter_shard_records(path):
+            text, label = example_text_and_label(record)
+            if text is not None and label is not None:
+                yield text, label
+
+
+class CorpusSplit:
+    """
+    Label statistics and the validation set of a corpus, computed in one streaming pass
+
+    An example is a validation candidate when its text digest falls in the fixed
+    validation slice (see in_fixed_validation), so the split is stratified by label in
+    expectation and stable as the corpus grows. With `max_validation_per_label`, a seeded
+    reservoir per label keeps a uniform sample of each label's candidates and the rest
+    train. Memory is bounded by the validation set, not the corpus.
+    """
+
+    def __init__(
+        self,
+        data_files,
+        validation_percent: int = 10,
+        max_validation_per_label: Optional[int] = 2000,
+        seed: int = 42
+    ):
+        self.shards = expand_shards(data_files)
+        self.validation_percent = validation_percent
+        self.max_validation_per_label = max_validation_per_label
+        self.seed = seed
+
+        self.label_counts: Counter = Counter()
+        self.validation: Dict[str, List[Tuple[str, str]]] = defaultdict(list)
+        self._scan()
+
+        self.label2id = {label: idx for idx, label in enumerate(sorted(self.label_counts))}
+        self.id2label = {idx: label for label, idx in self.label2id.items()}
+        self.validation_digests = {digest for examples in self.validation.values() for digest, _ in examples}
+        self.validation_counts = Counter({label: len(examples) for label, examples in self.validation.items()})
+        self.train_counts = self.label_counts - self.validation_counts
+
+    def _scan(self):
+        rng = np.random.default_rng(self.seed)
+        candidates_seen: Counter = Counter()
+        for text, label in iter_examples(self.shards):
+            self.label_counts[label] += 1
+            digest = text_digest(text)
+            if not in_fixed_validation(digest, self.validation_percent):
+                continue
+
+            reservoir = self.validation[label]
+            candidates_seen[label] += 1
+            cap = self.max_validation_per_label
+            if cap is None or len(reservoir) < cap:
+                reservoir.append((digest, text))
+            else:
+                # Algorithm R: keep each candidate with probability cap / seen
+                slot = int(rng.integers(candidates_seen[label]))
+                if slot < cap:
+                    reservoir[slot] = (digest, text)
+
+        logger.info(f"Scanned {sum(self.label_counts.values())} examples in {len(self.shards)} shards; "
+                    f"{sum(len(v) for v in self.validation.values())} held out for validation")
+
+    @property
+    def num_train(self) -> int:
+        return sum(self.train_counts.values())
+
+    def is_validation(self, text: str) -> bool:
+        return text_digest(text) in self.validation_digests
+
+    def validation_examples(self) -> Tuple[List[str], List[int]]:
+        """Validation texts and label ids, ordered by label"""
+        texts, labels = [], []
+        for label in sorted(self.validation):
+            for _, text in self.validation[label]:
+                texts.append(text)
+                labels.append(self.label2id[label])
+        return texts, labels
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'shards': len(self.shards),
+            'examples': sum(self.label_counts.values()),
+            'train': dict(self.train_counts),
+            'validation': dict(self.validation_counts),
+            'validation_percent': self.validation_percent,
+            'max_validation_per_label': self.max_validation_per_label
+        }
+
+
+class StreamingEmailDataset(IterableDataset):
+    """
+    Tokenized training examples streamed from the shards of a CorpusSplit
+
+    Each epoch visits the shards in a seeded order and passes examples through a
+    shuffle buffer, so the order is deterministic for a given seed and epoch. With
+    length grouping, every megabatch of examples is sorted by length, cut into batches
+    and the batches are shuffled, mirroring BatchPlanner. DataLoader workers take
+    disjoint examples.
+    """
+
+    def __init__(
+        self,
+        corpus: CorpusSplit,
+        tokenizer,
+        max_length: int = 256,
+        batch_size: int = 16,
+        shuffle_buffer: int = 10000,
+        batching: str = 'length_grouped',
+        megabatch_factor: int = 50,
+        seed: int = 42
+    ):
+        self.corpus = corpus
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.shuffle_buffer = shuffle_buffer
+        self.batching = batching
+        self.megabatch_factor = megabatch_factor
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def steps_per_epoch(self) -> int:
+        return math.ceil(self.corpus.num_train / self.batch_size)
+
+    def _shuffled_examples(self, rng: np.random.Generator) -> Iterator[Tuple[str, str]]:
+        worker = get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker else (0, 1)
+
+        shards = [self.corpus.shards[i] for i in rng.permutation(len(self.corpus.shards))]
+        buffer: List[Tuple[str, str]] = []
+        index = 0
+        for text, label in iter_examples(shards):
+            if self.corpus.is_validation(text):
+                continue
+            index += 1
+            if index % num_workers != worker_id:
+                continue
+
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append((text, label))
+                continue
+            slot = int(rng.integers(len(buffer)))
+            yield buffer[slot]
+            buffer[slot] = (text, label)
+
+        for i in rng.permutation(len(buffer)):
+            yield buffer[i]
+
+    def _tokenize(self, chunk: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        encoding = self.tokenizer([text for text, _ in chunk], truncation=True, max_length=self.max_length)
+        return [
+            {
+                'input_ids': encoding['input_ids'][i],
+                'attention_mask': encoding['attention_mask'][i],
+                'labels': self.corpus.label2id[label]
+            }
+            for i, (_, label) in enumerate(chunk)
+        ]
+
+    def _emit(self, chunk: List[Tuple[str, str]], rng: np.random.Generator) -> Iterator[Dict[str, Any]]:
+        features = self._tokenize(chunk)
+        if self.batching != 'length_grouped':
+            yield from features
+            return
+
+        features.sort(key=lambda f: len(f['input_ids']))
+        batches = [features[i:i + self.batch_size] for i in range(0, len(features), self.batch_size)]
+        for b in rng.permutation(len(batches)):
+            yield from batches[b]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        rng = np.random.default_rng([self.seed, self.epoch])
+        chunk_size = self.batch_size * (self.megabatch_factor if self.batching == 'length_grouped' else 4)
+        chunk: List[Tuple[str, str]] = []
+        for example in self._shuffled_examples(rng):
+            chunk.append(example)
+            if len(chunk) == chunk_size:
+                yield from self._emit(chunk, rng)
+                chunk = []
+        if chunk:
+            yield from self._emit(chunk, rng)
+
+
+class StreamEpochCallback(TrainerCallback):
+    """
+    Advances the streaming dataset's shuffle seed at every epoch
+
+    Epochs are counted here: with max_steps, state.epoch is a fraction of the whole run,
+    not the number of passes over the stream.
+    """
+
+    def __init__(self, dataset: StreamingEmailDataset):
+        self.dataset = dataset
+        self.epochs_started = 0
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        self.dataset.set_epoch(self.epochs_started)
+        self.epochs_started += 1
+
@@ -0,0 +1,397 @@
+"""
+Synthetic Mailbox Generator
+Generates realistic emails per category from the patterns in categories.json and
+category_templates.json, for exercising and benchmarking the Mongo-backed batch tools
+
+Emails follow the Email schema of the server: subject and body are drawn from each
+category's subject patterns, keywords and phrases, senders from its domains and sender
+patterns with a skewed (Zipf) per-sender volume, send times from its peak hours, and a
+share of emails carry HTML bodies and attachments. Generation is seeded and streams, so
+a million emails can be written without holding them in memory.
+"""
+
+import os
+import sys
+import json
+import gzip
+import random
+import hashlib
+import argparse
+import itertools
+from bisect import bisect
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from pymongo import MongoClient
+    from bson import ObjectId, json_util
+    from dotenv import load_dotenv
+    from tqdm import tqdm
+except ImportError:
+    print("Installing required packages...")
+    os.system("pip install pymongo python-dotenv tqdm")
+    from pymongo import MongoClient
+    from bson import ObjectId, json_util
+    from dotenv import load_dotenv
+    from tqdm import tqdm
+
+# Load environment variables
+load_dotenv()
+
+MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/sortify')
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+CATEGORIES_FILE = os.path.join(SERVICE_DIR, 'categories.json')
+TEMPLATES_FILE = os.path.join(SERVICE_DIR, 'category_templates.json')
+
+# Meta-categories that never label an email
+EXCLUDED_CATEGORIES = {'All'}
+
+FIRST_NAMES = ['Aarav', 'Priya', 'Rahul', 'Ananya', 'Vikram', 'Sneha', 'Arjun', 'Neha', 'Karan', 'Isha',
+               'Rohan', 'Meera', 'Aditya', 'Kavya', 'Siddharth', 'Pooja', 'John', 'Sarah', 'David', 'Emily']
+LAST_NAMES = ['Sharma', 'Verma', 'Gupta', 'Singh', 'Kumar', 'Patel', 'Mehta', 'Iyer', 'Reddy', 'Nair',
+              'Joshi', 'Chopra', 'Smith', 'Johnson', 'Brown', 'Wilson']
+
+SUBJECT_TEMPLATES = [
+    '{Pattern}', '{Pattern}: {keyword}', 'Re: {Pattern}', '{Pattern} - {keyword} update',
+    'Reminder: {pattern} {keyword}', 'Important: {Pattern}', '{Pattern} ({day})', 'Fwd: {Pattern} {keyword}'
+]
+SENTENCE_TEMPLATES = [
+    'This is regarding the {phrase} scheduled for {day}.',
+    'Please find the details of the {phrase} below.',
+    'All students are requested to note the {keyword} and {keyword2} information.',
+    'Kindly complete the {keyword} before the deadline on {day}.',
+    'For any queries about the {phrase}, contact the {keyword} office.',
+    'We are pleased to share an update on {phrase}.',
+    'The {keyword} session will cover {phrase} and {keyword2}.',
+    'Make sure to review the {keyword2} guidelines shared earlier.'
+]
+FILLER_SENTENCES = [
+    'Thank you for your attention.', 'Further details will be shared soon.',
+    'Please ignore this email if already done.', 'Regards and best wishes.',
+    'This is a system generated message.', 'Looking forward to your participation.'
+]
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+DEFAULT_MIME_TYPES = ['application/pdf', 'image/png', 'image/jpeg',
+                      'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+                      'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet']
+MIME_EXTENSIONS = {'application/pdf': 'pdf', 'image/png': 'png', 'image/jpeg': 'jpg',
+                   'application/vnd.openxmlformats-officedocument.wordprocessingml.document': 'docx',
+                   'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': 'xlsx'}
+
+
+def slug(value: str) -> str:
+    return ''.join(ch if ch.isalnum() else '-' for ch in value.lower()).strip('-') or 'mail'
+
+
+def zipf_weights(n: int, skew: float) -> List[float]:
+    """Cumulative weights 1/rank**skew for n items"""
+    return list(itertools.accumulate(1.0 / (rank ** skew) for rank in range(1, n + 1)))
+
+
+def load_category_profiles(categories_file: str = CATEGORIES_FILE,
+                           templates_file: Optional[str] = TEMPLATES_FILE) -> Dict[str, Dict[str, Any]]:
+    """
+    Generation profile per category
+
+    categories.json categories come first; template categories not defined there are
+    added, and templates fill patterns a category leaves empty.
+    """
+    with open(categories_file, 'r', encoding='utf-8') as f:
+        categories = json.load(f).get('categories', {})
+    templates = {}
+    if templates_file and os.path.exists(templates_file):
+        with open(templates_file, 'r', encoding='utf-8') as f:
+            templates = json.load(f).get('templates', {})
+
+    profiles = {}
+    for name in list(categories) + [name for name in templates if name not in categories]:
+        if name in EXCLUDED_CATEGORIES:
+            continue
+        sources = [data for data in (categories.get(name), templates.get(name)) if data]
+
+        def pick(*path, default=None):
+            for data in sources:
+                value = data
+                for key in path:
+                    value = value.get(key) if isinstance(value, dict) else None
+                if value:
+                    return value
+            return default
+
+        keywords = list(dict.fromkeys((pick('keywords', default=[]) or []) +
+                                      (pick('classification_strategy', 'bodyAnalysis', 'keywords', default=[]) or [])))
+        keywords = keywords or [name.lower()]
+
+        domains = []
+        for domain in pick('classification_strategy', 'headerAnalysis', 'senderDomains', default=[]):
+            domain = domain.split('@')[-1].lower()
+            domains.append(domain if '.' in domain else f"{slug(domain)}.example.com")
+        hours = (pick('classification_strategy', 'metadataAnalysis', 'timePatterns', 'peakHours') or
+                 pick('classification_strategy', 'metadataAnalysis', 'timePatterns', 'typicalHours') or
+                 list(range(8, 21)))
+        # Days are JavaScript getDay() numbers (0 = Sunday)
+        days = pick('classification_strategy', 'metadataAnalysis', 'timePatterns', 'typicalDays') or list(range(7))
+
+        profiles[name] = {
+            'keywords': keywords,
+            'phrases': pick('classification_strategy', 'bodyAnalysis', 'phrases') or keywords,
+            'subject_patterns': pick('classification_strategy', 'headerAnalysis', 'subjectPatterns') or keywords,
+            'sender_patterns': pick('classification_strategy', 'headerAnalysis', 'senderPatterns') or [name],
+            'domains': list(dict.fromkeys(domains)) or [f"{slug(name)}.example.com"],
+            'hours': hours,
+            'weekdays': sorted({(day - 1) % 7 for day in days}),
+            'length_range': pick('classification_strategy', 'metadataAnalysis', 'lengthPatterns', 'typicalRange') or [200, 2000],
+            'mime_types': pick('classification_strategy', 'metadataAnalysis', 'attachmentPatterns', 'commonTypes') or DEFAULT_MIME_TYPES,
+            'external_links': bool(pick('classification_strategy', 'metadataAnalysis', 'attachmentPatterns', 'hasExternalLinks'))
+        }
+    return profiles
+
+
+class SyntheticMailbox:
+    """Seeded generator of Email documents following the category profiles"""
+
+    def __init__(self,
+                 profiles: Optional[Dict[str, Dict[str, Any]]] = None,
+                 seed: int = 42,
+                 users: int = 1,
+                 category_skew: float = 0.8,
+                 sender_skew: float = 1.2,
+                 senders_per_category: int = 40,
+                 html_rate: float = 0.7,
+                 attachment_rate: float = 0.15,
+                 deleted_rate: float = 0.02,
+                 days: int = 365,
+                 end_date: Optional[datetime] = None):
+        self.profiles = profiles if profiles is not None else load_category_profiles()
+        self.rng = random.Random(seed)
+        self.html_rate = html_rate
+        self.attachment_rate = attachment_rate
+        self.deleted_rate = deleted_rate
+        self.days = days
+        self.end_date = end_date or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+        self.user_ids = [ObjectId(hashlib.md5(f"user-{seed}-{i}".encode()).hexdigest()[:24]) for i in range(users)]
+        self.user_addresses = [f"student{i}@ug.sharda.ac.in" for i in range(users)]
+
+        # Category volumes follow a Zipf law over a seeded order of the categories
+        self.categories = list(self.profiles)
+        self.rng.shuffle(self.categories)
+        self.category_weights = zipf_weights(len(self.categories), category_skew)
+
+        # A few senders send most of each category's mail
+        self.senders = {name: self._make_senders(name, senders_per_category) for name in self.categories}
+        self.sender_weights = zipf_weights(senders_per_category, sender_skew)
+
+    def _make_senders(self, category: str, count: int) -> List[str]:
+        profile = self.profiles[category]
+        senders = []
+        for _ in range(count):
+            domain = self.rng.choice(profile['domains'])
+            pattern = self.rng.choice(profile['sender_patterns'])
+            if self.rng.random() < 0.5:
+                first, last = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+                name = f"{first} {last} ({pattern})" if self.rng.random() < 0.3 else f"{first} {last}"
+                local = f"{first}.{last}".lower()
+            else:
+                name = pattern.title() if pattern.islower() else pattern
+                local = slug(pattern).replace('-', '.')
+            senders.append(f"{name} <{local}@{domain}>")
+        return senders
+
+    def _choose(self, items: List[Any], cumulative: List[float]) -> Any:
+        return items[bisect(cumulative, self.rng.random() * cumulative[-1])]
+
+    def _sentence(self, profile: Dict[str, Any]) -> str:
+        return self.rng.choice(SENTENCE_TEMPLATES).format(
+            phrase=self.rng.choice(profile['phrases']),
+            keyword=self.rng.choice(profile['keywords']),
+            keyword2=self.rng.choice(profile['keywords']),
+            day=self.rng.choice(DAYS)
+        )
+
+    def _body(self, profile: Dict[str, Any]) -> List[List[str]]:
+        """Paragraphs of sentences with a length drawn log-uniformly from the category's range"""
+        low, high = profile['length_range']
+        target = int(low * (max(high, low + 1) / max(low, 1)) ** self.rng.random())
+        paragraphs, paragraph, length = [], [], 0
+        while length < target:
+            sentence = self._sentence(profile) if self.rng.random() < 0.8 else self.rng.choice(FILLER_SENTENCES)
+            paragraph.append(sentence)
+            length += len(sentence) + 1
+            if len(paragraph) >= self.rng.randint(2, 5):
+                paragraphs.append(paragraph)
+                paragraph = []
+        if paragraph:
+            paragraphs.append(paragraph)
+        return paragraphs
+
+    def _html(self, paragraphs: List[List[str]], domain: str, links: bool) -> str:
+        parts = ['<html><head><meta charset="utf-8"><style>p{font-family:Arial;font-size:14px}</style></head><body>']
+        for paragraph in paragraphs:
+            parts.append(f"<p>{' '.join(paragraph)}</p>")
+        if links or self.rng.random() < 0.3:
+            parts.append(f'<p><a href="https://{domain}/notice/{self.rng.randrange(10**6)}">View details</a></p>')
+        parts.append('<p style="color:#888">--<br>Sent via mailing list</p></body></html>')
+        return ''.join(parts)
+
+    def _attachments(self, profile: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if self.rng.random() >= self.attachment_rate:
+            return []
+        attachments = []
+        for i in range(self.rng.choice([1, 1, 1, 2, 3])):
+            mime_type = self.rng.choice(profile['mime_types'])
+            extension = MIME_EXTENSIONS.get(mime_type, 'bin')
+            attachments.append({
+                'attachmentId': f"att_{self.rng.getrandbits(64):016x}",
+                'filename': f"{slug(self.rng.choice(profile['keywords']))}_{i + 1}.{extension}",
+                'mimeType': mime_type,
+                'size': int(self.rng.lognormvariate(11, 1.2))
+            })
+        return attachments
+
+    def _date(self, profile: Dict[str, Any]) -> datetime:
+        day = self.end_date - timedelta(days=self.rng.randrange(self.days))
+        for _ in range(7):
+            if day.weekday() in profile['weekdays']:
+                break
+            day -= timedelta(days=1)
+        return day.replace(hour=self.rng.choice(profile['hours']), minute=self.rng.randrange(60), second=self.rng.randrange(60))
+
+    def generate_email(self) -> Dict[str, Any]:
+        category = self._choose(self.categories, self.category_weights)
+        profile = self.profiles[category]
+        sender = self._choose(self.senders[category], self.sender_weights)
+        domain = sender.rsplit('@', 1)[1].rstrip('>')
+        user = self.rng.randrange(len(self.user_ids))
+
+        pattern = self.rng.choice(profile['subject_patterns'])
+        subject = self.rng.choice(SUBJECT_TEMPLATES).format(
+            Pattern=pattern[:1].upper() + pattern[1:], pattern=pattern,
+            keyword=self.rng.choice(profile['keywords']), day=self.rng.choice(DAYS)
+        )
+        paragraphs = self._body(profile)
+        text = '\n\n'.join(' '.join(paragraph) for paragraph in paragraphs)
+        message_id = f"{self.rng.getrandbits(64):016x}"
+
+        email = {
+            'userId': self.user_ids[user],
+            'provider': 'gmail',
+            'gmailId': message_id,
+            'messageId': f"<{message_id}@{domain}>",
+            'threadId': f"{self.rng.getrandbits(64):016x}",
+            'subject': subject,
+            'from': sender,
+            'to': self.user_addresses[user],
+            'date': self._date(profile),
+            'snippet': text[:200],
+            'text': text,
+            'isRead': self.rng.random() < 0.6,
+            'labels': ['INBOX', f"CATEGORY_{slug(category).upper()}"],
+            'category': category,
+            'classification': {
+                'label': category,
+                'confidence': round(self.rng.uniform(0.55, 0.99), 3)
+            },
+            'attachments': self._attachments(profile),
+            'isArchived': False,
+            'isDeleted': self.rng.random() < self.deleted_rate,
+            'isFullContentLoaded': True,
+            'fullBody': text
+        }
+        if self.rng.random() < self.html_rate:
+            email['html'] = self._html(paragraphs, domain, profile['external_links'])
+        return email
+
+    def generate(self, count: int) -> Iterator[Dict[str, Any]]:
+        for _ in range(count):
+            yield self.generate_email()
+
+    def insert(self, collection, count: int, batch_size: int = 1000, progress: bool = True) -> int:
+        """Insert `count` emails with unordered insert_many batches; returns the number inserted"""
+        inserted = 0
+        batch = []
+        with tqdm(total=count, desc="Generating", unit="email", disable=not progress) as pbar:
+            for email in self.generate(count):
+                batch.append(email)
+                if len(batch) == batch_size:
+                    inserted += len(collection.insert_many(batch, ordered=False).inserted_ids)
+                    pbar.update(len(batch))
+                    batch = []
+            if batch:
+                inserted += len(collection.insert_many(batch, ordered=False).inserted_ids)
+                pbar.update(len(batch))
+        return inserted
+
+    def write_ndjson(self, output_file: str, count: int, progress: bool = True) -> int:
+        """Write `count` emails as (gzip) NDJSON in MongoDB extended JSON"""
+        opener = gzip.open if output_file.endswith('.gz') else open
+        tmp_file = f"{output_file}.tmp"
+        with opener(tmp_file, 'wt', encoding='utf-8') as f:
+            for email in tqdm(self.generate(count), total=count, desc="Generating", unit="email", disable=not progress):
+                f.write(json_util.dumps(email, ensure_ascii=False) + '\n')
+        os.replace(tmp_file, output_file)
+        return count
+
+
+def main():
+    """Main generator function"""
+    parser = argparse.ArgumentParser(description="Generate a synthetic mailbox from the category patterns")
+    parser.add_argument("--count", type=int, default=10000,
+                       help="Number of emails (10k-1M)")
+    parser.add_argument("--seed", type=int, default=42,
+                       help="Random seed")
+    parser.add_argument("--users", type=int, default=1,
+                       help="Number of mailbox owners")
+    parser.add_argument("--mongodb-uri", type=str, default=MONGODB_URI,
+                       help="Database to insert into")
+    parser.add_argument("--collection", type=str, default="emails",
+                       help="Target collection")
+    parser.add_argument("--drop", action="store_true",
+                       help="Drop the target collection first")
+    parser.add_argument("--output", type=str, default=None,
+                       help="Write NDJSON (.ndjson or .ndjson.gz) instead of inserting")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                       help="Emails per insert_many")
+    parser.add_argument("--html-rate", type=float, default=0.7,
+                       help="Share of emails with an HTML body")
+    parser.add_argument("--attachment-rate", type=float, default=0.15,
+                       help="Share of emails with attachments")
+    parser.add_argument("--no-templates", action="store_true",
+                       help="Only use categories.json, not category_templates.json")
+
+    args = parser.parse_args()
+
+    print("="*70)
+    print("SYNTHETIC MAILBOX GENERATOR")
+    print("="*70)
+
+    profiles = load_category_profiles(CATEGORIES_FILE, None if args.no_templates else TEMPLATES_FILE)
+    mailbox = SyntheticMailbox(profiles, seed=args.seed, users=args.users,
+                               html_rate=args.html_rate, attachment_rate=args.attachment_rate)
+    print(f"\nCategories: {', '.join(mailbox.categories)}")
+
+    start = datetime.now()
+    if args.output:
+        count = mailbox.write_ndjson(args.output, args.count)
+        target = args.output
+    else:
+        client = MongoClient(args.mongodb_uri)
+        try:
+            collection = client.get_database()[args.collection]
+            if args.drop:
+                collection.drop()
+            count = mailbox.insert(collection, args.count, args.batch_size)
+            target = f"{client.get_database().name}.{args.collection}"
+        finally:
+            client.close()
+
+    elapsed = (datetime.now() - start).total_seconds()
+    print(f"\n✓ Generated {count} emails into {target} in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f}/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,7 +12,7 @@ from datetime import datetime
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from distilbert_trainer import DistilBERTTrainer
+from distilbert_trainer import DistilBERTTrainer, BatchPlanner, TOKENIZED_CACHE_DIR, TOKENIZE_NUM_PROC
 
 
 def main():
@@ -34,6 +34,24 @@ def main():
                        help="Maximum token sequence length")
     parser.add_argument("--validation_split", type=float, default=0.2,
                        help="Validation split ratio")
+    parser.add_argument("--cache_dir", type=str, default=TOKENIZED_CACHE_DIR,
+                       help="Tokenized dataset cache directory (shared with evaluate_model.py)")
+    parser.add_argument("--num_proc", type=int, default=TOKENIZE_NUM_PROC,
+                       help="Tokenization worker processes")
+    parser.add_argument("--batching", type=str, default="length_grouped", choices=BatchPlanner.STRATEGIES,
+                       help="Training batch composition (length_grouped sorts within shuffled megabatches)")
+    parser.add_argument("--max_tokens_per_batch", type=int, default=None,
+                       help="Size training batches by padded tokens instead of --batch_size")
+    parser.add_argument("--megabatch_factor", type=int, default=50,
+                       help="Megabatch size (in batches) for length-grouped sampling")
+    parser.add_argument("--streaming", action="store_true",
+                       help="Stream --data_file (glob/directory/comma list of JSONL or Parquet shards) in bounded memory")
+    parser.add_argument("--validation_percent", type=int, default=10,
+                       help="Fixed validation slice in percent (streaming mode)")
+    parser.add_argument("--max_validation_per_label", type=int, default=2000,
+                       help="Cap on validation examples per label (streaming mode)")
+    parser.add_argument("--shuffle_buffer", type=int, default=10000,
+                       help="Examples buffered for shuffling the stream (streaming mode)")
     
     args = parser.parse_args()
     
@@ -45,12 +63,15 @@ def main():
     print(f"  Output Directory: {args.output_dir}")
     print(f"  Epochs: {args.num_epochs}")
     print(f"  Batch Size: {args.batch_size}")
+    print(f"  Batching: {args.batching}"
+          + (f" ({args.max_tokens_per_batch} tokens/batch)" if args.max_tokens_per_batch else ""))
     print(f"  Learning Rate: {args.learning_rate}")
     print(f"  Max Length: {args.max_length}")
     print(f"  Validation Split: {args.validation_split}")
+    print(f"  Tokenized Cache: {args.cache_dir}")
     
-    # Check if dataset exists
-    if not os.path.exists(args.data_file):
+    # Check if dataset exists (streamed shards are resolved by the loader)
+    if not args.streaming and not os.path.exists(args.data_file):
         print(f"\n❌ Error: Dataset file not found: {args.data_file}")
         print("   Please run prepare_distilbert_dataset.py first.")
         return
@@ -63,50 +84,73 @@ def main():
         
         trainer = DistilBERTTrainer(
             output_dir=args.output_dir,
-            max_length=args.max_length
+            max_length=args.max_length,
+            cache_dir=args.cache_dir,
+            num_proc=args.num_proc
         )
         
-        # Load and preprocess dataset
-        print("\n" + "-"*70)
-        print("LOADING AND PREPROCESSING DATASET")
-        print("-"*70)
-        
-        texts, labels, label_mapping = trainer.load_and_preprocess_dataset(args.data_file)
-        
-        if len(texts) == 0:
-            print("\n❌ Error: No valid training examples found in dataset!")
-            return
-        
-        print(f"\n✓ Dataset loaded successfully")
-        print(f"  Total examples: {len(texts)}")
-        print(f"  Number of categories: {len(label_mapping)}")
-        print(f"  Categories: {', '.join(sorted(label_mapping.keys()))}")
-        
-        # Initialize model
-        print("\n" + "-"*70)
-        print("INITIALIZING MODEL")
-        print("-"*70)
-        
-        trainer.initialize_model(len(label_mapping))
-        print(f"✓ Model initialized with {len(label_mapping)} output classes")
-        
-        # Train model
-        print("\n" + "-"*70)
-        print("TRAINING MODEL")
-        print("-"*70)
-        print("\nThis may take a while depending on your hardware...")
-        print("Training progress will be displayed below:\n")
-        
         start_time = datetime.now()
         
-        results = trainer.train_model(
-            texts=texts,
-            labels=labels,
-            validation_split=args.validation_split,
-            train_batch_size=args.batch_size,
-            num_epochs=args.num_epochs,
-            learning_rate=args.learning_rate
-        )
+        if args.streaming:
+            print("\n" + "-"*70)
+            print("STREAMING TRAINING")
+            print("-"*70)
+            print("\nScanning shards for labels and the validation sample, then streaming epochs...\n")
+            
+            results = trainer.train_streaming(
+                data_files=args.data_file,
+                validation_percent=args.validation_percent,
+                max_validation_per_label=args.max_validation_per_label,
+                train_batch_size=args.batch_size,
+                num_epochs=args.num_epochs,
+                learning_rate=args.learning_rate,
+                batching=args.batching,
+                megabatch_factor=args.megabatch_factor,
+                shuffle_buffer=args.shuffle_buffer
+            )
+        else:
+            # Load and preprocess dataset
+            print("\n" + "-"*70)
+            print("LOADING AND PREPROCESSING DATASET")
+            print("-"*70)
+        
+            texts, labels, label_mapping = trainer.load_and_preprocess_dataset(args.data_file)
+        
+            if len(texts) == 0:
+                print("\n❌ Error: No valid training examples found in dataset!")
+                return
+        
+            print(f"\n✓ Dataset loaded successfully")
+            print(f"  Total examples: {len(texts)}")
+            print(f"  Number of categories: {len(label_mapping)}")
+            print(f"  Categories: {', '.join(sorted(label_mapping.keys()))}")
+        
+            # Initialize model
+            print("\n" + "-"*70)
+            print("INITIALIZING MODEL")
+            print("-"*70)
+        
+            trainer.initialize_model(len(label_mapping))
+            print(f"✓ Model initialized with {len(label_mapping)} output classes")
+        
+            # Train model
+            print("\n" + "-"*70)
+            print("TRAINING MODEL")
+            print("-"*70)
+            print("\nThis may take a while depending on your hardware...")
+            print("Training progress will be displayed below:\n")
+        
+            results = trainer.train_model(
+                texts=texts,
+                labels=labels,
+                validation_split=args.validation_split,
+                train_batch_size=args.batch_size,
+                num_epochs=args.num_epochs,
+                learning_rate=args.learning_rate,
+                batching=args.batching,
+                max_tokens_per_batch=args.max_tokens_per_batch,
+                megabatch_factor=args.megabatch_factor
+            )
         
         end_time = datetime.now()
         training_duration = (end_time - start_time).total_seconds()
@@ -119,6 +163,9 @@ def main():
         print(f"\n📊 Training Results:")
         print(f"  Training Duration: {training_duration/60:.1f} minutes")
         print(f"  Final Training Loss: {results['training_loss']:.4f}")
+        for epoch in results.get('epoch_throughput', []):
+            print(f"  Epoch {epoch['epoch']}: {epoch['tokens_per_sec']:.0f} tokens/s, "
+                  f"padding {epoch['padding_ratio']:.1%}")
         
         eval_results = results['eval_results']
         print(f"\n📈 Validation Metrics:")
@@ -0,0 +1,456 @@
+"""
+Training Job Queue for the Model Service
+Runs DistilBERT fine-tunes in a separate worker process with persisted job state,
+progress events, cancellation and resume-from-checkpoint
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import queue
+import asyncio
+import logging
+import traceback
+import threading
+import multiprocessing as mp
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Job records and per-job output directories live here
+TRAINING_JOBS_DIR = os.getenv('TRAINING_JOBS_DIR', 'training_jobs')
+
+# CPU budget of the worker process, so training does not starve inference
+TRAINING_WORKER_THREADS = int(os.getenv('TRAINING_WORKER_THREADS', str(max(1, (os.cpu_count() or 2) // 2))))
+TRAINING_WORKER_CPUS = os.getenv('TRAINING_WORKER_CPUS')  # e.g. "4-7" or "4,5,6,7"
+TRAINING_WORKER_NICE = int(os.getenv('TRAINING_WORKER_NICE', '10'))
+
+# Seconds a worker gets to checkpoint and exit after a cancel before it is killed
+CANCEL_GRACE_SECONDS = float(os.getenv('TRAINING_CANCEL_GRACE_SECONDS', '120'))
+
+ACTIVE_STATUSES = ('running', 'cancelling')
+RESUMABLE_STATUSES = ('cancelled', 'interrupted', 'failed')
+
+
+def parse_cpu_list(spec: Optional[str]) -> List[int]:
+    """Parse a cpu list like "0-3,6" into [0, 1, 2, 3, 6]"""
+    cpus = []
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def latest_checkpoint(output_dir: str) -> Optional[str]:
+    """Newest checkpoint-<step> directory written by the Trainer, if any"""
+    if not output_dir or not os.path.isdir(output_dir):
+        return None
+    checkpoints = []
+    for name in os.listdir(output_dir):
+        match = re.fullmatch(r'checkpoint-(\d+)', name)
+        if match and os.path.isdir(os.path.join(output_dir, name)):
+            checkpoints.append((int(match.group(1)), name))
+    if not checkpoints:
+        return None
+    return os.path.join(output_dir, max(checkpoints)[1])
+
+
+class TrainingJobStore:
+    """Job records as one JSON file per job, written atomically"""
+
+    def __init__(self, jobs_dir: str = TRAINING_JOBS_DIR):
+        self.jobs_dir = Path(jobs_dir)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.RLock()
+
+    def _job_path(self, job_id: str) -> Path:
+        return self.jobs_dir / job_id / 'job.json'
+
+    def _write(self, job: Dict[str, Any]):
+        path = self._job_path(job['id'])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f, indent=2, default=str)
+        os.replace(tmp_path, path)
+
+    def create(self, job_type: str, config: Dict[str, Any]) -> Dict[str, Any]:
+        job_id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        job = {
+            'id': job_id,
+            'type': job_type,
+            'status': 'queued',
+            'config': config,
+            'output_dir': os.path.join(config.get('output_dir') or 'distilbert_models', job_id),
+            'created_at': datetime.now().isoformat(),
+            'started_at': None,
+            'finished_at': None,
+            'attempts': 0,
+            'resume_from_checkpoint': None,
+            'checkpoint': None,
+            'progress': None,
+            'result': None,
+            'error': None
+        }
+        with self.lock:
+            self._write(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        path = self._job_path(job_id)
+        if not path.exists():
+            return None
+        with self.lock, open(path, 'r') as f:
+            return json.load(f)
+
+    def list(self) -> List[Dict[str, Any]]:
+        jobs = []
+        for path in self.jobs_dir.glob('*/job.json'):
+            try:
+                with open(path, 'r') as f:
+                    jobs.append(json.load(f))
+            except Exception as e:
+                logger.warning(f"Skipping unreadable job record {path}: {e}")
+        return sorted(jobs, key=lambda job: job['created_at'])
+
+    def update(self, job_id: str, **fields) -> Dict[str, Any]:
+        with self.lock:
+            job = self.get(job_id)
+            if job is None:
+                raise KeyError(job_id)
+            job.update(fields)
+            job['updated_at'] = datetime.now().isoformat()
+            self._write(job)
+            return job
+
+
+def apply_cpu_budget(threads: int, cpus: List[int], niceness: int = 0):
+    """
+    Restrict the current (worker) process to `threads` threads on `cpus`
+
+    The thread variables only reach libraries initialised after this call. A spawned
+    worker re-imports the parent's main module first (torch included when that is
+    enhanced_app), so callers also call torch.set_num_threads.
+    """
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[var] = str(threads)
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError as e:
+            logger.warning(f"Could not pin training worker to CPUs {cpus}: {e}")
+    if niceness and hasattr(os, 'nice'):
+        try:
+            os.nice(niceness)
+        except OSError:
+            pass
+
+
+def run_distilbert_job(job: Dict[str, Any], events, cancel_event, threads: int,
+                       cpus: List[int], niceness: int):
+    """Worker process entry point: train, then report the outcome as an event"""
+    apply_cpu_budget(threads, cpus, niceness)
+    job_id = job['id']
+
+    def emit(event_type: str, **data):
+        events.put({'job_id': job_id, 'type': event_type, **data})
+
+    try:
+        import torch
+        torch.set_num_threads(threads)
+        from distilbert_trainer import DistilBERTTrainer, ProgressCallback
+
+        config = job['config']
+        emit('status', status='running', pid=os.getpid())
+
+        trainer = DistilBERTTrainer(
+            output_dir=job['output_dir'],
+            max_length=config.get('max_length', 256)
+        )
+        progress = ProgressCallback(
+            report=lambda data: emit('progress', progress=data),
+            should_cancel=cancel_event.is_set
+        )
+        train_kwargs = dict(
+            validation_split=config.get('validation_split', 0.2),
+            train_batch_size=config.get('batch_size', 16),
+            batching=config.get('batching', 'length_grouped'),
+            max_tokens_per_batch=config.get('max_tokens_per_batch'),
+            callbacks=[progress],
+            resume_from_checkpoint=job.get('resume_from_checkpoint')
+        )
+
+        if config.get('incremental'):
+            results = trainer.train_incremental(
+                data_file=config['data_file'],
+                base_model_path=config['base_model_path'],
+                new_data_file=config.get('new_data_file'),
+                replay_ratio=config.get('replay_ratio', 4.0),
+                promotion_tolerance=config.get('promotion_tolerance', 0.0),
+                num_epochs=config.get('num_epochs', 2),
+                learning_rate=config.get('learning_rate', 1e-5),
+                **train_kwargs
+            )
+        else:
+            texts, labels, label_mapping = trainer.load_and_preprocess_dataset(config['data_file'])
+            if len(texts) == 0:
+                raise ValueError("No valid training examples found")
+            trainer.initialize_model(len(label_mapping))
+
+            results = trainer.train_model(
+                texts=texts,
+                labels=labels,
+                num_epochs=config.get('num_epochs', 3),
+                learning_rate=config.get('learning_rate', 2e-5),
+                **train_kwargs
+            )
+
+        if results.get('cancelled'):
+            emit('status', status='cancelled', checkpoint=results.get('checkpoint'))
+        else:
+            emit('status', status='completed', result=json.loads(json.dumps(results, default=str)))
+
+    except Exception as e:
+        emit('status', status='failed', error=str(e), traceback=traceback.format_exc())
+
+
+class TrainingJobManager:
+    """
+    Queue of training jobs run one at a time in a spawned worker process
+
+    The serving process only polls worker events: progress and status changes are
+    persisted and passed to `broadcast`, and a completed job's model directory is
+    passed to `on_completed` for hand-off to the live classifier.
+    """
+
+    def __init__(
+        self,
+        store: TrainingJobStore,
+        broadcast: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+        on_completed: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+        threads: int = TRAINING_WORKER_THREADS,
+        cpus: Optional[List[int]] = None,
+        niceness: int = TRAINING_WORKER_NICE,
+        poll_interval: float = 0.5
+    ):
+        self.store = store
+        self.broadcast = broadcast
+        self.on_completed = on_completed
+        self.threads = threads
+        self.cpus = cpus if cpus is not None else parse_cpu_list(TRAINING_WORKER_CPUS)
+        self.niceness = niceness
+        self.poll_interval = poll_interval
+
+        self.context = mp.get_context('spawn')
+        self.events = self.context.Queue()
+        self.pending: List[str] = []
+        self.active_job_id: Optional[str] = None
+        self.process = None
+        self.cancel_event = None
+        self._cancel_deadline = None
+        self._stopped = False
+
+    def recover(self):
+        """After a restart: running jobs lost their worker, queued jobs are queued again"""
+        for job in self.store.list():
+            if job['status'] in ACTIVE_STATUSES:
+                checkpoint = latest_checkpoint(job['output_dir'])
+                self.store.update(job['id'], status='interrupted', checkpoint=checkpoint,
+                                  finished_at=datetime.now().isoformat())
+                logger.info(f"Training job {job['id']} was interrupted by a restart (checkpoint: {checkpoint})")
+            elif job['status'] == 'queued':
+                self.pending.append(job['id'])
+
+    def submit(self, job_type: str, config: Dict[str, Any]) -> Dict[str, Any]:
+        job = self.store.create(job_type, config)
+        self.pending.append(job['id'])
+        logger.info(f"Queued training job {job['id']}")
+        return job
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        return self.pending.index(job_id) + 1 if job_id in self.pending else None
+
+    def cancel(self, job_id: str, force: bool = False) -> Dict[str, Any]:
+        """Cancel a queued job, or ask the running one to checkpoint and stop"""
+        job = self.store.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+
+        if job_id in self.pending:
+            self.pending.remove(job_id)
+            return self.store.update(job_id, status='cancelled', finished_at=datetime.now().isoformat())
+
+        if job_id != self.active_job_id:
+            raise ValueError(f"Job {job_id} is {job['status']} and cannot be cancelled")
+
+        self.cancel_event.set()
+        self._cancel_deadline = time.monotonic() + (0 if force else CANCEL_GRACE_SECONDS)
+        return self.store.update(job_id, status='cancelling')
+
+    def resume(self, job_id: str) -> Dict[str, Any]:
+        """Queue a stopped job again, continuing from its newest checkpoint"""
+        job = self.store.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        if job['status'] not in RESUMABLE_STATUSES:
+            raise ValueError(f"Job {job_id} is {job['status']} and cannot be resumed")
+
+        checkpoint = latest_checkpoint(job['output_dir'])
+        job = self.store.update(job_id, status='queued', resume_from_checkpoint=checkpoint,
+                                error=None, finished_at=None)
+        self.pending.append(job_id)
+        logger.info(f"Resuming training job {job_id} from {checkpoint or 'scratch'}")
+        return job
+
+    def _start_next(self):
+        job_id = self.pending.pop(0)
+        job = self.store.get(job_id)
+        if job is None or job['status'] != 'queued':
+            return
+
+        job = self.store.update(job_id, status='running', started_at=datetime.now().isoformat(),
+                                attempts=job.get('attempts', 0) + 1)
+        self.cancel_event = self.context.Event()
+        self._cancel_deadline = None
+        process = self.context.Process(
+            target=run_distilbert_job,
+            args=(job, self.events, self.cancel_event, self.threads, self.cpus, self.niceness),
+            name=f"training-{job_id}",
+            daemon=True
+        )
+        try:
+            process.start()
+        except Exception as e:
+            logger.error(f"Could not start training worker for job {job_id}: {e}")
+            self.store.update(job_id, status='failed', error=f"Could not start training worker: {e}",
+                              finished_at=datetime.now().isoformat())
+            return
+        self.process = process
+        self.active_job_id = job_id
+        logger.info(f"Started training job {job_id} in worker pid {self.process.pid} "
+                    f"({self.threads} threads, cpus={self.cpus or 'all'})")
+
+    async def _notify(self, message: Dict[str, Any]):
+        if self.broadcast is not None:
+            try:
+                await self.broadcast(message)
+            except Exception as e:
+                logger.warning(f"Failed to broadcast training event: {e}")
+
+    async def _handle_event(self, event: Dict[str, Any]):
+        job_id = event['job_id']
+
+        if event['type'] == 'progress':
+            self.store.update(job_id, progress=event['progress'])
+            await self._notify({'type': 'training_job_progress',
+                                'data': {'job_id': job_id, **event['progress']}})
+            return
+
+        status = event['status']
+        fields = {'status': status}
+        if status == 'running':
+            fields['pid'] = event.get('pid')
+            if self.cancel_event is not None and self.cancel_event.is_set():
+                fields['status'] = 'cancelling'
+        else:
+            fields['finished_at'] = datetime.now().isoformat()
+            for key in ('checkpoint', 'result', 'error', 'traceback'):
+                if key in event:
+                    fields[key] = event[key]
+        job = self.store.update(job_id, **fields)
+
+        await self._notify({'type': 'training_job_status',
+                            'data': {'job_id': job_id, 'status': job['status'],
+                                     'error': job.get('error'), 'checkpoint': job.get('checkpoint')}})
+
+        if status == 'completed' and self.on_completed is not None:
+            try:
+                await self.on_completed(job)
+            except Exception as e:
+                logger.error(f"Hand-off of training job {job_id} failed: {e}")
+
+    async def _reap(self):
+        """Clean up after the worker exits; a worker that died silently fails its job"""
+        job_id = self.active_job_id
+        self.process.join(timeout=0)
+        exitcode = self.process.exitcode
+        self.process = None
+        self.active_job_id = None
+
+        job = self.store.get(job_id)
+        if job is not None and job['status'] in ACTIVE_STATUSES:
+            cancelled = self.cancel_event is not None and self.cancel_event.is_set()
+            job = self.store.update(
+                job_id,
+                status='cancelled' if cancelled else 'failed',
+                checkpoint=latest_checkpoint(job['output_dir']),
+                error=None if cancelled else f"Training worker exited with code {exitcode}",
+                finished_at=datetime.now().isoformat()
+            )
+            await self._notify({'type': 'training_job_status',
+                                'data': {'job_id': job_id, 'status': job['status'], 'error': job.get('error'),
+                                         'checkpoint': job.get('checkpoint')}})
+
+    async def run(self):
+        """Poll loop, run as an asyncio task in the serving process"""
+        while not self._stopped:
+            try:
+                while True:
+                    try:
+                        event = self.events.get_nowait()
+                    except queue.Empty:
+                        break
+                    await self._handle_event(event)
+
+                if self.process is not None:
+                    if (self._cancel_deadline is not None and time.monotonic() > self._cancel_deadline
+                            and self.process.is_alive()):
+                        logger.warning(f"Training job {self.active_job_id} did not stop in time; terminating")
+                        self.process.terminate()
+                        self._cancel_deadline = None
+                    if not self.process.is_alive() and self.events.empty():
+                        await self._reap()
+
+                if self.process is None and self.pending:
+                    self._start_next()
+
+            except Exception as e:
+                logger.error(f"Error in training job loop: {e}")
+
+            await asyncio.sleep(self.poll_interval)
+
+    def shutdown(self, timeout: float = 30.0):
+        """Ask a running worker to checkpoint; it is marked interrupted and can be resumed"""
+        self._stopped = True
+        if self.process is None or not self.process.is_alive():
+            return
+        self.cancel_event.set()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        job = self.store.get(self.active_job_id)
+        self.store.update(self.active_job_id, status='interrupted',
+                          checkpoint=latest_checkpoint(job['output_dir']),
+                          finished_at=datetime.now().isoformat())
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'active_job_id': self.active_job_id,
+            'worker_pid': self.process.pid if self.process is not None else None,
+            'pending': list(self.pending),
+            'worker_threads': self.threads,
+            'worker_cpus': self.cpus
+        }
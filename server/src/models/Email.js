@@ -96,6 +96,10 @@ const emailSchema = new mongoose.Schema({
       type: String,
       default: '2.1.0'
     },
+    // Written by model_service reclassification for incremental runs
+    contentDigest: String,
+    modelFingerprint: String,
+    categoriesVersion: String,
     classifiedAt: {
       type: Date,
       default: Date.now
@@ -295,6 +299,8 @@ emailSchema.index({ subject: 'text', snippet: 'text', body: 'text' })
 emailSchema.index({ userId: 1, category: 1 }) // Fast category filtering
 emailSchema.index({ userId: 1, isDeleted: 1 }) // Active emails only
 emailSchema.index({ userId: 1, category: 1, date: -1 }) // Category + sorting without provider
+emailSchema.index({ 'classification.modelFingerprint': 1, 'classification.categoriesVersion': 1 }) // Incremental reclassification
+emailSchema.index({ 'classification.categoriesVersion': 1 }) // Incremental reclassification (category-set clauses)
 
 // Virtual for formatted date
 emailSchema.virtual('formattedDate').get(function() {
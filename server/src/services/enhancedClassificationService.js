@@ -105,7 +105,8 @@ export const classifyEmailWithEnsemble = async (subject, snippet, body, userId,
       date: emailData.date ? new Date(emailData.date).toISOString() : null,
       attachments: emailData.attachments || [],
       headers: emailData.enhancedMetadata?.headers || emailData.headers || {},
-      user_id: userId
+      user_id: userId,
+      email_id: emailData._id ? String(emailData._id) : (emailData.gmailId || null)
     }
     
     const response = await axios.post(`${ML_SERVICE_BASE_URL}/predict/ensemble`, ensembleRequest, {